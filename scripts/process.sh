@@ -2,6 +2,8 @@
 DATA_RAW=data/raw
 DATA_INT=data/interim
 DATA_PRO=data/processed
+# état conservé d'une exécution à l'autre (stock et index des PDF, caches)
+DATA_CACHE=data/cache
 
 # local
 # DIR_IN=${DATA_RAW}/arretes_peril_hors_marseille_2018_2022
@@ -24,15 +26,30 @@ DIR_OUT=${DATA_PRO}/
 #
 RUN=`date +%FT%T`  # date au format "Y-m-dTH:M:S" (ex: "2023-06-17T12:31:44")
 
+# budget de l'exécution (optionnel), pour rester dans la fenêtre du serveur partagé:
+# RUN_BUDGET_MIN: durée maximale en minutes, d'où l'échéance RUN_DEADLINE ;
+# RUN_MAX_RSS_MB: mémoire résidente maximale (Mio) ; RUN_CPU_SHARE: charge maximale des processeurs (0 à 1).
+# Aux étapes 3 et 8, les documents hors budget sont reportés au lot suivant (data/cache/deferred.csv)
+if [ -n "${RUN_BUDGET_MIN}" ]; then
+    export RUN_DEADLINE=`date -d "+${RUN_BUDGET_MIN} minutes" +%FT%T`
+fi
+
 # remove interim folder
+# (le stock et l'index des PDF sont dans ${DATA_CACHE}, partagés avec src/preprocess/watch_folder.py)
 rm -rf ${DATA_INT}
 
 # 1. indexer les fichiers PDF dans le dossier d'entrée:
-# calculer le hash de chaque fichier et en faire une copie dans data/interim/pdf-index ,
-# extraire les métadonnées et les ajouter à l'index CSV,
+# calculer le hash de chaque fichier et le stocker dans data/cache/pdf-index (ab/cd/<hash>.pdf,
+# par lien physique ou reflink si possible, sinon par copie),
+# extraire les métadonnées des seuls fichiers absents de l'index (base SQLite conservée
+# d'une exécution à l'autre) et les y ajouter,
 # générer un fichier CSV avec les seuls fichiers nouvellement ajoutés
+# (un PDF déjà indexé n'est pas traité de nouveau, même s'il est resté dans ${DIR_IN}, sauf s'il a été reporté)
 NEW_INDEX=${DATA_INT}/pdf-index_new_${RUN}.csv
-python src/preprocess/index_pdfs.py ${DIR_IN} ${DATA_INT}/pdf-index ${DATA_INT}/pdf-index.csv ${NEW_INDEX}
+# (--jobs 0: autant de workers que de coeurs)
+python src/preprocess/index_pdfs.py ${DIR_IN} ${DATA_CACHE}/pdf-index ${DATA_CACHE}/pdf-index.sqlite ${NEW_INDEX} --jobs 0
+# ajouter au lot les documents reportés par l'exécution précédente
+python src/preprocess/deferred_queue.py ${NEW_INDEX}
 # arrêter là si aucun nouveau fichier d'index n'a été généré,
 # car aucun PDF dans ${DIR_IN} n'était nouveau
 if [ ! -f "${NEW_INDEX}" ]; then
@@ -40,36 +57,17 @@ if [ ! -f "${NEW_INDEX}" ]; then
     exit 0
 fi
 
-echo "traiter les métadonnées"
-# 2. traiter les métadonnées pour déterminer si ce sont des PDF natifs (textes) ou images
-python src/preprocess/process_metadata.py ${DATA_INT}/pdf-index_new_${RUN}.csv ${DATA_INT}/meta_${RUN}_proc.csv
-
-echo "extraire le texte natif"
-# 3. extraire le texte natif des PDF ; 2 sorties: CSV de métadonnées enrichies + dossier pour les fichiers texte natif
-python src/preprocess/extract_native_text.py ${DATA_INT}/meta_${RUN}_proc.csv ${DATA_INT}/meta_${RUN}_ntxt.csv ${DATA_INT} 
-
-echo "déterminer le type des fichiers pdf"
-# 4. déterminer le type des fichiers PDF natifs ("texte") ou non ("image")
-# TODO ajouter des indicateurs au niveau de la page? après separate_pages?
-python src/preprocess/determine_pdf_type.py ${DATA_INT}/meta_${RUN}_ntxt.csv ${DATA_INT}/meta_${RUN}_ntxt_pdftype.csv 
-
-echo "rassembler les pages dans un df"
-# 5. rassembler les pages de texte natif dans un dataframe
-python src/preprocess/separate_pages.py ${DATA_INT}/meta_${RUN}_ntxt_pdftype.csv ${DATA_INT}/pages_${RUN}_ntxt.csv 
-
-echo "filtrage des documents hors périmètre"
-# 6. filtrer les documents qui sont hors périmètre (plan de périmètre de sécurité), et les annexes
-python src/preprocess/filter_docs.py ${DATA_INT}/meta_${RUN}_ntxt_pdftype.csv ${DATA_INT}/pages_${RUN}_ntxt.csv ${DATA_INT}/meta_${RUN}_ntxt_filt.csv ${DATA_INT}/pages_${RUN}_ntxt_filt.csv 
-
-echo "conversion des pdf natifs en pdf/a"
-# 7. convertir les PDF natifs ("texte") en PDF/A  # (seulement si on ajoute "--keep_pdfa")
-python src/preprocess/convert_native_pdf_to_pdfa.py ${DATA_INT}/meta_${RUN}_ntxt_filt.csv ${DATA_INT}/meta_${RUN}_ntxt_pdfa.csv ${DATA_INT} 
-
-echo "extraire le texte des pdf non natifs par OCR"
-# 8. extraire le texte des PDF non natifs par OCR
-# (1 entrée: CSV de métadonnées ; 2 sorties: CSV de métadonnées enrichies (OCR) + dossier pour les fichiers (PDF/A et TXT sidecar OCR))
-python src/preprocess/extract_text_ocr.py ${DATA_INT}/meta_${RUN}_ntxt_pdfa.csv ${DATA_INT}/meta_${RUN}_otxt.csv ${DATA_INT} 
-
-echo "analyse du texte des pdf et production paquets"
-# 9. analyser le texte des PDF et produire les fichiers paquet_*.csv
-python src/process/parse_doc_direct.py data/interim/meta_${RUN}_otxt.csv ${DIR_OUT}
+# 2. à 9. traiter le lot de PDF nouvellement indexés
+# (en mode continu, src/preprocess/watch_folder.py remplace ce script: il indexe
+# les nouveaux PDF au fil de l'eau et appelle process_batch.sh par micro-lots)
+# PIPELINE_INPROC=1: mêmes étapes dans un seul processus Python, sans fichiers CSV intermédiaires
+# (ajouter --keep_intermediates pour les conserver, --measure_savings pour mesurer le temps économisé) ;
+# PIPELINE_INPROC=stream: en flux, document par document (premières lignes des paquet_*.csv datés au plus tôt,
+# mémoire indépendante de la taille du lot)
+if [ "${PIPELINE_INPROC}" = "stream" ]; then
+    python -m src.pipeline stream ${RUN} ${DIR_OUT}
+elif [ -n "${PIPELINE_INPROC}" ]; then
+    python -m src.pipeline run ${RUN} ${DIR_OUT}
+else
+    scripts/process_batch.sh ${RUN} ${DIR_OUT}
+fi
@@ -0,0 +1,58 @@
+#!/usr/bin/env bash
+# Traitement d'un lot de PDF déjà indexés (étapes 2 à 9 du pipeline),
+# appelé par process.sh après l'indexation, ou par le démon
+# src/preprocess/watch_folder.py pour chaque micro-lot.
+#
+# usage: scripts/process_batch.sh RUN [DIR_OUT]
+# RUN: identifiant du lot, tel que l'index des nouveaux PDF est
+# ${DATA_INT}/pdf-index_new_${RUN}.csv
+# DATA_INT: dossier des fichiers intermédiaires, data/interim par défaut
+# (fixé par watch_folder.py d'après son option --data_int)
+DATA_INT=${DATA_INT:-data/interim}
+DATA_PRO=data/processed
+
+RUN=$1
+DIR_OUT=${2:-${DATA_PRO}/}
+# format des fichiers intermédiaires (meta_*, pages_*): csv (par défaut) ou parquet
+# (types des colonnes conservés, nécessite pyarrow)
+EXT=${INTERMEDIATE_FORMAT:-csv}
+
+echo "traiter les métadonnées"
+# 2. traiter les métadonnées pour déterminer si ce sont des PDF natifs (textes) ou images
+# et repérer les numérisations en double (hachage perceptuel des pages, index conservé dans data/cache ;
+# leur texte OCRisé sera copié de l'original à l'étape 8)
+python src/preprocess/process_metadata.py ${DATA_INT}/pdf-index_new_${RUN}.csv ${DATA_INT}/meta_${RUN}_proc.${EXT}
+
+echo "extraire le texte natif"
+# 3. extraire le texte natif des PDF ; 2 sorties: CSV de métadonnées enrichies + dossier pour les fichiers texte natif
+# et repérer les quasi-doublons de documents déjà reçus (index conservé dans data/cache, exclus à l'étape 6) ;
+# pré-classer les documents (priorité: arrêtés urgents d'abord, pour les étapes 8 et 9)
+python src/preprocess/extract_native_text.py ${DATA_INT}/meta_${RUN}_proc.${EXT} ${DATA_INT}/meta_${RUN}_ntxt.${EXT} ${DATA_INT} 
+
+echo "déterminer le type des fichiers pdf"
+# 4. déterminer le type des fichiers PDF natifs ("texte"), non natifs ("image") ou mixtes ("mixed"),
+# et les pages image à OCRiser (classification page par page)
+python src/preprocess/determine_pdf_type.py ${DATA_INT}/meta_${RUN}_ntxt.${EXT} ${DATA_INT}/meta_${RUN}_ntxt_pdftype.${EXT} 
+
+echo "rassembler les pages dans un df"
+# 5. rassembler les pages de texte natif dans un dataframe
+python src/preprocess/separate_pages.py ${DATA_INT}/meta_${RUN}_ntxt_pdftype.${EXT} ${DATA_INT}/pages_${RUN}_ntxt.${EXT} 
+
+echo "filtrage des documents hors périmètre"
+# 6. filtrer les documents qui sont hors périmètre (plan de périmètre de sécurité), et les annexes
+# (règles sur le texte natif et sur des vignettes des pages image ; les pages exclues ne seront pas OCRisées)
+python src/preprocess/filter_docs.py ${DATA_INT}/meta_${RUN}_ntxt_pdftype.${EXT} ${DATA_INT}/pages_${RUN}_ntxt.${EXT} ${DATA_INT}/meta_${RUN}_ntxt_filt.${EXT} ${DATA_INT}/pages_${RUN}_ntxt_filt.${EXT} 
+
+echo "conversion des pdf natifs en pdf/a"
+# 7. convertir les PDF natifs ("texte") en PDF/A  # (seulement si on ajoute "--keep_pdfa")
+python src/preprocess/convert_native_pdf_to_pdfa.py ${DATA_INT}/meta_${RUN}_ntxt_filt.${EXT} ${DATA_INT}/meta_${RUN}_ntxt_pdfa.${EXT} ${DATA_INT} 
+
+echo "extraire le texte des pdf non natifs par OCR"
+# 8. extraire le texte des PDF non natifs par OCR
+# (1 entrée: CSV de métadonnées ; 2 sorties: CSV de métadonnées enrichies (OCR) + dossier pour les fichiers (PDF/A et TXT sidecar OCR))
+python src/preprocess/extract_text_ocr.py ${DATA_INT}/meta_${RUN}_ntxt_pdfa.${EXT} ${DATA_INT}/meta_${RUN}_otxt.${EXT} ${DATA_INT} 
+
+echo "analyse du texte des pdf et production paquets"
+# 9. analyser le texte des PDF et produire les fichiers paquet_*.csv
+# (délai de publication de chaque document dans data/cache/publish-latency.csv)
+python src/process/parse_doc_direct.py ${DATA_INT}/meta_${RUN}_otxt.${EXT} ${DIR_OUT}
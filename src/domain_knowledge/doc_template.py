@@ -284,4 +284,27 @@ P_FOOTER = re.compile(RE_FOOTER, flags=re.MULTILINE | re.IGNORECASE | re.VERBOSE
 # page de bordereau de formalités (en fin de document, Aix-en-Provence)
 RE_BORDEREAU = r"^BORDEREAU\s+DE\s+FORMALITES$"
 P_BORDEREAU = re.compile(RE_BORDEREAU, flags=re.MULTILINE | re.IGNORECASE)
-# TODO annexes
+
+# annexes et pièces hors périmètre: (règle, motif) ;
+# les motifs sont cherchés dans le texte de la page
+# (issus des heuristiques notées dans data_sources.EXCLUDE_FILES)
+RE_ANNEXES = [
+    # "IZ" pour le 1 et 2 mal reconnus par OCR
+    ("annexe", r"\A\s*ANNEXE\s+[I\dZ]+"),
+    ("perimetre_securite", r"\A\s*P[EÉ]RIM[EÈ]TRE\s+DE\s+S[EÉ]CURIT[EÉ]"),
+    ("plan_cadastral", r"EXTRAIT\s+DU\s+PLAN\s+CADASTRAL"),
+    ("plan_cadastral", r"^Impression\s+non\s+normalisée\s+du\s+plan\s+cadastral$"),
+    ("plan_cadastral", r"^Cet\s+extrait\s+de\s+plan\s+vous\s+est\s+délivré\s+par\s*:"),
+    # extraits du code de la construction et de l'habitation, en début de page
+    (
+        "extrait_cch",
+        r"\A\s*(?:ANNEXE\s*[-–:]?\s*)?(?:EXTRAITS?\s+DU\s+)?"
+        + r"CODE\s+DE\s+LA\s+CONSTRUCTION\s+ET\s+DE\s+L['’]HABITATION",
+    ),
+    # rapports d'expertise et diagnostics
+    (
+        "diagnostic",
+        r"\A\s*(?:RAPPORT\s+D['’]EXPERTISE|DIAGNOSTIC\s+(?:DE\s+)?(?:SOLIDIT[EÉ]|STRUCTURE))",
+    ),
+]
+P_ANNEXES = [(rule, re.compile(x, flags=re.MULTILINE)) for rule, x in RE_ANNEXES]
@@ -0,0 +1,1182 @@
+"""Exécution des étapes 2 à 9 du traitement d'un lot dans un seul processus.
+
+`scripts/process_batch.sh` lance un interpréteur Python par étape, et les
+étapes se transmettent les métadonnées par des fichiers CSV dans
+data/interim: chaque étape paie le démarrage de l'interpréteur et l'import
+de ses dépendances (pandas, pdfminer, ocrmypdf...), puis l'écriture et la
+relecture de son entrée et de sa sortie.
+
+Ce module enchaîne les mêmes étapes, avec les mêmes réglages par défaut, en
+appelant directement leurs fonctions `process_files`: les DataFrames passent
+d'une étape à la suivante en mémoire. Les fichiers CSV intermédiaires, utiles
+pour déboguer une étape, ne sont écrits qu'avec `--keep_intermediates`.
+
+Avec `--measure_savings`, le temps économisé est mesuré pour chaque étape:
+démarrage d'un interpréteur qui importe le module de l'étape, et aller-retour
+de sa sortie par un fichier CSV (écriture puis relecture avec les types de
+l'étape).
+
+En mode flux (`stream`), chaque document traverse seul les étapes, chacune
+exécutée par un thread (plusieurs pour l'OCR) et reliée à la suivante par une
+file bornée: les lignes des premiers documents sont écrites dans les fichiers
+paquet_*.csv datés (csv_historique/) bien avant la fin du lot, et la mémoire
+occupée ne dépend pas de la taille du lot (au plus `queue_size` documents en
+attente entre deux étapes, pages de texte d'un seul document à la fois). Les
+files sont ordonnées par priorité (voir `src.preprocess.priority`): les
+arrêtés urgents doublent les documents en attente.
+
+Dans les deux modes, la sortie de chaque étape pour chaque document est
+conservée dans un cache persistant (voir `src.utils.artifact_cache`): à la
+ré-exécution d'un lot, seules les étapes dont le code, les réglages ou
+l'entrée ont changé sont exécutées de nouveau (ex: après la modification
+d'une expression régulière de `src.domain_knowledge`, seule l'analyse du
+texte).
+
+Exemples:
+python -m src.pipeline run 2023-06-17T06:00:00 data/processed/ --measure_savings
+python -m src.pipeline stream 2023-06-17T06:00:00 data/processed/
+"""
+
+import argparse
+from datetime import datetime
+import io
+import itertools
+import logging
+import os
+from pathlib import Path
+import queue
+import resource
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+import pandas as pd
+
+from src.preprocess import (
+    convert_native_pdf_to_pdfa,
+    determine_pdf_type,
+    extract_native_text,
+    extract_text_ocr,
+    filter_docs,
+    process_metadata,
+    separate_pages,
+)
+from src.preprocess.convert_native_pdf_to_pdfa import DTYPE_META_NTXT_PDFA
+from src.preprocess.deferred_queue import FP_DEFERRED, DeferredQueue
+from src.preprocess.determine_pdf_type import DTYPE_META_NTXT_PDFTYPE
+from src.preprocess.extract_native_text import DTYPE_META_NTXT
+from src.preprocess.extract_text_ocr import DTYPE_META_NTXT_OCR
+from src.preprocess.extract_text_ocr_ocrmypdf import OCR_ENGINE_KEY
+from src.preprocess.filter_docs import DTYPE_META_NTXT_FILT, DTYPE_NTXT_PAGES_FILT
+from src.preprocess.index_pdfs import DTYPE_META_BASE
+from src.preprocess.ocr_cache import OcrPageCache
+from src.preprocess.ocr_cost import OcrCostModel
+from src.preprocess.ocr_pool import get_nb_ocr_slots, get_profile_path, load_ocr_profile
+from src.preprocess.priority import PRIORITY_UNKNOWN
+from src.preprocess.process_metadata import DTYPE_META_PROC
+from src.preprocess.separate_pages import DTYPE_NTXT_PAGES
+from src.process import parse_doc_direct
+from src.utils.artifact_cache import (
+    ARTIFACT_CACHE_MAX_BYTES,
+    ArtifactCache,
+    run_cached,
+)
+from src.utils.file_utils import CACHE_DIR
+from src.utils.run_budget import RunBudget, parse_deadline
+from src.utils.storage import TABLE_FORMATS, write_table
+
+# dossiers par défaut, comme dans scripts/process_batch.sh
+ROOT_DIR = Path(__file__).resolve().parents[1]
+DATA_INT = ROOT_DIR / "data" / "interim"
+DATA_PRO = ROOT_DIR / "data" / "processed"
+# mode flux: nombre maximal de documents en attente entre deux étapes
+STREAM_QUEUE_SIZE = 4
+# cache des sorties des étapes
+FP_ARTIFACT_CACHE = CACHE_DIR / "artifact-cache.sqlite"
+
+
+class StageTiming:
+    """Durées d'une étape du pipeline."""
+
+    def __init__(self, name: str, module: str):
+        """Initialise les durées d'une étape.
+
+        Parameters
+        ----------
+        name: str
+            Nom de l'étape, pour le rapport.
+        module: str
+            Module exécuté par `scripts/process_batch.sh` pour cette étape.
+        """
+        self.name = name
+        self.module = module
+        # nombre de documents en entrée
+        self.nb_docs = 0
+        # durée du traitement
+        self.compute_s = 0.0
+        # écriture des fichiers intermédiaires (--keep_intermediates)
+        self.write_s = 0.0
+        # temps économisés (--measure_savings), None si non mesurés
+        self.startup_s = None
+        self.csv_s = None
+
+
+class PipelineRunner:
+    """Enchaîne des étapes dans le processus courant, en mesurant leurs durées."""
+
+    def __init__(
+        self,
+        run: str,
+        data_int: Path,
+        keep_intermediates: bool = False,
+        measure_savings: bool = False,
+        table_format: str = "csv",
+    ):
+        """Initialise l'exécution d'un lot.
+
+        Parameters
+        ----------
+        run: str
+            Identifiant du lot.
+        data_int: Path
+            Dossier des fichiers intermédiaires (data/interim).
+        keep_intermediates: bool, defaults to False
+            Si True, écrit la sortie de chaque étape dans le fichier CSV
+            qu'utilise `scripts/process_batch.sh`.
+        measure_savings: bool, defaults to False
+            Si True, mesure pour chaque étape le démarrage d'un interpréteur
+            et l'aller-retour de sa sortie par un fichier CSV.
+        table_format: str, defaults to "csv"
+            Format des fichiers intermédiaires: "csv" ou "parquet".
+        """
+        self.run = run
+        self.data_int = data_int
+        self.keep_intermediates = keep_intermediates
+        self.measure_savings = measure_savings
+        self.table_format = table_format
+        self.timings: List[StageTiming] = []
+
+    def run_stage(self, name: str, module: str, func: Callable, *args, **kwargs):
+        """Exécute une étape.
+
+        Parameters
+        ----------
+        name: str
+            Nom de l'étape.
+        module: str
+            Module de l'étape, pour mesurer le coût de son démarrage.
+        func: Callable
+            Fonction de l'étape, appelée avec `args` et `kwargs`.
+
+        Returns
+        -------
+        result
+            Résultat de la fonction de l'étape.
+        """
+        timing = StageTiming(name, module)
+        self.timings.append(timing)
+        if args and isinstance(args[0], pd.DataFrame):
+            timing.nb_docs = len(args[0])
+        logging.info(f"Étape {name}")
+        print(name)
+        t_start = time.perf_counter()
+        result = func(*args, **kwargs)
+        timing.compute_s = time.perf_counter() - t_start
+        if self.measure_savings:
+            timing.startup_s = measure_startup(module)
+        return result
+
+    def hand_off(self, df: pd.DataFrame, dtype: Dict[str, str], csv_name: str):
+        """Transmet la sortie de la dernière étape à la suivante.
+
+        Parameters
+        ----------
+        df: pd.DataFrame
+            Sortie de l'étape.
+        dtype: Dict[str, str]
+            Types des colonnes, pour relire le fichier CSV.
+        csv_name: str
+            Nom du fichier de la sortie dans `scripts/process_batch.sh`, sans
+            extension ni identifiant du lot (ex: "meta_{run}_proc").
+        """
+        timing = self.timings[-1]
+        if self.measure_savings:
+            timing.csv_s = (timing.csv_s or 0.0) + measure_csv_round_trip(df, dtype)
+        if self.keep_intermediates:
+            t_start = time.perf_counter()
+            fp_table = (
+                self.data_int / f"{csv_name.format(run=self.run)}.{self.table_format}"
+            )
+            write_table(df, fp_table, dtype)
+            timing.write_s += time.perf_counter() - t_start
+            logging.info(f"Fichier intermédiaire: {fp_table}")
+
+    def report(self):
+        """Écrit les durées de chaque étape et les temps économisés.
+
+        Aussi sur la sortie standard, pour le résumé dans batch-logs.
+        """
+        lines = [
+            f"{'étape':<46} {'docs':>5} {'calcul':>9} {'démarrage':>10} {'CSV':>8}"
+        ]
+        for timing in self.timings:
+            startup = (
+                f"{timing.startup_s:.2f}s" if timing.startup_s is not None else "-"
+            )
+            csv = f"{timing.csv_s:.3f}s" if timing.csv_s is not None else "-"
+            lines.append(
+                f"{timing.name:<46} {timing.nb_docs:>5} {timing.compute_s:>8.2f}s"
+                + f" {startup:>10} {csv:>8}"
+            )
+        total_compute = sum(x.compute_s for x in self.timings)
+        lines.append(f"Durée totale des étapes: {total_compute:.1f}s")
+        if self.keep_intermediates:
+            total_write = sum(x.write_s for x in self.timings)
+            lines.append(f"Écriture des fichiers intermédiaires: {total_write:.2f}s")
+        if self.measure_savings:
+            total_startup = sum(x.startup_s or 0.0 for x in self.timings)
+            total_csv = sum(x.csv_s or 0.0 for x in self.timings)
+            lines.append(
+                f"Temps économisé: {total_startup + total_csv:.1f}s"
+                + f" (démarrage: {total_startup:.1f}s, CSV: {total_csv:.2f}s)"
+            )
+        for line in lines:
+            logging.info(line)
+            print(line)
+
+
+def measure_startup(module: str) -> float:
+    """Mesure le démarrage d'un interpréteur qui importe un module.
+
+    Parameters
+    ----------
+    module: str
+        Module à importer (ex: "src.preprocess.extract_native_text").
+
+    Returns
+    -------
+    duration_s: float
+        Durée, en secondes.
+    """
+    t_start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", f"import {module}"],
+        cwd=ROOT_DIR,
+        check=True,
+        capture_output=True,
+    )
+    return time.perf_counter() - t_start
+
+
+def measure_csv_round_trip(df: pd.DataFrame, dtype: Dict[str, str]) -> float:
+    """Mesure l'écriture d'un DataFrame en CSV et sa relecture.
+
+    Le fichier est écrit en mémoire, pour ne pas compter les accès disque.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        DataFrame transmis à l'étape suivante.
+    dtype: Dict[str, str]
+        Types des colonnes, pour la relecture.
+
+    Returns
+    -------
+    duration_s: float
+        Durée, en secondes.
+    """
+    t_start = time.perf_counter()
+    buf = io.StringIO()
+    df.to_csv(buf, index=False)
+    buf.seek(0)
+    pd.read_csv(buf, dtype=dtype)
+    return time.perf_counter() - t_start
+
+
+def cached_stage(
+    cache: Optional[ArtifactCache],
+    stage: str,
+    func: Callable[[pd.DataFrame], pd.DataFrame],
+    dtype: Dict[str, str],
+    params: Optional[Dict] = None,
+    required_cols: Iterable[str] = (),
+) -> Callable[[pd.DataFrame], pd.DataFrame]:
+    """Applique le cache des sorties à une étape.
+
+    Parameters
+    ----------
+    cache: ArtifactCache, optional
+        Cache des sorties ; si None, l'étape est exécutée sur tous les
+        documents.
+    stage: str
+        Nom de l'étape dans le cache (voir `STAGE_MODULES`).
+    func: Callable[[pd.DataFrame], pd.DataFrame]
+        Traitement des documents.
+    dtype: Dict[str, str]
+        Types des colonnes de la sortie.
+    params: Dict, optional
+        Réglages de l'étape.
+    required_cols: Iterable[str], defaults to ()
+        Colonnes de la sortie désignant un fichier qui doit exister.
+
+    Returns
+    -------
+    func_cached: Callable[[pd.DataFrame], pd.DataFrame]
+        Traitement des seuls documents dont la sortie n'est pas en cache.
+    """
+    return lambda df: run_cached(
+        cache, stage, func, df, dtype, params=params, required_cols=required_cols
+    )
+
+
+def process_metadata_stage(
+    cache: Optional[ArtifactCache], scandup_db: Path
+) -> Callable[[pd.DataFrame], pd.DataFrame]:
+    """Applique le cache des sorties à l'étape des métadonnées.
+
+    Les doublons repérés par `process_metadata.guess_duplicates_meta`
+    ("dup_allinfo", "dup_createdate", "dup_hash") dépendent de tout le lot:
+    ils ne sont pas mis en cache, mais recherchés sur le lot complet, y
+    compris les documents dont la sortie est en cache.
+
+    Parameters
+    ----------
+    cache: ArtifactCache, optional
+        Cache des sorties ; si None, l'étape est exécutée sur tous les
+        documents.
+    scandup_db: Path
+        Base SQLite de l'index des numérisations en double.
+
+    Returns
+    -------
+    func_cached: Callable[[pd.DataFrame], pd.DataFrame]
+        Traitement des métadonnées du lot.
+    """
+    func_cached = cached_stage(
+        cache,
+        "process_metadata",
+        lambda df: process_metadata.process_files(
+            df, scandup_db=scandup_db, guess_dups=False
+        ),
+        DTYPE_META_PROC,
+    )
+    return lambda df: process_metadata.guess_duplicates_meta(func_cached(df)).astype(
+        dtype=DTYPE_META_PROC
+    )
+
+
+def prepare_batch(
+    runner: PipelineRunner,
+    df_metas: pd.DataFrame,
+    data_int: Path,
+    budget: Optional[RunBudget] = None,
+    deferred_queue: Optional[DeferredQueue] = None,
+    artifact_cache: Optional[ArtifactCache] = None,
+) -> Optional[pd.DataFrame]:
+    """Prépare un lot de PDF pour l'OCR (étapes 2 à 7 du pipeline).
+
+    Parameters
+    ----------
+    runner: PipelineRunner
+        Exécution du lot.
+    df_metas: pd.DataFrame
+        Index des nouveaux PDF.
+    data_int: Path
+        Dossier des fichiers intermédiaires (textes, PDF/A, CSV).
+    budget: RunBudget, optional
+        Budget de l'exécution, pour l'extraction du texte natif.
+    deferred_queue: DeferredQueue, optional
+        File des documents reportés au prochain lot.
+    artifact_cache: ArtifactCache, optional
+        Cache des sorties des étapes.
+
+    Returns
+    -------
+    df_metas: pd.DataFrame, optional
+        Métadonnées des documents à OCRiser (meta_{run}_ntxt_pdfa), None si
+        aucun document n'a passé l'extraction du texte natif.
+    """
+    out_txt_nat = data_int / "txt_nat"
+    out_pdfa_nat = data_int / "pdfa_nat"
+    # 2. métadonnées, numérisations en double
+    df_metas = runner.run_stage(
+        "traiter les métadonnées",
+        "src.preprocess.process_metadata",
+        process_metadata_stage(artifact_cache, CACHE_DIR / "scandup-index.sqlite"),
+        df_metas,
+    )
+    runner.hand_off(df_metas, DTYPE_META_PROC, "meta_{run}_proc")
+    # 3. texte natif, quasi-doublons, priorité
+    df_metas = runner.run_stage(
+        "extraire le texte natif",
+        "src.preprocess.extract_native_text",
+        cached_stage(
+            artifact_cache,
+            "extract_native_text",
+            lambda df: extract_native_text.process_files(
+                df,
+                out_txt_nat,
+                neardup_db=CACHE_DIR / "neardup-index.sqlite",
+                budget=budget,
+                deferred_queue=deferred_queue,
+            ),
+            DTYPE_META_NTXT,
+            params={"out_dir": out_txt_nat},
+        ),
+        df_metas,
+    )
+    runner.hand_off(df_metas, DTYPE_META_NTXT, "meta_{run}_ntxt")
+    if df_metas.empty:
+        logging.warning("Aucun document après l'extraction du texte natif")
+        print("Arrêt: aucun document à traiter")
+        return None
+    # 4. type des PDF
+    df_metas = runner.run_stage(
+        "déterminer le type des fichiers pdf",
+        "src.preprocess.determine_pdf_type",
+        cached_stage(
+            artifact_cache,
+            "determine_pdf_type",
+            determine_pdf_type.process_files,
+            DTYPE_META_NTXT_PDFTYPE,
+        ),
+        df_metas,
+    )
+    runner.hand_off(df_metas, DTYPE_META_NTXT_PDFTYPE, "meta_{run}_ntxt_pdftype")
+    # 5. pages de texte natif
+    df_pages = runner.run_stage(
+        "rassembler les pages dans un df",
+        "src.preprocess.separate_pages",
+        separate_pages.create_pages_dataframe,
+        df_metas,
+    )
+    runner.hand_off(df_pages, DTYPE_NTXT_PAGES, "pages_{run}_ntxt")
+    # 6. documents hors périmètre, annexes
+    # (sans cache si les fichiers intermédiaires sont écrits: les pages des
+    # documents trouvés en cache manqueraient dans pages_{run}_ntxt_filt)
+    pages_filt = []
+
+    def _filter(df: pd.DataFrame) -> pd.DataFrame:
+        df, df_pages_filt = filter_docs.process_files(
+            df, df_pages[df_pages["pdf"].isin(df["pdf"])]
+        )
+        pages_filt.append(df_pages_filt)
+        return df
+
+    df_metas = runner.run_stage(
+        "filtrage des documents hors périmètre",
+        "src.preprocess.filter_docs",
+        cached_stage(
+            artifact_cache if not runner.keep_intermediates else None,
+            "filter_docs",
+            _filter,
+            DTYPE_META_NTXT_FILT,
+        ),
+        df_metas,
+    )
+    df_pages = pd.concat(pages_filt, ignore_index=True) if pages_filt else None
+    runner.hand_off(df_metas, DTYPE_META_NTXT_FILT, "meta_{run}_ntxt_filt")
+    if df_pages is not None:
+        runner.hand_off(df_pages, DTYPE_NTXT_PAGES_FILT, "pages_{run}_ntxt_filt")
+    # 7. PDF natifs en PDF/A
+    df_metas = runner.run_stage(
+        "conversion des pdf natifs en pdf/a",
+        "src.preprocess.convert_native_pdf_to_pdfa",
+        cached_stage(
+            artifact_cache,
+            "convert_native_pdf_to_pdfa",
+            lambda df: convert_native_pdf_to_pdfa.process_files(df, out_pdfa_nat),
+            DTYPE_META_NTXT_PDFA,
+            params={"out_dir": out_pdfa_nat},
+            required_cols=("fullpath_pdfa",),
+        ),
+        df_metas,
+    )
+    runner.hand_off(df_metas, DTYPE_META_NTXT_PDFA, "meta_{run}_ntxt_pdfa")
+    return df_metas
+
+
+def run_batch(
+    run: str,
+    dir_out: Path,
+    data_int: Path = DATA_INT,
+    budget: Optional[RunBudget] = None,
+    fp_deferred: Path = FP_DEFERRED,
+    keep_intermediates: bool = False,
+    measure_savings: bool = False,
+    table_format: str = "csv",
+    fp_artifact_cache: Optional[Path] = FP_ARTIFACT_CACHE,
+    artifact_cache_size: int = ARTIFACT_CACHE_MAX_BYTES,
+) -> Optional[Dict[str, Path]]:
+    """Traite un lot de PDF déjà indexés (étapes 2 à 9 du pipeline).
+
+    Parameters
+    ----------
+    run: str
+        Identifiant du lot: l'index des nouveaux PDF est
+        `data_int / f"pdf-index_new_{run}.csv"`.
+    dir_out: Path
+        Dossier de sortie des fichiers paquet_*.csv et des PDF.
+    data_int: Path, defaults to DATA_INT
+        Dossier des fichiers intermédiaires (textes, PDF/A, CSV).
+    budget: RunBudget, optional
+        Budget de l'exécution, pour l'extraction du texte natif et l'OCR.
+    fp_deferred: Path, defaults to FP_DEFERRED
+        Fichier CSV de la file des documents reportés au prochain lot.
+    keep_intermediates: bool, defaults to False
+        Si True, écrit les fichiers CSV intermédiaires de
+        `scripts/process_batch.sh`.
+    measure_savings: bool, defaults to False
+        Si True, mesure le temps économisé par rapport à un processus par
+        étape.
+    table_format: str, defaults to "csv"
+        Format des fichiers intermédiaires: "csv" ou "parquet".
+    fp_artifact_cache: Path, optional
+        Base SQLite du cache des sorties des étapes ; si None, toutes les
+        étapes sont exécutées pour tous les documents.
+    artifact_cache_size: int, defaults to ARTIFACT_CACHE_MAX_BYTES
+        Taille maximale du cache des sorties des étapes, en octets.
+
+    Returns
+    -------
+    out_files: Dict[str, Path], optional
+        Fichiers CSV produits, None si aucun document n'est arrivé à
+        l'analyse.
+    """
+    in_file = data_int / f"pdf-index_new_{run}.csv"
+    if not in_file.is_file():
+        raise ValueError(f"Le fichier en entrée {in_file} n'existe pas.")
+    # mêmes dossiers que les scripts des étapes
+    out_txt_nat = data_int / "txt_nat"
+    out_pdfa_nat = data_int / "pdfa_nat"
+    out_pdfa_ocr = data_int / "pdfa_ocr"
+    out_txt_ocr = data_int / "txt_ocr"
+    for out_sub in (out_txt_nat, out_pdfa_nat, out_pdfa_ocr, out_txt_ocr):
+        out_sub.mkdir(parents=True, exist_ok=True)
+    dir_out.mkdir(parents=True, exist_ok=True)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    deferred_queue = DeferredQueue(fp_deferred)
+    artifact_cache = (
+        ArtifactCache(fp_artifact_cache, max_bytes=artifact_cache_size)
+        if fp_artifact_cache is not None
+        else None
+    )
+
+    runner = PipelineRunner(
+        run,
+        data_int,
+        keep_intermediates=keep_intermediates,
+        measure_savings=measure_savings,
+        table_format=table_format,
+    )
+    df_metas = pd.read_csv(in_file, dtype=DTYPE_META_BASE)
+    out_files = None
+    try:
+        # 2. à 7. métadonnées, texte natif, type des PDF, filtrage, PDF/A
+        df_metas = prepare_batch(
+            runner, df_metas, data_int, budget, deferred_queue, artifact_cache
+        )
+        if df_metas is None:
+            return None
+        # 8. OCR
+        ocr_cache = OcrPageCache(CACHE_DIR / "ocr-page-cache.sqlite", OCR_ENGINE_KEY)
+        ocr_profile = load_ocr_profile(get_profile_path())
+        ocr_params = {
+            "engine": OCR_ENGINE_KEY,
+            "out_dirs": [out_pdfa_ocr, out_txt_ocr],
+        }
+        try:
+            df_metas = runner.run_stage(
+                "extraire le texte des pdf non natifs par OCR",
+                "src.preprocess.extract_text_ocr",
+                cached_stage(
+                    artifact_cache,
+                    "extract_text_ocr",
+                    lambda df: extract_text_ocr.process_files(
+                        df,
+                        out_pdfa_ocr,
+                        out_txt_ocr,
+                        ocr_cache=ocr_cache,
+                        ocr_profile=ocr_profile,
+                        cost_model=OcrCostModel(CACHE_DIR / "ocr-timings.csv"),
+                        budget=budget,
+                        deferred_queue=deferred_queue,
+                    ),
+                    DTYPE_META_NTXT_OCR,
+                    params=ocr_params,
+                    required_cols=("fullpath_pdfa",),
+                ),
+                df_metas,
+            )
+        finally:
+            ocr_cache.close()
+        runner.hand_off(df_metas, DTYPE_META_NTXT_OCR, "meta_{run}_otxt")
+        if df_metas.empty:
+            logging.warning("Aucun document après l'OCR")
+            print("Arrêt: aucun document à analyser")
+            return None
+        # 9. analyse du texte, fichiers paquet_*.csv
+        date_exec = datetime.now().date()
+        out_files = runner.run_stage(
+            "analyse du texte des pdf et production paquets",
+            "src.process.parse_doc_direct",
+            parse_doc_direct.process_files,
+            df_metas,
+            dir_out,
+            date_exec=date_exec,
+            latency_csv=CACHE_DIR / "publish-latency.csv",
+            artifact_cache=artifact_cache,
+        )
+        if out_files:
+            parse_doc_direct.export_report(out_files, dir_out)
+    finally:
+        runner.report()
+        if artifact_cache is not None:
+            artifact_cache.log_stats()
+            artifact_cache.close()
+    return out_files
+
+
+class StreamStage:
+    """Étape du mode flux, appliquée à un document à la fois."""
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[pd.DataFrame], Optional[pd.DataFrame]],
+        workers: int = 1,
+    ):
+        """Initialise l'étape.
+
+        Parameters
+        ----------
+        name: str
+            Nom de l'étape, pour le rapport.
+        func: Callable[[pd.DataFrame], Optional[pd.DataFrame]]
+            Traitement d'un document (DataFrame d'une ligne) ; renvoie None
+            ou un DataFrame vide si le document sort du flux (reporté,
+            doublon, analysé).
+        workers: int, defaults to 1
+            Nombre de threads de l'étape.
+        """
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.nb_docs = 0
+        self.nb_errors = 0
+        # durée cumulée des traitements, sur tous les threads
+        self.compute_s = 0.0
+        self._lock = threading.Lock()
+        self._nb_running = workers
+
+    def add(self, duration_s: float, error: bool = False):
+        """Compte un document traité.
+
+        Parameters
+        ----------
+        duration_s: float
+            Durée du traitement, en secondes.
+        error: bool, defaults to False
+            Si True, le traitement a échoué.
+        """
+        with self._lock:
+            self.nb_docs += 1
+            self.nb_errors += error
+            self.compute_s += duration_s
+
+    def worker_done(self) -> bool:
+        """Signale la fin d'un thread de l'étape.
+
+        Returns
+        -------
+        last: bool
+            True si c'était le dernier thread de l'étape.
+        """
+        with self._lock:
+            self._nb_running -= 1
+            return self._nb_running == 0
+
+
+class StreamingRunner:
+    """Enchaîne des étapes document par document, reliées par des files bornées.
+
+    Les files sont ordonnées par priorité du document puis par ordre
+    d'arrivée. Un document dont le traitement échoue sort du flux (l'erreur
+    est écrite dans le log) : son fichier d'origine reste dans le dossier
+    d'entrée, et il est ajouté à la file des documents reportés, pour être
+    traité au prochain lot (il est déjà dans l'index des PDF, et ne serait
+    pas ré-indexé).
+    """
+
+    # fin du flux, après tous les documents dans les files
+    _END = (float("inf"), float("inf"), None)
+
+    def __init__(
+        self,
+        stages: List[StreamStage],
+        queue_size: int = STREAM_QUEUE_SIZE,
+        deferred_queue: Optional[DeferredQueue] = None,
+    ):
+        """Initialise le flux.
+
+        Parameters
+        ----------
+        stages: List[StreamStage]
+            Étapes, dans l'ordre.
+        queue_size: int, defaults to STREAM_QUEUE_SIZE
+            Nombre maximal de documents en attente devant chaque étape.
+        deferred_queue: DeferredQueue, optional
+            File des documents reportés au prochain lot, où sont ajoutés les
+            documents dont le traitement échoue ; si None, ils sont
+            seulement écrits dans le log.
+        """
+        self.stages = stages
+        self.deferred_queue = deferred_queue
+        self.queues = [queue.PriorityQueue(maxsize=queue_size) for _ in stages]
+        self._seq = itertools.count()
+
+    def _put(self, i_stage: int, df_doc: pd.DataFrame):
+        """Place un document dans la file d'une étape (bloque si elle est pleine).
+
+        Parameters
+        ----------
+        i_stage: int
+            Indice de l'étape.
+        df_doc: pd.DataFrame
+            Document (une ligne).
+        """
+        priority = PRIORITY_UNKNOWN
+        if "priority" in df_doc.columns and pd.notna(df_doc["priority"].iloc[0]):
+            priority = int(df_doc["priority"].iloc[0])
+        self.queues[i_stage].put((priority, next(self._seq), df_doc))
+
+    def _work(self, i_stage: int):
+        """Traite les documents de la file d'une étape, jusqu'à la fin du flux.
+
+        Parameters
+        ----------
+        i_stage: int
+            Indice de l'étape.
+        """
+        stage = self.stages[i_stage]
+        q_in = self.queues[i_stage]
+        has_next = i_stage + 1 < len(self.stages)
+        while True:
+            item = q_in.get()
+            if item[2] is None:
+                # fin du flux: la laisser aux autres threads de l'étape
+                q_in.put(item)
+                break
+            df_doc = item[2]
+            t_start = time.perf_counter()
+            try:
+                df_out = stage.func(df_doc)
+            except Exception as exc:
+                logging.exception(f"{stage.name}: échec sur {df_doc['pdf'].iloc[0]}")
+                stage.add(time.perf_counter() - t_start, error=True)
+                if self.deferred_queue is not None:
+                    self.deferred_queue.add(
+                        next(df_doc.itertuples()),
+                        stage.name,
+                        f"échec: {type(exc).__name__}: {exc}",
+                    )
+                continue
+            stage.add(time.perf_counter() - t_start)
+            if has_next and df_out is not None and not df_out.empty:
+                for i in range(len(df_out)):
+                    self._put(i_stage + 1, df_out.iloc[[i]])
+        if stage.worker_done() and has_next:
+            self.queues[i_stage + 1].put(self._END)
+
+    def run(self, docs: Iterable[pd.DataFrame]):
+        """Fait passer des documents dans toutes les étapes.
+
+        Parameters
+        ----------
+        docs: Iterable[pd.DataFrame]
+            Documents (une ligne chacun), dans l'ordre d'arrivée.
+        """
+        threads = [
+            threading.Thread(
+                target=self._work, args=(i_stage,), name=f"{stage.name}-{i_worker}"
+            )
+            for i_stage, stage in enumerate(self.stages)
+            for i_worker in range(stage.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for df_doc in docs:
+            self._put(0, df_doc)
+        self.queues[0].put(self._END)
+        for thread in threads:
+            thread.join()
+        if self.deferred_queue is not None:
+            self.deferred_queue.save()
+
+    def report(self, duration_s: float, first_row_s: Optional[float]):
+        """Écrit le nombre de documents et la durée de chaque étape, et la
+        mémoire résidente maximale.
+
+        Aussi sur la sortie standard, pour le résumé dans batch-logs.
+
+        Parameters
+        ----------
+        duration_s: float
+            Durée totale du flux, en secondes.
+        first_row_s: float, optional
+            Délai avant l'écriture des premières lignes des fichiers
+            paquet_*.csv, en secondes ; None si aucune ligne n'a été écrite.
+        """
+        lines = [f"{'étape':<46} {'docs':>5} {'échecs':>6} {'calcul':>9}"]
+        for stage in self.stages:
+            lines.append(
+                f"{stage.name:<46} {stage.nb_docs:>5} {stage.nb_errors:>6}"
+                + f" {stage.compute_s:>8.2f}s"
+            )
+        lines.append(f"Durée totale: {duration_s:.1f}s")
+        if first_row_s is not None:
+            lines.append(
+                f"Premières lignes des fichiers paquet_*.csv: {first_row_s:.1f}s"
+            )
+        # ru_maxrss est en Kio sous Linux
+        rss_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        rss_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        lines.append(
+            f"Mémoire résidente maximale: {rss_self:.0f} Mio"
+            + f" (plus gros processus lancé: {rss_children:.0f} Mio)"
+        )
+        for line in lines:
+            logging.info(line)
+            print(line)
+
+
+def stream_batch(
+    run: str,
+    dir_out: Path,
+    data_int: Path = DATA_INT,
+    budget: Optional[RunBudget] = None,
+    fp_deferred: Path = FP_DEFERRED,
+    queue_size: int = STREAM_QUEUE_SIZE,
+    ocr_workers: int = 0,
+    fp_artifact_cache: Optional[Path] = FP_ARTIFACT_CACHE,
+    artifact_cache_size: int = ARTIFACT_CACHE_MAX_BYTES,
+) -> Optional[Dict[str, Path]]:
+    """Traite un lot de PDF déjà indexés en flux, document par document.
+
+    Mêmes étapes que `run_batch`, sans fichiers intermédiaires.
+
+    Parameters
+    ----------
+    run: str
+        Identifiant du lot: l'index des nouveaux PDF est
+        `data_int / f"pdf-index_new_{run}.csv"`.
+    dir_out: Path
+        Dossier de sortie des fichiers paquet_*.csv et des PDF.
+    data_int: Path, defaults to DATA_INT
+        Dossier des fichiers intermédiaires (textes, PDF/A).
+    budget: RunBudget, optional
+        Budget de l'exécution, pour l'extraction du texte natif et l'OCR.
+    fp_deferred: Path, defaults to FP_DEFERRED
+        Fichier CSV de la file des documents reportés au prochain lot.
+    queue_size: int, defaults to STREAM_QUEUE_SIZE
+        Nombre maximal de documents en attente devant chaque étape.
+    ocr_workers: int, defaults to 0
+        Nombre de documents OCRisés simultanément (0: d'après le profil
+        d'OCR de la machine, sinon selon les coeurs et la mémoire
+        disponibles).
+    fp_artifact_cache: Path, optional
+        Base SQLite du cache des sorties des étapes ; si None, toutes les
+        étapes sont exécutées pour tous les documents.
+    artifact_cache_size: int, defaults to ARTIFACT_CACHE_MAX_BYTES
+        Taille maximale du cache des sorties des étapes, en octets.
+
+    Returns
+    -------
+    out_files: Dict[str, Path], optional
+        Fichiers CSV produits, None si aucun document n'est arrivé à
+        l'analyse.
+    """
+    in_file = data_int / f"pdf-index_new_{run}.csv"
+    if not in_file.is_file():
+        raise ValueError(f"Le fichier en entrée {in_file} n'existe pas.")
+    # mêmes dossiers que les scripts des étapes
+    out_txt_nat = data_int / "txt_nat"
+    out_pdfa_nat = data_int / "pdfa_nat"
+    out_pdfa_ocr = data_int / "pdfa_ocr"
+    out_txt_ocr = data_int / "txt_ocr"
+    for out_sub in (out_txt_nat, out_pdfa_nat, out_pdfa_ocr, out_txt_ocr):
+        out_sub.mkdir(parents=True, exist_ok=True)
+    dir_out.mkdir(parents=True, exist_ok=True)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    deferred_queue = DeferredQueue(fp_deferred)
+    artifact_cache = (
+        ArtifactCache(fp_artifact_cache, max_bytes=artifact_cache_size)
+        if fp_artifact_cache is not None
+        else None
+    )
+    ocr_profile = load_ocr_profile(get_profile_path())
+    if ocr_workers <= 0:
+        ocr_workers = (
+            ocr_profile["workers"] if ocr_profile is not None else get_nb_ocr_slots()
+        )
+    ocr_cache = OcrPageCache(CACHE_DIR / "ocr-page-cache.sqlite", OCR_ENGINE_KEY)
+    cost_model = OcrCostModel(CACHE_DIR / "ocr-timings.csv")
+    writer = parse_doc_direct.PaquetWriter(
+        dir_out,
+        datetime.now().date(),
+        latency_csv=CACHE_DIR / "publish-latency.csv",
+        artifact_cache=artifact_cache,
+    )
+    t_start = time.perf_counter()
+    first_row_s = None
+
+    def _filter(df_doc: pd.DataFrame) -> pd.DataFrame:
+        # pages de texte natif du seul document courant
+        df_pages = separate_pages.create_pages_dataframe(df_doc)
+        df_doc, _ = filter_docs.process_files(df_doc, df_pages)
+        return df_doc
+
+    def _parse(df_doc: pd.DataFrame) -> None:
+        nonlocal first_row_s
+        for df_row in writer.exclude_duplicates(df_doc).itertuples():
+            writer.add_doc(df_row)
+            if first_row_s is None:
+                first_row_s = time.perf_counter() - t_start
+                logging.info(f"Premières lignes écrites après {first_row_s:.1f}s")
+
+    stages = [
+        StreamStage(
+            "traiter les métadonnées",
+            process_metadata_stage(artifact_cache, CACHE_DIR / "scandup-index.sqlite"),
+        ),
+        StreamStage(
+            "extraire le texte natif",
+            cached_stage(
+                artifact_cache,
+                "extract_native_text",
+                lambda df: extract_native_text.process_files(
+                    df,
+                    out_txt_nat,
+                    neardup_db=CACHE_DIR / "neardup-index.sqlite",
+                    budget=budget,
+                    deferred_queue=deferred_queue,
+                ),
+                DTYPE_META_NTXT,
+                params={"out_dir": out_txt_nat},
+            ),
+        ),
+        StreamStage(
+            "déterminer le type des fichiers pdf",
+            cached_stage(
+                artifact_cache,
+                "determine_pdf_type",
+                determine_pdf_type.process_files,
+                DTYPE_META_NTXT_PDFTYPE,
+            ),
+        ),
+        StreamStage(
+            "filtrage des documents hors périmètre",
+            cached_stage(artifact_cache, "filter_docs", _filter, DTYPE_META_NTXT_FILT),
+        ),
+        StreamStage(
+            "conversion des pdf natifs en pdf/a",
+            cached_stage(
+                artifact_cache,
+                "convert_native_pdf_to_pdfa",
+                lambda df: convert_native_pdf_to_pdfa.process_files(df, out_pdfa_nat),
+                DTYPE_META_NTXT_PDFA,
+                params={"out_dir": out_pdfa_nat},
+                required_cols=("fullpath_pdfa",),
+            ),
+        ),
+        StreamStage(
+            "extraire le texte des pdf non natifs par OCR",
+            cached_stage(
+                artifact_cache,
+                "extract_text_ocr",
+                lambda df: extract_text_ocr.process_files(
+                    df,
+                    out_pdfa_ocr,
+                    out_txt_ocr,
+                    workers=1,
+                    ocr_cache=ocr_cache,
+                    ocr_profile=ocr_profile,
+                    cost_model=cost_model,
+                    budget=budget,
+                    deferred_queue=deferred_queue,
+                ),
+                DTYPE_META_NTXT_OCR,
+                params={
+                    "engine": OCR_ENGINE_KEY,
+                    "out_dirs": [out_pdfa_ocr, out_txt_ocr],
+                },
+                required_cols=("fullpath_pdfa",),
+            ),
+            workers=ocr_workers,
+        ),
+        # un seul thread: les identifiants (idu) sont attribués dans l'ordre
+        StreamStage("analyse du texte des pdf et production paquets", _parse),
+    ]
+    runner = StreamingRunner(
+        stages, queue_size=queue_size, deferred_queue=deferred_queue
+    )
+    df_metas = pd.read_csv(in_file, dtype=DTYPE_META_BASE)
+    try:
+        runner.run(df_metas.iloc[[i]] for i in range(len(df_metas)))
+    finally:
+        ocr_cache.close()
+        runner.report(time.perf_counter() - t_start, first_row_s)
+        if artifact_cache is not None:
+            artifact_cache.log_stats()
+            artifact_cache.close()
+    out_files = writer.finalize()
+    if not out_files:
+        print("Aucun document analysé")
+        return None
+    parse_doc_direct.export_report(out_files, dir_out)
+    return out_files
+
+
+if __name__ == "__main__":
+    # log
+    dir_log = ROOT_DIR / "logs"
+    dir_log.mkdir(exist_ok=True)
+    # NB: pas de level=logging.DEBUG, à cause de pdfminer.six (voir extract_native_text)
+    logging.basicConfig(
+        filename=f"{dir_log}/pipeline_{datetime.now().isoformat()}.log",
+        encoding="utf-8",
+        level=logging.INFO,
+    )
+
+    # arguments de la commande exécutable
+    # - communs aux deux modes
+    parser_common = argparse.ArgumentParser(add_help=False)
+    parser_common.add_argument(
+        "run",
+        help="Identifiant du lot, tel que l'index des nouveaux PDF est DATA_INT/pdf-index_new_RUN.csv",
+    )
+    parser_common.add_argument(
+        "dir_out",
+        nargs="?",
+        default=str(DATA_PRO),
+        help="Dossier de sortie des fichiers paquet_*.csv et des PDF",
+    )
+    parser_common.add_argument(
+        "--data_int",
+        default=str(DATA_INT),
+        help="Dossier des fichiers intermédiaires",
+    )
+    parser_common.add_argument(
+        "--deadline",
+        default=os.environ.get("RUN_DEADLINE", ""),
+        help="Échéance de l'exécution, au format ISO (ex: 2023-06-17T06:00:00): les documents restants sont alors reportés au prochain lot (par défaut: variable d'environnement RUN_DEADLINE)",
+    )
+    parser_common.add_argument(
+        "--max_rss",
+        type=int,
+        default=int(os.environ.get("RUN_MAX_RSS_MB", 0)),
+        help="Mémoire résidente maximale, en Mio (0: pas de limite ; par défaut: variable d'environnement RUN_MAX_RSS_MB)",
+    )
+    parser_common.add_argument(
+        "--cpu_share",
+        type=float,
+        default=float(os.environ.get("RUN_CPU_SHARE", 0)),
+        help="Charge maximale des processeurs de la machine, entre 0 et 1, au-delà de laquelle aucun document n'est commencé (0: pas de limite ; par défaut: variable d'environnement RUN_CPU_SHARE)",
+    )
+    parser_common.add_argument(
+        "--deferred",
+        default=str(FP_DEFERRED),
+        help="Fichier CSV de la file des documents reportés au prochain lot",
+    )
+    parser_common.add_argument(
+        "--artifact_cache",
+        default=str(FP_ARTIFACT_CACHE),
+        help="Base SQLite du cache des sorties des étapes, conservée entre les exécutions ('' pour désactiver le cache)",
+    )
+    parser_common.add_argument(
+        "--artifact_cache_size",
+        type=int,
+        default=ARTIFACT_CACHE_MAX_BYTES // (1024 * 1024),
+        help="Taille maximale du cache des sorties des étapes, en Mio",
+    )
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    # - étape par étape
+    parser_run = subparsers.add_parser(
+        "run",
+        parents=[parser_common],
+        help="Traiter un lot de PDF déjà indexés, comme scripts/process_batch.sh",
+    )
+    parser_run.add_argument(
+        "--keep_intermediates",
+        action="store_true",
+        help="Écrire les fichiers CSV intermédiaires de scripts/process_batch.sh (débogage)",
+    )
+    parser_run.add_argument(
+        "--format",
+        choices=TABLE_FORMATS,
+        default=os.environ.get("INTERMEDIATE_FORMAT", "csv"),
+        help="Format des fichiers intermédiaires écrits avec --keep_intermediates (par défaut: variable d'environnement INTERMEDIATE_FORMAT, sinon csv)",
+    )
+    parser_run.add_argument(
+        "--measure_savings",
+        action="store_true",
+        help="Mesurer, pour chaque étape, le démarrage d'un interpréteur et l'aller-retour de sa sortie par un fichier CSV",
+    )
+    # - en flux, document par document
+    parser_stream = subparsers.add_parser(
+        "stream",
+        parents=[parser_common],
+        help="Traiter un lot de PDF déjà indexés en flux, document par document",
+    )
+    parser_stream.add_argument(
+        "--queue_size",
+        type=int,
+        default=STREAM_QUEUE_SIZE,
+        help="Nombre maximal de documents en attente devant chaque étape",
+    )
+    parser_stream.add_argument(
+        "--ocr_workers",
+        type=int,
+        default=0,
+        help="Nombre de documents OCRisés simultanément (0: d'après le profil d'OCR de la machine, ou selon les coeurs et la mémoire disponibles)",
+    )
+    args = parser.parse_args()
+
+    # budget de l'exécution
+    budget = RunBudget(
+        deadline=parse_deadline(args.deadline),
+        max_rss=args.max_rss * 1024 * 1024 if args.max_rss else None,
+        cpu_share=args.cpu_share if args.cpu_share else None,
+    )
+    fp_artifact_cache = (
+        Path(args.artifact_cache).resolve() if args.artifact_cache else None
+    )
+    artifact_cache_size = args.artifact_cache_size * 1024 * 1024
+    if args.command == "stream":
+        stream_batch(
+            args.run,
+            Path(args.dir_out).resolve(),
+            data_int=Path(args.data_int).resolve(),
+            budget=budget if budget.is_limited else None,
+            fp_deferred=Path(args.deferred).resolve(),
+            queue_size=args.queue_size,
+            ocr_workers=args.ocr_workers,
+            fp_artifact_cache=fp_artifact_cache,
+            artifact_cache_size=artifact_cache_size,
+        )
+    else:
+        run_batch(
+            args.run,
+            Path(args.dir_out).resolve(),
+            data_int=Path(args.data_int).resolve(),
+            budget=budget if budget.is_limited else None,
+            fp_deferred=Path(args.deferred).resolve(),
+            keep_intermediates=args.keep_intermediates,
+            measure_savings=args.measure_savings,
+            table_format=args.format,
+            fp_artifact_cache=fp_artifact_cache,
+            artifact_cache_size=artifact_cache_size,
+        )
@@ -0,0 +1,151 @@
+"""Compare le débit de l'OCR avec ocrmypdf et avec l'OCR "texte seul".
+
+Toutes les pages de chaque PDF d'un dossier sont OCRisées:
+* "ocrmypdf": un appel à ocrmypdf par document (PDF/A + sidecar), avec le
+pool de documents de `extract_text_ocr` (voir `plan_ocr_pool`) ;
+* "tesseract": pages rastérisées par pdf2image et OCRisées par un pool de
+moteurs tesseract persistants (`TesseractPool`).
+
+Le texte produit par les deux moteurs est comparé page par page (ratio de
+similarité de difflib), pour vérifier que les analyses en aval peuvent
+utiliser l'un ou l'autre.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import difflib
+from pathlib import Path
+import tempfile
+import time
+from typing import Dict, List
+
+import pikepdf
+
+from src.preprocess.extract_text_ocr_ocrmypdf import extract_text_from_pdf_image
+from src.preprocess.extract_text_ocr_tesseract import TesseractPool
+from src.preprocess.index_pdfs import PAT_PDF
+from src.preprocess.ocr_pool import get_nb_ocr_slots, plan_ocr_pool
+from src.utils.txt_format import load_pages_text
+
+
+def _run_ocrmypdf(fps: List[Path], nb_pages: List[int], out_dir: Path) -> Dict:
+    """OCRise des documents avec ocrmypdf.
+
+    Parameters
+    ----------
+    fps: List[Path]
+        Fichiers PDF.
+    nb_pages: List[int]
+        Nombre de pages de chaque fichier.
+    out_dir: Path
+        Dossier (temporaire) des fichiers produits.
+
+    Returns
+    -------
+    doc_pages: Dict[Path, List[str]]
+        Texte de chaque page, par fichier.
+    """
+    nb_workers, jobs_per_doc = plan_ocr_pool(nb_pages)
+
+    def _ocr(fp_nb: tuple) -> List[str]:
+        fp_pdf, nb = fp_nb
+        fp_txt = out_dir / f"{fp_pdf.stem}.txt"
+        extract_text_from_pdf_image(
+            fp_pdf,
+            fp_txt,
+            out_dir / fp_pdf.name,
+            page_beg=1,
+            page_end=nb,
+            redo_ocr=True,
+            jobs=jobs_per_doc,
+        )
+        return load_pages_text(fp_txt) if fp_txt.is_file() else []
+
+    with ThreadPoolExecutor(max_workers=nb_workers) as executor:
+        return dict(zip(fps, executor.map(_ocr, zip(fps, nb_pages))))
+
+
+def _run_tesseract(fps: List[Path], nb_pages: List[int]) -> Dict:
+    """OCRise des documents avec le pool de moteurs tesseract.
+
+    Parameters
+    ----------
+    fps: List[Path]
+        Fichiers PDF.
+    nb_pages: List[int]
+        Nombre de pages de chaque fichier.
+
+    Returns
+    -------
+    doc_pages: Dict[Path, List[str]]
+        Texte de chaque page, par fichier.
+    """
+    nb_engines = get_nb_ocr_slots()
+    with TesseractPool(nb_engines) as pool:
+
+        def _ocr(fp_nb: tuple) -> List[str]:
+            fp_pdf, nb = fp_nb
+            pages_ocr = pool.ocr_pages(fp_pdf, range(1, nb + 1))
+            return [pages_ocr[i] for i in range(1, nb + 1)]
+
+        with ThreadPoolExecutor(max_workers=nb_engines) as executor:
+            return dict(zip(fps, executor.map(_ocr, zip(fps, nb_pages))))
+
+
+def bench_backends(in_dir: Path) -> dict:
+    """Mesure le débit des deux moteurs d'OCR sur un dossier de PDF.
+
+    Parameters
+    ----------
+    in_dir: Path
+        Dossier contenant des PDF (parcouru récursivement).
+
+    Returns
+    -------
+    results: dict
+        Pour chaque moteur, débit en pages par seconde et temps par
+        document ; similarité moyenne des textes produits.
+    """
+    fps = sorted(in_dir.rglob(PAT_PDF))
+    nb_pages = []
+    for fp in fps:
+        with pikepdf.open(fp) as pdf:
+            nb_pages.append(len(pdf.pages))
+    nb_pages_tot = sum(nb_pages)
+    print(f"{len(fps)} fichiers, {nb_pages_tot} pages")
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        t0 = time.perf_counter()
+        txt_ocrmypdf = _run_ocrmypdf(fps, nb_pages, Path(tmp_dir))
+        elapsed = time.perf_counter() - t0
+        results["ocrmypdf"] = {
+            "pages_per_s": nb_pages_tot / elapsed,
+            "s_per_doc": elapsed / max(len(fps), 1),
+        }
+    t0 = time.perf_counter()
+    txt_tesseract = _run_tesseract(fps, nb_pages)
+    elapsed = time.perf_counter() - t0
+    results["tesseract"] = {
+        "pages_per_s": nb_pages_tot / elapsed,
+        "s_per_doc": elapsed / max(len(fps), 1),
+    }
+    # similarité des textes produits, page par page
+    ratios = [
+        difflib.SequenceMatcher(None, x, y).ratio()
+        for fp in fps
+        for x, y in zip(txt_ocrmypdf[fp], txt_tesseract[fp])
+    ]
+    results["similarity"] = sum(ratios) / len(ratios) if ratios else None
+    for key in ("ocrmypdf", "tesseract"):
+        res = results[key]
+        print(f"{key}: {res['pages_per_s']:.2f} pages/s, {res['s_per_doc']:.2f} s/doc")
+    if results["similarity"] is not None:
+        print(f"similarité moyenne des pages: {results['similarity']:.3f}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("in_dir", help="Dossier contenant des PDF image")
+    args = parser.parse_args()
+    bench_backends(Path(args.in_dir).resolve())
@@ -0,0 +1,297 @@
+"""Compare les réglages d'OCR nommés: débit et champs correctement extraits.
+
+Les pages d'un jeu annoté sont OCRisées avec chaque réglage de
+`ocr_settings.OCR_SETTINGS` ("fast", "balanced", "best"), puis les
+extracteurs de `domain_knowledge` sont appliqués au texte de chaque page.
+Pour chaque réglage, le débit (pages par seconde) et la part des champs
+annotés correctement extraits sont mesurés, pour choisir un réglage en
+connaissance du compromis.
+
+Le jeu annoté est un fichier CSV avec une ligne par page:
+* "fullpath": chemin du fichier PDF ;
+* "page": numéro de la page (la première page est numérotée 1) ;
+* "adresse", "date", "classe", "parcelle": valeur attendue de chaque champ
+sur la page, vide si le champ n'y figure pas (date au format jj/mm/aaaa,
+références cadastrales séparées par "|").
+
+Exemple:
+python -m src.preprocess.bench_ocr_settings data/labels/ocr_pages.csv
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import pandas as pd
+import pikepdf
+
+from src.domain_knowledge.arrete import get_date
+from src.domain_knowledge.cadastre import get_parcelles
+from src.domain_knowledge.logement import get_adr_doc
+from src.domain_knowledge.typologie_securite import get_classe
+from src.preprocess.extract_text_ocr_ocrmypdf import extract_text_from_pdf_image
+from src.preprocess.extract_text_ocr_tesseract import TesseractPool
+from src.preprocess.ocr_pool import get_nb_ocr_slots, plan_ocr_pool
+from src.preprocess.ocr_settings import OCR_SETTINGS
+from src.utils.str_date import process_date_brute
+from src.utils.text_utils import normalize_string
+from src.utils.txt_format import load_pages_text
+
+# champs évalués
+FIELDS = ["adresse", "date", "classe", "parcelle"]
+# séparateur des références cadastrales attendues
+SEP_PARCELLES = "|"
+
+
+def _norm(txt: str) -> str:
+    """Normalise un texte pour la comparaison d'une valeur attendue.
+
+    Parameters
+    ----------
+    txt: str
+        Texte à normaliser.
+
+    Returns
+    -------
+    txt_norm: str
+        Texte normalisé, en minuscules.
+    """
+    return normalize_string(txt, num=True, apos=True, hyph=True, spaces=True).lower()
+
+
+def _match_adresse(page_txt: str, expected: str) -> bool:
+    """Vérifie que l'adresse attendue est extraite de la page."""
+    expected = _norm(expected)
+    return any(expected in _norm(x["adresse_brute"]) for x in get_adr_doc(page_txt))
+
+
+def _match_date(page_txt: str, expected: str) -> bool:
+    """Vérifie que la date attendue est extraite de la page."""
+    arr_date = get_date(page_txt)
+    return arr_date is not None and process_date_brute(arr_date) == expected.strip()
+
+
+def _match_classe(page_txt: str, expected: str) -> bool:
+    """Vérifie que la classification attendue est extraite de la page."""
+    return get_classe(page_txt) == expected.strip()
+
+
+def _match_parcelle(page_txt: str, expected: str) -> bool:
+    """Vérifie que toutes les références cadastrales attendues sont extraites."""
+    found = {x.replace(" ", "") for x in get_parcelles(page_txt)}
+    return all(
+        x.strip().replace(" ", "") in found
+        for x in expected.split(SEP_PARCELLES)
+        if x.strip()
+    )
+
+
+MATCH_FIELD: Dict[str, Callable[[str, str], bool]] = {
+    "adresse": _match_adresse,
+    "date": _match_date,
+    "classe": _match_classe,
+    "parcelle": _match_parcelle,
+}
+
+
+def score_pages(df_labels: pd.DataFrame, pages_txt: Sequence[str]) -> Dict:
+    """Évalue l'extraction des champs annotés sur le texte OCRisé des pages.
+
+    Parameters
+    ----------
+    df_labels: pd.DataFrame
+        Jeu annoté, une ligne par page.
+    pages_txt: Sequence[str]
+        Texte OCRisé de chaque page, dans l'ordre du jeu annoté.
+
+    Returns
+    -------
+    scores: Dict
+        Pour chaque champ, puis pour l'ensemble ("total"): nombre de valeurs
+        attendues, nombre de valeurs correctement extraites, et part.
+    """
+    scores = {field: {"expected": 0, "found": 0} for field in FIELDS + ["total"]}
+    for row, page_txt in zip(df_labels.itertuples(), pages_txt):
+        for field in FIELDS:
+            expected = getattr(row, field)
+            if pd.isna(expected) or not str(expected).strip():
+                continue
+            ok = page_txt is not None and MATCH_FIELD[field](page_txt, str(expected))
+            for key in (field, "total"):
+                scores[key]["expected"] += 1
+                scores[key]["found"] += int(ok)
+    for score in scores.values():
+        score["accuracy"] = (
+            score["found"] / score["expected"] if score["expected"] else None
+        )
+    return scores
+
+
+def _run_ocrmypdf(
+    docs: Dict[Path, List[int]], ocr_pass: str, out_dir: Path
+) -> Dict[Path, Optional[List[str]]]:
+    """OCRise les pages annotées de chaque document avec ocrmypdf.
+
+    Parameters
+    ----------
+    docs: Dict[Path, List[int]]
+        Pages annotées de chaque fichier PDF.
+    ocr_pass: str
+        Réglages d'OCR, clé de `OCR_SETTINGS`.
+    out_dir: Path
+        Dossier (temporaire) des fichiers produits.
+
+    Returns
+    -------
+    doc_pages: Dict[Path, List[str], optional]
+        Texte de toutes les pages, par fichier ; None en cas d'échec.
+    """
+    nb_pages = {}
+    for fp in docs:
+        with pikepdf.open(fp) as pdf:
+            nb_pages[fp] = len(pdf.pages)
+    nb_workers, jobs_per_doc = plan_ocr_pool([len(x) for x in docs.values()])
+
+    def _ocr(fp_pdf: Path) -> Optional[List[str]]:
+        fp_txt = out_dir / f"{fp_pdf.stem}.txt"
+        extract_text_from_pdf_image(
+            fp_pdf,
+            fp_txt,
+            out_dir / fp_pdf.name,
+            page_beg=1,
+            page_end=nb_pages[fp_pdf],
+            redo_ocr=True,
+            pages=docs[fp_pdf],
+            jobs=jobs_per_doc,
+            ocr_pass=ocr_pass,
+        )
+        return load_pages_text(fp_txt) if fp_txt.is_file() else None
+
+    with ThreadPoolExecutor(max_workers=nb_workers) as executor:
+        return dict(zip(docs, executor.map(_ocr, docs)))
+
+
+def _run_tesseract(
+    docs: Dict[Path, List[int]], ocr_pass: str, pool: TesseractPool
+) -> Dict[Path, Optional[Dict[int, str]]]:
+    """OCRise les pages annotées de chaque document avec le pool tesseract.
+
+    Parameters
+    ----------
+    docs: Dict[Path, List[int]]
+        Pages annotées de chaque fichier PDF.
+    ocr_pass: str
+        Réglages d'OCR, clé de `OCR_SETTINGS`.
+    pool: TesseractPool
+        Pool de moteurs tesseract.
+
+    Returns
+    -------
+    doc_pages: Dict[Path, Dict[int, str]]
+        Texte des pages annotées, par fichier.
+    """
+
+    def _ocr(fp_pdf: Path) -> Dict[int, str]:
+        return pool.ocr_pages(fp_pdf, docs[fp_pdf], ocr_pass=ocr_pass)
+
+    with ThreadPoolExecutor(max_workers=get_nb_ocr_slots()) as executor:
+        return dict(zip(docs, executor.map(_ocr, docs)))
+
+
+def bench_settings(
+    df_labels: pd.DataFrame,
+    settings: Sequence[str] = tuple(OCR_SETTINGS),
+    backend: str = "ocrmypdf",
+) -> Dict[str, Dict]:
+    """Mesure le débit et la qualité de l'extraction pour chaque réglage.
+
+    Parameters
+    ----------
+    df_labels: pd.DataFrame
+        Jeu annoté, une ligne par page.
+    settings: Sequence[str], defaults to all keys of OCR_SETTINGS
+        Réglages à évaluer.
+    backend: str, defaults to "ocrmypdf"
+        Moteur d'OCR: "ocrmypdf" ou "tesseract" (texte seul).
+
+    Returns
+    -------
+    results: Dict[str, Dict]
+        Pour chaque réglage, débit en pages par seconde et scores de
+        l'extraction (voir `score_pages`).
+    """
+    docs = {}
+    for row in df_labels.itertuples():
+        docs.setdefault(Path(row.fullpath), []).append(int(row.page))
+    nb_pages_tot = len(df_labels)
+    print(f"{len(docs)} fichiers, {nb_pages_tot} pages annotées")
+    pool = TesseractPool(get_nb_ocr_slots()) if backend == "tesseract" else None
+    results = {}
+    try:
+        for ocr_pass in settings:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                t0 = time.perf_counter()
+                if pool is not None:
+                    doc_pages = _run_tesseract(docs, ocr_pass, pool)
+                else:
+                    doc_pages = _run_ocrmypdf(docs, ocr_pass, Path(tmp_dir))
+                elapsed = time.perf_counter() - t0
+            pages_txt = []
+            for row in df_labels.itertuples():
+                txt = doc_pages[Path(row.fullpath)]
+                if txt is None:
+                    pages_txt.append(None)
+                elif pool is not None:
+                    pages_txt.append(txt[int(row.page)])
+                else:
+                    pages_txt.append(txt[int(row.page) - 1])
+            results[ocr_pass] = {
+                "pages_per_s": nb_pages_tot / elapsed,
+                "scores": score_pages(df_labels, pages_txt),
+            }
+    finally:
+        if pool is not None:
+            pool.close()
+    for ocr_pass, res in results.items():
+        acc = {
+            k: f"{v['accuracy']:.1%}" if v["accuracy"] is not None else "-"
+            for k, v in res["scores"].items()
+        }
+        print(
+            f"{ocr_pass}: {res['pages_per_s']:.2f} pages/s, champs extraits:"
+            + f" {acc['total']} ("
+            + ", ".join(f"{field} {acc[field]}" for field in FIELDS)
+            + ")"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("labels", help="Fichier CSV du jeu de pages annotées")
+    parser.add_argument(
+        "--settings",
+        nargs="+",
+        choices=list(OCR_SETTINGS),
+        default=list(OCR_SETTINGS),
+        help="Réglages d'OCR à évaluer",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["ocrmypdf", "tesseract"],
+        default="ocrmypdf",
+        help="Moteur d'OCR",
+    )
+    args = parser.parse_args()
+    df_labels = pd.read_csv(
+        Path(args.labels).resolve(),
+        dtype={
+            "fullpath": "string",
+            "page": "int64",
+            **{field: "string" for field in FIELDS},
+        },
+    )
+    bench_settings(df_labels, settings=args.settings, backend=args.backend)
@@ -0,0 +1,136 @@
+"""Compare l'ouverture multiple des PDF (ancien fonctionnement) et `PdfSession`.
+
+Pour chaque PDF d'un dossier, mesure le temps nécessaire pour obtenir le
+hachage, les métadonnées, le texte natif et la date de signature:
+* "legacy": hachage, pikepdf, pdftotext et PyPDF2 ouvrent chacun le fichier ;
+* "session": un seul `PdfSession` (une ouverture, projection en mémoire).
+
+Si pdftotext n'est pas installé, le texte natif est ignoré dans les deux cas.
+"""
+
+import argparse
+from pathlib import Path
+import time
+
+from src.preprocess.index_pdfs import PAT_PDF
+from src.preprocess.pdf_info import get_pdf_info_pikepdf
+from src.preprocess.pdf_session import PdfSession
+from src.utils.file_utils import get_file_digest
+
+try:
+    import pdftotext
+except ImportError:
+    pdftotext = None
+
+
+def _legacy(fp_pdf: Path) -> int:
+    """Ancien fonctionnement: une ouverture par bibliothèque.
+
+    Parameters
+    ----------
+    fp_pdf: Path
+        Fichier PDF.
+
+    Returns
+    -------
+    nb_opens: int
+        Nombre d'ouvertures (et d'analyses) du fichier.
+    """
+    import PyPDF2
+
+    get_file_digest(fp_pdf)
+    get_pdf_info_pikepdf(fp_pdf)
+    nb_opens = 2
+    if pdftotext is not None:
+        with open(fp_pdf, "rb") as f:
+            try:
+                list(pdftotext.PDF(f))
+            except pdftotext.Error:
+                pass
+        nb_opens += 1
+    PyPDF2.PdfReader(fp_pdf).get_fields()
+    nb_opens += 1
+    return nb_opens
+
+
+def _session(fp_pdf: Path) -> int:
+    """Une seule ouverture, partagée par tous les traitements.
+
+    Parameters
+    ----------
+    fp_pdf: Path
+        Fichier PDF.
+
+    Returns
+    -------
+    nb_parses: int
+        Nombre d'analyses du fichier (pikepdf, pdftotext), pour une ouverture.
+    """
+    with PdfSession(fp_pdf) as session:
+        session.digest()
+        session.metadata()
+        if pdftotext is not None:
+            try:
+                session.pages_text()
+            except pdftotext.Error:
+                pass
+        session.signature_date()
+        return session.nb_parses
+
+
+def bench_session(in_dir: Path, repeat: int = 3) -> dict:
+    """Mesure le temps par document des deux fonctionnements.
+
+    Parameters
+    ----------
+    in_dir: Path
+        Dossier contenant des PDF (parcouru récursivement).
+    repeat: int, defaults to 3
+        Nombre de répétitions ; le meilleur temps est retenu.
+
+    Returns
+    -------
+    results: dict
+        Pour chaque fonctionnement, temps moyen par document (ms) et nombre
+        d'ouvertures et d'analyses par document.
+    """
+    fps = sorted(in_dir.rglob(PAT_PDF))
+    print(
+        f"{len(fps)} fichiers, pdftotext {'absent' if pdftotext is None else 'présent'}"
+    )
+    results = {}
+    for key, fn in (("legacy", _legacy), ("session", _session)):
+        best = None
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            nb_ok = 0
+            nb_parses = 0
+            for fp in fps:
+                try:
+                    nb_parses += fn(fp)
+                    nb_ok += 1
+                except Exception:
+                    # PDF illisible: ignoré dans les deux cas
+                    continue
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        nb_opens = nb_parses if key == "legacy" else nb_ok
+        results[key] = {
+            "ms_per_doc": 1000 * best / max(nb_ok, 1),
+            "opens_per_doc": nb_opens / max(nb_ok, 1),
+            "parses_per_doc": nb_parses / max(nb_ok, 1),
+        }
+    for key, res in results.items():
+        print(
+            f"{key}: {res['ms_per_doc']:.2f} ms/doc, {res['opens_per_doc']:.1f} ouverture(s)/doc,"
+            + f" {res['parses_per_doc']:.1f} analyse(s)/doc"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("in_dir", help="Dossier contenant les PDFs")
+    parser.add_argument("--repeat", type=int, default=3, help="Nombre de répétitions")
+    args = parser.parse_args()
+    bench_session(Path(args.in_dir).resolve(), repeat=args.repeat)
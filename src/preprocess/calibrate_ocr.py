@@ -0,0 +1,377 @@
+"""Calibre le parallélisme de l'OCR sur la machine courante.
+
+Un échantillon de PDF image réels (les PDF texte du dossier sont écartés,
+voir `select_scanned_sample`) est OCRisé par `extract_text_from_pdf_image`
+sous une grille de réglages:
+* nombre de documents OCRisés simultanément ("workers") ;
+* nombre de pages OCRisées en parallèle par document ("--jobs" d'ocrmypdf) ;
+* nombre de threads de chaque processus tesseract ("OMP_THREAD_LIMIT").
+
+Pour chaque réglage, le débit (pages par seconde) et le pic de mémoire
+résidente (somme des RSS des processus lancés: ocrmypdf, tesseract,
+ghostscript) sont mesurés. Le réglage le plus rapide dont le pic de mémoire
+reste sous une fraction de la mémoire disponible est enregistré dans le
+profil de la machine, chargé automatiquement par `extract_text_ocr`.
+
+Exemple:
+python -m src.preprocess.calibrate_ocr data/raw/2023-05 --nb_docs 8
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import itertools
+import json
+import logging
+import os
+from pathlib import Path
+import socket
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from src.preprocess.classify_pages import classify_pages
+from src.preprocess.extract_text_ocr_ocrmypdf import extract_text_from_pdf_image
+from src.preprocess.index_pdfs import PAT_PDF
+from src.preprocess.pdf_session import PdfSession
+from src.preprocess.ocr_pool import (
+    get_available_memory,
+    get_nb_cores,
+    get_profile_path,
+)
+from src.utils.run_budget import get_process_tree_rss
+
+# nombre de documents de l'échantillon
+NB_DOCS = 8
+# nombre maximal de pages OCRisées par document
+MAX_PAGES = 4
+# part maximale de la mémoire disponible occupée par l'OCR
+MEM_RATIO_MAX = 0.8
+# intervalle d'échantillonnage de la mémoire, en secondes
+RSS_POLL_INTERVAL = 0.2
+
+
+class PeakRssMonitor:
+    """Mesure le pic de mémoire résidente des processus lancés par l'OCR.
+
+    La mémoire est échantillonnée par un thread, le temps d'un bloc `with`.
+    """
+
+    def __init__(self, interval: float = RSS_POLL_INTERVAL):
+        """Initialise le moniteur.
+
+        Parameters
+        ----------
+        interval: float, defaults to RSS_POLL_INTERVAL
+            Intervalle d'échantillonnage, en secondes.
+        """
+        self.interval = interval
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+
+    def _poll(self):
+        """Échantillonne la mémoire jusqu'à l'arrêt du moniteur."""
+        pid = os.getpid()
+        while not self._stop.is_set():
+            self.peak_rss = max(
+                self.peak_rss, get_process_tree_rss(pid, include_self=False)
+            )
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def get_config_grid(nb_cores: int) -> List[Tuple[int, int, int]]:
+    """Construit la grille des réglages à mesurer.
+
+    Les réglages qui sursouscrivent fortement les coeurs (plus de deux
+    threads d'OCR par coeur) sont écartés.
+
+    Parameters
+    ----------
+    nb_cores: int
+        Nombre de coeurs utilisables.
+
+    Returns
+    -------
+    grid: List[Tuple[int, int, int]]
+        Réglages (documents simultanés, jobs par document, threads par
+        processus tesseract).
+    """
+    # puissances de 2 jusqu'au nombre de coeurs, et le nombre de coeurs
+    steps = sorted({min(2**i, nb_cores) for i in range(nb_cores.bit_length() + 1)})
+    return [
+        (workers, jobs, omp_threads)
+        for workers, jobs, omp_threads in itertools.product(steps, steps, (1, 2))
+        if workers * jobs * omp_threads <= 2 * nb_cores
+    ]
+
+
+def select_scanned_sample(
+    in_dir: Path, nb_docs: int = NB_DOCS, max_pages: int = MAX_PAGES
+) -> List[Tuple[Path, int, int]]:
+    """Sélectionne un échantillon de PDF numérisés, et les pages à OCRiser.
+
+    Les PDF texte (natifs), qui ne passent pas par l'OCR, sont écartés: les
+    pages de chaque document sont classées par `classify_pages`, et seuls
+    les documents ayant des pages image sont retenus.
+
+    Parameters
+    ----------
+    in_dir: Path
+        Dossier contenant des PDF (parcouru récursivement).
+    nb_docs: int, defaults to NB_DOCS
+        Nombre de documents de l'échantillon.
+    max_pages: int, defaults to MAX_PAGES
+        Nombre maximal de pages OCRisées par document.
+
+    Returns
+    -------
+    sample: List[Tuple[Path, int, int]]
+        Pour chaque document retenu: chemin, première et dernière page de la
+        première plage de pages image (au plus `max_pages` pages).
+    """
+    sample = []
+    for fp_pdf in sorted(in_dir.rglob(PAT_PDF)):
+        if len(sample) >= nb_docs:
+            break
+        try:
+            with PdfSession(fp_pdf) as session:
+                try:
+                    pages_txt = session.pages_text()
+                except Exception:
+                    # pas de texte natif exploitable (pdftotext.Error)
+                    pages_txt = []
+            page_types = classify_pages(fp_pdf, pages_txt)
+        except Exception as e:
+            logging.warning(f"{fp_pdf}: classification des pages impossible: {e}")
+            continue
+        pages_image = [
+            i for i, (x, _, _) in enumerate(page_types, start=1) if x == "image"
+        ]
+        if not pages_image:
+            logging.info(f"{fp_pdf}: PDF texte, écarté de l'échantillon")
+            continue
+        # première plage de pages image consécutives
+        page_beg = page_end = pages_image[0]
+        while page_end + 1 in pages_image and page_end - page_beg + 1 < max_pages:
+            page_end += 1
+        sample.append((fp_pdf, page_beg, page_end))
+    return sample
+
+
+def run_config(
+    sample: Sequence[Tuple[Path, int, int]],
+    workers: int,
+    jobs: int,
+    omp_threads: int,
+) -> Dict:
+    """OCRise l'échantillon avec un réglage, et mesure débit et mémoire.
+
+    Parameters
+    ----------
+    sample: Sequence[Tuple[Path, int, int]]
+        Fichiers PDF de l'échantillon, avec la première et la dernière page
+        à OCRiser (voir `select_scanned_sample`).
+    workers: int
+        Nombre de documents OCRisés simultanément.
+    jobs: int
+        Nombre de pages OCRisées en parallèle par document.
+    omp_threads: int
+        Nombre de threads de chaque processus tesseract.
+
+    Returns
+    -------
+    result: Dict
+        Réglage, débit en pages par seconde, pic de mémoire résidente en
+        octets, et nombre de documents en échec.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_dir = Path(tmp_dir)
+
+        def _ocr(fp_pages: tuple) -> int:
+            fp_pdf, page_beg, page_end = fp_pages
+            return extract_text_from_pdf_image(
+                fp_pdf,
+                out_dir / f"{fp_pdf.stem}.txt",
+                out_dir / fp_pdf.name,
+                page_beg=page_beg,
+                page_end=page_end,
+                redo_ocr=True,
+                jobs=jobs,
+                omp_threads=omp_threads,
+            )
+
+        t0 = time.perf_counter()
+        with PeakRssMonitor() as monitor:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                retcodes = list(executor.map(_ocr, sample))
+        elapsed = time.perf_counter() - t0
+    nb_pages = sum(page_end - page_beg + 1 for _, page_beg, page_end in sample)
+    return {
+        "workers": workers,
+        "jobs": jobs,
+        "omp_threads": omp_threads,
+        "pages_per_s": nb_pages / elapsed,
+        "peak_rss": monitor.peak_rss,
+        "nb_errors": sum(x != 0 for x in retcodes),
+    }
+
+
+def select_best_config(results: Sequence[Dict], mem_max: int) -> Optional[Dict]:
+    """Choisit le réglage le plus rapide qui tient dans la mémoire.
+
+    Parameters
+    ----------
+    results: Sequence[Dict]
+        Mesures de chaque réglage (voir `run_config`).
+    mem_max: int
+        Pic de mémoire résidente maximal, en octets.
+
+    Returns
+    -------
+    best: Dict, optional
+        Meilleur réglage, None si aucun réglage n'a OCRisé l'échantillon
+        sans erreur dans la limite de mémoire.
+    """
+    ok = [x for x in results if x["nb_errors"] == 0 and x["peak_rss"] <= mem_max]
+    if not ok:
+        return None
+    return max(ok, key=lambda x: x["pages_per_s"])
+
+
+def save_ocr_profile(profile: Dict, fp_profile: Path):
+    """Enregistre le profil d'OCR de la machine.
+
+    Parameters
+    ----------
+    profile: Dict
+        Profil: machine, réglage retenu et mesures de la calibration.
+    fp_profile: Path
+        Fichier JSON du profil.
+    """
+    fp_profile.parent.mkdir(parents=True, exist_ok=True)
+    with open(fp_profile, "w") as f_profile:
+        json.dump(profile, f_profile, indent=2)
+
+
+def calibrate(
+    in_dir: Path,
+    nb_docs: int = NB_DOCS,
+    max_pages: int = MAX_PAGES,
+    grid: Optional[Sequence[Tuple[int, int, int]]] = None,
+) -> Optional[Dict]:
+    """Mesure la grille de réglages sur un échantillon et choisit le meilleur.
+
+    Parameters
+    ----------
+    in_dir: Path
+        Dossier contenant des PDF (parcouru récursivement) ; seuls les PDF
+        numérisés sont retenus dans l'échantillon.
+    nb_docs: int, defaults to NB_DOCS
+        Nombre de documents de l'échantillon.
+    max_pages: int, defaults to MAX_PAGES
+        Nombre maximal de pages OCRisées par document.
+    grid: Sequence[Tuple[int, int, int]], optional
+        Réglages à mesurer ; par défaut, `get_config_grid`.
+
+    Returns
+    -------
+    profile: Dict, optional
+        Profil de la machine, None si aucun réglage ne convient.
+    """
+    sample = select_scanned_sample(in_dir, nb_docs=nb_docs, max_pages=max_pages)
+    if not sample:
+        logging.warning(f"Aucun PDF numérisé dans {in_dir}, profil non enregistré")
+        print(f"Aucun PDF numérisé dans {in_dir}")
+        return None
+    nb_pages = [page_end - page_beg + 1 for _, page_beg, page_end in sample]
+    nb_cores = get_nb_cores()
+    mem_available = get_available_memory()
+    if grid is None:
+        grid = get_config_grid(nb_cores)
+    print(
+        f"{len(sample)} fichiers numérisés, {sum(nb_pages)} pages image,"
+        + f" {nb_cores} coeurs,"
+        + f" {len(grid)} réglages"
+    )
+    results = []
+    for workers, jobs, omp_threads in grid:
+        res = run_config(sample, workers, jobs, omp_threads)
+        results.append(res)
+        msg = (
+            f"{workers} documents x {jobs} jobs x {omp_threads} threads:"
+            + f" {res['pages_per_s']:.2f} pages/s,"
+            + f" pic RSS {res['peak_rss'] / 2**20:.0f} Mio"
+            + (f", {res['nb_errors']} erreurs" if res["nb_errors"] else "")
+        )
+        logging.info(msg)
+        print(msg)
+    mem_max = int(MEM_RATIO_MAX * mem_available) if mem_available is not None else 2**63
+    best = select_best_config(results, mem_max)
+    if best is None:
+        logging.warning("Aucun réglage ne convient, profil non enregistré")
+        return None
+    return {
+        "hostname": socket.gethostname(),
+        "nb_cores": nb_cores,
+        "mem_available": mem_available,
+        "created": datetime.now().isoformat(),
+        "workers": best["workers"],
+        "jobs": best["jobs"],
+        "omp_threads": best["omp_threads"],
+        "pages_per_s": best["pages_per_s"],
+        "peak_rss": best["peak_rss"],
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    # log
+    dir_log = Path(__file__).resolve().parents[2] / "logs"
+    logging.basicConfig(
+        filename=f"{dir_log}/calibrate_ocr_{datetime.now().isoformat()}.log",
+        encoding="utf-8",
+        level=logging.DEBUG,
+    )
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("in_dir", help="Dossier contenant un échantillon de PDF image")
+    parser.add_argument(
+        "--profile",
+        default=str(get_profile_path()),
+        help="Fichier JSON du profil d'OCR de la machine",
+    )
+    parser.add_argument(
+        "--nb_docs",
+        type=int,
+        default=NB_DOCS,
+        help="Nombre de documents de l'échantillon",
+    )
+    parser.add_argument(
+        "--max_pages",
+        type=int,
+        default=MAX_PAGES,
+        help="Nombre maximal de pages OCRisées par document",
+    )
+    args = parser.parse_args()
+
+    profile = calibrate(
+        Path(args.in_dir).resolve(), nb_docs=args.nb_docs, max_pages=args.max_pages
+    )
+    if profile is not None:
+        fp_profile = Path(args.profile).resolve()
+        save_ocr_profile(profile, fp_profile)
+        print(
+            f"Profil enregistré dans {fp_profile}: {profile['workers']} documents x"
+            + f" {profile['jobs']} jobs x {profile['omp_threads']} threads"
+            + f" ({profile['pages_per_s']:.2f} pages/s)"
+        )
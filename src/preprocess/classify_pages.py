@@ -0,0 +1,220 @@
+"""Type de chaque page d'un PDF: texte natif ("text") ou image ("image").
+
+Un document peut mélanger des pages natives et des pages numérisées, par
+exemple un arrêté produit avec un traitement de texte auquel une annexe
+numérisée a été ajoutée.
+Chaque page est caractérisée par:
+* le nombre de caractères (hors espaces) de son texte natif, extrait par
+pdftotext ;
+* la proportion de sa surface couverte par des images (XObject de type
+"/Image" ou images "en ligne"), calculée en suivant les matrices de
+transformation du flux de contenu de la page.
+
+Seules les pages "image" ont besoin d'être OCRisées.
+"""
+
+import logging
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple, Union
+
+import pikepdf
+
+from src.preprocess.pdf_session import PdfSession
+
+# nombre minimal de caractères (hors espaces) pour qu'une page contienne du texte natif
+MIN_CHARS_TEXT = 50
+# proportion de la page couverte par des images au-delà de laquelle une page
+# sans texte natif est considérée comme une page image
+IMAGE_COVERAGE_MIN = 0.3
+# proportion de la page couverte par des images au-delà de laquelle la page
+# est considérée comme numérisée, même si elle contient du texte natif
+# (couche d'OCR produite par le numériseur)
+IMAGE_COVERAGE_SCAN = 0.8
+# profondeur maximale d'imbrication des XObject de type "/Form"
+_MAX_FORM_DEPTH = 8
+
+
+def count_chars(page_txt: str) -> int:
+    """Compte les caractères (hors espaces) du texte natif d'une page.
+
+    Parameters
+    ----------
+    page_txt: str
+        Texte natif de la page.
+
+    Returns
+    -------
+    nb_chars: int
+        Nombre de caractères hors espaces.
+    """
+    return sum(not x.isspace() for x in page_txt)
+
+
+def _iter_images(
+    content: pikepdf.Object,
+    resources: Optional[pikepdf.Dictionary],
+    det_ctm: float,
+    depth: int = 0,
+) -> Iterator[Tuple[Union[pikepdf.Object, pikepdf.PdfInlineImage], float]]:
+    """Parcourt les images dessinées par un flux de contenu.
+
+    Une image est dessinée dans le carré unité transformé par la matrice
+    courante (CTM), sa surface est donc la valeur absolue du déterminant
+    de la CTM, qu'il suffit de suivre (les translations n'y contribuent pas).
+
+    Parameters
+    ----------
+    content: pikepdf.Object
+        Page ou XObject de type "/Form".
+    resources: pikepdf.Dictionary, optional
+        Ressources du flux de contenu.
+    det_ctm: float
+        Déterminant de la matrice de transformation courante.
+    depth: int
+        Profondeur d'imbrication des XObject de type "/Form".
+
+    Yields
+    ------
+    image: pikepdf.Object or pikepdf.PdfInlineImage
+        Image (XObject de type "/Image" ou image "en ligne"), dans l'ordre
+        où elle est dessinée.
+    area: float
+        Surface couverte par l'image, en unités de l'espace de la page.
+    """
+    xobjects = resources.get("/XObject") if resources is not None else None
+    stack = []
+    for operands, operator in pikepdf.parse_content_stream(content):
+        op = str(operator)
+        if op == "q":
+            stack.append(det_ctm)
+        elif op == "Q":
+            if stack:
+                det_ctm = stack.pop()
+        elif op == "cm":
+            a, b, c, d = (float(x) for x in operands[:4])
+            det_ctm *= a * d - b * c
+        elif op == "INLINE IMAGE":
+            yield operands[0], abs(det_ctm)
+        elif op == "Do" and xobjects is not None:
+            xobj = xobjects.get(operands[0])
+            if xobj is None:
+                continue
+            subtype = xobj.get("/Subtype")
+            if subtype == "/Image":
+                yield xobj, abs(det_ctm)
+            elif subtype == "/Form" and depth < _MAX_FORM_DEPTH:
+                a, b, c, d = (float(x) for x in xobj.get("/Matrix", [1, 0, 0, 1])[:4])
+                yield from _iter_images(
+                    xobj,
+                    xobj.get("/Resources", resources),
+                    det_ctm * (a * d - b * c),
+                    depth + 1,
+                )
+
+
+def iter_page_images(
+    page: pikepdf.Page,
+) -> Iterator[Tuple[Union[pikepdf.Object, pikepdf.PdfInlineImage], float]]:
+    """Parcourt les images dessinées sur une page.
+
+    Parameters
+    ----------
+    page: pikepdf.Page
+        Page du document.
+
+    Yields
+    ------
+    image: pikepdf.Object or pikepdf.PdfInlineImage
+        Image, dans l'ordre où elle est dessinée.
+    area: float
+        Surface couverte par l'image (les recouvrements sont comptés
+        plusieurs fois).
+    """
+    yield from _iter_images(page.obj, page.obj.get("/Resources"), 1.0)
+
+
+def get_image_coverage(page: pikepdf.Page) -> float:
+    """Calcule la proportion de la surface d'une page couverte par des images.
+
+    Parameters
+    ----------
+    page: pikepdf.Page
+        Page du document.
+
+    Returns
+    -------
+    coverage: float
+        Proportion de la page couverte par des images, entre 0 et 1.
+    """
+    x0, y0, x1, y1 = (float(x) for x in page.mediabox)
+    page_area = abs((x1 - x0) * (y1 - y0))
+    if page_area == 0:
+        return 0.0
+    area = sum(x for _, x in iter_page_images(page))
+    return min(area / page_area, 1.0)
+
+
+def guess_page_type(nb_chars: int, coverage: float, trust_text_layer: bool) -> str:
+    """Devine le type d'une page: texte natif ("text") ou image ("image").
+
+    Parameters
+    ----------
+    nb_chars: int
+        Nombre de caractères (hors espaces) du texte natif de la page.
+    coverage: float
+        Proportion de la page couverte par des images.
+    trust_text_layer: bool
+        Si True, le texte natif d'une page numérisée (couche d'OCR) est
+        conservé ; sinon la page est OCRisée de nouveau.
+
+    Returns
+    -------
+    page_type: string, one of {"text", "image"}
+        Type de la page.
+    """
+    if nb_chars >= MIN_CHARS_TEXT:
+        if coverage >= IMAGE_COVERAGE_SCAN and not trust_text_layer:
+            # page numérisée avec une couche d'OCR de qualité inconnue
+            return "image"
+        return "text"
+    if coverage >= IMAGE_COVERAGE_MIN:
+        # page numérisée, sans texte natif
+        return "image"
+    # page (quasi) blanche ou dessin vectoriel: rien à OCRiser
+    return "text"
+
+
+def classify_pages(
+    fp_pdf: Path,
+    pages_txt: Sequence[str],
+    trust_text_layer: bool = False,
+) -> List[Tuple[str, int, float]]:
+    """Détermine le type de chaque page d'un PDF.
+
+    Parameters
+    ----------
+    fp_pdf: Path
+        Chemin du fichier PDF.
+    pages_txt: Sequence[str]
+        Texte natif de chaque page, extrait par pdftotext.
+    trust_text_layer: bool, defaults to False
+        Si True, le texte natif des pages numérisées est conservé.
+
+    Returns
+    -------
+    page_types: List[Tuple[str, int, float]]
+        Pour chaque page: type ("text" ou "image"), nombre de caractères du
+        texte natif et proportion de la page couverte par des images.
+    """
+    page_types = []
+    with PdfSession(fp_pdf) as session:
+        if len(pages_txt) != session.nb_pages:
+            logging.warning(
+                f"{fp_pdf}: {len(pages_txt)} pages de texte natif pour {session.nb_pages} pages"
+            )
+        for i, page in enumerate(session.pdf.pages):
+            nb_chars = count_chars(pages_txt[i]) if i < len(pages_txt) else 0
+            coverage = get_image_coverage(page)
+            page_type = guess_page_type(nb_chars, coverage, trust_text_layer)
+            page_types.append((page_type, nb_chars, coverage))
+    return page_types
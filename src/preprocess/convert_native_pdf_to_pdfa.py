@@ -14,6 +14,7 @@ import pandas as pd
 # schéma des données en entrée: sortie de extract_native_text
 from src.preprocess.determine_pdf_type import DTYPE_META_NTXT_PDFTYPE
 from src.preprocess.convert_to_pdfa import convert_pdf_to_pdfa
+from src.utils.storage import read_table, write_table
 
 
 # schéma des données en sortie
@@ -60,8 +61,9 @@ def process_files(
         for df_row in df_meta.itertuples():
             # fichier d'origine
             fp_pdf_in = Path(df_row.fullpath)
-            # fichier à produire
-            fp_pdf_out = out_pdf_dir / f"{fp_pdf_in.name}"
+            # fichier à produire (nommé d'après le nom logique, le fichier
+            # d'origine étant stocké sous le nom de son hachage)
+            fp_pdf_out = out_pdf_dir / df_row.pdf
 
             # si le fichier à produire existe déjà
             if fp_pdf_out.is_file():
@@ -153,13 +155,13 @@ if __name__ == "__main__":
 
     # entrée: CSV de métadonnées enrichi
     in_file = Path(args.in_file).resolve()
-    if not in_file.is_file():
+    if not in_file.exists():
         raise ValueError(f"Le fichier en entrée {in_file} n'existe pas.")
 
     # sortie: CSV de métadonnées enrichi + infos fichiers produits
     # on crée le dossier parent (récursivement) si besoin
     out_file = Path(args.out_file).resolve()
-    if out_file.is_file():
+    if out_file.exists():
         if not args.redo and not args.append:
             # erreur si le fichier CSV existe déjà mais ni redo, ni append
             raise ValueError(
@@ -181,7 +183,7 @@ if __name__ == "__main__":
 
     # ouvrir le fichier d'entrée
     logging.info(f"Ouverture du fichier CSV {in_file}")
-    df_metas = pd.read_csv(in_file, dtype=DTYPE_META_NTXT_PDFTYPE)
+    df_metas = read_table(in_file, DTYPE_META_NTXT_PDFTYPE)
     # traiter les fichiers
     df_mmod = process_files(
         df_metas,
@@ -190,12 +192,5 @@ if __name__ == "__main__":
         keep_pdfa=args.keep_pdfa,
         verbose=args.verbose,
     )
-    # sauvegarder les infos extraites dans un fichier CSV
-    if args.append and out_file.is_file():
-        # si 'append', charger le fichier existant et lui ajouter les nouvelles entrées
-        df_mmod_old = pd.read_csv(out_file, dtype=DTYPE_META_NTXT_PDFA)
-        df_proc = pd.concat([df_mmod_old, df_mmod])
-    else:
-        # sinon utiliser les seules nouvelles entrées
-        df_proc = df_mmod
-    df_proc.to_csv(out_file, index=False)
+    # sauvegarder les infos extraites (CSV ou Parquet, selon l'extension)
+    write_table(df_mmod, out_file, DTYPE_META_NTXT_PDFA, append=args.append)
@@ -0,0 +1,171 @@
+"""File des documents reportés au lot suivant, faute de temps ou de ressources.
+
+Un document reporté par une étape (voir `src.utils.run_budget`) est retiré
+de la sortie de cette étape: il n'est pas traité par les étapes suivantes,
+et son fichier d'origine reste dans le dossier d'entrée.
+Ses métadonnées d'indexation sont inscrites dans un fichier CSV conservé
+dans `CACHE_DIR`. Au début du lot suivant, elles sont ajoutées à l'index des
+nouveaux PDF du lot, qui reprend leur traitement depuis le début.
+
+Exemple (au début de `process_batch.sh`):
+python src/preprocess/deferred_queue.py data/interim/pdf-index_new_${RUN}.csv
+"""
+
+import argparse
+from datetime import datetime
+import logging
+from pathlib import Path
+import threading
+from typing import NamedTuple
+
+import pandas as pd
+
+from src.preprocess.index_pdfs import DTYPE_META_BASE
+from src.utils.file_utils import CACHE_DIR
+
+# fichier de la file des documents reportés
+FP_DEFERRED = CACHE_DIR / "deferred.csv"
+# format: métadonnées d'indexation, étape, motif et date du report
+DTYPE_DEFERRED = DTYPE_META_BASE | {
+    "deferred_step": "string",
+    "deferred_reason": "string",
+    "deferred_at": "string",
+}
+
+
+class DeferredQueue:
+    """File des documents reportés, stockée dans un fichier CSV.
+
+    Les documents reportés pendant une étape sont ajoutés depuis plusieurs
+    threads (`add`), puis écrits à la fin de l'étape (`save`).
+    """
+
+    def __init__(self, fp_csv: Path = FP_DEFERRED):
+        """Initialise la file.
+
+        Parameters
+        ----------
+        fp_csv: Path, defaults to FP_DEFERRED
+            Fichier CSV de la file.
+        """
+        self.fp_csv = fp_csv
+        self._new = []
+        self._lock = threading.Lock()
+
+    def add(self, df_row: NamedTuple, step: str, reason: str):
+        """Ajoute un document à la file.
+
+        Parameters
+        ----------
+        df_row: NamedTuple
+            Métadonnées du document (au moins celles de `DTYPE_META_BASE`).
+        step: str
+            Étape qui a reporté le document.
+        reason: str
+            Motif du report.
+        """
+        row = {col: getattr(df_row, col) for col in DTYPE_META_BASE}
+        row.update(
+            deferred_step=step,
+            deferred_reason=reason,
+            deferred_at=datetime.now().isoformat(),
+        )
+        logging.warning(f"{step}: {df_row.pdf} reporté au prochain lot ({reason})")
+        with self._lock:
+            self._new.append(row)
+
+    def __len__(self) -> int:
+        return len(self._new)
+
+    def save(self):
+        """Ajoute les documents reportés pendant l'étape au fichier CSV."""
+        with self._lock:
+            if not self._new:
+                return
+            df_new = pd.DataFrame(self._new, columns=list(DTYPE_DEFERRED)).astype(
+                DTYPE_DEFERRED
+            )
+            self.fp_csv.parent.mkdir(parents=True, exist_ok=True)
+            df_new.to_csv(
+                self.fp_csv,
+                mode="a",
+                header=not self.fp_csv.is_file(),
+                index=False,
+            )
+            self._new = []
+
+
+def requeue_deferred(new_csv: Path, fp_csv: Path = FP_DEFERRED) -> int:
+    """Ajoute les documents reportés à l'index des nouveaux PDF d'un lot.
+
+    Les documents déjà présents dans l'index du lot (ré-indexés depuis le
+    dossier d'entrée) ou dont le fichier n'est plus dans le stock de travail
+    ne sont pas ajoutés. La file est ensuite vidée.
+
+    Parameters
+    ----------
+    new_csv: Path
+        Index des nouveaux PDF du lot, créé s'il n'existe pas.
+    fp_csv: Path, defaults to FP_DEFERRED
+        Fichier CSV de la file.
+
+    Returns
+    -------
+    nb_requeued: int
+        Nombre de documents ajoutés à l'index du lot.
+    """
+    if not fp_csv.is_file():
+        return 0
+    df_deferred = pd.read_csv(fp_csv, dtype=DTYPE_DEFERRED)
+    df_deferred = df_deferred.drop_duplicates(subset=["pdf"], keep="last")
+    if new_csv.is_file():
+        df_new = pd.read_csv(new_csv, dtype=DTYPE_META_BASE)
+    else:
+        df_new = pd.DataFrame(columns=list(DTYPE_META_BASE)).astype(DTYPE_META_BASE)
+    s_known = df_deferred["pdf"].isin(df_new["pdf"])
+    s_missing = ~df_deferred["fullpath"].map(lambda x: Path(x).is_file())
+    for df_row in df_deferred[s_missing & ~s_known].itertuples():
+        logging.warning(
+            f"Document reporté introuvable dans le stock de travail: {df_row.fullpath}"
+        )
+    df_requeue = df_deferred[~s_known & ~s_missing][list(DTYPE_META_BASE)]
+    # les documents ré-indexés conservent leur date d'indexation d'origine,
+    # pour mesurer leur délai de publication depuis leur réception
+    ingested_at = df_deferred.set_index("pdf")["ingested_at"].dropna()
+    s_reindexed = df_new["pdf"].isin(ingested_at.index)
+    df_new.loc[s_reindexed, "ingested_at"] = df_new.loc[s_reindexed, "pdf"].map(
+        ingested_at
+    )
+    if not df_requeue.empty or s_reindexed.any():
+        # les documents reportés passent avant les nouveaux documents
+        df_new = pd.concat([df_requeue, df_new]).astype(DTYPE_META_BASE)
+        df_new.to_csv(new_csv, index=False)
+    fp_csv.unlink()
+    msg = f"{len(df_requeue)} document(s) reporté(s) ajouté(s) au lot"
+    logging.info(msg)
+    if len(df_requeue):
+        print(msg)
+    return len(df_requeue)
+
+
+if __name__ == "__main__":
+    # log
+    dir_log = Path(__file__).resolve().parents[2] / "logs"
+    logging.basicConfig(
+        filename=f"{dir_log}/deferred_queue_{datetime.now().isoformat()}.log",
+        encoding="utf-8",
+        level=logging.DEBUG,
+    )
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "new_csv",
+        help="Chemin vers le fichier CSV de l'index des nouveaux PDF du lot",
+    )
+    parser.add_argument(
+        "--deferred",
+        default=str(FP_DEFERRED),
+        help="Fichier CSV de la file des documents reportés",
+    )
+    args = parser.parse_args()
+    requeue_deferred(Path(args.new_csv).resolve(), Path(args.deferred).resolve())
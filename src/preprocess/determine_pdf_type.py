@@ -1,31 +1,35 @@
-"""Un fichier peut être considéré PDF natif ("texte")
-ou non ("image").
-
-Le type est déterminé pour le fichier entier, sans
-rentrer dans les cas particuliers commme un PDF texte
-dans lequel une page numérisée a été insérée en tant
-qu'image.
-Actuellement, de tels fichiers sont probablement
-considérés comme des fichiers PDF non natifs ("image"),
-en se basant sur les métadonnées du fichier PDF.
+"""Un fichier peut être considéré PDF natif ("texte"),
+non natif ("image") ou mixte ("mixed").
+
+Le type est d'abord deviné pour le fichier entier, en se
+basant sur les métadonnées du fichier PDF, puis affiné
+page par page (voir `classify_pages`): un PDF texte dans
+lequel une page numérisée a été insérée en tant qu'image
+est un fichier mixte, dont seules les pages image seront
+OCRisées.
 """
 
 import argparse
 from datetime import datetime
 import logging
 from pathlib import Path
-from typing import NamedTuple
+from typing import List, NamedTuple
 
 #
 import pandas as pd
 
+from src.preprocess.classify_pages import classify_pages
+
 # schéma des données en entrée: sortie de extract_native_text
 from src.preprocess.extract_native_text import DTYPE_META_NTXT
+from src.utils.storage import read_table, write_table
+from src.utils.txt_format import format_page_list, load_pages_text
 
 
 # schéma des données en sortie
 DTYPE_META_NTXT_PDFTYPE = DTYPE_META_NTXT | {
-    "processed_as": "string",  # "text" ou "image" (traité en tant que fichier PDF natif ou non)
+    "processed_as": "string",  # "text", "image" ou "mixed" (traité en tant que fichier PDF natif, non natif ou mixte)
+    "pages_image": "string",  # pages à OCRiser, au format de l'option "--pages" d'ocrmypdf (ex: "1,3-4")
 }
 
 
@@ -66,12 +70,73 @@ def guess_pdf_type(df_row: NamedTuple) -> str:
     return pdf_type
 
 
+def get_nb_pages_ocr_max(df_row: NamedTuple) -> int:
+    """Renvoie le nombre de pages susceptibles d'être OCRisées.
+
+    La dernière page n'est jamais OCRisée si c'est un accusé de réception
+    de transmission à @ctes.
+
+    Parameters
+    ----------
+    df_row: NamedTuple
+        Métadonnées et propriétés du fichier PDF.
+
+    Returns
+    -------
+    nb_pages: int
+        Nombre de pages, en partant de la première, pouvant être OCRisées.
+    """
+    if pd.notna(df_row.guess_dernpage) and df_row.guess_dernpage:
+        return df_row.nb_pages - 1
+    return df_row.nb_pages
+
+
+def guess_pages_image(df_row: NamedTuple, pdf_type: str) -> List[int]:
+    """Détermine les pages à OCRiser d'un fichier PDF.
+
+    Parameters
+    ----------
+    df_row: NamedTuple
+        Métadonnées et propriétés du fichier PDF.
+    pdf_type: string, one of {"text", "image"}
+        Type du fichier entier, deviné d'après les métadonnées.
+
+    Returns
+    -------
+    pages_image: List[int]
+        Numéros des pages à OCRiser (la première page est numérotée 1).
+    """
+    nb_pages = get_nb_pages_ocr_max(df_row)
+    if pd.notna(df_row.guess_badocr) and df_row.guess_badocr:
+        # la couche d'OCR existante est de mauvaise qualité: tout refaire
+        return list(range(1, nb_pages + 1))
+    # le texte natif d'une page numérisée n'est conservé que si les
+    # métadonnées indiquent un PDF texte
+    pages_txt = (
+        load_pages_text(df_row.fullpath_txt) if pd.notna(df_row.fullpath_txt) else []
+    )
+    try:
+        page_types = classify_pages(
+            Path(df_row.fullpath), pages_txt, trust_text_layer=(pdf_type == "text")
+        )
+    except Exception as e:
+        # analyse des pages impossible: conserver le type du fichier entier
+        logging.warning(f"Type des pages indéterminé: {df_row.fullpath}: {e}")
+        return list(range(1, nb_pages + 1)) if pdf_type == "image" else []
+    return [
+        i
+        for i, (page_type, _, _) in enumerate(page_types[:nb_pages], start=1)
+        if page_type == "image"
+    ]
+
+
 def process_files(
     df_meta: pd.DataFrame,
 ) -> pd.DataFrame:
-    """Déterminer le type des fichiers PDF.
+    """Déterminer le type des fichiers PDF et des pages à OCRiser.
 
-    Un fichier PDF peut être natif ("texte") ou non ("image").
+    Un fichier PDF peut être natif ("texte"), non natif ("image") ou mixte
+    ("mixed") s'il contient à la fois des pages natives et des pages image.
 
     Parameters
     ----------
@@ -81,20 +146,40 @@ def process_files(
     Returns
     -------
     df_mmod: pd.DataFrame
-        Métadonnées des fichiers d'entrée et chemins vers les fichiers PDF/A et TXT.
+        Métadonnées des fichiers d'entrée, type des fichiers et pages à OCRiser.
     """
     processed_as = []
+    pages_image = []
+    # pages à OCRiser, et pages qui l'auraient été d'après le seul type du fichier entier
+    nb_pages_ocr = 0
+    nb_pages_ocr_meta = 0
     for df_row in df_meta.itertuples():
-        # fichier d'origine
-        fp_pdf_in = Path(df_row.fullpath)
-
         # déterminer le type de fichier: PDF natif ("text") ou non ("image")
+        # d'après les métadonnées
         pdf_type = guess_pdf_type(df_row)
+        # puis les pages à OCRiser, page par page
+        doc_pages_image = guess_pages_image(df_row, pdf_type)
+        if pdf_type == "image":
+            nb_pages_ocr_meta += get_nb_pages_ocr_max(df_row)
+        if not doc_pages_image:
+            pdf_type = "text"
+        elif len(doc_pages_image) < get_nb_pages_ocr_max(df_row):
+            # pages natives et pages image
+            pdf_type = "mixed"
+        else:
+            pdf_type = "image"
         processed_as.append(pdf_type)
+        pages_image.append(format_page_list(doc_pages_image))
+        nb_pages_ocr += len(doc_pages_image)
+    logging.info(
+        f"Pages à OCRiser: {nb_pages_ocr} (contre {nb_pages_ocr_meta} d'après les"
+        + " seules métadonnées des fichiers)"
+    )
 
     # remplir le fichier CSV de sortie
     df_mmod = df_meta.assign(
         processed_as=processed_as,
+        pages_image=pages_image,
     )
     # forcer les types des nouvelles colonnes
     df_mmod = df_mmod.astype(dtype=DTYPE_META_NTXT_PDFTYPE)
@@ -137,13 +222,13 @@ if __name__ == "__main__":
 
     # entrée: CSV de métadonnées enrichi
     in_file = Path(args.in_file).resolve()
-    if not in_file.is_file():
+    if not in_file.exists():
         raise ValueError(f"Le fichier en entrée {in_file} n'existe pas.")
 
     # sortie: CSV de métadonnées enrichi + infos fichiers produits
     # on crée le dossier parent (récursivement) si besoin
     out_file = Path(args.out_file).resolve()
-    if out_file.is_file():
+    if out_file.exists():
         if not args.redo and not args.append:
             # erreur si le fichier CSV existe déjà mais ni redo, ni append
             raise ValueError(
@@ -159,15 +244,8 @@ if __name__ == "__main__":
 
     # ouvrir le fichier d'entrée
     logging.info(f"Ouverture du fichier CSV {in_file}")
-    df_metas = pd.read_csv(in_file, dtype=DTYPE_META_NTXT)
+    df_metas = read_table(in_file, DTYPE_META_NTXT)
     # traiter les fichiers
     df_mmod = process_files(df_metas)
-    # sauvegarder les infos extraites dans un fichier CSV
-    if args.append and out_file.is_file():
-        # si 'append', charger le fichier existant et lui ajouter les nouvelles entrées
-        df_mmod_old = pd.read_csv(out_file, dtype=DTYPE_META_NTXT_PDFTYPE)
-        df_proc = pd.concat([df_mmod_old, df_mmod])
-    else:
-        # sinon utiliser les seules nouvelles entrées
-        df_proc = df_mmod
-    df_proc.to_csv(out_file, index=False)
+    # sauvegarder les infos extraites (CSV ou Parquet, selon l'extension)
+    write_table(df_mmod, out_file, DTYPE_META_NTXT_PDFTYPE, append=args.append)
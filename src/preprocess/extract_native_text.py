@@ -30,8 +30,9 @@ Le texte est normalisé en forme NFC: <https://docs.python.org/3/howto/unicode.h
 import argparse
 from datetime import datetime
 import logging
+import os
 from pathlib import Path
-from typing import NamedTuple
+from typing import NamedTuple, Optional
 
 import pandas as pd
 
@@ -41,13 +42,25 @@ from src.preprocess.extract_native_text_pdftotext import (
     extract_native_text_pdftotext,
 )
 
+from src.preprocess.deferred_queue import FP_DEFERRED, DeferredQueue
+from src.preprocess.near_duplicates import flag_near_duplicates
+from src.preprocess.priority import PRIORITY_URGENT, get_doc_priority
+
 # schéma des données en entrée
 from src.preprocess.process_metadata import DTYPE_META_PROC
+from src.utils.file_utils import CACHE_DIR
+from src.utils.run_budget import RunBudget, log_deferred, parse_deadline
+from src.utils.storage import read_table, write_table
 
 # schéma des données en sortie
 DTYPE_META_NTXT = DTYPE_META_PROC | {
     "retcode_txt": "Int64",  # FIXME Int16 ? (dtype à fixer ici, avant le dump)
     "fullpath_txt": "string",
+    # quasi-doublons détectés sur le texte natif (voir near_duplicates)
+    "dup_neartext": "boolean",
+    "dup_neartext_pdf": "string",
+    # priorité de traitement, d'après la première page et le nom du fichier (voir priority)
+    "priority": "Int64",
 }
 
 
@@ -102,9 +115,17 @@ def process_files(
     df_meta: pd.DataFrame,
     out_dir_txt: Path,
     redo: bool = False,
+    neardup_db: Optional[Path] = None,
+    budget: Optional[RunBudget] = None,
+    deferred_queue: Optional[DeferredQueue] = None,
 ) -> pd.DataFrame:
     """Traiter un ensemble de fichiers PDF: convertir les PDF en PDF/A et extraire le texte.
 
+    Avec un budget, les documents qui ne peuvent pas être traités dans le
+    temps ou les ressources impartis sont reportés au lot suivant: ils sont
+    retirés des métadonnées renvoyées et ajoutés à la file des documents
+    reportés.
+
     Parameters
     ----------
     df_meta: pd.DataFrame
@@ -113,21 +134,34 @@ def process_files(
         Dossier de sortie pour les fichiers texte.
     redo: bool, defaults to False
         Si True, réanalyse les fichiers déjà traités.
+    neardup_db: Path, optional
+        Base SQLite de l'index des quasi-doublons, conservée entre les
+        exécutions. Si None, les quasi-doublons ne sont pas recherchés.
+    budget: RunBudget, optional
+        Budget de l'exécution: échéance, mémoire et charge des processeurs
+        maximales (voir `run_budget`).
+    deferred_queue: DeferredQueue, optional
+        File des documents reportés au lot suivant, faute de budget.
 
     Returns
     -------
     df_mmod: pd.DataFrame
-        Métadonnées des fichiers d'entrée, chemins vers les fichiers TXT produits et codes
-        de retour de l'extraction de texte natif.
+        Métadonnées des fichiers d'entrée (sauf les documents reportés), chemins vers
+        les fichiers TXT produits, codes de retour de l'extraction de texte natif et
+        priorité de traitement.
     """
     retcodes = []
     fullpath_txt = []
+    # documents reportés au lot suivant: position dans le lot -> motif
+    deferred = {}
     for df_row in df_meta.itertuples():
         # fichier d'origine
         fp_pdf_in = Path(df_row.fullpath)
         # fichier à produire
         # TODO gérer le digest proprement, sans présupposer que c'est toujours blake2b
-        fp_txt = out_dir_txt / (f"{df_row.blake2b}-{fp_pdf_in.stem}" + ".txt")
+        # (nommé d'après le nom logique, le fichier d'origine étant stocké
+        # sous le nom de son hachage)
+        fp_txt = out_dir_txt / (f"{df_row.blake2b}-{Path(df_row.pdf).stem}" + ".txt")
         # si les fichiers à produire existent déjà
         if fp_txt.is_file():
             if redo:
@@ -146,6 +180,16 @@ def process_files(
                 # stocker le chemin vers le fichier TXT existant
                 fullpath_txt.append(fp_txt)
                 continue
+        # demander l'accord du budget de l'exécution
+        if budget is not None:
+            reason = budget.acquire()
+            if reason is not None:
+                if deferred_queue is not None:
+                    deferred_queue.add(df_row, "extract_native_text", reason)
+                deferred[len(retcodes)] = reason
+                retcodes.append(None)
+                fullpath_txt.append(None)
+                continue
         # traiter le fichier: extraire le texte natif
         retcode = extract_native_text(df_row, fp_pdf_in, fp_txt)
         if retcode == 1:
@@ -165,6 +209,27 @@ def process_files(
         retcode_txt=retcodes,
         fullpath_txt=fullpath_txt,
     )
+    if deferred:
+        # retirer les documents reportés, qui seront traités au lot suivant
+        # (avant la recherche des quasi-doublons, pour ne pas les indexer)
+        if deferred_queue is not None:
+            deferred_queue.save()
+        df_mmod = df_mmod.drop(index=df_mmod.index[list(deferred)])
+    log_deferred("Texte natif", deferred.values())
+    # pré-classer les documents, pour OCRiser et analyser les urgents en premier
+    df_mmod = df_mmod.assign(
+        priority=[
+            get_doc_priority(x, Path(x.fullpath_txt)) for x in df_mmod.itertuples()
+        ]
+    )
+    nb_urgent = (df_mmod["priority"] == PRIORITY_URGENT).sum()
+    if nb_urgent:
+        logging.info(f"Documents urgents (pré-classification): {nb_urgent}")
+    # repérer les quasi-doublons de documents déjà reçus, à partir du texte natif
+    if neardup_db is not None:
+        df_mmod = flag_near_duplicates(df_mmod, neardup_db)
+    else:
+        df_mmod = df_mmod.assign(dup_neartext=None, dup_neartext_pdf=None)
     # forcer les types des nouvelles colonnes
     df_mmod = df_mmod.astype(dtype=DTYPE_META_NTXT)
     return df_mmod
@@ -196,6 +261,33 @@ if __name__ == "__main__":
         "out_dir",
         help="Chemin vers le dossier de sortie contenant les fichiers de texte extraits",
     )
+    parser.add_argument(
+        "--neardup_db",
+        default=str(CACHE_DIR / "neardup-index.sqlite"),
+        help="Base SQLite de l'index des quasi-doublons, conservée entre les exécutions ('' pour désactiver)",
+    )
+    parser.add_argument(
+        "--deadline",
+        default=os.environ.get("RUN_DEADLINE", ""),
+        help="Échéance de l'exécution, au format ISO (ex: 2023-06-17T06:00:00): les documents restants sont alors reportés au prochain lot (par défaut: variable d'environnement RUN_DEADLINE)",
+    )
+    parser.add_argument(
+        "--max_rss",
+        type=int,
+        default=int(os.environ.get("RUN_MAX_RSS_MB", 0)),
+        help="Mémoire résidente maximale de l'extraction, en Mio (0: pas de limite ; par défaut: variable d'environnement RUN_MAX_RSS_MB)",
+    )
+    parser.add_argument(
+        "--cpu_share",
+        type=float,
+        default=float(os.environ.get("RUN_CPU_SHARE", 0)),
+        help="Charge maximale des processeurs de la machine, entre 0 et 1, au-delà de laquelle aucun document n'est commencé (0: pas de limite ; par défaut: variable d'environnement RUN_CPU_SHARE)",
+    )
+    parser.add_argument(
+        "--deferred",
+        default=str(FP_DEFERRED),
+        help="Fichier CSV de la file des documents reportés au prochain lot",
+    )
     group = parser.add_mutually_exclusive_group()
     # par défaut, le fichier out_file ne doit pas exister, sinon deux options mutuellement exclusives:
     # "redo" (écrase le fichier existant) et "append" (étend le fichier existant)
@@ -213,13 +305,13 @@ if __name__ == "__main__":
 
     # entrée: CSV de métadonnées enrichi
     in_file = Path(args.in_file).resolve()
-    if not in_file.is_file():
+    if not in_file.exists():
         raise ValueError(f"Le fichier en entrée {in_file} n'existe pas.")
 
     # sortie: CSV de métadonnées enrichi + infos fichiers produits
     # on crée le dossier parent (récursivement) si besoin
     out_file = Path(args.out_file).resolve()
-    if out_file.is_file():
+    if out_file.exists():
         if not args.redo and not args.append:
             # erreur si le fichier CSV existe déjà mais ni redo, ni append
             raise ValueError(
@@ -241,15 +333,27 @@ if __name__ == "__main__":
 
     # ouvrir le fichier d'entrée
     logging.info(f"Ouverture du fichier CSV {in_file}")
-    df_metas = pd.read_csv(in_file, dtype=DTYPE_META_PROC)
+    df_metas = read_table(in_file, DTYPE_META_PROC)
     # traiter les fichiers
-    df_mmod = process_files(df_metas, out_txt_dir, redo=args.redo)
-    # sauvegarder les infos extraites dans un fichier CSV
-    if args.append and out_file.is_file():
-        # si 'append', charger le fichier existant et lui ajouter les nouvelles entrées
-        df_mmod_old = pd.read_csv(out_file, dtype=DTYPE_META_NTXT)
-        df_proc = pd.concat([df_mmod_old, df_mmod])
+    # index des quasi-doublons, hors de data/interim
+    if args.neardup_db:
+        neardup_db = Path(args.neardup_db).resolve()
+        neardup_db.parent.mkdir(parents=True, exist_ok=True)
     else:
-        # sinon utiliser les seules nouvelles entrées
-        df_proc = df_mmod
-    df_proc.to_csv(out_file, index=False)
+        neardup_db = None
+    # budget de l'exécution, et file des documents reportés
+    budget = RunBudget(
+        deadline=parse_deadline(args.deadline),
+        max_rss=args.max_rss * 1024 * 1024 if args.max_rss else None,
+        cpu_share=args.cpu_share if args.cpu_share else None,
+    )
+    df_mmod = process_files(
+        df_metas,
+        out_txt_dir,
+        redo=args.redo,
+        neardup_db=neardup_db,
+        budget=budget if budget.is_limited else None,
+        deferred_queue=DeferredQueue(Path(args.deferred).resolve()),
+    )
+    # sauvegarder les infos extraites (CSV ou Parquet, selon l'extension)
+    write_table(df_mmod, out_file, DTYPE_META_NTXT, append=args.append)
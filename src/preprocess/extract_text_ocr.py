@@ -1,5 +1,13 @@
 """Le texte des PDF non-natifs ("PDF image") est extrait avec ocrmypdf.
 
+Pour les PDF mixtes, seules les pages image sont OCRisées, et le texte
+natif des autres pages est conservé.
+
+En mode progressif, les pages sont OCRisées par petits paquets et analysées
+au fur et à mesure ; les pages situées après la signature de l'arrêté ne
+sont pas OCRisées, et sont reportées dans "pages_ocr_skipped" pour être
+OCRisées ultérieurement si besoin.
+
 ocrmypdf produit un fichier PDF/A incluant une couche de texte extrait par OCR,
 et un fichier "sidecar" contenant le texte extrait par l'OCR uniquement.
 
@@ -9,9 +17,8 @@ Le fichier PDF/A est effacé, sauf mention contraire explicite par l'option
 
 # 2023-03-20: 260 fichiers en 38 minutes ; 184 en 24 minutes
 
-# TODO détecter les première et dernière page: de "nous" + vu, considérant etc jusqu'à la signature
-# pour exclure les annexes (rappel des articles du code de la construction, rapport de BE), page de garde etc.
-# => ajouter un mode "early_stopping", optionnel, à l'extraction de texte
+# TODO détecter la première page: de "nous" + vu, considérant etc
+# pour exclure la page de garde (la dernière page est détectée par le mode progressif)
 # TODO tester si (1) la sortie de pdftotext et (2) le sidecar (sur des PDF différents) sont globalement formés de façon similaire
 # pour valider qu'on peut appliquer les mêmes regex/patterns d'extraction, ou s'il faut prévoir des variantes
 # TODO si redo='ocr', ré-OCRisation des documents (mal) OCRisés (avec un warning.info)
@@ -29,17 +36,58 @@ Le fichier PDF/A est effacé, sauf mention contraire explicite par l'option
 # * pdfplumber introduit des espaces et lignes superflus
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 import logging
 import os
 from pathlib import Path
-from typing import NamedTuple
+import shutil
+import sys
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
 
 # bibliothèques tierces
+from ocrmypdf.exceptions import ExitCode
 import pandas as pd
 
 # imports locaux
-from src.preprocess.extract_text_ocr_ocrmypdf import extract_text_from_pdf_image
+from src.preprocess.deferred_queue import FP_DEFERRED, DeferredQueue
+from src.preprocess.extract_text_ocr_ocrmypdf import (
+    OCR_ENGINE_KEY,
+    extract_text_from_pdf_image,
+)
+from src.preprocess.ocr_adaptive import AdaptiveOcrStats, select_pages_redo
+from src.preprocess.ocr_cache import OCR_CACHE_MAX_BYTES, OcrPageCache
+from src.preprocess.ocr_cost import (
+    OcrCostModel,
+    format_duration,
+    log_estimate,
+    lpt_order,
+)
+from src.preprocess.extract_text_ocr_tesseract import (
+    TesseractPool,
+    extract_text_from_pdf_image_textonly,
+    get_engine_key,
+)
+from src.preprocess.ocr_pool import (
+    get_nb_ocr_slots,
+    get_profile_path,
+    load_ocr_profile,
+    plan_ocr_pool,
+)
+from src.preprocess.ocr_settings import (
+    OCR_SETTINGS,
+    get_settings_key,
+    select_ocr_settings,
+)
+from src.preprocess.priority import PRIORITY_UNKNOWN
+from src.preprocess.scan_duplicates import confirm_same_text
+from src.process.parse_doc import iter_arrete_pages
+from src.utils.file_utils import CACHE_DIR
+from src.utils.run_budget import RunBudget, log_deferred, parse_deadline
+from src.utils.storage import read_table, write_table
+from src.utils.txt_format import format_page_list, load_pages_text, parse_page_list
 
 # schéma des données en entrée
 from src.preprocess.convert_native_pdf_to_pdfa import DTYPE_META_NTXT_PDFA
@@ -47,8 +95,237 @@ from src.preprocess.convert_native_pdf_to_pdfa import DTYPE_META_NTXT_PDFA
 # schéma des données en sortie (idem entrée)
 DTYPE_META_NTXT_OCR = DTYPE_META_NTXT_PDFA | {
     "retcode_ocr": "Int64",  # FIXME Int16 ? (dtype à fixer ici, avant le dump)
+    "pages_ocr_skipped": "string",  # pages image non OCRisées car après la signature (ex: "5-8")
 }
 
+# nombre de pages OCRisées à chaque appel du moteur d'OCR, en mode progressif
+PROGRESSIVE_CHUNK = 2
+# copie du texte OCRisé des originaux de l'index des numérisations en double
+# (voir `scan_duplicates`), conservée entre les exécutions, contrairement aux
+# fichiers txt de data/interim
+DIR_SCANDUP_TXT = CACHE_DIR / "scandup-txt"
+
+
+def ocr_pages(
+    df_row: NamedTuple,
+    fp_pdf_in: Path,
+    fp_pdf_out: Path,
+    fp_txt_out: Path,
+    pages: List[int],
+    verbose: int = 0,
+    jobs: Optional[int] = None,
+    ocr_cache: Optional[OcrPageCache] = None,
+    tess_pool: Optional[TesseractPool] = None,
+    ocr_pass: Optional[str] = None,
+    omp_threads: Optional[int] = None,
+) -> Tuple[int, Optional[Dict[int, str]]]:
+    """OCRise des pages d'un document, en passant par le cache d'OCR.
+
+    Parameters
+    ----------
+    df_row: NamedTuple
+        Métadonnées et informations sur le fichier PDF à traiter.
+    fp_pdf_in: Path
+        Chemin du fichier PDF à traiter.
+    fp_pdf_out: Path
+        Chemin du fichier PDF converti en PDF/A (avec OCR le cas échéant).
+    fp_txt_out: Path
+        Chemin du fichier txt "sidecar" produit par ocrmypdf.
+    pages: List[int]
+        Numéros des pages à OCRiser (la première page est numérotée 1).
+    verbose: int, defaults to 0
+        Niveau de verbosité d'ocrmypdf.
+    jobs: int, optional
+        Nombre de pages OCRisées en parallèle par ocrmypdf.
+    ocr_cache: OcrPageCache, optional
+        Cache du texte OCRisé des pages.
+    tess_pool: TesseractPool, optional
+        Pool de moteurs tesseract pour l'OCR "texte seul".
+    ocr_pass: str, optional
+        Réglages d'OCR (clé de `ocr_settings.OCR_SETTINGS`: "fast",
+        "balanced" ou "best"), None pour les réglages par défaut.
+    omp_threads: int, optional
+        Nombre de threads de chaque processus tesseract lancé par ocrmypdf.
+
+    Returns
+    -------
+    retcode: int
+        Code de retour d'ocrmypdf.
+    pages_ocr: Dict[int, str], optional
+        Texte de chaque page OCRisée ou trouvée dans le cache, None en cas
+        d'échec de l'OCR.
+    """
+    # Si un PDF est susceptible de contenir des couches d'OCR de mauvaise qualité, indiquer à
+    # ocrmypdf de les ignorer et de refaire l'OCR, avec "--redo-ocr" (CLI) / "redo_ocr" (ici)
+    # (si cela ne fonctionne pas ou pas toujours, modifier le code pour remplacer "--redo-ocr"
+    # par "--force-ocr" qui forcera la rasterization des pages avant de leur appliquer l'OCR)
+    # FIXME ? force ocr pour les PDF avec une mauvaise OCR, eg. "Image Capture Plus" ?
+    redo_ocr = True
+    # redo_ocr = df_row.processed_as == "image"  # toujours vrai?
+
+    # pages déjà OCRisées, trouvées dans le cache
+    page_keys = {}
+    pages_ocr = {}
+    if ocr_cache is not None:
+        page_keys = ocr_cache.page_keys(
+            fp_pdf_in,
+            pages,
+            variant=get_settings_key(ocr_pass) if ocr_pass is not None else "",
+        )
+        for i, page_key in page_keys.items():
+            if page_key is not None:
+                page_txt = ocr_cache.get(page_key)
+                if page_txt is not None:
+                    pages_ocr[i] = page_txt
+    nb_cached = len(pages_ocr)
+    pages_todo = [i for i in pages if i not in pages_ocr]
+
+    logging.info(
+        f"PDF {df_row.processed_as}, pages à OCRiser {pages_todo}"
+        + (f" (passe {ocr_pass})" if ocr_pass is not None else "")
+        + f" ({nb_cached} en cache): {fp_pdf_in}"
+    )
+    if pages_todo and tess_pool is not None:
+        # OCR "texte seul", sans PDF/A
+        try:
+            pages_new = extract_text_from_pdf_image_textonly(
+                fp_pdf_in, pages_todo, pool=tess_pool, ocr_pass=ocr_pass
+            )
+        except Exception as e:
+            logging.error(f"Erreur OCR (tesseract): {fp_pdf_in}: {e}")
+            return ExitCode.other_error, None
+        retcode = ExitCode.ok
+        pages_ocr.update(pages_new)
+        if ocr_cache is not None:
+            for i, page_txt in pages_new.items():
+                if page_keys.get(i) is not None:
+                    ocr_cache.put(page_keys[i], page_txt)
+    elif pages_todo:
+        retcode = extract_text_from_pdf_image(
+            fp_pdf_in,
+            fp_txt_out,
+            fp_pdf_out,
+            page_beg=1,
+            page_end=df_row.nb_pages,
+            redo_ocr=redo_ocr,
+            verbose=verbose,
+            pages=pages_todo,
+            jobs=jobs,
+            ocr_pass=ocr_pass,
+            omp_threads=omp_threads,
+        )
+        if not fp_txt_out.is_file():
+            return retcode, None
+        pages_sidecar = load_pages_text(fp_txt_out)
+        if len(pages_sidecar) != df_row.nb_pages:
+            logging.warning(
+                f"{len(pages_sidecar)} pages dans {fp_txt_out} != {df_row.nb_pages} pages dans {fp_pdf_in}"
+            )
+            return retcode, None
+        for i in pages_todo:
+            pages_ocr[i] = pages_sidecar[i - 1]
+            # stocker les pages nouvellement OCRisées dans le cache
+            if (
+                ocr_cache is not None
+                and page_keys.get(i) is not None
+                and retcode in (ExitCode.ok, ExitCode.pdfa_conversion_failed)
+            ):
+                ocr_cache.put(page_keys[i], pages_sidecar[i - 1])
+    else:
+        # toutes les pages sont en cache: ocrmypdf n'est pas appelé
+        retcode = ExitCode.ok
+    return retcode, pages_ocr
+
+
+def ocr_pages_progressive(
+    df_row: NamedTuple,
+    pages: List[int],
+    ocr_fn: Callable[[List[int]], Tuple[int, Optional[Dict[int, str]]]],
+    chunk_size: int = PROGRESSIVE_CHUNK,
+) -> Tuple[int, Optional[Dict[int, str]], List[int]]:
+    """OCRise les pages d'un arrêté jusqu'à sa signature.
+
+    Les pages sont OCRisées par petits paquets, au fur et à mesure de leur
+    analyse par `parse_doc.iter_arrete_pages`. Dès que la signature de
+    l'arrêté a été lue (état "apres_signature"), les pages restantes,
+    généralement des annexes (extraits du CCH, plans, rapports), ne sont
+    pas OCRisées.
+    Si l'analyse échoue ou n'atteint pas la signature, toutes les pages
+    sont OCRisées.
+
+    Parameters
+    ----------
+    df_row: NamedTuple
+        Métadonnées et informations sur le fichier PDF à traiter.
+    pages: List[int]
+        Numéros des pages à OCRiser (la première page est numérotée 1).
+    ocr_fn: Callable[[List[int]], Tuple[int, Optional[Dict[int, str]]]]
+        Fonction OCRisant une liste de pages (voir `ocr_pages`).
+    chunk_size: int, defaults to PROGRESSIVE_CHUNK
+        Nombre de pages OCRisées à chaque appel du moteur d'OCR.
+
+    Returns
+    -------
+    retcode: int
+        Code de retour d'ocrmypdf (le premier code d'erreur rencontré).
+    pages_ocr: Dict[int, str], optional
+        Texte de chaque page OCRisée, None en cas d'échec de l'OCR.
+    pages_skipped: List[int]
+        Pages à OCRiser qui ne l'ont pas été car situées après la signature.
+    """
+    # texte natif des pages qui ne sont pas à OCRiser (PDF mixte)
+    pages_nat = None
+    if df_row.processed_as == "mixed":
+        pages_nat = load_pages_text(Path(df_row.fullpath_txt))
+        if len(pages_nat) != df_row.nb_pages:
+            pages_nat = None
+    pages_set = set(pages)
+    pages_ocr = {}
+    retcodes = []
+
+    def _iter_pages():
+        """Produit le texte des pages, en OCRisant chaque paquet à la demande."""
+        for i in range(1, df_row.nb_pages + 1):
+            if i in pages_set:
+                if i not in pages_ocr:
+                    chunk = [x for x in pages if x >= i][:chunk_size]
+                    retcode, chunk_ocr = ocr_fn(chunk)
+                    retcodes.append(retcode)
+                    if chunk_ocr is None:
+                        # échec de l'OCR: arrêter l'analyse
+                        return
+                    pages_ocr.update(chunk_ocr)
+                yield pages_ocr.get(i)
+            elif pages_nat is not None:
+                yield pages_nat[i - 1]
+            else:
+                yield None
+
+    signed = False
+    try:
+        for _, cur_state in iter_arrete_pages(df_row.pdf, _iter_pages()):
+            if cur_state == "apres_signature":
+                signed = True
+                break
+    except Exception as e:
+        logging.warning(f"{df_row.pdf}: analyse progressive impossible: {e}")
+    retcode = next((x for x in retcodes if x != ExitCode.ok), ExitCode.ok)
+    if retcode not in (ExitCode.ok, ExitCode.pdfa_conversion_failed):
+        return retcode, None, []
+    pages_todo = [i for i in pages if i not in pages_ocr]
+    if signed or not pages_todo:
+        if pages_todo:
+            logging.info(
+                f"{df_row.pdf}: signature lue, pages non OCRisées {pages_todo}"
+            )
+        return retcode, pages_ocr, pages_todo
+    # signature non trouvée: OCRiser les pages restantes
+    retcode, pages_new = ocr_fn(pages_todo)
+    if pages_new is None:
+        return retcode, None, []
+    pages_ocr.update(pages_new)
+    return retcode, pages_ocr, []
+
 
 # TODO type hint pour la valeur de retour: str, Literal ou LiteralString? dépend de la version de python
 def preprocess_pdf_file(
@@ -57,11 +334,30 @@ def preprocess_pdf_file(
     fp_pdf_out: Path,
     fp_txt_out: Path,
     verbose: int = 0,
-) -> int:
+    jobs: Optional[int] = None,
+    ocr_cache: Optional[OcrPageCache] = None,
+    tess_pool: Optional[TesseractPool] = None,
+    progressive: bool = False,
+    adaptive: bool = False,
+    ocr_stats: Optional[AdaptiveOcrStats] = None,
+    omp_threads: Optional[int] = None,
+    ocr_pass: Optional[str] = None,
+) -> Tuple[int, List[int]]:
     """Extraire le texte par OCR et générer des fichiers PDF/A et txt.
 
     Le fichier PDF est OCRisé avec ocrmypdf, qui crée un PDF/A et un
     fichier texte "sidecar".
+    Seules les pages image ("pages_image") sont OCRisées ; pour un PDF
+    mixte, le texte natif des autres pages est reporté dans le fichier txt.
+    Les pages trouvées dans le cache d'OCR ne sont pas OCRisées de nouveau
+    (le PDF/A produit ne contient alors pas leur couche d'OCR).
+    Si un pool de moteurs tesseract est fourni, le texte est extrait sans
+    ocrmypdf et aucun PDF/A n'est produit.
+    En mode progressif, l'OCR s'arrête après la signature de l'arrêté
+    (voir `ocr_pages_progressive`).
+    En mode adaptatif, les pages sont OCRisées avec des réglages rapides,
+    puis seules les pages en échec sont OCRisées de nouveau avec des
+    réglages de qualité (voir `ocr_adaptive.select_pages_redo`).
 
     La version actuelle est: ocrmypdf 14.0.3 / Tesseract OCR-PDF 5.2.0
     (+ pikepdf 5.6.1).
@@ -79,45 +375,338 @@ def preprocess_pdf_file(
     verbose: int, defaults to 0
         Niveau de verbosité d'ocrmypdf (-1, 0, 1, 2):
         <https://ocrmypdf.readthedocs.io/en/latest/api.html#ocrmypdf.Verbosity>
+    jobs: int, optional
+        Nombre de pages OCRisées en parallèle par ocrmypdf.
+    ocr_cache: OcrPageCache, optional
+        Cache du texte OCRisé des pages.
+    tess_pool: TesseractPool, optional
+        Pool de moteurs tesseract pour l'OCR "texte seul".
+    progressive: bool, defaults to False
+        Si True, les pages situées après la signature ne sont pas OCRisées.
+    adaptive: bool, defaults to False
+        Si True, OCR en deux passes: rapide, puis qualité sur les pages en
+        échec.
+    ocr_stats: AdaptiveOcrStats, optional
+        Statistiques des deux passes, en mode adaptatif.
+    omp_threads: int, optional
+        Nombre de threads de chaque processus tesseract lancé par ocrmypdf.
+    ocr_pass: str, optional
+        Réglages d'OCR (clé de `ocr_settings.OCR_SETTINGS`), None pour les
+        réglages par défaut ; ignoré en mode adaptatif.
 
     Returns
     -------
     retcode: int
         Code de retour d'ocrmypdf
         <https://ocrmypdf.readthedocs.io/en/latest/advanced.html#return-code-policy> .
+    pages_skipped: List[int]
+        Pages image non OCRisées car situées après la signature.
     """
     logging.info(f"Ouverture du fichier {fp_pdf_in}")
 
-    # définir les pages à traiter
-    page_beg = 1
-    # exclure la dernière page de l'OCRisation, si c'est un accusé de réception de transmission à @ctes
+    # définir les pages à traiter: les pages image, déterminées page par page
+    # (la dernière page en est exclue si c'est un accusé de réception de
+    # transmission à @ctes)
     # TODO gérer les cas où l'AR de transmission n'est pas en dernière page car suivi d'annexes
-    page_end = (
-        df_row.nb_pages - 1
-        if (pd.notna(df_row.guess_dernpage) and df_row.guess_dernpage)
-        else df_row.nb_pages
+    pages = parse_page_list(df_row.pages_image)
+    assert df_row.processed_as in ("image", "mixed")
+
+    ocr_fn = partial(
+        ocr_pages,
+        df_row,
+        fp_pdf_in,
+        fp_pdf_out,
+        fp_txt_out,
+        verbose=verbose,
+        jobs=jobs,
+        ocr_cache=ocr_cache,
+        tess_pool=tess_pool,
+        ocr_pass="fast" if adaptive else ocr_pass,
+        omp_threads=omp_threads,
     )
+    t0 = time.perf_counter()
+    if progressive:
+        retcode, pages_ocr, pages_skipped = ocr_pages_progressive(df_row, pages, ocr_fn)
+    else:
+        retcode, pages_ocr = ocr_fn(pages)
+        pages_skipped = []
+    if pages_ocr is None:
+        return retcode, []
+    # écrire le fichier txt: pages OCRisées ou en cache, et texte natif des
+    # autres pages pour un PDF mixte
+    fp_txt_native = (
+        Path(df_row.fullpath_txt) if df_row.processed_as == "mixed" else None
+    )
+    write_sidecar(fp_txt_out, df_row.nb_pages, pages_ocr, fp_txt_native)
+    if adaptive:
+        # seconde passe, avec des réglages de qualité, sur les pages en échec
+        nb_pages_fast = len(pages_ocr)
+        t1 = time.perf_counter()
+        pages_redo = select_pages_redo(load_pages_text(fp_txt_out), pages_ocr)
+        if pages_redo:
+            retcode_best, pages_best = ocr_fn(pages_redo, ocr_pass="best")
+            if pages_best is not None:
+                retcode = retcode_best
+                pages_ocr.update(pages_best)
+                write_sidecar(fp_txt_out, df_row.nb_pages, pages_ocr, fp_txt_native)
+            else:
+                logging.warning(
+                    f"Échec de la seconde passe, texte de la première passe conservé: {fp_pdf_in}"
+                )
+        if ocr_stats is not None:
+            ocr_stats.add("fast", nb_pages_fast, t1 - t0)
+            ocr_stats.add("best", len(pages_redo), time.perf_counter() - t1)
+    return retcode, pages_skipped
 
-    # Si un PDF est susceptible de contenir des couches d'OCR de mauvaise qualité, indiquer à
-    # ocrmypdf de les ignorer et de refaire l'OCR, avec "--redo-ocr" (CLI) / "redo_ocr" (ici)
-    # (si cela ne fonctionne pas ou pas toujours, modifier le code pour remplacer "--redo-ocr"
-    # par "--force-ocr" qui forcera la rasterization des pages avant de leur appliquer l'OCR)
-    # FIXME ? force ocr pour les PDF avec une mauvaise OCR, eg. "Image Capture Plus" ?
-    redo_ocr = True
-    # redo_ocr = df_row.processed_as == "image"  # toujours vrai?
-    assert df_row.processed_as == "image"
 
-    logging.info(f"PDF image: {fp_pdf_in}")
-    retcode = extract_text_from_pdf_image(
+def write_sidecar(
+    fp_txt_out: Path,
+    nb_pages: int,
+    pages_ocr: Dict[int, str],
+    fp_txt_native: Optional[Path] = None,
+):
+    """Écrit un fichier txt au format du fichier sidecar d'ocrmypdf.
+
+    Le fichier sidecar d'ocrmypdf contient une page de texte par page du PDF,
+    séparées par "\f", avec "[OCR skipped on page(s) N]" pour les pages non
+    OCRisées.
+
+    Parameters
+    ----------
+    fp_txt_out: Path
+        Fichier txt à produire.
+    nb_pages: int
+        Nombre de pages du document.
+    pages_ocr: Dict[int, str]
+        Texte de chaque page OCRisée (la première page est numérotée 1).
+    fp_txt_native: Path, optional
+        Fichier contenant le texte natif du document, extrait par pdftotext ;
+        s'il est fourni, les pages non OCRisées sont remplacées par leur texte
+        natif.
+    """
+    pages_nat = None
+    if fp_txt_native is not None:
+        pages_nat = load_pages_text(fp_txt_native)
+        if len(pages_nat) != nb_pages:
+            logging.warning(
+                f"Fusion impossible: {len(pages_nat)} pages de texte natif dans"
+                + f" {fp_txt_native} != {nb_pages} pages"
+            )
+            pages_nat = None
+    pages_txt = []
+    for i in range(1, nb_pages + 1):
+        if i in pages_ocr:
+            pages_txt.append(pages_ocr[i])
+        elif pages_nat is not None:
+            pages_txt.append(pages_nat[i - 1])
+        else:
+            pages_txt.append(f"[OCR skipped on page(s) {i}]")
+    with open(fp_txt_out, "w") as f_txt:
+        f_txt.write("\f".join(pages_txt))
+
+
+def find_skipped_pages(fp_txt: Path, pages: List[int]) -> List[int]:
+    """Renvoie les pages à OCRiser qui ne l'ont pas été dans un fichier txt.
+
+    Parameters
+    ----------
+    fp_txt: Path
+        Fichier txt produit par une exécution précédente (voir
+        `write_sidecar`).
+    pages: List[int]
+        Numéros des pages à OCRiser (la première page est numérotée 1).
+
+    Returns
+    -------
+    pages_skipped: List[int]
+        Pages marquées "[OCR skipped on page(s) N]" dans le fichier txt.
+    """
+    pages_txt = load_pages_text(fp_txt)
+    return [
+        i
+        for i in pages
+        if i <= len(pages_txt) and pages_txt[i - 1].startswith("[OCR skipped on page")
+    ]
+
+
+def _ocr_task(
+    task: Tuple[NamedTuple, Path, Path, Path],
+    keep_pdfa: bool = False,
+    verbose: int = 0,
+    jobs: Optional[int] = None,
+    ocr_cache: Optional[OcrPageCache] = None,
+    tess_pool: Optional[TesseractPool] = None,
+    progressive: bool = False,
+    adaptive: bool = False,
+    ocr_stats: Optional[AdaptiveOcrStats] = None,
+    omp_threads: Optional[int] = None,
+    ocr_settings: Optional[str] = None,
+    settings_by_producer: bool = False,
+    cost_model: Optional[OcrCostModel] = None,
+    budget: Optional[RunBudget] = None,
+) -> Tuple[Optional[int], Optional[Path], List[int], Optional[str]]:
+    """OCRise un document (exécuté par un worker du pool).
+
+    Parameters
+    ----------
+    task: Tuple[NamedTuple, Path, Path, Path]
+        Métadonnées du fichier PDF, chemins du PDF à traiter, du PDF/A et du
+        fichier txt à produire.
+    keep_pdfa: bool, defaults to False
+        Si True, n'efface pas le fichier PDF/A produit par l'OCR.
+    verbose: int, defaults to 0
+        Niveau de verbosité d'ocrmypdf.
+    jobs: int, optional
+        Nombre de pages OCRisées en parallèle par ocrmypdf.
+    ocr_cache: OcrPageCache, optional
+        Cache du texte OCRisé des pages.
+    tess_pool: TesseractPool, optional
+        Pool de moteurs tesseract pour l'OCR "texte seul".
+    progressive: bool, defaults to False
+        Si True, les pages situées après la signature ne sont pas OCRisées.
+    adaptive: bool, defaults to False
+        Si True, OCR en deux passes: rapide, puis qualité sur les pages en
+        échec.
+    ocr_stats: AdaptiveOcrStats, optional
+        Statistiques des deux passes, en mode adaptatif.
+    omp_threads: int, optional
+        Nombre de threads de chaque processus tesseract lancé par ocrmypdf.
+    ocr_settings: str, optional
+        Réglages d'OCR du lot (clé de `ocr_settings.OCR_SETTINGS`).
+    settings_by_producer: bool, defaults to False
+        Si True, les réglages sont choisis selon le logiciel producteur du
+        PDF (voir `select_ocr_settings`), `ocr_settings` par défaut.
+    cost_model: OcrCostModel, optional
+        Modèle de coût de l'OCR, auquel la durée mesurée est ajoutée.
+    budget: RunBudget, optional
+        Budget de l'exécution, dont l'accord est demandé avant de commencer
+        l'OCR (avec la durée estimée par `cost_model`).
+
+    Returns
+    -------
+    retcode: int, optional
+        Code de retour d'ocrmypdf, None si le document est reporté.
+    fp_pdfa: Path, optional
+        Chemin du fichier PDF/A conservé, None s'il a été effacé.
+    pages_skipped: List[int]
+        Pages image non OCRisées car situées après la signature.
+    deferred: str, optional
+        Motif du report du document au lot suivant, None s'il a été OCRisé.
+    """
+    df_row, fp_pdf_in, fp_pdf_out, fp_txt = task
+    if budget is not None:
+        cost = cost_model.predict(df_row) if cost_model is not None else 0.0
+        deferred = budget.acquire(cost)
+        if deferred is not None:
+            return None, None, [], deferred
+    if settings_by_producer:
+        ocr_settings = select_ocr_settings(
+            df_row.creatortool, df_row.producer, ocr_settings
+        )
+    t0 = time.perf_counter()
+    retcode, pages_skipped = preprocess_pdf_file(
+        df_row,
         fp_pdf_in,
-        fp_txt_out,
         fp_pdf_out,
-        page_beg=page_beg,
-        page_end=page_end,
-        redo_ocr=redo_ocr,
+        fp_txt,
         verbose=verbose,
+        jobs=jobs,
+        ocr_cache=ocr_cache,
+        tess_pool=tess_pool,
+        progressive=progressive,
+        adaptive=adaptive,
+        ocr_stats=ocr_stats,
+        omp_threads=omp_threads,
+        ocr_pass=ocr_settings,
     )
-    return retcode
+    if cost_model is not None and retcode in (
+        ExitCode.ok,
+        ExitCode.pdfa_conversion_failed,
+    ):
+        cost_model.record(df_row, time.perf_counter() - t0)
+    if keep_pdfa:
+        return retcode, fp_pdf_out, pages_skipped, None
+    # effacer le PDF/A dès la fin de l'OCR du document
+    if fp_pdf_out.is_file():
+        os.remove(fp_pdf_out)
+    return retcode, None, pages_skipped, None
+
+
+def _confirm_scan_dup(
+    task: Tuple[NamedTuple, Path, Path, Path],
+    fp_txt_orig: Path,
+    verbose: int = 0,
+    jobs: Optional[int] = None,
+    ocr_cache: Optional[OcrPageCache] = None,
+    tess_pool: Optional[TesseractPool] = None,
+    omp_threads: Optional[int] = None,
+    ocr_settings: Optional[str] = None,
+) -> bool:
+    """Confirme une numérisation en double sur le texte d'une page (exécuté
+    par un worker du pool).
+
+    La première page image du document est OCRisée (en passant par le cache
+    d'OCR, que l'OCR complète du document réutilise si le doublon n'est pas
+    confirmé), puis comparée à la même page de l'original (voir
+    `scan_duplicates.confirm_same_text`).
+
+    Parameters
+    ----------
+    task: Tuple[NamedTuple, Path, Path, Path]
+        Métadonnées du fichier PDF, chemins du PDF à traiter, du PDF/A et du
+        fichier txt à produire.
+    fp_txt_orig: Path
+        Fichier txt de l'original.
+    verbose: int, defaults to 0
+        Niveau de verbosité d'ocrmypdf.
+    jobs: int, optional
+        Nombre de pages OCRisées en parallèle par ocrmypdf.
+    ocr_cache: OcrPageCache, optional
+        Cache du texte OCRisé des pages.
+    tess_pool: TesseractPool, optional
+        Pool de moteurs tesseract pour l'OCR "texte seul".
+    omp_threads: int, optional
+        Nombre de threads de chaque processus tesseract lancé par ocrmypdf.
+    ocr_settings: str, optional
+        Réglages d'OCR (clé de `ocr_settings.OCR_SETTINGS`).
+
+    Returns
+    -------
+    confirmed: bool
+        True si la page est la même que celle de l'original.
+    """
+    df_row, fp_pdf_in, fp_pdf_out, fp_txt = task
+    pages = parse_page_list(df_row.pages_image)
+    pages_orig = load_pages_text(fp_txt_orig)
+    if not pages or len(pages_orig) != df_row.nb_pages:
+        return False
+    page = pages[0]
+    # sidecar et PDF/A d'une seule page OCRisée, effacés après la comparaison
+    fp_txt_page = fp_txt.with_suffix(".confirm.txt")
+    try:
+        _, pages_ocr = ocr_pages(
+            df_row,
+            fp_pdf_in,
+            fp_pdf_out,
+            fp_txt_page,
+            [page],
+            verbose=verbose,
+            jobs=jobs,
+            ocr_cache=ocr_cache,
+            tess_pool=tess_pool,
+            ocr_pass=ocr_settings,
+            omp_threads=omp_threads,
+        )
+    except Exception as e:
+        logging.warning(f"Erreur OCR de la page {page}: {fp_pdf_in}: {e}")
+        return False
+    finally:
+        for fp in (fp_txt_page, fp_pdf_out):
+            if fp.is_file():
+                os.remove(fp)
+    if pages_ocr is None:
+        return False
+    return confirm_same_text(pages_ocr[page], pages_orig[page - 1])
 
 
 # TODO redo='all'|'ocr'|'none' ? 'ocr' pour ré-extraire le texte quand le fichier source est mal océrisé par la source, ex: 99_AI-013-211300264-20220223-22_100-AI-1-1_1.pdf
@@ -128,9 +717,40 @@ def process_files(
     redo: bool = False,
     keep_pdfa: bool = False,
     verbose: int = 0,
-) -> pd.DataFrame:
+    workers: int = 0,
+    jobs: int = 0,
+    ocr_cache: Optional[OcrPageCache] = None,
+    backend: str = "ocrmypdf",
+    progressive: bool = False,
+    adaptive: bool = False,
+    ocr_profile: Optional[dict] = None,
+    ocr_settings: Optional[str] = None,
+    settings_by_producer: bool = False,
+    reuse_scan_dups: bool = True,
+    scandup_txt_dir: Optional[Path] = DIR_SCANDUP_TXT,
+    cost_model: Optional[OcrCostModel] = None,
+    dry_run: bool = False,
+    budget: Optional[RunBudget] = None,
+    deferred_queue: Optional[DeferredQueue] = None,
+) -> Optional[pd.DataFrame]:
     """Traiter un ensemble de fichiers PDF: convertir les PDF en PDF/A et extraire le texte.
 
+    Plusieurs documents sont OCRisés simultanément ; les résultats sont
+    reportés dans l'ordre des fichiers en entrée.
+    Les documents sont soumis au pool par priorité ("priority", voir
+    `priority`), les arrêtés urgents en premier ; avec un modèle de coût,
+    à priorité égale, du plus long au plus court, et la durée estimée de
+    l'OCR est écrite avant de commencer (voir `ocr_cost`).
+    Les numérisations en double d'un document déjà OCRisé ("dup_scan", voir
+    `scan_duplicates`) ne sont pas OCRisées: le fichier txt de l'original
+    est copié, une fois confirmé que leur première page image a le même
+    texte que celle de l'original ; les doublons non confirmés, ou dont
+    l'original n'a pas de fichier txt, sont OCRisés.
+    Avec un budget, les documents qui ne peuvent pas être OCRisés dans le
+    temps ou les ressources impartis sont reportés au lot suivant: ils sont
+    retirés des métadonnées renvoyées et ajoutés à la file des documents
+    reportés.
+
     Parameters
     ----------
     df_meta: pd.DataFrame
@@ -146,38 +766,146 @@ def process_files(
     verbose: int, defaults to 0
         Niveau de verbosité d'ocrmypdf (-1, 0, 1, 2):
         <https://ocrmypdf.readthedocs.io/en/latest/api.html#ocrmypdf.Verbosity>
+    workers: int, defaults to 0
+        Nombre de documents OCRisés simultanément ; si 0, déterminé d'après
+        les coeurs et la mémoire disponibles (voir `plan_ocr_pool`).
+    jobs: int, defaults to 0
+        Nombre de pages OCRisées en parallèle dans chaque document
+        (option "--jobs" d'ocrmypdf) ; si 0, déterminé automatiquement.
+    ocr_cache: OcrPageCache, optional
+        Cache du texte OCRisé des pages, conservé entre les exécutions.
+        Il n'est pas utilisé si `keep_pdfa` est True, car les PDF/A doivent
+        alors contenir la couche d'OCR de toutes les pages.
+    backend: str, defaults to "ocrmypdf"
+        Moteur d'OCR: "ocrmypdf" (PDF/A et sidecar) ou "tesseract" (texte
+        seul, pages rastérisées avec pdf2image et OCRisées par un pool de
+        moteurs tesseract persistants ; ignoré si `keep_pdfa` est True).
+        Avec "tesseract", `workers` est le nombre de moteurs et `jobs` est
+        ignoré.
+    progressive: bool, defaults to False
+        Si True, l'OCR de chaque document s'arrête après la signature de
+        l'arrêté ; les pages non OCRisées sont reportées dans la colonne
+        "pages_ocr_skipped", et marquées "[OCR skipped on page(s) N]" dans
+        le fichier txt (ignoré si `keep_pdfa` est True). Une nouvelle
+        exécution sans ce mode, avec les mêmes dossiers de sortie, OCRise
+        ces pages même sans `redo`, les autres pages étant lues dans le
+        cache d'OCR. Avec le moteur "ocrmypdf", chaque paquet de pages
+        (`PROGRESSIVE_CHUNK`) est un appel complet à ocrmypdf, production
+        du PDF/A comprise: ce mode est surtout utile avec "tesseract".
+    adaptive: bool, defaults to False
+        Si True, les pages sont OCRisées avec des réglages rapides, puis les
+        pages dont le texte est illisible, ou les documents dont les champs
+        clés ne sont pas trouvés, avec des réglages de qualité (ignoré si
+        `keep_pdfa` est True). La part de pages OCRisées de nouveau et le
+        temps gagné sont écrits dans le log.
+    ocr_profile: dict, optional
+        Profil d'OCR de la machine, produit par `calibrate_ocr` (voir
+        `load_ocr_profile`): nombre de documents simultanés, de jobs par
+        document et de threads par processus tesseract, utilisés avec
+        "ocrmypdf" à la place du dimensionnement par `plan_ocr_pool` ;
+        `workers` et `jobs`, s'ils sont non nuls, restent prioritaires.
+    ocr_settings: str, optional
+        Réglages d'OCR du lot: "fast", "balanced" ou "best" (voir
+        `ocr_settings.OCR_SETTINGS`) ; par défaut, réglages d'ocrmypdf sans
+        redressement ni nettoyage. Ignoré en mode adaptatif.
+    settings_by_producer: bool, defaults to False
+        Si True, les réglages de chaque document sont choisis selon le
+        logiciel qui a produit le PDF ("creatortool", "producer"), ceux du
+        lot s'appliquant aux autres documents (voir `select_ocr_settings`).
+    reuse_scan_dups: bool, defaults to True
+        Si True, le texte OCRisé des originaux est copié pour leurs
+        numérisations en double (ignoré si `keep_pdfa` est True, car le
+        PDF/A des doublons ne serait pas produit).
+    scandup_txt_dir: Path, optional
+        Dossier où le texte OCRisé des originaux est conservé entre les
+        exécutions, pour leurs numérisations en double reçues lors d'un lot
+        ultérieur ; si None, seuls les fichiers txt de `out_txt_dir` sont
+        réutilisés.
+    cost_model: OcrCostModel, optional
+        Modèle de coût de l'OCR: à priorité égale, les documents sont
+        OCRisés du plus long au plus court, et les durées mesurées sont
+        conservées pour les exécutions suivantes ; si None, les documents
+        de même priorité sont OCRisés dans l'ordre du fichier d'entrée.
+    dry_run: bool, defaults to False
+        Si True, écrit la durée estimée de l'OCR sans rien traiter.
+    budget: RunBudget, optional
+        Budget de l'exécution: échéance, mémoire et charge des processeurs
+        maximales (voir `run_budget`).
+    deferred_queue: DeferredQueue, optional
+        File des documents reportés au lot suivant, faute de budget.
 
     Returns
     -------
-    df_mmod: pd.DataFrame
-        Métadonnées des fichiers d'entrée et chemins vers les fichiers PDF/A et TXT.
+    df_mmod: pd.DataFrame, optional
+        Métadonnées des fichiers d'entrée (sauf les documents reportés) et
+        chemins vers les fichiers PDF/A et TXT ; None si `dry_run` est True.
     """
+    if keep_pdfa and ocr_cache is not None:
+        logging.info("Cache OCR désactivé: les PDF/A sont conservés")
+        ocr_cache = None
+    if keep_pdfa and backend != "ocrmypdf":
+        logging.info("OCR avec ocrmypdf: les PDF/A sont conservés")
+        backend = "ocrmypdf"
+    if keep_pdfa and reuse_scan_dups:
+        logging.info(
+            "Réutilisation de l'OCR des doublons désactivée: les PDF/A sont conservés"
+        )
+        reuse_scan_dups = False
+    if keep_pdfa and (progressive or adaptive):
+        logging.info("OCR de toutes les pages en une passe: les PDF/A sont conservés")
+        progressive = False
+        adaptive = False
+    if progressive and backend == "ocrmypdf":
+        logging.info(
+            "OCR progressive avec ocrmypdf: un appel à ocrmypdf (et un PDF/A)"
+            + f" par paquet de {PROGRESSIVE_CHUNK} pages"
+        )
+    ocr_stats = AdaptiveOcrStats() if adaptive else None
     retcode_ocr = []
+    pages_ocr_skipped = []
     fullpath_pdfa = []
     fullpath_txt = []
-    for i, df_row in enumerate(df_meta.itertuples()):
-        if i != 0 and i % 10 == 0:
-            print(f"{i}/{len(df_meta)} pdf traités")
+    # documents reportés au lot suivant: position dans le lot -> motif
+    deferred = {}
+    # documents à OCRiser: (position dans le lot, tâche)
+    tasks = []
+    # numérisations en double: (position dans le lot, tâche, txt de l'original)
+    reused = []
+    pdfs_todo = set(
+        df_meta.loc[
+            df_meta["processed_as"].isin(["image", "mixed"])
+            & ~df_meta["exclude"].fillna(False),
+            "pdf",
+        ]
+    )
+    for df_row in df_meta.itertuples():
         # fichier d'origine
         fp_pdf_in = Path(df_row.fullpath)
         # fichiers à produire
-        fp_pdf_out = out_pdf_dir / f"{fp_pdf_in.name}"
-        fp_txt = out_txt_dir / (f"{fp_pdf_in.stem}" + ".txt")
+        # (nommés d'après le nom logique, le fichier d'origine étant stocké
+        # sous le nom de son hachage)
+        fp_pdf_out = out_pdf_dir / df_row.pdf
+        fp_txt = out_txt_dir / (f"{Path(df_row.pdf).stem}" + ".txt")
         # sauter les fichiers identifiés comme PDF texte, et les fichiers exclus
         # et simplement reporter les chemins vers les fichiers txt et éventuellement PDF/A
         if df_row.processed_as == "text" or df_row.exclude:
             retcode_ocr.append(None)  # valeur de retour ocrmypdf
+            pages_ocr_skipped.append(None)
             fullpath_pdfa.append(df_row.fullpath_pdfa)
             fullpath_txt.append(df_row.fullpath_txt)
             continue
 
-        # sinon processed_as est "image" (et pas <NA>)
-        assert df_row.processed_as == "image"
+        # sinon processed_as est "image" ou "mixed" (et pas <NA>)
+        assert df_row.processed_as in ("image", "mixed")
         # et le fichier n'est pas exclus (et pas <NA>)
         assert not df_row.exclude
 
         # si le fichier txt à produire existe déjà
         if fp_txt.is_file():
+            # pages non OCRisées par une exécution en mode progressif
+            pages_skipped = find_skipped_pages(
+                fp_txt, parse_page_list(df_row.pages_image)
+            )
             if redo:
                 # ré-exécution explicitement demandée: émettre une info et traiter le fichier
                 # TODO comparer les versions d'ocrmypdf/tesseract/pikepdf dans les métadonnées du PDF de sortie et les versions actuelles des dépendances,
@@ -185,6 +913,12 @@ def process_files(
                 logging.info(
                     f"Re-traitement de {fp_pdf_in}, le fichier de sortie {fp_txt} existant sera écrasé."
                 )
+            elif pages_skipped and not progressive:
+                # OCRiser les pages reportées par le mode progressif
+                logging.info(
+                    f"Re-traitement de {fp_pdf_in}: pages non OCRisées"
+                    + f" {format_page_list(pages_skipped)} dans {fp_txt}"
+                )
             else:
                 # pas de ré-exécution demandée: émettre un warning et passer au fichier suivant
                 logging.info(
@@ -193,6 +927,9 @@ def process_files(
                 retcode_ocr.append(
                     None
                 )  # valeur de retour ocrmypdf, impossible à récupérer sans refaire tourner la conversion
+                pages_ocr_skipped.append(
+                    format_page_list(pages_skipped) if pages_skipped else None
+                )
                 if fp_pdf_out.is_file():
                     fullpath_pdfa.append(fp_pdf_out)
                 else:
@@ -200,23 +937,250 @@ def process_files(
                 fullpath_txt.append(fp_txt)
                 continue
 
-        # traiter le fichier: extraire le texte par OCR si nécessaire, corriger et convertir le PDF d'origine en PDF/A-2b
-        retcode = preprocess_pdf_file(
-            df_row, fp_pdf_in, fp_pdf_out, fp_txt, verbose=verbose
-        )
-        # stocker les chemins: fichier TXT (OCR), éventuellement PDF/A
-        retcode_ocr.append(retcode)  # valeur de retour ocrmypdf
+        # numérisation en double d'un document déjà OCRisé, ou OCRisé dans ce
+        # lot: son texte sera copié
+        if (
+            reuse_scan_dups
+            and pd.notna(df_row.dup_scan)
+            and df_row.dup_scan
+            and pd.notna(df_row.dup_scan_pdf)
+        ):
+            fp_txt_orig = out_txt_dir / f"{Path(df_row.dup_scan_pdf).stem}.txt"
+            if (
+                not fp_txt_orig.is_file()
+                and df_row.dup_scan_pdf not in pdfs_todo
+                and scandup_txt_dir is not None
+            ):
+                # original OCRisé lors d'une exécution précédente
+                fp_txt_orig = scandup_txt_dir / fp_txt_orig.name
+            if fp_txt_orig.is_file() or df_row.dup_scan_pdf in pdfs_todo:
+                reused.append(
+                    (
+                        len(retcode_ocr),
+                        (df_row, fp_pdf_in, fp_pdf_out, fp_txt),
+                        fp_txt_orig,
+                    )
+                )
+                retcode_ocr.append(None)
+                pages_ocr_skipped.append(None)
+                fullpath_pdfa.append(None)
+                fullpath_txt.append(fp_txt)
+                continue
+
+        # document à OCRiser: les valeurs seront remplies avec le résultat de l'OCR
+        tasks.append((len(retcode_ocr), (df_row, fp_pdf_in, fp_pdf_out, fp_txt)))
+        retcode_ocr.append(None)
+        pages_ocr_skipped.append(None)
+        fullpath_pdfa.append(None)
         fullpath_txt.append(fp_txt)
-        if not keep_pdfa:
-            os.remove(fp_pdf_out)
-            fullpath_pdfa.append(None)
+
+    if dry_run and cost_model is None:
+        cost_model = OcrCostModel(None, backend=backend)
+    if dry_run and not tasks:
+        print("Aucun document à OCRiser")
+        return None
+    if scandup_txt_dir is not None and reuse_scan_dups:
+        scandup_txt_dir.mkdir(parents=True, exist_ok=True)
+    if tasks or reused:
+        if backend == "tesseract":
+            # un moteur par slot ; les documents sont soumis par autant de
+            # threads, pour que les pages de plusieurs documents alimentent
+            # le pool
+            nb_engines = workers if workers > 0 else get_nb_ocr_slots()
+            nb_workers = nb_engines
+            jobs_per_doc = None
+            omp_threads = None
         else:
-            fullpath_pdfa.append(fp_pdf_out)
+            # dimensionner le pool: documents simultanés x pages par document,
+            # d'après le profil de la machine s'il existe
+            if ocr_profile is not None:
+                nb_workers = ocr_profile["workers"]
+                jobs_per_doc = ocr_profile["jobs"]
+                omp_threads = ocr_profile["omp_threads"]
+            else:
+                nb_workers, jobs_per_doc = plan_ocr_pool(
+                    [
+                        len(parse_page_list(task[0].pages_image))
+                        for task in [x[1] for x in tasks + reused]
+                    ]
+                )
+                omp_threads = None
+            if workers > 0:
+                nb_workers = workers
+            if jobs > 0:
+                jobs_per_doc = jobs
+        logging.info(
+            f"OCR ({backend}{', progressive' if progressive else ''}"
+            + f"{', adaptative' if adaptive else ''}"
+            + (f", réglages {ocr_settings}" if ocr_settings is not None else "")
+            + f"{', réglages par producteur' if settings_by_producer else ''}) de"
+            + f" {len(tasks)} documents, {len(reused)} numérisations en double:"
+            + f" {nb_workers} en parallèle,"
+            + f" {jobs_per_doc} jobs chacun"
+            + (f", {omp_threads} threads par tesseract" if omp_threads else "")
+            + (" (profil de la machine)" if ocr_profile is not None else "")
+        )
+        # priorité de chaque document (voir `priority`): urgents d'abord
+        priorities = [
+            task[0].priority if pd.notna(task[0].priority) else PRIORITY_UNKNOWN
+            for _, task in tasks
+        ]
+        if cost_model is None:
+            order = sorted(range(len(tasks)), key=lambda i: priorities[i])
+            tasks = [tasks[i] for i in order]
+        else:
+            # à priorité égale, soumettre les documents du plus long au plus court
+            costs = [cost_model.predict(task[0]) for _, task in tasks]
+            order = lpt_order(costs, priorities)
+            tasks = [tasks[i] for i in order]
+            makespan = log_estimate(
+                {tasks[j][1][0].pdf: costs[i] for j, i in enumerate(order)},
+                nb_workers,
+            )
+            remaining_s = budget.remaining_s() if budget is not None else None
+            if remaining_s is not None and makespan > remaining_s:
+                msg = (
+                    "Durée estimée supérieure au temps restant"
+                    + f" ({format_duration(max(remaining_s, 0))}):"
+                    + " des documents seront reportés au prochain lot"
+                )
+                logging.warning(msg)
+                print(msg)
+        if dry_run:
+            return None
+        tess_pool = TesseractPool(nb_workers) if backend == "tesseract" else None
+        # les workers attendent la fin de processus (ocrmypdf, tesseract):
+        # des threads suffisent
+        ocr_task = partial(
+            _ocr_task,
+            keep_pdfa=keep_pdfa,
+            verbose=verbose,
+            jobs=jobs_per_doc,
+            ocr_cache=ocr_cache,
+            tess_pool=tess_pool,
+            progressive=progressive,
+            adaptive=adaptive,
+            ocr_stats=ocr_stats,
+            omp_threads=omp_threads,
+            ocr_settings=ocr_settings,
+            settings_by_producer=settings_by_producer,
+            cost_model=cost_model,
+            budget=budget,
+        )
+
+        def _store_results(tasks_done, results):
+            """Reporte les résultats de l'OCR, dans l'ordre des tâches."""
+            for i, (
+                (i_row, task),
+                (retcode, fp_pdfa, pages_skipped, reason),
+            ) in enumerate(zip(tasks_done, results), start=1):
+                if reason is not None:
+                    # document non commencé, faute de budget
+                    deferred[i_row] = (task[0], reason)
+                    continue
+                # stocker les chemins: fichier TXT (OCR), éventuellement PDF/A
+                retcode_ocr[i_row] = retcode  # valeur de retour ocrmypdf
+                fullpath_pdfa[i_row] = fp_pdfa
+                if pages_skipped:
+                    pages_ocr_skipped[i_row] = format_page_list(pages_skipped)
+                # conserver le texte des originaux indexés, pour leurs
+                # numérisations en double des lots suivants
+                df_row, _, _, fp_txt = task
+                if (
+                    reuse_scan_dups
+                    and scandup_txt_dir is not None
+                    and pd.notna(df_row.dup_scan)
+                    and not df_row.dup_scan
+                    and retcode in (ExitCode.ok, ExitCode.pdfa_conversion_failed)
+                    and fp_txt.is_file()
+                ):
+                    shutil.copyfile(fp_txt, scandup_txt_dir / fp_txt.name)
+                if i % 10 == 0:
+                    print(f"{i}/{len(tasks_done)} pdf traités")
+
+        # les workers attendent la fin de processus (ocrmypdf, tesseract):
+        # des threads suffisent
+        with ThreadPoolExecutor(max_workers=nb_workers) as executor:
+            # map() renvoie les résultats dans l'ordre des entrées, au fur et
+            # à mesure qu'ils sont disponibles
+            _store_results(tasks, executor.map(ocr_task, [task for _, task in tasks]))
+            # numérisations en double, une fois leurs originaux OCRisés
+            pdfs_deferred = {df_row.pdf: reason for df_row, reason in deferred.values()}
+            to_confirm = []
+            # doublons à OCRiser: non confirmés, ou original sans texte
+            tasks_dup = []
+            for i_row, task, fp_txt_orig in reused:
+                df_row = task[0]
+                if df_row.dup_scan_pdf in pdfs_deferred:
+                    # l'original est reporté: le doublon aussi
+                    deferred[i_row] = (df_row, pdfs_deferred[df_row.dup_scan_pdf])
+                elif not fp_txt_orig.is_file():
+                    logging.warning(
+                        f"Texte de l'original introuvable: {fp_txt_orig},"
+                        + f" OCR de {df_row.pdf}"
+                    )
+                    tasks_dup.append((i_row, task))
+                else:
+                    to_confirm.append((i_row, task, fp_txt_orig))
+            confirmed = executor.map(
+                partial(
+                    _confirm_scan_dup,
+                    verbose=verbose,
+                    jobs=jobs_per_doc,
+                    ocr_cache=ocr_cache,
+                    tess_pool=tess_pool,
+                    omp_threads=omp_threads,
+                    ocr_settings="fast" if adaptive else ocr_settings,
+                ),
+                [task for _, task, _ in to_confirm],
+                [fp_txt_orig for _, _, fp_txt_orig in to_confirm],
+            )
+            nb_reused = 0
+            for (i_row, task, fp_txt_orig), is_dup in zip(to_confirm, confirmed):
+                df_row, _, _, fp_txt = task
+                if not is_dup:
+                    logging.warning(
+                        f"Numérisation en double de {df_row.dup_scan_pdf} non"
+                        + f" confirmée sur le texte, OCR de {df_row.pdf}"
+                    )
+                    tasks_dup.append((i_row, task))
+                    continue
+                # copier le texte de l'original
+                shutil.copyfile(fp_txt_orig, fp_txt)
+                logging.info(f"Texte OCRisé réutilisé: {fp_txt_orig} -> {fp_txt}")
+                retcode_ocr[i_row] = ExitCode.ok
+                nb_reused += 1
+            if reused:
+                logging.info(
+                    f"{len(reused)} numérisations en double, OCR réutilisée"
+                    + f" pour {nb_reused}"
+                )
+            _store_results(
+                tasks_dup, executor.map(ocr_task, [task for _, task in tasks_dup])
+            )
+        if tess_pool is not None:
+            tess_pool.close()
+        if ocr_cache is not None:
+            ocr_cache.log_stats()
+        if ocr_stats is not None:
+            ocr_stats.log_stats()
+        if cost_model is not None:
+            cost_model.save()
     df_mmod = df_meta.assign(
         retcode_ocr=retcode_ocr,
+        pages_ocr_skipped=pages_ocr_skipped,
         fullpath_pdfa=fullpath_pdfa,
         fullpath_txt=fullpath_txt,
     )
+    if deferred:
+        # retirer les documents reportés, qui seront traités au lot suivant
+        if deferred_queue is not None:
+            for i_row in sorted(deferred):
+                df_row, reason = deferred[i_row]
+                deferred_queue.add(df_row, "extract_text_ocr", reason)
+            deferred_queue.save()
+        df_mmod = df_mmod.drop(index=df_mmod.index[sorted(deferred)])
+    log_deferred("OCR", [reason for _, reason in deferred.values()])
     # forcer les types des nouvelles colonnes
     df_mmod = df_mmod.astype(dtype=DTYPE_META_NTXT_OCR)
     return df_mmod
@@ -270,18 +1234,115 @@ if __name__ == "__main__":
         default=0,
         help="Niveau de verbosité d'ocrmypdf (-1, 0, 1, 2)",
     )
+    parser.add_argument(
+        "--ocr_cache",
+        default=str(CACHE_DIR / "ocr-page-cache.sqlite"),
+        help="Base SQLite du cache des pages OCRisées, conservée entre les exécutions ('' pour désactiver)",
+    )
+    parser.add_argument(
+        "--ocr_cache_size",
+        type=int,
+        default=OCR_CACHE_MAX_BYTES // (1024 * 1024),
+        help="Taille maximale du cache des pages OCRisées, en Mio",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["ocrmypdf", "tesseract"],
+        default="ocrmypdf",
+        help="Moteur d'OCR: ocrmypdf (PDF/A + sidecar) ou tesseract (texte seul, sans PDF/A ; ignoré avec --keep_pdfa)",
+    )
+    parser.add_argument(
+        "--progressive",
+        action="store_true",
+        help="OCRiser chaque document jusqu'à la signature de l'arrêté, sans les annexes (ignoré avec --keep_pdfa ; avec --backend ocrmypdf, un appel à ocrmypdf par paquet de pages)",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="OCR en deux passes: réglages rapides, puis réglages de qualité sur les pages en échec (ignoré avec --keep_pdfa)",
+    )
+    parser.add_argument(
+        "--ocr_profile",
+        default=str(get_profile_path()),
+        help="Profil d'OCR de la machine, produit par src.preprocess.calibrate_ocr, chargé s'il existe ('' pour désactiver)",
+    )
+    parser.add_argument(
+        "--ocr_settings",
+        choices=list(OCR_SETTINGS),
+        default=None,
+        help="Réglages d'OCR du lot (ignoré avec --adaptive)",
+    )
+    parser.add_argument(
+        "--settings_by_producer",
+        action="store_true",
+        help="Choisir les réglages d'OCR de chaque document selon le logiciel producteur du PDF (creatortool, producer)",
+    )
+    parser.add_argument(
+        "--no_reuse_scan_dups",
+        action="store_true",
+        help="OCRiser les numérisations en double au lieu de copier le texte de l'original",
+    )
+    parser.add_argument(
+        "--scandup_txt_dir",
+        default=str(DIR_SCANDUP_TXT),
+        help="Dossier du texte OCRisé des originaux, conservé entre les exécutions pour leurs numérisations en double ('' pour désactiver)",
+    )
+    parser.add_argument(
+        "--ocr_timings",
+        default=str(CACHE_DIR / "ocr-timings.csv"),
+        help="Fichier CSV des durées d'OCR mesurées, pour estimer la durée des documents et les ordonner du plus long au plus court ('' pour ne pas conserver les durées)",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Écrire la durée estimée de l'OCR, sans rien traiter",
+    )
+    parser.add_argument(
+        "--deadline",
+        default=os.environ.get("RUN_DEADLINE", ""),
+        help="Échéance de l'exécution, au format ISO (ex: 2023-06-17T06:00:00): les documents qui ne peuvent être OCRisés avant sont reportés au prochain lot (par défaut: variable d'environnement RUN_DEADLINE)",
+    )
+    parser.add_argument(
+        "--max_rss",
+        type=int,
+        default=int(os.environ.get("RUN_MAX_RSS_MB", 0)),
+        help="Mémoire résidente maximale de l'OCR, en Mio (0: pas de limite ; par défaut: variable d'environnement RUN_MAX_RSS_MB)",
+    )
+    parser.add_argument(
+        "--cpu_share",
+        type=float,
+        default=float(os.environ.get("RUN_CPU_SHARE", 0)),
+        help="Charge maximale des processeurs de la machine, entre 0 et 1, au-delà de laquelle aucun document n'est commencé (0: pas de limite ; par défaut: variable d'environnement RUN_CPU_SHARE)",
+    )
+    parser.add_argument(
+        "--deferred",
+        default=str(FP_DEFERRED),
+        help="Fichier CSV de la file des documents reportés au prochain lot",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Nombre de documents OCRisés simultanément (0: selon les coeurs et la mémoire disponibles)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=0,
+        help="Nombre de pages OCRisées en parallèle par document, option --jobs d'ocrmypdf (0: automatique)",
+    )
     args = parser.parse_args()
 
     # entrée: CSV de métadonnées enrichi
     in_file = Path(args.in_file).resolve()
-    if not in_file.is_file():
+    if not in_file.exists():
         raise ValueError(f"Le fichier en entrée {in_file} n'existe pas.")
 
     # sortie: CSV de métadonnées enrichi + infos fichiers produits
     # on crée le dossier parent (récursivement) si besoin
     out_file = Path(args.out_file).resolve()
-    if out_file.is_file():
-        if not args.redo and not args.append:
+    if out_file.exists():
+        if not args.redo and not args.append and not args.dry_run:
             # erreur si le fichier CSV existe déjà mais ni redo, ni append
             raise ValueError(
                 f"Le fichier de sortie {out_file} existe déjà. Pour l'écraser, ajoutez --redo ; pour l'augmenter, ajoutez --append."
@@ -304,7 +1365,41 @@ if __name__ == "__main__":
 
     # ouvrir le fichier d'entrée
     logging.info(f"Ouverture du fichier CSV {in_file}")
-    df_metas = pd.read_csv(in_file, dtype=DTYPE_META_NTXT_PDFA)
+    df_metas = read_table(in_file, DTYPE_META_NTXT_PDFA)
+    # cache des pages OCRisées, hors de data/interim
+    if args.ocr_cache:
+        fp_ocr_cache = Path(args.ocr_cache).resolve()
+        fp_ocr_cache.parent.mkdir(parents=True, exist_ok=True)
+        # le texte d'une page dépend du moteur d'OCR
+        engine_key = (
+            get_engine_key()
+            if args.backend == "tesseract" and not args.keep_pdfa
+            else OCR_ENGINE_KEY
+        )
+        ocr_cache = OcrPageCache(
+            fp_ocr_cache, engine_key, max_bytes=args.ocr_cache_size * 1024 * 1024
+        )
+    else:
+        ocr_cache = None
+    # profil d'OCR de la machine (parallélisme)
+    ocr_profile = (
+        load_ocr_profile(Path(args.ocr_profile).resolve()) if args.ocr_profile else None
+    )
+    # modèle de coût de l'OCR, appris sur les durées des exécutions précédentes
+    cost_model = OcrCostModel(
+        Path(args.ocr_timings).resolve() if args.ocr_timings else None,
+        backend=(
+            "tesseract"
+            if args.backend == "tesseract" and not args.keep_pdfa
+            else "ocrmypdf"
+        ),
+    )
+    # budget de l'exécution, et file des documents reportés
+    budget = RunBudget(
+        deadline=parse_deadline(args.deadline),
+        max_rss=args.max_rss * 1024 * 1024 if args.max_rss else None,
+        cpu_share=args.cpu_share if args.cpu_share else None,
+    )
     # traiter les fichiers
     df_mmod = process_files(
         df_metas,
@@ -313,13 +1408,28 @@ if __name__ == "__main__":
         redo=args.redo,
         keep_pdfa=args.keep_pdfa,
         verbose=args.verbose,
+        workers=args.workers,
+        jobs=args.jobs,
+        ocr_cache=ocr_cache,
+        backend=args.backend,
+        progressive=args.progressive,
+        adaptive=args.adaptive,
+        ocr_profile=ocr_profile,
+        ocr_settings=args.ocr_settings,
+        settings_by_producer=args.settings_by_producer,
+        reuse_scan_dups=not args.no_reuse_scan_dups,
+        scandup_txt_dir=(
+            Path(args.scandup_txt_dir).resolve() if args.scandup_txt_dir else None
+        ),
+        cost_model=cost_model,
+        dry_run=args.dry_run,
+        budget=budget if budget.is_limited else None,
+        deferred_queue=DeferredQueue(Path(args.deferred).resolve()),
     )
-    # sauvegarder les infos extraites dans un fichier CSV
-    if args.append and out_file.is_file():
-        # si 'append', charger le fichier existant et lui ajouter les nouvelles entrées
-        df_mmod_old = pd.read_csv(out_file, dtype=DTYPE_META_NTXT_OCR)
-        df_proc = pd.concat([df_mmod_old, df_mmod])
-    else:
-        # sinon utiliser les seules nouvelles entrées
-        df_proc = df_mmod
-    df_proc.to_csv(out_file, index=False)
+    if ocr_cache is not None:
+        ocr_cache.close()
+    if args.dry_run:
+        # simulation: aucun fichier produit
+        sys.exit(0)
+    # sauvegarder les infos extraites (CSV ou Parquet, selon l'extension)
+    write_table(df_mmod, out_file, DTYPE_META_NTXT_OCR, append=args.append)
@@ -2,12 +2,17 @@
 """
 
 import logging
+import os
 from pathlib import Path
 import subprocess
+from typing import List, Optional
 
 #
 from ocrmypdf.exceptions import ExitCode
 
+from src.preprocess.ocr_settings import OCR_SETTINGS
+from src.utils.txt_format import format_page_list
+
 
 # version des bibliothèques d'extraction de contenu des PDF image
 OCRMYPDF_VERSION = (
@@ -15,6 +20,18 @@ OCRMYPDF_VERSION = (
     .stdout.decode()
     .strip()
 )
+# version de tesseract, appelé par ocrmypdf (première ligne: "tesseract 5.3.0")
+TESSERACT_VERSION = (
+    subprocess.run(["tesseract", "--version"], capture_output=True)
+    .stdout.decode()
+    .split("\n")[0]
+    .strip()
+)
+# langue de l'OCR
+OCR_LANG = "fra"
+# clé du moteur d'OCR, pour le cache des pages OCRisées: le texte d'une page
+# doit être recalculé si l'une de ces valeurs change
+OCR_ENGINE_KEY = f"ocrmypdf {OCRMYPDF_VERSION}|{TESSERACT_VERSION}|{OCR_LANG}"
 
 
 def extract_text_from_pdf_image(
@@ -25,6 +42,10 @@ def extract_text_from_pdf_image(
     page_end: int,
     redo_ocr: bool = False,
     verbose: int = 0,
+    pages: Optional[List[int]] = None,
+    jobs: Optional[int] = None,
+    ocr_pass: Optional[str] = None,
+    omp_threads: Optional[int] = None,
 ) -> int:
     """Extraire le texte d'un PDF image et convertir le fichier en PDF/A.
 
@@ -49,6 +70,21 @@ def extract_text_from_pdf_image(
     verbose: int, defaults to 0
         Niveau de verbosité d'ocrmypdf (-1, 0, 1, 2):
         <https://ocrmypdf.readthedocs.io/en/latest/api.html#ocrmypdf.Verbosity>
+    pages: List[int], optional
+        Liste explicite des pages à traiter ; si elle est fournie, `page_beg`
+        et `page_end` sont ignorés. Le fichier "sidecar" contient alors
+        "[OCR skipped on page(s) N]" pour les pages non traitées.
+    jobs: int, optional
+        Nombre de pages traitées en parallèle par ocrmypdf ("--jobs") ;
+        par défaut, ocrmypdf utilise tous les coeurs.
+    ocr_pass: str, optional
+        Réglages d'OCR (clé de `OCR_SETTINGS`: "fast", "balanced" ou "best") ; par
+        défaut, réglages d'ocrmypdf sans redressement ni nettoyage.
+        Le redressement ("--deskew") est incompatible avec "--redo-ocr",
+        qui est alors remplacé par "--force-ocr".
+    omp_threads: int, optional
+        Nombre de threads de chaque processus tesseract ("OMP_THREAD_LIMIT") ;
+        par défaut 1, sauf si la variable d'environnement est déjà définie.
 
     Returns
     -------
@@ -56,16 +92,35 @@ def extract_text_from_pdf_image(
         0 si deux fichiers PDF/A et TXT ont été produits, une autre valeur sinon
         <https://ocrmypdf.readthedocs.io/en/latest/advanced.html#return-code-policy> .
     """
+    settings = OCR_SETTINGS[ocr_pass] if ocr_pass is not None else {}
+    opt_settings = []
+    if settings.get("deskew"):
+        opt_settings.append("--deskew")
+        if redo_ocr:
+            opt_settings.append("--force-ocr")
+            redo_ocr = False
+    if settings.get("clean"):
+        opt_settings.append("--clean")
+    if "optimize" in settings:
+        opt_settings.extend(["--optimize", str(settings["optimize"])])
+    if "oem" in settings:
+        opt_settings.extend(["--tesseract-oem", str(settings["oem"])])
+    if "psm" in settings:
+        opt_settings.extend(["--tesseract-pagesegmode", str(settings["psm"])])
     # appeler ocrmypdf pour produire 2 fichiers: PDF/A-2b (inc. OCR) + sidecar (txt)
     cmd = (
         ["ocrmypdf"]
         + [
             # langue française
             "-l",
-            "fra",
+            OCR_LANG,
             # sélection de pages
             "--page",
-            f"{page_beg}-{page_end}",
+            (
+                format_page_list(pages)
+                if pages is not None
+                else f"{page_beg}-{page_end}"
+            ),
             # TXT en sortie
             "--sidecar",
             fp_txt_out,
@@ -73,7 +128,9 @@ def extract_text_from_pdf_image(
             "--verbose",
             str(verbose),
         ]
+        + (["--jobs", str(jobs)] if jobs is not None else [])
         + (["--redo-ocr"] if redo_ocr else [])
+        + opt_settings
         + [
             # PDF en entrée
             fp_pdf_in,
@@ -81,12 +138,24 @@ def extract_text_from_pdf_image(
             fp_pdf_out,
         ]
     )
+    # un seul thread par processus tesseract, le parallélisme étant géré
+    # par ocrmypdf ("--jobs") et par le pool de documents, sauf réglage
+    # explicite (profil de la machine, voir `calibrate_ocr`)
+    env = os.environ.copy()
+    if omp_threads is not None:
+        env["OMP_THREAD_LIMIT"] = str(omp_threads)
+    else:
+        env.setdefault("OMP_THREAD_LIMIT", "1")
+    if settings.get("tessdata_dir"):
+        # modèles de tesseract de la passe (ex: modèles "fast")
+        env["TESSDATA_PREFIX"] = settings["tessdata_dir"]
     try:
         compl_proc = subprocess.run(
             cmd,
             capture_output=True,
             check=False,
             text=True,
+            env=env,
         )
     finally:
         logging.info(compl_proc.stdout)
@@ -0,0 +1,359 @@
+"""OCR "texte seul": pages rastérisées avec pdf2image et OCRisées par tesseract.
+
+Quand le PDF/A produit par ocrmypdf n'est pas conservé, seul le texte est
+utile: ce module évite le lancement d'ocrmypdf pour chaque document, et
+les étapes d'optimisation et de validation du PDF/A.
+
+Les pages d'un document sont rastérisées par poppler (pdftoppm, via
+pdf2image), en un seul appel par plage de pages contiguës, puis OCRisées par
+des moteurs tesseract persistants: chaque processus du pool initialise son
+moteur une seule fois (tesserocr, optionnel). Sans tesserocr, pytesseract
+lance un processus tesseract par page.
+
+Les réglages d'une passe d'OCR (`ocr_settings.OCR_SETTINGS`) fixent la
+résolution de rastérisation, le dossier des modèles, le moteur ("oem") et
+la segmentation des pages ("psm") de tesseract ; le redressement et le
+nettoyage des pages, propres à ocrmypdf, sont ignorés.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+from pathlib import Path
+import tempfile
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+# un seul thread par moteur, le parallélisme est assuré par le pool ;
+# à fixer avant le chargement de tesseract (lu par OpenMP au chargement)
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+from pdf2image import convert_from_path
+from PIL import Image
+import pytesseract
+
+try:
+    # optionnel: moteur tesseract persistant, dans le processus
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+from src.preprocess.ocr_settings import OCR_SETTINGS
+
+# langue de l'OCR
+OCR_LANG = "fra"
+# résolution de rastérisation des pages
+OCR_DPI = 300
+
+# moteurs tesseract du processus worker, par dossier de modèles et moteur
+# (initialisés par `_init_worker` et `_get_engine`)
+_ENGINES = {}
+_LANG = OCR_LANG
+
+
+def get_engine_key(lang: str = OCR_LANG, dpi: int = OCR_DPI) -> str:
+    """Renvoie la clé du moteur d'OCR, pour le cache des pages OCRisées.
+
+    Parameters
+    ----------
+    lang: str, defaults to OCR_LANG
+        Langue de l'OCR.
+    dpi: int, defaults to OCR_DPI
+        Résolution de rastérisation des pages.
+
+    Returns
+    -------
+    engine_key: str
+        Version de tesseract, langue et résolution.
+    """
+    if tesserocr is not None:
+        version = tesserocr.tesseract_version().split("\n")[0]
+    else:
+        version = f"tesseract {pytesseract.get_tesseract_version()}"
+    return f"{version}|{lang}|{dpi}dpi"
+
+
+def _init_worker(lang: str):
+    """Initialise le moteur tesseract d'un processus worker.
+
+    Parameters
+    ----------
+    lang: str
+        Langue de l'OCR.
+    """
+    global _LANG
+    _LANG = lang
+    _get_engine(None, None)
+
+
+def _get_engine(tessdata_dir: Optional[str], oem: Optional[int]):
+    """Renvoie le moteur tesseract du processus pour un dossier de modèles.
+
+    Parameters
+    ----------
+    tessdata_dir: str, optional
+        Dossier des modèles, None pour les modèles installés par défaut.
+    oem: int, optional
+        Moteur de tesseract ("--oem"), None pour le moteur par défaut.
+
+    Returns
+    -------
+    engine: tesserocr.PyTessBaseAPI, optional
+        Moteur persistant, None si tesserocr n'est pas installé.
+    """
+    if tesserocr is None:
+        return None
+    if (tessdata_dir, oem) not in _ENGINES:
+        kwargs = {"lang": _LANG}
+        if tessdata_dir is not None:
+            kwargs["path"] = tessdata_dir
+        if oem is not None:
+            kwargs["oem"] = tesserocr.OEM(oem)
+        _ENGINES[(tessdata_dir, oem)] = tesserocr.PyTessBaseAPI(**kwargs)
+    return _ENGINES[(tessdata_dir, oem)]
+
+
+def _get_pass_settings(
+    ocr_pass: Optional[str], dpi: int
+) -> Tuple[int, Optional[str], Optional[int], Optional[int]]:
+    """Renvoie les réglages de tesseract pour une passe d'OCR.
+
+    Parameters
+    ----------
+    ocr_pass: str, optional
+        Réglages d'OCR (clé de `OCR_SETTINGS`), None pour les réglages
+        par défaut.
+    dpi: int
+        Résolution par défaut.
+
+    Returns
+    -------
+    dpi: int
+        Résolution de rastérisation.
+    tessdata_dir: str, optional
+        Dossier des modèles.
+    oem: int, optional
+        Moteur de tesseract.
+    psm: int, optional
+        Segmentation des pages.
+    """
+    if ocr_pass is None:
+        return dpi, None, None, None
+    settings = OCR_SETTINGS[ocr_pass]
+    return (
+        settings["dpi"],
+        settings["tessdata_dir"],
+        settings.get("oem"),
+        settings.get("psm"),
+    )
+
+
+def _get_page_runs(pages: Iterable[int]) -> List[Tuple[int, int]]:
+    """Regroupe des numéros de pages en plages de pages contiguës.
+
+    Parameters
+    ----------
+    pages: Iterable[int]
+        Numéros des pages.
+
+    Returns
+    -------
+    page_runs: List[Tuple[int, int]]
+        Première et dernière page de chaque plage.
+    """
+    page_runs = []
+    for i in sorted(set(pages)):
+        if page_runs and i == page_runs[-1][1] + 1:
+            page_runs[-1] = (page_runs[-1][0], i)
+        else:
+            page_runs.append((i, i))
+    return page_runs
+
+
+def _render_pages(
+    fp_pdf: Path, pages: Iterable[int], dpi: int, out_dir: Optional[Path] = None
+) -> Dict[int, Union[Image.Image, str]]:
+    """Rastérise des pages d'un document, un appel à pdftoppm par plage de
+    pages contiguës.
+
+    Parameters
+    ----------
+    fp_pdf: Path
+        Chemin du fichier PDF.
+    pages: Iterable[int]
+        Numéros des pages (la première page est numérotée 1).
+    dpi: int
+        Résolution de rastérisation.
+    out_dir: Path, optional
+        Dossier où écrire les images ; si None, les images sont renvoyées
+        en mémoire.
+
+    Returns
+    -------
+    images: Dict[int, Union[Image.Image, str]]
+        Image de chaque page, ou chemin du fichier image si `out_dir` est
+        fourni.
+    """
+    images = {}
+    for first_page, last_page in _get_page_runs(pages):
+        res = convert_from_path(
+            fp_pdf,
+            dpi=dpi,
+            first_page=first_page,
+            last_page=last_page,
+            grayscale=True,
+            output_folder=out_dir,
+            paths_only=out_dir is not None,
+        )
+        images.update(zip(range(first_page, last_page + 1), res))
+    return images
+
+
+def _ocr_page(
+    image: Union[Image.Image, str],
+    tessdata_dir: Optional[str] = None,
+    oem: Optional[int] = None,
+    psm: Optional[int] = None,
+) -> str:
+    """OCRise une page rastérisée (exécuté dans un processus worker).
+
+    Parameters
+    ----------
+    image: Union[Image.Image, str]
+        Image de la page, ou chemin du fichier image.
+    tessdata_dir: str, optional
+        Dossier des modèles de tesseract.
+    oem: int, optional
+        Moteur de tesseract ("--oem").
+    psm: int, optional
+        Segmentation des pages ("--psm").
+
+    Returns
+    -------
+    page_txt: str
+        Texte OCRisé de la page, sans séparateur de page ("\\f").
+    """
+    if isinstance(image, str):
+        image = Image.open(image)
+    engine = _get_engine(tessdata_dir, oem)
+    if engine is not None:
+        engine.SetPageSegMode(
+            tesserocr.PSM(psm) if psm is not None else tesserocr.PSM.AUTO
+        )
+        engine.SetImage(image)
+        page_txt = engine.GetUTF8Text()
+    else:
+        config = []
+        if tessdata_dir is not None:
+            config.append(f'--tessdata-dir "{tessdata_dir}"')
+        if oem is not None:
+            config.append(f"--oem {oem}")
+        if psm is not None:
+            config.append(f"--psm {psm}")
+        config = " ".join(config)
+        page_txt = pytesseract.image_to_string(image, lang=_LANG, config=config)
+    # tesseract termine chaque page par "\f", qui sépare les pages des fichiers txt
+    return page_txt.replace("\f", "")
+
+
+class TesseractPool:
+    """Pool de processus, chacun muni d'un moteur tesseract persistant.
+
+    Les pages de plusieurs documents peuvent être soumises simultanément
+    (depuis plusieurs threads), le pool les traite au fil de l'eau.
+    """
+
+    def __init__(self, nb_workers: int, lang: str = OCR_LANG, dpi: int = OCR_DPI):
+        """Démarre le pool.
+
+        Parameters
+        ----------
+        nb_workers: int
+            Nombre de processus (moteurs tesseract).
+        lang: str, defaults to OCR_LANG
+            Langue de l'OCR.
+        dpi: int, defaults to OCR_DPI
+            Résolution de rastérisation des pages.
+        """
+        self.dpi = dpi
+        self.executor = ProcessPoolExecutor(
+            max_workers=nb_workers, initializer=_init_worker, initargs=(lang,)
+        )
+        logging.info(
+            f"Pool tesseract: {nb_workers} moteurs"
+            + f" ({'tesserocr' if tesserocr is not None else 'pytesseract'})"
+        )
+
+    def close(self):
+        """Arrête le pool."""
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def ocr_pages(
+        self, fp_pdf: Path, pages: Iterable[int], ocr_pass: Optional[str] = None
+    ) -> Dict[int, str]:
+        """OCRise des pages d'un document.
+
+        Parameters
+        ----------
+        fp_pdf: Path
+            Chemin du fichier PDF.
+        pages: Iterable[int]
+            Numéros des pages à OCRiser (la première page est numérotée 1).
+        ocr_pass: str, optional
+            Réglages d'OCR (clé de `OCR_SETTINGS`: "fast", "balanced" ou
+            "best").
+
+        Returns
+        -------
+        pages_ocr: Dict[int, str]
+            Texte OCRisé de chaque page.
+        """
+        dpi, *settings = _get_pass_settings(ocr_pass, self.dpi)
+        # pages rastérisées une fois pour tout le document, dans des fichiers
+        # temporaires lus par les processus du pool
+        with tempfile.TemporaryDirectory(prefix="ocr_pages_") as tmp_dir:
+            images = _render_pages(fp_pdf, pages, dpi, out_dir=Path(tmp_dir))
+            futures = {
+                i: self.executor.submit(_ocr_page, fp_img, *settings)
+                for i, fp_img in images.items()
+            }
+            return {i: future.result() for i, future in futures.items()}
+
+
+def extract_text_from_pdf_image_textonly(
+    fp_pdf_in: Path,
+    pages: Iterable[int],
+    pool: Optional[TesseractPool] = None,
+    ocr_pass: Optional[str] = None,
+) -> Dict[int, str]:
+    """Extrait le texte de pages d'un PDF image, sans produire de PDF/A.
+
+    Parameters
+    ----------
+    fp_pdf_in: Path
+        Fichier PDF image à traiter.
+    pages: Iterable[int]
+        Numéros des pages à OCRiser (la première page est numérotée 1).
+    pool: TesseractPool, optional
+        Pool de moteurs tesseract ; si None, les pages sont OCRisées dans
+        le processus courant.
+    ocr_pass: str, optional
+        Réglages d'OCR (clé de `OCR_SETTINGS`: "fast", "balanced" ou "best").
+
+    Returns
+    -------
+    pages_ocr: Dict[int, str]
+        Texte OCRisé de chaque page.
+    """
+    if pool is not None:
+        return pool.ocr_pages(fp_pdf_in, pages, ocr_pass=ocr_pass)
+    if not _ENGINES:
+        _init_worker(OCR_LANG)
+    dpi, *settings = _get_pass_settings(ocr_pass, OCR_DPI)
+    images = _render_pages(fp_pdf_in, pages, dpi)
+    return {i: _ocr_page(image, *settings) for i, image in images.items()}
@@ -1,29 +1,166 @@
 """Annexes des arrêtés: plan de périmètre de sécurité, rapports d'expertise etc.
 
-TODO filtrer automatiquement à partir du texte
+Le tri est fait avant l'OCR, pour que les annexes ne soient pas OCRisées:
+* documents listés dans `data_sources.EXCLUDE_FILES`, et quasi-doublons de
+documents déjà reçus ;
+* règles sur le texte natif des pages (`doc_template.P_ANNEXES`): si la
+première page est une annexe, un plan ou un diagnostic, tout le document est
+exclu, sinon seules les pages concernées sont exclues ;
+* règle sur une vignette (basse résolution) des pages image, qui n'ont pas de
+texte natif: une page majoritairement en couleur est un plan ou une photo.
+
+Les pages exclues sont retirées des pages à OCRiser ("pages_image").
 """
 
 import argparse
+from collections import Counter
 from datetime import datetime
 import logging
 from pathlib import Path
+from typing import Dict, Iterable, Mapping, Optional, Tuple
 
+import numpy as np
 import pandas as pd
+from pdf2image import convert_from_path
 
-# TODO détection automatique à partir du texte
+from src.domain_knowledge.doc_template import P_ANNEXES
 from src.preprocess.data_sources import EXCLUDE_FILES
 from src.preprocess.separate_pages import DTYPE_META_NTXT_PDFTYPE, DTYPE_NTXT_PAGES
+from src.utils.storage import read_table, write_table
+from src.utils.txt_format import format_page_list, parse_page_list
 
-DTYPE_META_NTXT_FILT = DTYPE_META_NTXT_PDFTYPE | {"exclude": "boolean"}
+DTYPE_META_NTXT_FILT = DTYPE_META_NTXT_PDFTYPE | {
+    "exclude": "boolean",
+    "exclude_rule": "string",  # règle d'exclusion du document
+    "pages_excluded": "string",  # pages exclues (annexes), au format "1,3-4"
+}
 
-DTYPE_NTXT_PAGES_FILT = DTYPE_NTXT_PAGES | {"exclude": "boolean"}
+DTYPE_NTXT_PAGES_FILT = DTYPE_NTXT_PAGES | {
+    "exclude": "boolean",
+    "exclude_rule": "string",  # règle d'exclusion de la page ou du document
+}
 
 SET_EXCLUDE = set(EXCLUDE_FILES)
 
+# règles d'exclusion, hors motifs de `doc_template.P_ANNEXES`
+RULE_LIST = "liste"  # fichier listé dans EXCLUDE_FILES
+RULE_NEARDUP = "quasi_doublon"  # quasi-doublon d'un document déjà reçu
+RULE_COLOR = "plan_couleur"  # page image majoritairement en couleur
+
+# résolution des vignettes des pages image
+THUMB_DPI = 12
+# saturation (0-255) au-delà de laquelle un pixel est en couleur
+COLOR_SAT_MIN = 64
+# proportion de pixels en couleur au-delà de laquelle une page image est un
+# plan ou une photo (une page numérisée en couleur n'a qu'un logo ou un tampon)
+COLOR_PIXELS_MIN = 0.25
+
+
+def match_annex_rule(page_txt: str) -> Optional[str]:
+    """Cherche la règle d'annexe vérifiée par le texte d'une page.
+
+    Parameters
+    ----------
+    page_txt: str
+        Texte natif de la page.
+
+    Returns
+    -------
+    rule: str, optional
+        Nom de la première règle vérifiée, None si aucune.
+    """
+    for rule, pattern in P_ANNEXES:
+        if pattern.search(page_txt):
+            return rule
+    return None
+
+
+def get_color_ratio(fp_pdf: Path, pages: Iterable[int]) -> Dict[int, float]:
+    """Calcule la proportion de pixels en couleur de pages, sur des vignettes.
+
+    Parameters
+    ----------
+    fp_pdf: Path
+        Chemin du fichier PDF.
+    pages: Iterable[int]
+        Numéros des pages (la première page est numérotée 1).
+
+    Returns
+    -------
+    color_ratios: Dict[int, float]
+        Proportion de pixels en couleur de chaque page.
+    """
+    pages = sorted(set(pages))
+    if not pages:
+        return {}
+    # un seul appel à pdftoppm pour toutes les vignettes du document (les
+    # pages intermédiaires, peu coûteuses à cette résolution, sont ignorées)
+    thumbs = convert_from_path(
+        fp_pdf, dpi=THUMB_DPI, first_page=pages[0], last_page=pages[-1]
+    )
+    color_ratios = {}
+    for i in pages:
+        sat = np.asarray(thumbs[i - pages[0]].convert("HSV"))[:, :, 1]
+        color_ratios[i] = float(np.mean(sat >= COLOR_SAT_MIN))
+    return color_ratios
+
+
+def triage_doc_pages(
+    fp_pdf: Path,
+    pages_txt: Mapping[int, Optional[str]],
+    pages_image: Iterable[int],
+    image_rules: bool = True,
+) -> Tuple[Optional[str], Dict[int, str]]:
+    """Repère les pages d'annexe d'un document, ou un document hors périmètre.
+
+    Parameters
+    ----------
+    fp_pdf: Path
+        Chemin du fichier PDF.
+    pages_txt: Mapping[int, Optional[str]]
+        Texte natif de chaque page (None ou NA si la page n'en a pas).
+    pages_image: Iterable[int]
+        Pages image, sans texte natif exploitable.
+    image_rules: bool, defaults to True
+        Si True, les pages image sont examinées sur une vignette.
+
+    Returns
+    -------
+    doc_rule: str, optional
+        Règle excluant tout le document, None si le document est conservé.
+    page_rules: Dict[int, str]
+        Règle excluant chaque page exclue (vide si le document est exclu).
+    """
+    page_rules = {}
+    for i, page_txt in sorted(pages_txt.items()):
+        if pd.isna(page_txt):
+            continue
+        rule = match_annex_rule(page_txt)
+        if rule is None:
+            continue
+        if i == 1:
+            # le document commence par une annexe: il est hors périmètre
+            return rule, {}
+        page_rules[i] = rule
+    if image_rules:
+        # la première page n'est jamais exclue sur la seule foi de sa vignette
+        pages_thumb = [i for i in pages_image if i > 1 and i not in page_rules]
+        if pages_thumb:
+            try:
+                color_ratios = get_color_ratio(fp_pdf, pages_thumb)
+            except Exception as e:
+                logging.warning(f"Vignettes impossibles à produire: {fp_pdf}: {e}")
+                color_ratios = {}
+            for i, color_ratio in color_ratios.items():
+                if color_ratio >= COLOR_PIXELS_MIN:
+                    page_rules[i] = RULE_COLOR
+    return None, page_rules
+
 
 def process_files(
     df_meta: pd.DataFrame,
     df_txts: pd.DataFrame,
+    image_rules: bool = True,
 ) -> pd.DataFrame:
     """Traiter un ensemble d'arrêtés: repérer des éléments de structure des textes.
 
@@ -33,6 +170,8 @@ def process_files(
         Liste de métadonnées des fichiers à traiter.
     df_txts: pd.DataFrame
         Liste de pages de documents à traiter.
+    image_rules: bool, defaults to True
+        Si True, les pages image sont examinées sur une vignette.
 
     Returns
     -------
@@ -42,11 +181,76 @@ def process_files(
         Liste de métadonnées des pages traitées, avec indications des éléments de
         structure détectés.
     """
-    df_mmod = df_meta.assign(exclude=(lambda x: x.pdf.isin(SET_EXCLUDE)))
+    # texte natif des pages de chaque document
+    doc_pages = {
+        fullpath: dict(zip(df_grp["pagenum"], df_grp["pagetxt"]))
+        for fullpath, df_grp in df_txts.groupby("fullpath")
+    }
+    # nombre de documents et de pages exclus par chaque règle
+    nb_docs_rule = Counter()
+    nb_pages_rule = Counter()
+    doc_rules = {}  # fullpath => règle
+    page_rules = {}  # (fullpath, pagenum) => règle
+    exclude_rule = []
+    pages_excluded = []
+    pages_image = []
+    for df_row in df_meta.itertuples():
+        doc_pages_image = (
+            parse_page_list(df_row.pages_image) if pd.notna(df_row.pages_image) else []
+        )
+        # exclure les fichiers listés, et les quasi-doublons de documents déjà
+        # reçus (détectés sur le texte natif), avant l'OCR et l'analyse
+        if df_row.pdf in SET_EXCLUDE:
+            doc_rule, doc_page_rules = RULE_LIST, {}
+        elif pd.notna(df_row.dup_neartext) and df_row.dup_neartext:
+            doc_rule, doc_page_rules = RULE_NEARDUP, {}
+        else:
+            doc_rule, doc_page_rules = triage_doc_pages(
+                Path(df_row.fullpath),
+                doc_pages.get(df_row.fullpath, {}),
+                doc_pages_image,
+                image_rules=image_rules,
+            )
+        if doc_rule is not None:
+            nb_docs_rule[doc_rule] += 1
+            doc_rules[df_row.fullpath] = doc_rule
+        for i, rule in doc_page_rules.items():
+            nb_pages_rule[rule] += 1
+            page_rules[(df_row.fullpath, i)] = rule
+        exclude_rule.append(doc_rule)
+        pages_excluded.append(format_page_list(doc_page_rules) or None)
+        # ne pas OCRiser les pages exclues
+        pages_image.append(
+            format_page_list(x for x in doc_pages_image if x not in doc_page_rules)
+        )
+    # statistiques: documents et pages exclus par chaque règle
+    for rule in sorted(set(nb_docs_rule) | set(nb_pages_rule)):
+        msg = f"Règle {rule}: {nb_docs_rule[rule]} documents, {nb_pages_rule[rule]} pages exclus"
+        logging.info(msg)
+        print(msg)
+
+    df_mmod = df_meta.assign(
+        exclude=[x is not None for x in exclude_rule],
+        exclude_rule=exclude_rule,
+        pages_excluded=pages_excluded,
+        pages_image=pages_image,
+    )
     df_mmod = df_mmod.astype(dtype=DTYPE_META_NTXT_FILT)
 
-    df_tmod = df_txts.assign(exclude=(lambda x: x.pdf.isin(SET_EXCLUDE)))
-    df_tmod = df_tmod.astype(dtype=DTYPE_NTXT_PAGES_FILT)
+    # une page est exclue si son document ou elle-même est exclu(e)
+    txts_rule = [
+        doc_rules.get(fullpath, page_rules.get((fullpath, pagenum)))
+        for fullpath, pagenum in zip(df_txts["fullpath"], df_txts["pagenum"])
+    ]
+    df_tmod = df_txts.assign(
+        exclude=[x is not None for x in txts_rule],
+        exclude_rule=txts_rule,
+    )
+    # forcer les types des nouvelles colonnes, sans reconvertir les chaînes
+    # des pages si elles sont au format Arrow
+    df_tmod = df_tmod.astype(
+        dtype={k: DTYPE_NTXT_PAGES_FILT[k] for k in ("exclude", "exclude_rule")}
+    )
 
     return df_mmod, df_tmod
 
@@ -92,22 +296,27 @@ if __name__ == "__main__":
         action="store_true",
         help="Ajoute les pages annotées au fichier out_file s'il existe",
     )
+    parser.add_argument(
+        "--no_image_rules",
+        action="store_true",
+        help="Ne pas examiner les vignettes des pages image (règles sur le texte natif seulement)",
+    )
     args = parser.parse_args()
 
     # entrée: CSV de métadonnées
     in_file_meta = Path(args.in_file_meta).resolve()
-    if not in_file_meta.is_file():
+    if not in_file_meta.exists():
         raise ValueError(f"Le fichier en entrée {in_file_meta} n'existe pas.")
 
     # entrée: CSV de pages de texte
     in_file_pages = Path(args.in_file_pages).resolve()
-    if not in_file_pages.is_file():
+    if not in_file_pages.exists():
         raise ValueError(f"Le fichier en entrée {in_file_pages} n'existe pas.")
 
     # sortie: CSV de métadonnées
     # on crée le dossier parent (récursivement) si besoin
     out_file_meta = Path(args.out_file_meta).resolve()
-    if out_file_meta.is_file():
+    if out_file_meta.exists():
         if not args.redo and not args.append:
             # erreur si le fichier CSV existe déjà mais ni redo, ni append
             raise ValueError(
@@ -124,7 +333,7 @@ if __name__ == "__main__":
     # sortie: CSV de pages de texte annotées
     # on crée le dossier parent (récursivement) si besoin
     out_file_pages = Path(args.out_file_pages).resolve()
-    if out_file_pages.is_file():
+    if out_file_pages.exists():
         if not args.redo and not args.append:
             # erreur si le fichier CSV existe déjà mais ni redo, ni append
             raise ValueError(
@@ -140,32 +349,16 @@ if __name__ == "__main__":
 
     # ouvrir le fichier de métadonnées en entrée
     logging.info(f"Ouverture du fichier CSV de métadonnées {in_file_meta}")
-    df_meta = pd.read_csv(in_file_meta, dtype=DTYPE_META_NTXT_PDFTYPE)
+    df_meta = read_table(in_file_meta, DTYPE_META_NTXT_PDFTYPE)
     # ouvrir le fichier d'entrée
     logging.info(f"Ouverture du fichier CSV de pages de texte {in_file_pages}")
-    df_txts = pd.read_csv(in_file_pages, dtype=DTYPE_NTXT_PAGES)
+    # texte des pages: chaînes au format Arrow, plus compactes en mémoire
+    df_txts = read_table(in_file_pages, DTYPE_NTXT_PAGES, arrow_strings=True)
     # traiter les documents (découpés en pages de texte)
-    df_mmod, df_tmod = process_files(df_meta, df_txts)
-
-    # optionnel: afficher des statistiques
-    # TODO nombre de fichiers ignorés
+    df_mmod, df_tmod = process_files(
+        df_meta, df_txts, image_rules=not args.no_image_rules
+    )
 
-    # sauvegarder les infos extraites dans un fichier CSV
-    if args.append and out_file_meta.is_file():
-        # si 'append', charger le fichier existant et lui ajouter les nouvelles entrées
-        df_mmod_old = pd.read_csv(out_file_meta, dtype=DTYPE_META_NTXT_FILT)
-        df_mproc = pd.concat([df_mmod_old, df_mmod])
-    else:
-        # sinon utiliser les seules nouvelles entrées
-        df_mproc = df_mmod
-    df_mproc.to_csv(out_file_meta, index=False)
-
-    # sauvegarder les infos extraites dans un fichier CSV
-    if args.append and out_file_pages.is_file():
-        # si 'append', charger le fichier existant et lui ajouter les nouvelles entrées
-        df_tmod_old = pd.read_csv(out_file_pages, dtype=DTYPE_NTXT_PAGES_FILT)
-        df_tproc = pd.concat([df_tmod_old, df_tmod])
-    else:
-        # sinon utiliser les seules nouvelles entrées
-        df_tproc = df_tmod
-    df_tproc.to_csv(out_file_pages, index=False)
+    # sauvegarder les infos extraites (CSV ou Parquet, selon l'extension)
+    write_table(df_mmod, out_file_meta, DTYPE_META_NTXT_FILT, append=args.append)
+    write_table(df_tmod, out_file_pages, DTYPE_NTXT_PAGES_FILT, append=args.append)
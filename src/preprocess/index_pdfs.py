@@ -1,6 +1,11 @@
-"""Calcule le hachage de chaque fichier et crée une copie
-du fichier dans un dossier de travail, en faisant précéder
+"""Calcule le hachage de chaque fichier et le range dans un stock de
+travail adressé par contenu (voir `src.preprocess.pdf_store`).
+
+Chaque PDF est désigné par un nom logique, formé en faisant précéder
 le nom du fichier par son hachage.
+
+L'index général des fichiers est stocké dans une base SQLite
+(voir `src.preprocess.index_store`).
 """
 
 # TODO ajuster le logging
@@ -8,22 +13,32 @@ le nom du fichier par son hachage.
 # TODO transformer la blacklist sur les fichiers, importée de data_sources, en vrai script, exécuté en amont, pour exclure les documents non pertinents comme les diagnostics
 
 import argparse
-from collections import defaultdict
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 import logging
+import os
 from pathlib import Path
-import shutil
+from typing import Callable, Iterable, List, Optional, Tuple
 
 import pandas as pd
 
 from src.preprocess.data_sources import EXCLUDE_FILES
+from src.preprocess.index_store import FirstSeenStore, IndexStore
 from src.preprocess.pdf_info import get_pdf_info
-from src.utils.file_utils import get_file_digest
+from src.preprocess.pdf_store import PdfStore
+from src.utils.file_utils import (
+    CACHE_DIR,
+    DigestCache,
+    get_file_digest,
+    get_stat_key,
+)
 
 # colonnes des fichiers CSV d'index
 DTYPE_META_BASE = {
-    "pdf": "string",  # nom de fichier de la copie dans le dossier de travail (incluant le hash)
-    "fullpath": "string",  # chemin de la copie dans le dossier de travail (avec le hash)
+    "pdf": "string",  # nom logique du fichier: hash + nom du fichier d'origine
+    "fullpath": "string",  # chemin du fichier dans le stock de travail (voir PdfStore)
     "origpath": "string",  # chemin du fichier original dans le dossier d'entrée (sans le hash)
     "filesize": "Int64",  # FIXME Int16 ? (dtype à fixer en amont, avant le dump)
     "nb_pages": "Int64",  # FIXME Int16 ? (dtype à fixer en amont, avant le dump)
@@ -31,36 +46,199 @@ DTYPE_META_BASE = {
     "producer": "string",
     "createdate": "string",
     "modifydate": "string",
+    "ingested_at": "string",  # date et heure de la première réception (ISO), origine du délai de publication
 }
 
+# stock de travail et index général des PDF, conservés d'une exécution à
+# l'autre (hors data/interim, effacé à chaque exécution de process.sh)
+DIR_PDF_STORE = CACHE_DIR / "pdf-index"
+FP_INDEX_DB = CACHE_DIR / "pdf-index.sqlite"
+# date de première réception de chaque PDF, conservée même si l'index est
+# réinitialisé
+FP_FIRST_SEEN_DB = CACHE_DIR / "pdf-first-seen.sqlite"
+
 # motif glob pour les fichiers PDF
 PAT_PDF = "*.[Pp][Dd][Ff]"
 
+# nombre maximal de threads pour le stockage des fichiers (entrées/sorties):
+# au-delà, les accès disque concurrents ralentissent plus qu'ils n'accélèrent
+MAX_IO_JOBS = 8
+
+
+def _safe_call(fn: Callable, item, **kwargs) -> Tuple[object, Optional[str]]:
+    """Appelle `fn(item, **kwargs)` en capturant l'éventuelle exception.
+
+    Permet de traiter un lot de fichiers sans qu'une erreur sur un fichier
+    n'interrompe le traitement des autres.
+
+    Parameters
+    ----------
+    fn: Callable
+        Fonction à appeler.
+    item: object
+        Premier argument de la fonction (ex: chemin de fichier).
+    **kwargs
+        Arguments nommés supplémentaires.
+
+    Returns
+    -------
+    res: object
+        Résultat de la fonction, None en cas d'erreur.
+    err: str, optional
+        Message d'erreur, None en l'absence d'erreur.
+    """
+    try:
+        return fn(item, **kwargs), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def _map_files(
+    fn: Callable,
+    items: Iterable,
+    jobs: int = 1,
+    executor_cls=ProcessPoolExecutor,
+    **kwargs,
+) -> List[Tuple[object, Optional[str]]]:
+    """Applique une fonction à une liste de fichiers, éventuellement en parallèle.
+
+    L'ordre des résultats est celui des fichiers en entrée, quel que soit
+    l'ordre de fin des traitements.
+
+    Parameters
+    ----------
+    fn: Callable
+        Fonction à appliquer à chaque fichier (fonction de module, pour
+        pouvoir être transmise à des processus).
+    items: Iterable
+        Fichiers à traiter.
+    jobs: int, defaults to 1
+        Nombre de workers ; si 1, traitement séquentiel dans le processus courant.
+    executor_cls: type, defaults to ProcessPoolExecutor
+        Type de pool de workers: ProcessPoolExecutor pour les traitements
+        consommateurs de CPU (hachage, lecture des métadonnées),
+        ThreadPoolExecutor pour les entrées/sorties (stockage).
+    **kwargs
+        Arguments nommés supplémentaires passés à `fn`.
+
+    Returns
+    -------
+    results: List[Tuple[object, Optional[str]]]
+        Liste de couples (résultat, message d'erreur), dans l'ordre des fichiers.
+    """
+    items = list(items)
+    call = partial(_safe_call, fn, **kwargs)
+    if jobs <= 1 or len(items) <= 1:
+        return [call(x) for x in items]
+    with executor_cls(max_workers=jobs) as executor:
+        # map() renvoie les résultats dans l'ordre des entrées
+        return list(executor.map(call, items))
+
+
+def _store_file(fp_digest: Tuple[Path, str], pdf_store: PdfStore) -> str:
+    """Range un fichier dans le stock de travail.
+
+    Parameters
+    ----------
+    fp_digest: Tuple[Path, str]
+        Chemin du fichier et son hachage.
+    pdf_store: PdfStore
+        Stock de travail.
+
+    Returns
+    -------
+    method: str
+        Méthode de stockage utilisée (voir `PdfStore.add`).
+    """
+    fp_src, f_digest = fp_digest
+    _, method = pdf_store.add(fp_src, f_digest)
+    return method
+
+
+def _get_pdf_info_known_digest(
+    fp_digest: Tuple[Path, Optional[str]], digest: str, verbose: bool
+) -> dict:
+    """Extraire les informations d'un fichier PDF dont le hachage est déjà connu.
+
+    Parameters
+    ----------
+    fp_digest: Tuple[Path, Optional[str]]
+        Chemin du fichier PDF et son hachage s'il est connu, sinon None.
+    digest : str
+        Algorithme de hachage.
+    verbose: boolean
+        Si True, des warnings sont émis à chaque anomalie constatée dans les
+        métadonnées du PDF.
+
+    Returns
+    -------
+    pdf_info : dict
+        Informations (dont métadonnées) du fichier PDF.
+    """
+    fp_pdf, f_digest = fp_digest
+    return get_pdf_info(fp_pdf, digest=digest, f_digest=f_digest, verbose=verbose)
+
+
+def _report_failures(failures: List[Tuple[Path, str]], step: str):
+    """Signale les fichiers dont le traitement a échoué, sans interrompre le lot.
+
+    Parameters
+    ----------
+    failures: List[Tuple[Path, str]]
+        Liste de couples (fichier, message d'erreur).
+    step: str
+        Nom de l'étape, pour les messages.
+    """
+    for fp_pdf, err in failures:
+        logging.error(f"{step}: échec sur {fp_pdf}: {err}")
+    if failures:
+        # aussi sur la sortie standard, pour le résumé dans batch-logs
+        print(f"{step}: {len(failures)} fichier(s) en erreur, voir le log")
+
 
 def index_folder(
     in_dir: Path,
     out_dir: Path,
-    index_csv: Path,
+    index_db: Path,
     new_csv: Path,
     recursive: bool = True,
     digest: str = "blake2b",
+    jobs: int = 1,
+    digest_cache: Optional[Path] = None,
+    allow_link: bool = True,
+    check_outdir: bool = False,
+    pdfs_in: Optional[List[Path]] = None,
+    first_seen_db: Optional[Path] = None,
     verbose: bool = False,
 ):
-    """Indexer un dossier: hacher et copier les fichiers PDF qu'il contient.
+    """Indexer un dossier: hacher et stocker les fichiers PDF qu'il contient.
+
+    Chaque contenu est stocké une seule fois dans `out_dir`, sous le nom de
+    son hachage (`ab/cd/<hachage>.pdf`), par reflink ou lien physique si
+    possible, sinon par copie.
+    Chaque fichier est indexé sous un nom logique, préfixant le nom du
+    fichier par le hachage, afin d'éviter les conflits de noms de fichiers
+    issus de dossiers différents.
 
-    Les copies sont renommées en préfixant le nom de chaque fichier par le
-    hachage, afin d'éviter les conflits de noms de fichiers issus de dossiers
-    différents.
+    Avec `jobs > 1`, le hachage, le stockage et la lecture des métadonnées sont
+    faits par un pool de workers. Le fichier d'index produit est identique à
+    celui d'une exécution séquentielle (même ordre des lignes, même
+    correspondance vers les fichiers d'origine). Un fichier en erreur est
+    signalé dans le log et écarté, sans interrompre le traitement du lot.
+
+    Chaque fichier est haché une seule fois: le hachage du fichier d'entrée
+    est réutilisé pour le fichier stocké, et avec `digest_cache` les fichiers
+    inchangés depuis l'exécution précédente (même chemin, taille, date de
+    modification et inode) ne sont pas relus.
 
     Parameters
     ----------
     in_dir: Path
         Dossier à traiter, contenant des PDF.
     out_dir: Path
-        Dossier de sortie, contenant les copies des PDF dont le nom est
-        précédé par le hachage.
-    index_csv: Path
-        Fichier d'index général des PDF.
+        Dossier du stock de travail, adressé par contenu (voir `PdfStore`).
+    index_db: Path
+        Base SQLite d'index général des PDF.
     new_csv: Path
         Fichier d'index des nouveaux PDF indexés par cette exécution.
     recursive: bool, defaults to True
@@ -68,60 +246,161 @@ def index_folder(
     digest : str, defaults to "blake2b"
         Algorithme de hachage à utiliser
         <https://docs.python.org/3/library/hashlib.html#hash-algorithms> .
+    jobs: int, defaults to 1
+        Nombre de workers pour le hachage et la lecture des métadonnées ;
+        le stockage utilise au plus `MAX_IO_JOBS` threads.
+    digest_cache: Path, optional
+        Fichier CSV du cache persistant des hachages des fichiers d'entrée.
+        Si None, tous les fichiers d'entrée sont hachés.
+    allow_link: bool, defaults to True
+        Si False, les fichiers sont copiés dans le stock, sans reflink ni
+        lien physique.
+    check_outdir: bool, defaults to False
+        Si True, vérifie que tous les fichiers de l'index sont présents dans
+        le dossier destination (coûteux: parcourt tout l'index).
+    pdfs_in: List[Path], optional
+        Fichiers PDF à indexer (ex: fichiers signalés par `watch_folder`) ;
+        si None, tous les PDF de in_dir sont listés.
+    first_seen_db: Path, optional
+        Base SQLite des dates de première réception des PDF: "ingested_at"
+        est la date à laquelle le fichier a été reçu pour la première fois,
+        même s'il est indexé de nouveau (index réinitialisé) ; si None,
+        "ingested_at" est la date de cette indexation.
     verbose: boolean, defaults to False
         Si True, des warnings sont émis à chaque anomalie constatée dans les
         métadonnées du PDF.
     """
-    # 1. lister les PDFs déjà indexés (dans le fichier CSV)
-    if index_csv.is_file():
-        df_index_old = pd.read_csv(index_csv, dtype=DTYPE_META_BASE)
-        logging.info(f"Index CSV chargé: {df_index_old.shape[0]} entrées")
-    else:
-        # créer un DataFrame vide, mais aux colonnes typées
-        df_index_old = pd.DataFrame(columns=DTYPE_META_BASE.keys()).astype(
-            DTYPE_META_BASE
-        )
-        logging.info(f"Pas d'index CSV à charger")
-        # df_index_csv = None  # alternative
-    set_pdfs_index = set(df_index_old["pdf"])
+    # 1. ouvrir l'index des PDFs déjà indexés (base SQLite)
+    store = IndexStore(index_db, list(DTYPE_META_BASE), digest=digest)
+    pdf_store = PdfStore(out_dir, allow_link=allow_link)
+    logging.info(f"Index {index_db} ouvert: {len(store)} entrées")
 
-    # 2. hacher puis copier chaque PDF du dossier d'entrée, dans le dossier destination
-    pdfs_in = sorted(in_dir.rglob(PAT_PDF) if recursive else in_dir.glob(PAT_PDF))
+    # 2. hacher puis stocker chaque PDF du dossier d'entrée, dans le dossier destination
+    if pdfs_in is None:
+        pdfs_in = in_dir.rglob(PAT_PDF) if recursive else in_dir.glob(PAT_PDF)
+    pdfs_in = sorted(pdfs_in)
     # exclure d'éventuels fichiers non pertinents
     # TODO transformer en vrai script ; utiliser des DataFrames pour accélérer le traitement si le nombre de fichiers concernés augmente trop?
     pdfs_in = [x for x in pdfs_in if x.name not in EXCLUDE_FILES]
 
     logging.info(f"Dossier {in_dir}: {len(pdfs_in)} fichier(s) PDF trouvé(s)")
-    nb_files_copied = 0
-    fp_copy2orig = {}  # mapping de la copie vers le fichier d'origine
-    for fp_pdf in pdfs_in:
-        # hash du fichier
-        f_digest = get_file_digest(fp_pdf, digest=digest)
-        # ajout du hash devant le nom de la copie du fichier
-        fp_copy = out_dir / f"{f_digest}-{fp_pdf.name}"
-        if not fp_copy.is_file():
-            shutil.copy2(fp_pdf, fp_copy)
-            fp_copy2orig[str(fp_copy)] = str(fp_pdf)
-            nb_files_copied += 1
-    logging.info(f"Dossier {out_dir}: {nb_files_copied} fichier(s) PDF importé(s)")
-
-    # 3. indexer les fichiers PDFs dans le dossier destination (après les copies)
-    # et absents de l'(ancien) index
-    fp_pdfs_outdir = sorted(
-        out_dir.rglob(PAT_PDF) if recursive else out_dir.glob(PAT_PDF)
-    )  # list[PosixPath]
-    pdf2path_outdir = {x.name: x for x in fp_pdfs_outdir}
-    set_pdfs_outdir = set(pdf2path_outdir.keys())
-    set_pdfs_new = set_pdfs_outdir - set_pdfs_index
-    pdfs_new = sorted(pdf2path_outdir[x] for x in set_pdfs_new)
+    # a. hacher les fichiers (en parallèle si jobs > 1), sauf ceux qui sont
+    # inchangés depuis leur dernier hachage (cache)
+    cache = DigestCache(digest_cache, digest=digest) if digest_cache else None
+    res_digests = [(None, None) for _ in pdfs_in]
+    stat_keys = [None for _ in pdfs_in]
+    idx_to_hash = []
+    for i, fp_pdf in enumerate(pdfs_in):
+        if cache is not None:
+            try:
+                stat_keys[i] = get_stat_key(fp_pdf)
+            except OSError as e:
+                res_digests[i] = (None, f"{type(e).__name__}: {e}")
+                continue
+            if (f_digest := cache.get(stat_keys[i])) is not None:
+                res_digests[i] = (f_digest, None)
+                continue
+        idx_to_hash.append(i)
+    res_hashed = _map_files(
+        get_file_digest, [pdfs_in[i] for i in idx_to_hash], jobs=jobs, digest=digest
+    )
+    for i, (f_digest, err) in zip(idx_to_hash, res_hashed):
+        res_digests[i] = (f_digest, err)
+        if cache is not None and err is None:
+            cache.put(stat_keys[i], f_digest)
+    if cache is not None:
+        cache.save()
+    _report_failures(
+        [(x, err) for x, (_, err) in zip(pdfs_in, res_digests) if err is not None],
+        "hachage",
+    )
+    # b. déterminer les noms logiques et les contenus à stocker, dans l'ordre
+    # (trié) des fichiers d'entrée: si plusieurs fichiers d'entrée ont le même
+    # nom logique (même hachage et même nom), c'est le premier qui est retenu,
+    # et un contenu partagé par plusieurs fichiers n'est stocké qu'une fois
+    pdf2orig = {}  # mapping du nom logique vers le fichier d'origine
+    pdf2digest = {}  # hachage de chaque nom logique
+    digest2src = {}  # contenus à stocker: hachage => premier fichier d'origine
+    for fp_pdf, (f_digest, err) in zip(pdfs_in, res_digests):
+        if err is not None:
+            continue
+        # ajout du hash devant le nom du fichier
+        pdf = f"{f_digest}-{fp_pdf.name}"
+        if pdf in pdf2orig:
+            continue
+        pdf2orig[pdf] = fp_pdf
+        pdf2digest[pdf] = f_digest
+        if f_digest not in digest2src and not pdf_store.path_for(f_digest).is_file():
+            digest2src[f_digest] = fp_pdf
+    # c. stocker les fichiers (entrées/sorties: pool de threads borné)
+    to_store = [(fp_src, f_digest) for f_digest, fp_src in digest2src.items()]
+    res_store = _map_files(
+        _store_file,
+        to_store,
+        jobs=min(jobs, MAX_IO_JOBS),
+        executor_cls=ThreadPoolExecutor,
+        pdf_store=pdf_store,
+    )
+    _report_failures(
+        [(x, err) for (x, _), (_, err) in zip(to_store, res_store) if err is not None],
+        "stockage",
+    )
+    digests_failed = {d for (_, d), (_, err) in zip(to_store, res_store) if err}
+    # retirer les noms logiques dont le stockage a échoué
+    for pdf in [x for x, d in pdf2digest.items() if d in digests_failed]:
+        del pdf2orig[pdf]
+        del pdf2digest[pdf]
+    methods = Counter(x for x, err in res_store if err is None)
+    logging.info(
+        f"Dossier {out_dir}: {sum(methods.values())} fichier(s) PDF stocké(s)"
+        + f" ({dict(methods)})"
+    )
+
+    # 3. indexer les fichiers d'entrée dont le nom logique est absent de l'index
+    # (sans relister tout le stock ni tout l'index)
+    set_pdfs_new = set(pdf2orig) - store.known_pdfs(pdf2orig)
+    pdfs_new = sorted(set_pdfs_new)
     logging.info(f"Fichiers PDF à indexer: {len(pdfs_new)}")
+    # extraire les métadonnées (étendues) des fichiers PDF (en parallèle si jobs > 1),
+    # une seule fois par contenu stocké, en réutilisant le hachage calculé à l'étape 2
+    digests_new = sorted({pdf2digest[x] for x in pdfs_new})
+    res_infos = _map_files(
+        _get_pdf_info_known_digest,
+        [(pdf_store.path_for(x), x) for x in digests_new],
+        jobs=jobs,
+        digest=digest,
+        verbose=verbose,
+    )
+    _report_failures(
+        [
+            (pdf_store.path_for(x), err)
+            for x, (_, err) in zip(digests_new, res_infos)
+            if err is not None
+        ],
+        "métadonnées",
+    )
+    digest2info = {x: info for x, (info, err) in zip(digests_new, res_infos) if not err}
     pdf_infos = []
-    for fp_pdf in pdfs_new:
-        # extraire les métadonnées (étendues) des fichiers PDF
-        pdf_info = get_pdf_info(fp_pdf, verbose=verbose)
-        # ajouter le chemin du fichier d'origina
-        pdf_info["origpath"] = fp_copy2orig[str(fp_pdf)]
-        pdf_infos.append(pdf_info)
+    ingested_at = datetime.now().isoformat(timespec="seconds")
+    if first_seen_db is not None:
+        # tous les fichiers reçus sont enregistrés, y compris ceux déjà indexés
+        first_seen_db.parent.mkdir(parents=True, exist_ok=True)
+        with FirstSeenStore(first_seen_db) as first_seen:
+            pdf2seen = first_seen.first_seen(sorted(pdf2orig), ingested_at)
+    else:
+        pdf2seen = {}
+    for pdf in pdfs_new:
+        if (pdf_info := digest2info.get(pdf2digest[pdf])) is None:
+            continue
+        # nom logique et chemin du fichier d'origine
+        pdf_infos.append(
+            pdf_info
+            | {
+                "pdf": pdf,
+                "origpath": str(pdf2orig[pdf]),
+                "ingested_at": pdf2seen.get(pdf, ingested_at),
+            }
+        )
     if pdf_infos:
         # produire le fichier CSV contenant les nouvelles entrées ajoutées à l'index
         df_index_new = pd.DataFrame(pdf_infos)
@@ -129,48 +408,37 @@ def index_folder(
         logging.info(f"Nouvelles entrées indexées: {len(pdf_infos)} dans {new_csv}")
         # générer le fichier d'index contenant uniquement les nouvelles entrées de cette exécution
         df_index_new.to_csv(new_csv, index=False)
-        # mettre à jour le fichier d'index global
-        df_index = pd.concat([df_index_old, df_index_new])
-        df_index.to_csv(index_csv, index=False)
+        # doublons: fichiers déjà indexés ayant le même hachage qu'une nouvelle entrée
+        # (recherche indexée par hachage)
+        digest2pdfs = store.find_by_digests(df_index_new[digest].dropna())
+        for df_row in df_index_new.itertuples():
+            if pdfs_old := digest2pdfs.get(getattr(df_row, digest)):
+                logging.warning(f"Doublon de {pdfs_old}: {df_row.pdf}")
+        # mettre à jour l'index global: ajout des seules nouvelles entrées
+        store.append(df_index_new)
     else:
         logging.warning(
             f"Aucune nouvelle entrée n'étant indexée, le fichier {new_csv} ne sera pas créé"
-            + f" et le fichier {index_csv} ne sera pas mis à jour."
+            + f" et l'index {index_db} ne sera pas mis à jour."
         )
 
     # 4. vérifier la qualité de l'état de l'index et du dossier destination:
     # TODO déplacer dans un utilitaire distinct, p. ex. dans quality, et qui
     # serait appelé pour générer le rapport d'erreurs ?
     #
-    # - cohérence: signaler les éventuels PDFs présents dans l'index mais absents du
+    # - cohérence (optionnel car proportionnel à la taille de l'index):
+    # signaler les éventuels PDFs présents dans l'index mais absents du
     # dossier destination (déplacés ou supprimés)
-    pdfs_mis = sorted(set_pdfs_index - set_pdfs_outdir)
-    if pdfs_mis:
-        logging.warning(f"Fichiers indexés mais absents de {out_dir} : {len(pdfs_mis)}")
-        # TODO marquer, voire supprimer les entrées correspondantes de l'index CSV?
-    # - doublons: détecter les doublons *selon la fonction de hachage* dans tout "out_dir"
-    # FIXME reprendre le hash (digest) qui est déjà disponible dans l'index CSV, colonne "blake2b"
-    # (nom du digest), et calculer les doublons avec pandas?
-    hash_dups = defaultdict(list)
-    for pdf_path in fp_pdfs_outdir:
-        pdf_digest = pdf_path.stem.split("-", 1)[0]
-        hash_dups[pdf_digest].append(pdf_path.name)  # ou pdf_path complet ?
-    # on repère les hashes non-uniques ; on peut facilement récupérer les groupes de
-    # fichiers concernés (pour chaque hash: 1 "original" et ses doublons)
-    nb_dups = 0  # nombre de doublons (cumul des fichiers surnuméraires)
-    nb_typs = 0  # nombre de fichiers "originaux" ayant au moins 1 doublon
-    for pdf_digest, pdf_dups in hash_dups.items():
-        if len(pdf_dups) > 1:
-            nb_dups += len(pdf_dups) - 1
-            nb_typs += 1
-    # si on ne voulait que le nombre de doublons:
-    # pdfs_hash_set = set(hash_dups.keys())
-    # nb_dups = len(pdfs_outdir) - len(pdfs_hash_set)
-    logging.info(
-        f"Doublons potentiels (même hachage): {nb_dups} ({nb_typs} distincts)"
-        + f" dans {out_dir}"
-    )
-    if False:
+    if check_outdir:
+        df_index = store.to_dataframe(DTYPE_META_BASE)
+        pdfs_mis = sorted(
+            x.pdf for x in df_index.itertuples() if not Path(x.fullpath).is_file()
+        )
+        if pdfs_mis:
+            logging.warning(
+                f"Fichiers indexés mais absents de {out_dir} : {len(pdfs_mis)}"
+            )
+            # TODO marquer, voire supprimer les entrées correspondantes de l'index?
         # bonus: afficher des indicateurs
         print(
             df_index[["creatortool", "producer"]]
@@ -178,6 +446,17 @@ def index_folder(
             .to_frame("counts")
             .reset_index()
         )
+    # - doublons: détecter les doublons *selon la fonction de hachage* dans l'index,
+    # par une requête groupée sur la colonne de hachage (indexée)
+    hash_dups = store.duplicate_groups()
+    # pour chaque hash: 1 "original" et ses doublons
+    nb_dups = sum(len(x) - 1 for x in hash_dups.values())  # fichiers surnuméraires
+    nb_typs = len(hash_dups)  # fichiers "originaux" ayant au moins 1 doublon
+    logging.info(
+        f"Doublons potentiels (même hachage): {nb_dups} ({nb_typs} distincts)"
+        + f" dans l'index {index_db}"
+    )
+    store.close()
 
 
 if __name__ == "__main__":
@@ -197,9 +476,9 @@ if __name__ == "__main__":
     parser.add_argument("in_dir", help="Dossier contenant les PDFs à indexer")
     parser.add_argument(
         "out_dir",
-        help="Dossier de sortie pour les copies des fichiers PDFs indexés avec leur hachage",
+        help="Dossier du stock des fichiers PDFs indexés, adressé par leur hachage",
     )
-    parser.add_argument("index_csv", help="Fichier CSV d'indexation des PDFs")
+    parser.add_argument("index_db", help="Base SQLite d'indexation des PDFs")
     parser.add_argument(
         "new_csv",
         help="Fichier CSV d'indexation des PDFs traités lors de cette exécution",
@@ -209,6 +488,36 @@ if __name__ == "__main__":
         action="store_true",
         help="Limite la recherche de fichiers PDF au dossier in_dir, sans descendre dans ses éventuels sous-dossiers",
     )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Nombre de workers pour hacher, stocker et lire les métadonnées des PDFs (0: nombre de coeurs)",
+    )
+    parser.add_argument(
+        "--import_csv",
+        help="Ancien fichier CSV d'indexation des PDFs, à importer dans la base SQLite",
+    )
+    parser.add_argument(
+        "--copy",
+        action="store_true",
+        help="Copier les fichiers dans le stock, sans reflink ni lien physique",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Vérifie que tous les PDFs indexés sont présents dans out_dir",
+    )
+    parser.add_argument(
+        "--digest_cache",
+        default=str(CACHE_DIR / "digest-cache.csv"),
+        help="Fichier CSV du cache des hachages des PDFs d'entrée ('' pour désactiver le cache)",
+    )
+    parser.add_argument(
+        "--first_seen_db",
+        default=str(FP_FIRST_SEEN_DB),
+        help="Base SQLite des dates de première réception des PDFs, conservée même si l'index est réinitialisé ('' pour dater les PDFs de cette indexation)",
+    )
     args = parser.parse_args()
 
     # entrée: dossier contenant les PDFs à indexer
@@ -218,18 +527,23 @@ if __name__ == "__main__":
             f"Le dossier contenant les PDFs à indexer n'existe pas: {in_dir}"
         )
 
-    # état persistant (entrée et sortie): dossier où les PDFs renommés sont copiés
+    # état persistant (entrée et sortie): stock des PDFs, adressé par contenu
     out_dir = Path(args.out_dir).resolve()
     logging.info(
         f"Dossier destination des PDFs: {out_dir} {'existe déjà' if out_dir.is_dir() else 'doit être créé'}."
     )
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    # état persistant (entrée et sortie): fichier CSV d'index des PDFs
-    index_csv = Path(args.index_csv).resolve()
+    # état persistant (entrée et sortie): base SQLite d'index des PDFs
+    index_db = Path(args.index_db).resolve()
     logging.info(
-        f"Fichier CSV d'index des PDFs: {index_csv} {'existe déjà' if index_csv.is_file() else 'doit être créé'}."
+        f"Base d'index des PDFs: {index_db} {'existe déjà' if index_db.is_file() else 'doit être créée'}."
     )
+    index_db.parent.mkdir(parents=True, exist_ok=True)
+    if args.import_csv:
+        # migration depuis l'ancien fichier CSV d'index
+        with IndexStore(index_db, list(DTYPE_META_BASE)) as store:
+            store.import_csv(Path(args.import_csv).resolve(), DTYPE_META_BASE)
 
     # sortie: fichier CSV reprenant uniquement les nouvelles entrées dans le CSV d'index
     # créées par cette exécution
@@ -237,7 +551,26 @@ if __name__ == "__main__":
     logging.info(
         f"Fichier CSV des nouveaux PDFs indexés par cette exécution: {new_csv}"
     )
+    new_csv.parent.mkdir(parents=True, exist_ok=True)
+
+    # nombre de workers
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
 
     # indexer le dossier
     recursive = not args.nonrecursive
-    index_folder(in_dir, out_dir, index_csv, new_csv, recursive=recursive)
+    # cache des hachages des fichiers d'entrée
+    digest_cache = Path(args.digest_cache).resolve() if args.digest_cache else None
+    index_folder(
+        in_dir,
+        out_dir,
+        index_db,
+        new_csv,
+        recursive=recursive,
+        jobs=jobs,
+        digest_cache=digest_cache,
+        allow_link=not args.copy,
+        check_outdir=args.check,
+        first_seen_db=(
+            Path(args.first_seen_db).resolve() if args.first_seen_db else None
+        ),
+    )
@@ -0,0 +1,298 @@
+"""Index général des PDF, stocké dans une base SQLite.
+
+Remplace le fichier CSV d'index, qui devait être entièrement relu puis
+réécrit à chaque exécution.
+Les entrées sont uniquement ajoutées (jamais réécrites), et des index
+sur le nom de fichier et le hachage permettent de tester la présence
+d'un fichier ou de retrouver ses doublons sans parcourir tout l'historique.
+
+La date de première réception de chaque fichier est conservée dans une
+base distincte, qui survit à une réinitialisation de l'index.
+"""
+
+import logging
+from pathlib import Path
+import sqlite3
+from typing import Dict, Iterable, List, Set
+
+import pandas as pd
+
+# nom de la table d'index
+TABLE_INDEX = "pdf_index"
+
+# nombre maximal de paramètres par requête "IN (...)" (limite SQLite: 999 par défaut)
+_SQL_MAX_PARAMS = 900
+
+
+class IndexStore:
+    """Index des fichiers PDF dans une base SQLite.
+
+    La table contient une ligne par fichier PDF indexé, avec les colonnes de
+    l'index CSV (`DTYPE_META_BASE`) et une colonne pour le hachage.
+    """
+
+    def __init__(self, fp_db: Path, columns: List[str], digest: str = "blake2b"):
+        """Ouvre (et crée si besoin) la base d'index.
+
+        Parameters
+        ----------
+        fp_db: Path
+            Fichier de la base SQLite.
+        columns: List[str]
+            Colonnes de l'index (hors hachage).
+        digest: str, defaults to "blake2b"
+            Nom de la colonne contenant le hachage (nom de l'algorithme).
+        """
+        if not digest.isidentifier():
+            raise ValueError(f"Nom de hachage invalide: {digest}")
+        self.fp_db = fp_db
+        self.digest = digest
+        self.columns = [x for x in columns if x != digest] + [digest]
+        self.conn = sqlite3.connect(fp_db)
+        cols_sql = ", ".join(f'"{x}"' for x in self.columns)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {TABLE_INDEX} ({cols_sql})")
+        # ajouter les colonnes apparues depuis la création de la base
+        # (vides pour les entrées existantes)
+        cols_db = {x[1] for x in self.conn.execute(f"PRAGMA table_info({TABLE_INDEX})")}
+        for col in self.columns:
+            if col not in cols_db:
+                logging.info(f"Index {fp_db}: ajout de la colonne {col}")
+                self.conn.execute(f'ALTER TABLE {TABLE_INDEX} ADD COLUMN "{col}"')
+        # un fichier (nom préfixé par le hachage) n'est indexé qu'une fois
+        self.conn.execute(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS ix_{TABLE_INDEX}_digest_pdf"
+            + f' ON {TABLE_INDEX} ("{digest}", pdf)'
+        )
+        self.conn.execute(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS ix_{TABLE_INDEX}_pdf"
+            + f" ON {TABLE_INDEX} (pdf)"
+        )
+        self.conn.commit()
+
+    def close(self):
+        """Ferme la connexion à la base."""
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.conn.execute(f"SELECT COUNT(*) FROM {TABLE_INDEX}").fetchone()[0]
+
+    def known_pdfs(self, pdfs: Iterable[str]) -> Set[str]:
+        """Renvoie le sous-ensemble des fichiers déjà présents dans l'index.
+
+        Parameters
+        ----------
+        pdfs: Iterable[str]
+            Noms de fichiers (préfixés par le hachage).
+
+        Returns
+        -------
+        known: Set[str]
+            Noms de fichiers déjà indexés.
+        """
+        pdfs = list(pdfs)
+        known = set()
+        for i in range(0, len(pdfs), _SQL_MAX_PARAMS):
+            chunk = pdfs[i : i + _SQL_MAX_PARAMS]
+            qmarks = ", ".join("?" for _ in chunk)
+            known.update(
+                x
+                for (x,) in self.conn.execute(
+                    f"SELECT pdf FROM {TABLE_INDEX} WHERE pdf IN ({qmarks})", chunk
+                )
+            )
+        return known
+
+    def find_by_digests(self, digests: Iterable[str]) -> Dict[str, List[str]]:
+        """Renvoie les fichiers indexés ayant l'un des hachages donnés.
+
+        Parameters
+        ----------
+        digests: Iterable[str]
+            Hachages recherchés.
+
+        Returns
+        -------
+        digest2pdfs: Dict[str, List[str]]
+            Pour chaque hachage présent dans l'index, la liste des fichiers
+            correspondants.
+        """
+        digests = sorted(set(digests))
+        digest2pdfs = {}
+        for i in range(0, len(digests), _SQL_MAX_PARAMS):
+            chunk = digests[i : i + _SQL_MAX_PARAMS]
+            qmarks = ", ".join("?" for _ in chunk)
+            for f_digest, pdf in self.conn.execute(
+                f'SELECT "{self.digest}", pdf FROM {TABLE_INDEX}'
+                + f' WHERE "{self.digest}" IN ({qmarks}) ORDER BY rowid',
+                chunk,
+            ):
+                digest2pdfs.setdefault(f_digest, []).append(pdf)
+        return digest2pdfs
+
+    def duplicate_groups(self) -> Dict[str, List[str]]:
+        """Renvoie les groupes de fichiers indexés ayant le même hachage.
+
+        Returns
+        -------
+        dups: Dict[str, List[str]]
+            Pour chaque hachage partagé par plusieurs fichiers, la liste
+            des fichiers, dans l'ordre d'indexation (l'"original" d'abord).
+        """
+        dups = {}
+        for f_digest, pdf in self.conn.execute(
+            f'SELECT "{self.digest}", pdf FROM {TABLE_INDEX} WHERE "{self.digest}" IN'
+            + f' (SELECT "{self.digest}" FROM {TABLE_INDEX}'
+            + f' GROUP BY "{self.digest}" HAVING COUNT(*) > 1)'
+            + " ORDER BY rowid"
+        ):
+            dups.setdefault(f_digest, []).append(pdf)
+        return dups
+
+    def append(self, df: pd.DataFrame) -> int:
+        """Ajoute des entrées à l'index.
+
+        Les entrées dont le fichier est déjà indexé sont ignorées.
+
+        Parameters
+        ----------
+        df: pd.DataFrame
+            Nouvelles entrées, avec les colonnes de l'index.
+
+        Returns
+        -------
+        nb_rows: int
+            Nombre d'entrées effectivement ajoutées.
+        """
+        # valeurs manquantes (pd.NA, NaN) => NULL ; types numpy => types python
+        df_sql = df.reindex(columns=self.columns).astype(object)
+        df_sql = df_sql.where(df_sql.notna(), None)
+        rows = [
+            tuple(x.item() if hasattr(x, "item") else x for x in row)
+            for row in df_sql.itertuples(index=False, name=None)
+        ]
+        cols_sql = ", ".join(f'"{x}"' for x in self.columns)
+        qmarks = ", ".join("?" for _ in self.columns)
+        nb_before = self.conn.total_changes
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT OR IGNORE INTO {TABLE_INDEX} ({cols_sql}) VALUES ({qmarks})",
+                rows,
+            )
+        nb_rows = self.conn.total_changes - nb_before
+        if nb_rows < len(rows):
+            logging.warning(
+                f"{len(rows) - nb_rows} entrée(s) déjà présente(s) dans l'index {self.fp_db}"
+            )
+        return nb_rows
+
+    def to_dataframe(self, dtype: dict) -> pd.DataFrame:
+        """Charge tout l'index dans un DataFrame.
+
+        Parameters
+        ----------
+        dtype: dict
+            Types des colonnes.
+
+        Returns
+        -------
+        df_index: pd.DataFrame
+            Index complet, dans l'ordre d'indexation.
+        """
+        df_index = pd.read_sql_query(
+            f"SELECT * FROM {TABLE_INDEX} ORDER BY rowid", self.conn
+        )
+        return df_index.astype(dtype=dtype)
+
+    def import_csv(self, fp_csv: Path, dtype: dict) -> int:
+        """Importe un ancien fichier CSV d'index.
+
+        Parameters
+        ----------
+        fp_csv: Path
+            Fichier CSV d'index.
+        dtype: dict
+            Types des colonnes du fichier CSV.
+
+        Returns
+        -------
+        nb_rows: int
+            Nombre d'entrées importées.
+        """
+        df_csv = pd.read_csv(fp_csv, dtype=dtype)
+        nb_rows = self.append(df_csv)
+        logging.info(f"Index CSV {fp_csv} importé: {nb_rows} entrées")
+        return nb_rows
+
+
+class FirstSeenStore:
+    """Date de première réception de chaque fichier PDF, stockée dans SQLite.
+
+    Contrairement à l'index, qui peut être reconstruit, une date n'est
+    jamais réécrite: elle reste celle de la première indexation du fichier.
+    """
+
+    def __init__(self, fp_db: Path):
+        """Ouvre (et crée si besoin) la base.
+
+        Parameters
+        ----------
+        fp_db: Path
+            Fichier de la base SQLite.
+        """
+        self.fp_db = fp_db
+        self.conn = sqlite3.connect(fp_db)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS first_seen (pdf TEXT PRIMARY KEY, seen_at TEXT)"
+        )
+        self.conn.commit()
+
+    def close(self):
+        """Ferme la connexion à la base."""
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def first_seen(self, pdfs: Iterable[str], seen_at: str) -> Dict[str, str]:
+        """Enregistre les fichiers reçus, et renvoie leur date de première
+        réception.
+
+        Parameters
+        ----------
+        pdfs: Iterable[str]
+            Noms de fichiers (préfixés par le hachage).
+        seen_at: str
+            Date et heure de réception (ISO), enregistrée pour les fichiers
+            jamais vus.
+
+        Returns
+        -------
+        pdf2seen: Dict[str, str]
+            Date et heure de la première réception de chaque fichier.
+        """
+        pdfs = list(pdfs)
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO first_seen (pdf, seen_at) VALUES (?, ?)",
+                [(x, seen_at) for x in pdfs],
+            )
+        pdf2seen = {}
+        for i in range(0, len(pdfs), _SQL_MAX_PARAMS):
+            chunk = pdfs[i : i + _SQL_MAX_PARAMS]
+            qmarks = ", ".join("?" for _ in chunk)
+            pdf2seen.update(
+                self.conn.execute(
+                    f"SELECT pdf, seen_at FROM first_seen WHERE pdf IN ({qmarks})",
+                    chunk,
+                )
+            )
+        return pdf2seen
@@ -0,0 +1,277 @@
+"""Détection des quasi-doublons à partir du texte natif des documents.
+
+Un même arrêté peut être reçu plusieurs fois, sous des noms et avec des
+contenus binaires différents (ex: ré-export, ajout d'un tampon), ce que
+ne détecte pas le hachage des fichiers.
+
+Chaque document est représenté par l'ensemble de ses "shingles" (séquences
+de `SHINGLE_SIZE` mots consécutifs), résumé par une signature MinHash.
+Un index LSH (Locality Sensitive Hashing) découpe les signatures en bandes:
+deux documents sont candidats s'ils partagent au moins une bande, ce qui
+permet de retrouver les quasi-doublons d'un nouveau document sans le
+comparer à tout l'historique.
+L'index est stocké dans une base SQLite, conservée d'une exécution à l'autre.
+"""
+
+import hashlib
+import logging
+from pathlib import Path
+import re
+import sqlite3
+from typing import Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.utils.txt_format import load_pages_text
+
+# taille des shingles (nombre de mots consécutifs)
+SHINGLE_SIZE = 5
+# nombre minimal de shingles pour qu'un document soit indexé: les PDF image
+# dont le texte natif se réduit à un tampon ou un accusé de réception
+# seraient sinon tous des quasi-doublons les uns des autres
+MIN_SHINGLES = 100
+# signature MinHash: NUM_BANDS bandes de ROWS_PER_BAND valeurs ;
+# seuil de similarité à partir duquel deux documents sont probablement
+# candidats: (1 / NUM_BANDS) ** (1 / ROWS_PER_BAND) ~ 0.7
+NUM_BANDS = 16
+ROWS_PER_BAND = 8
+NUM_PERM = NUM_BANDS * ROWS_PER_BAND
+# similarité de Jaccard estimée minimale pour confirmer un quasi-doublon
+JACCARD_MIN = 0.9
+# nombre premier de Mersenne pour les permutations (a * x + b) mod p,
+# choisi pour que le produit tienne sur 64 bits
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+# graine fixe: les signatures doivent rester comparables entre exécutions
+_SEED = 20230101
+
+# découpage en mots
+P_WORD = re.compile(r"\w+")
+
+
+def get_shingles(text: str, size: int = SHINGLE_SIZE) -> Set[int]:
+    """Renvoie l'ensemble des shingles (hachés) d'un texte.
+
+    Parameters
+    ----------
+    text: str
+        Texte du document.
+    size: int, defaults to SHINGLE_SIZE
+        Nombre de mots par shingle.
+
+    Returns
+    -------
+    shingles: Set[int]
+        Hachages (32 bits) des shingles du texte.
+    """
+    words = P_WORD.findall(text.lower())
+    return {
+        int.from_bytes(
+            hashlib.blake2b(
+                " ".join(words[i : i + size]).encode(), digest_size=4
+            ).digest(),
+            "little",
+        )
+        for i in range(max(len(words) - size + 1, 0))
+    }
+
+
+class NearDupIndex:
+    """Index LSH des signatures MinHash des documents, stocké dans SQLite."""
+
+    def __init__(self, fp_db: Path):
+        """Ouvre (et crée si besoin) l'index.
+
+        Parameters
+        ----------
+        fp_db: Path
+            Fichier de la base SQLite.
+        """
+        self.fp_db = fp_db
+        rng = np.random.default_rng(_SEED)
+        self.perm_a = rng.integers(1, _MERSENNE_PRIME, size=NUM_PERM, dtype=np.uint64)
+        self.perm_b = rng.integers(0, _MERSENNE_PRIME, size=NUM_PERM, dtype=np.uint64)
+        self.conn = sqlite3.connect(fp_db)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS neardup_doc (pdf TEXT PRIMARY KEY, sig BLOB)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS neardup_band"
+            + " (band INTEGER, bucket INTEGER, pdf TEXT)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_neardup_band ON neardup_band (band, bucket)"
+        )
+        self.conn.commit()
+
+    def close(self):
+        """Ferme la connexion à la base."""
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def signature(self, shingles: Set[int]) -> np.ndarray:
+        """Calcule la signature MinHash d'un ensemble de shingles.
+
+        Parameters
+        ----------
+        shingles: Set[int]
+            Shingles du document.
+
+        Returns
+        -------
+        sig: np.ndarray
+            Signature MinHash, de taille NUM_PERM.
+        """
+        x = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+        x %= _MERSENNE_PRIME
+        # (NUM_PERM, nb de shingles): a * x + b < 2**62, pas de dépassement
+        hashed = (self.perm_a[:, None] * x[None, :] + self.perm_b[:, None]) % (
+            _MERSENNE_PRIME
+        )
+        return hashed.min(axis=1)
+
+    @staticmethod
+    def _buckets(sig: np.ndarray):
+        """Renvoie le seau de chaque bande de la signature.
+
+        Parameters
+        ----------
+        sig: np.ndarray
+            Signature MinHash.
+
+        Returns
+        -------
+        buckets: List[Tuple[int, int]]
+            Couples (numéro de bande, seau).
+        """
+        return [
+            (
+                i,
+                int.from_bytes(
+                    hashlib.blake2b(band.tobytes(), digest_size=8).digest(),
+                    "little",
+                    signed=True,
+                ),
+            )
+            for i, band in enumerate(sig.reshape(NUM_BANDS, ROWS_PER_BAND))
+        ]
+
+    def query(self, pdf: str, sig: np.ndarray) -> Optional[Tuple[str, float]]:
+        """Cherche le quasi-doublon le plus proche d'un document.
+
+        Parameters
+        ----------
+        pdf: str
+            Nom du document, exclu des résultats.
+        sig: np.ndarray
+            Signature MinHash du document.
+
+        Returns
+        -------
+        match: Tuple[str, float], optional
+            Nom du document le plus proche et similarité de Jaccard estimée,
+            ou None si aucun document indexé n'atteint JACCARD_MIN.
+        """
+        candidates = set()
+        for band, bucket in self._buckets(sig):
+            candidates.update(
+                x
+                for (x,) in self.conn.execute(
+                    "SELECT pdf FROM neardup_band WHERE band = ? AND bucket = ?",
+                    (band, bucket),
+                )
+            )
+        candidates.discard(pdf)
+        best = None
+        for cand in sorted(candidates):
+            (blob,) = self.conn.execute(
+                "SELECT sig FROM neardup_doc WHERE pdf = ?", (cand,)
+            ).fetchone()
+            jaccard = float(np.mean(np.frombuffer(blob, dtype=np.uint64) == sig))
+            if jaccard >= JACCARD_MIN and (best is None or jaccard > best[1]):
+                best = (cand, jaccard)
+        return best
+
+    def add(self, pdf: str, sig: np.ndarray):
+        """Ajoute un document à l'index, s'il n'y est pas déjà.
+
+        Parameters
+        ----------
+        pdf: str
+            Nom du document.
+        sig: np.ndarray
+            Signature MinHash du document.
+        """
+        with self.conn:
+            cur = self.conn.execute(
+                "INSERT OR IGNORE INTO neardup_doc (pdf, sig) VALUES (?, ?)",
+                (pdf, sig.astype(np.uint64).tobytes()),
+            )
+            if cur.rowcount:
+                self.conn.executemany(
+                    "INSERT INTO neardup_band (band, bucket, pdf) VALUES (?, ?, ?)",
+                    [(band, bucket, pdf) for band, bucket in self._buckets(sig)],
+                )
+
+
+def flag_near_duplicates(df_meta: pd.DataFrame, fp_db: Path) -> pd.DataFrame:
+    """Repère les quasi-doublons de documents déjà indexés, puis indexe les autres.
+
+    Les documents sont traités dans l'ordre du DataFrame: un document est
+    comparé aux documents des exécutions précédentes et à ceux qui le
+    précèdent dans le lot.
+    Seuls les documents qui ne sont pas des quasi-doublons sont ajoutés à
+    l'index, qui ne contient donc que des "originaux".
+
+    Parameters
+    ----------
+    df_meta: pd.DataFrame
+        Métadonnées des documents, avec le chemin du texte natif
+        ("fullpath_txt").
+    fp_db: Path
+        Base SQLite de l'index LSH.
+
+    Returns
+    -------
+    df_mmod: pd.DataFrame
+        Métadonnées enrichies des colonnes "dup_neartext" (quasi-doublon d'un
+        document déjà indexé) et "dup_neartext_pdf" (document original) ;
+        <NA> pour les documents sans texte natif suffisant.
+    """
+    dup_neartext = []
+    dup_neartext_pdf = []
+    with NearDupIndex(fp_db) as index:
+        for df_row in df_meta.itertuples():
+            if pd.isna(df_row.fullpath_txt):
+                shingles = set()
+            else:
+                shingles = get_shingles(" ".join(load_pages_text(df_row.fullpath_txt)))
+            if len(shingles) < MIN_SHINGLES:
+                # texte natif absent ou trop court pour conclure
+                dup_neartext.append(None)
+                dup_neartext_pdf.append(None)
+                continue
+            sig = index.signature(shingles)
+            match = index.query(df_row.pdf, sig)
+            if match is None:
+                index.add(df_row.pdf, sig)
+                dup_neartext.append(False)
+                dup_neartext_pdf.append(None)
+            else:
+                pdf_orig, jaccard = match
+                logging.warning(
+                    f"Quasi-doublon de {pdf_orig} (Jaccard ~ {jaccard:.2f}): {df_row.pdf}"
+                )
+                dup_neartext.append(True)
+                dup_neartext_pdf.append(pdf_orig)
+    nb_dups = sum(x is True for x in dup_neartext)
+    logging.info(f"Quasi-doublons (texte natif): {nb_dups} / {len(df_meta)}")
+    df_mmod = df_meta.assign(
+        dup_neartext=dup_neartext, dup_neartext_pdf=dup_neartext_pdf
+    )
+    return df_mmod
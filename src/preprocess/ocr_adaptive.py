@@ -0,0 +1,193 @@
+"""OCR adaptative: choix des pages à OCRiser de nouveau, avec des réglages de qualité.
+
+Après une première passe rapide, les extracteurs de champs (adresse,
+date, classification, parcelles) sont appliqués au texte du document:
+* si un champ clé n'est pas trouvé, toutes les pages OCRisées du document
+passent en seconde passe ;
+* sinon, seules les pages dont le texte semble illisible (proportion de
+"mots" plausibles trop faible) passent en seconde passe.
+"""
+
+import logging
+import re
+import threading
+from typing import Dict, Iterable, List, Sequence
+
+from src.domain_knowledge.arrete import get_date
+from src.domain_knowledge.cadastre import get_parcelles
+from src.domain_knowledge.logement import get_adr_doc
+from src.domain_knowledge.typologie_securite import get_classe
+from src.utils.str_date import process_date_brute
+
+# champs dont l'absence déclenche la seconde passe sur tout le document
+# (la référence cadastrale est absente de nombreux arrêtés hors Marseille)
+KEY_FIELDS_REQUIRED = ("adresse", "date", "classe")
+# nombre minimal de mots pour évaluer la lisibilité d'une page
+MIN_TOKENS_PAGE = 20
+# proportion minimale de mots plausibles sur une page lisible
+MIN_WORD_RATIO = 0.6
+
+# mot plausible: lettres (avec apostrophe ou trait d'union), nombre, ou
+# nombre suivi d'un suffixe ("1er", "12bis")
+P_WORD = re.compile(
+    r"(?:[A-Za-zÀ-ÖØ-öø-ÿœŒ]+(?:['’-][A-Za-zÀ-ÖØ-öø-ÿœŒ]+)*|\d+(?:[.,/]\d+)*[a-z]{0,3})"
+)
+# ponctuation entourant les mots
+PUNCT_STRIP = "\"'’«»()[]{},.;:!?"
+
+
+def get_word_ratio(page_txt: str) -> float:
+    """Calcule la proportion de mots plausibles dans le texte d'une page.
+
+    Parameters
+    ----------
+    page_txt: str
+        Texte OCRisé de la page.
+
+    Returns
+    -------
+    word_ratio: float
+        Proportion de mots plausibles, 1.0 si la page ne contient pas assez
+        de mots pour en juger.
+    """
+    tokens = [x.strip(PUNCT_STRIP) for x in page_txt.split()]
+    tokens = [x for x in tokens if x]
+    if len(tokens) < MIN_TOKENS_PAGE:
+        return 1.0
+    nb_words = sum(P_WORD.fullmatch(x) is not None for x in tokens)
+    return nb_words / len(tokens)
+
+
+def _has_date(page_txt: str) -> bool:
+    """Vérifie si la date de l'arrêté est trouvée, et lisible, sur une page.
+
+    Parameters
+    ----------
+    page_txt: str
+        Texte de la page.
+
+    Returns
+    -------
+    has_date: bool
+        True si une date d'arrêté est trouvée et peut être normalisée.
+    """
+    arr_date = get_date(page_txt)
+    return arr_date is not None and process_date_brute(arr_date) is not None
+
+
+# extracteurs de champs: True si le champ est trouvé sur une page
+KEY_FIELD_TESTS = {
+    "adresse": lambda x: bool(get_adr_doc(x)),
+    "date": _has_date,
+    "classe": lambda x: get_classe(x) is not None,
+    "parcelle": lambda x: bool(get_parcelles(x)),
+}
+
+
+def find_key_fields(pages_txt: Sequence[str]) -> Dict[str, bool]:
+    """Applique les extracteurs de champs au texte d'un document.
+
+    Un extracteur qui lève une exception, sur un texte mal OCRisé, est
+    compté comme un champ non trouvé.
+
+    Parameters
+    ----------
+    pages_txt: Sequence[str]
+        Texte de chaque page du document.
+
+    Returns
+    -------
+    found: Dict[str, bool]
+        Pour chaque champ ("adresse", "date", "classe", "parcelle"), True
+        s'il a été trouvé sur au moins une page.
+    """
+    found = {x: False for x in KEY_FIELD_TESTS}
+    for page_txt in pages_txt:
+        if not page_txt or page_txt.startswith("[OCR skipped on page"):
+            continue
+        for field, has_field in KEY_FIELD_TESTS.items():
+            if found[field]:
+                continue
+            try:
+                found[field] = has_field(page_txt)
+            except Exception as e:
+                # texte illisible: le champ n'est pas trouvé sur cette page
+                logging.debug(f"Extracteur du champ {field} en erreur: {e}")
+    return found
+
+
+def select_pages_redo(pages_txt: Sequence[str], pages_ocr: Iterable[int]) -> List[int]:
+    """Sélectionne les pages à OCRiser de nouveau avec des réglages de qualité.
+
+    Parameters
+    ----------
+    pages_txt: Sequence[str]
+        Texte de chaque page du document, après la première passe.
+    pages_ocr: Iterable[int]
+        Pages OCRisées lors de la première passe (la première page est
+        numérotée 1).
+
+    Returns
+    -------
+    pages_redo: List[int]
+        Pages à OCRiser de nouveau.
+    """
+    pages_ocr = sorted(pages_ocr)
+    found = find_key_fields(pages_txt)
+    if missing := [x for x in KEY_FIELDS_REQUIRED if not found[x]]:
+        logging.info(f"Champs non trouvés: {missing}, seconde passe sur {pages_ocr}")
+        return pages_ocr
+    return [i for i in pages_ocr if get_word_ratio(pages_txt[i - 1]) < MIN_WORD_RATIO]
+
+
+class AdaptiveOcrStats:
+    """Statistiques des deux passes de l'OCR adaptative.
+
+    Utilisable depuis plusieurs threads.
+    """
+
+    def __init__(self):
+        """Initialise les compteurs."""
+        self.nb_pages = {"fast": 0, "best": 0}
+        self.elapsed = {"fast": 0.0, "best": 0.0}
+        self._lock = threading.Lock()
+
+    def add(self, ocr_pass: str, nb_pages: int, elapsed: float):
+        """Ajoute le résultat d'une passe sur un document.
+
+        Parameters
+        ----------
+        ocr_pass: str
+            Passe d'OCR: "fast" ou "best".
+        nb_pages: int
+            Nombre de pages OCRisées.
+        elapsed: float
+            Durée de la passe, en secondes.
+        """
+        with self._lock:
+            self.nb_pages[ocr_pass] += nb_pages
+            self.elapsed[ocr_pass] += elapsed
+
+    def log_stats(self):
+        """Écrit la part de pages OCRisées de nouveau et le temps gagné.
+
+        Le temps d'une OCR de toutes les pages avec les réglages de qualité
+        est estimé d'après la durée moyenne par page de la seconde passe.
+        """
+        nb_fast, nb_best = self.nb_pages["fast"], self.nb_pages["best"]
+        share = nb_best / nb_fast if nb_fast else 0.0
+        elapsed = self.elapsed["fast"] + self.elapsed["best"]
+        msg = (
+            f"OCR adaptative: {nb_best} pages OCRisées de nouveau sur {nb_fast}"
+            + f" ({share:.1%}), durée cumulée {elapsed:.0f} s"
+        )
+        if nb_best:
+            elapsed_best_all = nb_fast * self.elapsed["best"] / nb_best
+            msg += (
+                f" ; toutes les pages en qualité maximale: {elapsed_best_all:.0f} s"
+                + f" (estimé), gain {elapsed_best_all - elapsed:.0f} s"
+            )
+        else:
+            msg += " ; gain non estimé (aucune seconde passe)"
+        logging.info(msg)
+        print(msg)
@@ -0,0 +1,224 @@
+"""Cache persistant du texte OCRisé, page par page.
+
+Le dossier data/interim est effacé à chaque exécution du pipeline: sans
+cache, toute ré-exécution, ou tout PDF renvoyé avec un nouveau tampon,
+serait OCRisé de nouveau.
+
+La clé d'une page combine le hachage de ses images (les données brutes
+des images, dans l'ordre où elles sont dessinées, et la rotation de la
+page) et la "version" du moteur d'OCR (versions d'ocrmypdf et tesseract,
+langue). Un tampon ajouté en texte natif ou une page modifiée ailleurs dans
+le document ne change donc pas la clé des pages numérisées.
+
+Le cache est stocké dans une base SQLite, de taille bornée: les pages
+utilisées le moins récemment sont évincées (LRU).
+"""
+
+import hashlib
+import logging
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+import pikepdf
+
+from src.preprocess.classify_pages import iter_page_images
+from src.preprocess.pdf_session import PdfSession
+
+# taille maximale du cache par défaut (texte des pages), en octets
+OCR_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+# après éviction, le cache est ramené à cette fraction de sa taille maximale
+_EVICT_TO = 0.9
+
+
+def get_page_key(page: pikepdf.Page, engine_key: str) -> Optional[str]:
+    """Calcule la clé d'une page dans le cache.
+
+    Parameters
+    ----------
+    page: pikepdf.Page
+        Page du document.
+    engine_key: str
+        Versions du moteur d'OCR et langue.
+
+    Returns
+    -------
+    page_key: str, optional
+        Clé de la page, None si la page ne contient aucune image.
+    """
+    f_digest = hashlib.blake2b(digest_size=16)
+    f_digest.update(engine_key.encode())
+    f_digest.update(f"|{int(page.obj.get('/Rotate', 0))}".encode())
+    nb_images = 0
+    for image, _ in iter_page_images(page):
+        if isinstance(image, pikepdf.PdfInlineImage):
+            f_digest.update(image.unparse())
+        else:
+            f_digest.update(str(image.get("/Filter")).encode())
+            f_digest.update(image.read_raw_bytes())
+        nb_images += 1
+    if nb_images == 0:
+        return None
+    return f_digest.hexdigest()
+
+
+class OcrPageCache:
+    """Cache du texte OCRisé des pages, stocké dans SQLite.
+
+    Utilisable depuis plusieurs threads.
+    """
+
+    def __init__(
+        self,
+        fp_db: Path,
+        engine_key: str,
+        max_bytes: int = OCR_CACHE_MAX_BYTES,
+    ):
+        """Ouvre (et crée si besoin) le cache.
+
+        Parameters
+        ----------
+        fp_db: Path
+            Fichier de la base SQLite.
+        engine_key: str
+            Versions du moteur d'OCR et langue, intégrées à la clé des pages.
+        max_bytes: int, defaults to OCR_CACHE_MAX_BYTES
+            Taille maximale du texte stocké, en octets.
+        """
+        self.fp_db = fp_db
+        self.engine_key = engine_key
+        self.max_bytes = max_bytes
+        self.nb_hits = 0
+        self.nb_misses = 0
+        self.nb_evicted = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(fp_db, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_page"
+            + " (key TEXT PRIMARY KEY, txt TEXT, nb_bytes INTEGER, last_used REAL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_ocr_page_last_used ON ocr_page (last_used)"
+        )
+        self.conn.commit()
+        (total,) = self.conn.execute(
+            "SELECT COALESCE(SUM(nb_bytes), 0) FROM ocr_page"
+        ).fetchone()
+        self._total_bytes = total
+
+    def close(self):
+        """Ferme la connexion à la base."""
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def page_keys(
+        self, fp_pdf: Path, pages: Iterable[int], variant: str = ""
+    ) -> Dict[int, Optional[str]]:
+        """Calcule la clé de pages d'un document.
+
+        Parameters
+        ----------
+        fp_pdf: Path
+            Chemin du fichier PDF.
+        pages: Iterable[int]
+            Numéros des pages (la première page est numérotée 1).
+        variant: str, defaults to ""
+            Réglages de l'OCR (voir `ocr_settings.get_settings_key`), ajoutés
+            à la version du moteur.
+
+        Returns
+        -------
+        page_keys: Dict[int, Optional[str]]
+            Clé de chaque page, None pour les pages sans image.
+        """
+        with PdfSession(fp_pdf) as session:
+            return {
+                i: get_page_key(session.pdf.pages[i - 1], self.engine_key + variant)
+                for i in pages
+            }
+
+    def get(self, page_key: str) -> Optional[str]:
+        """Renvoie le texte d'une page en cache, sinon None.
+
+        Parameters
+        ----------
+        page_key: str
+            Clé de la page.
+
+        Returns
+        -------
+        page_txt: str, optional
+            Texte OCRisé de la page, None si la page est absente du cache.
+        """
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT txt FROM ocr_page WHERE key = ?", (page_key,)
+            ).fetchone()
+            if row is None:
+                self.nb_misses += 1
+                return None
+            self.nb_hits += 1
+            with self.conn:
+                self.conn.execute(
+                    "UPDATE ocr_page SET last_used = ? WHERE key = ?",
+                    (time.time(), page_key),
+                )
+            return row[0]
+
+    def put(self, page_key: str, page_txt: str):
+        """Ajoute le texte d'une page au cache, puis évince si besoin.
+
+        Parameters
+        ----------
+        page_key: str
+            Clé de la page.
+        page_txt: str
+            Texte OCRisé de la page.
+        """
+        nb_bytes = len(page_txt.encode())
+        with self._lock:
+            with self.conn:
+                row = self.conn.execute(
+                    "SELECT nb_bytes FROM ocr_page WHERE key = ?", (page_key,)
+                ).fetchone()
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO ocr_page (key, txt, nb_bytes, last_used)"
+                    + " VALUES (?, ?, ?, ?)",
+                    (page_key, page_txt, nb_bytes, time.time()),
+                )
+            self._total_bytes += nb_bytes - (row[0] if row is not None else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Évince les pages utilisées le moins récemment (verrou déjà acquis)."""
+        target = self.max_bytes * _EVICT_TO
+        evicted = []
+        for key, nb_bytes in self.conn.execute(
+            "SELECT key, nb_bytes FROM ocr_page ORDER BY last_used"
+        ):
+            if self._total_bytes <= target:
+                break
+            evicted.append((key,))
+            self._total_bytes -= nb_bytes
+        with self.conn:
+            self.conn.executemany("DELETE FROM ocr_page WHERE key = ?", evicted)
+        self.nb_evicted += len(evicted)
+        logging.info(f"Cache OCR: {len(evicted)} pages évincées")
+
+    def log_stats(self):
+        """Écrit les statistiques d'utilisation du cache dans le log."""
+        nb_lookups = self.nb_hits + self.nb_misses
+        hit_rate = self.nb_hits / nb_lookups if nb_lookups else 0.0
+        logging.info(
+            f"Cache OCR: {self.nb_hits} pages trouvées sur {nb_lookups}"
+            + f" ({hit_rate:.1%}), {self.nb_evicted} évincées,"
+            + f" {self._total_bytes / 1e6:.1f} Mo / {self.max_bytes / 1e6:.1f} Mo"
+        )
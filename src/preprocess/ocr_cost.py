@@ -0,0 +1,323 @@
+"""Estimation du temps d'OCR des documents et ordonnancement du pool.
+
+Le temps d'OCR d'un document est prédit d'après le nombre de pages à
+OCRiser, la taille du fichier et le logiciel qui a produit le PDF, à partir
+des durées mesurées lors des exécutions précédentes (fichier CSV conservé
+dans `CACHE_DIR`):
+* un modèle linéaire `durée = a + b * pages + c * Mio` est ajusté sur tout
+l'historique (valeurs par défaut tant que l'historique est trop court) ;
+* un facteur correctif par producteur ("creatortool", "producer") est
+estimé par la médiane du rapport entre durée mesurée et durée prédite.
+
+Les documents sont soumis au pool du plus long au plus court ("longest
+processing time first"), ce qui évite qu'un long document soumis en fin de
+lot n'allonge d'autant la durée totale ; cet ordre sert aussi à estimer la
+durée totale de l'exécution.
+"""
+
+import csv
+from datetime import datetime
+import heapq
+import logging
+from pathlib import Path
+import threading
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from src.utils.txt_format import parse_page_list
+
+# valeurs par défaut du modèle, sans historique: durée fixe par document,
+# durée par page, durée par Mio
+DEFAULT_S_PER_DOC = 5.0
+DEFAULT_S_PER_PAGE = 4.0
+DEFAULT_S_PER_MB = 0.0
+# nombre minimal de mesures pour ajuster le modèle linéaire, et le facteur
+# correctif d'un producteur
+MIN_SAMPLES = 20
+MIN_SAMPLES_PRODUCER = 5
+# colonnes du fichier des durées mesurées
+TIMINGS_COLUMNS = [
+    "date",
+    "pdf",
+    "backend",
+    "nb_pages_ocr",
+    "filesize",
+    "creatortool",
+    "producer",
+    "elapsed",
+]
+
+
+def get_producer_key(creatortool: Optional[str], producer: Optional[str]) -> str:
+    """Renvoie la clé du logiciel producteur d'un PDF.
+
+    Parameters
+    ----------
+    creatortool: str, optional
+        Champ "creatortool" des métadonnées du PDF.
+    producer: str, optional
+        Champ "producer" des métadonnées du PDF.
+
+    Returns
+    -------
+    producer_key: str
+        Clé "creatortool|producer".
+    """
+    return "|".join(
+        x.strip() if isinstance(x, str) else "" for x in (creatortool, producer)
+    )
+
+
+def get_nb_pages_ocr(df_row: NamedTuple) -> int:
+    """Renvoie le nombre de pages à OCRiser d'un document.
+
+    Parameters
+    ----------
+    df_row: NamedTuple
+        Métadonnées du document, dont "pages_image".
+
+    Returns
+    -------
+    nb_pages_ocr: int
+        Nombre de pages image.
+    """
+    return len(parse_page_list(df_row.pages_image))
+
+
+class OcrCostModel:
+    """Modèle de la durée d'OCR d'un document, appris sur les durées mesurées.
+
+    Les durées mesurées pendant l'exécution sont ajoutées depuis plusieurs
+    threads (`record`), puis écrites à la fin de l'exécution (`save`).
+    """
+
+    def __init__(self, fp_timings: Optional[Path] = None, backend: str = "ocrmypdf"):
+        """Charge l'historique des durées et ajuste le modèle.
+
+        Parameters
+        ----------
+        fp_timings: Path, optional
+            Fichier CSV des durées mesurées ; si None, le modèle utilise les
+            valeurs par défaut et les durées ne sont pas conservées.
+        backend: str, defaults to "ocrmypdf"
+            Moteur d'OCR: seules les durées mesurées avec ce moteur sont
+            utilisées.
+        """
+        self.fp_timings = fp_timings
+        self.backend = backend
+        self.coefs = np.array([DEFAULT_S_PER_DOC, DEFAULT_S_PER_PAGE, DEFAULT_S_PER_MB])
+        self.factors = {}
+        self._new = []
+        self._lock = threading.Lock()
+        if fp_timings is not None and fp_timings.is_file():
+            df_timings = pd.read_csv(
+                fp_timings, dtype={"creatortool": "string", "producer": "string"}
+            )
+            self.fit(df_timings[df_timings["backend"] == backend])
+
+    @staticmethod
+    def _features(nb_pages_ocr, filesize) -> np.ndarray:
+        """Construit la matrice des variables du modèle linéaire.
+
+        Parameters
+        ----------
+        nb_pages_ocr: array-like
+            Nombre de pages à OCRiser.
+        filesize: array-like
+            Taille des fichiers, en octets.
+
+        Returns
+        -------
+        x: np.ndarray
+            Constante, nombre de pages, taille en Mio.
+        """
+        nb_pages_ocr = np.atleast_1d(np.asarray(nb_pages_ocr, dtype=float))
+        filesize = np.atleast_1d(np.asarray(filesize, dtype=float))
+        return np.column_stack(
+            [np.ones_like(nb_pages_ocr), nb_pages_ocr, filesize / 2**20]
+        )
+
+    def fit(self, df_timings: pd.DataFrame):
+        """Ajuste le modèle sur des durées mesurées.
+
+        Parameters
+        ----------
+        df_timings: pd.DataFrame
+            Durées mesurées, avec les colonnes de `TIMINGS_COLUMNS`.
+        """
+        if len(df_timings) < MIN_SAMPLES:
+            logging.info(
+                f"Modèle de coût de l'OCR: {len(df_timings)} mesures, valeurs par défaut"
+            )
+            return
+        x = self._features(df_timings["nb_pages_ocr"], df_timings["filesize"])
+        y = df_timings["elapsed"].to_numpy(dtype=float)
+        coefs, *_ = np.linalg.lstsq(x, y, rcond=None)
+        # une durée ne décroît pas avec le nombre de pages ou la taille
+        self.coefs = np.clip(coefs, 0.0, None)
+        pred = np.maximum(x @ self.coefs, 1e-3)
+        ratios = pd.Series(y / pred, index=df_timings.index)
+        producer_keys = [
+            get_producer_key(ct, pr)
+            for ct, pr in zip(df_timings["creatortool"], df_timings["producer"])
+        ]
+        for key, grp in ratios.groupby(producer_keys):
+            if len(grp) >= MIN_SAMPLES_PRODUCER:
+                self.factors[key] = float(grp.median())
+        logging.info(
+            f"Modèle de coût de l'OCR ({len(df_timings)} mesures): {self.coefs[0]:.1f} s"
+            + f" + {self.coefs[1]:.2f} s/page + {self.coefs[2]:.2f} s/Mio,"
+            + f" {len(self.factors)} producteurs"
+        )
+
+    def predict(self, df_row: NamedTuple) -> float:
+        """Prédit la durée d'OCR d'un document.
+
+        Parameters
+        ----------
+        df_row: NamedTuple
+            Métadonnées du document: "pages_image", "filesize",
+            "creatortool", "producer".
+
+        Returns
+        -------
+        cost: float
+            Durée estimée, en secondes.
+        """
+        filesize = df_row.filesize if pd.notna(df_row.filesize) else 0
+        x = self._features(get_nb_pages_ocr(df_row), filesize)
+        cost = float((x @ self.coefs)[0])
+        key = get_producer_key(df_row.creatortool, df_row.producer)
+        return cost * self.factors.get(key, 1.0)
+
+    def record(self, df_row: NamedTuple, elapsed: float):
+        """Enregistre la durée mesurée de l'OCR d'un document.
+
+        Parameters
+        ----------
+        df_row: NamedTuple
+            Métadonnées du document.
+        elapsed: float
+            Durée de l'OCR, en secondes.
+        """
+        row = {
+            "date": datetime.now().isoformat(),
+            "pdf": df_row.pdf,
+            "backend": self.backend,
+            "nb_pages_ocr": get_nb_pages_ocr(df_row),
+            "filesize": df_row.filesize if pd.notna(df_row.filesize) else 0,
+            "creatortool": df_row.creatortool if pd.notna(df_row.creatortool) else "",
+            "producer": df_row.producer if pd.notna(df_row.producer) else "",
+            "elapsed": round(elapsed, 3),
+        }
+        with self._lock:
+            self._new.append(row)
+
+    def save(self):
+        """Ajoute les durées mesurées pendant l'exécution au fichier CSV."""
+        if self.fp_timings is None or not self._new:
+            return
+        self.fp_timings.parent.mkdir(parents=True, exist_ok=True)
+        write_header = not self.fp_timings.is_file()
+        with self._lock, open(self.fp_timings, "a", newline="") as f_timings:
+            writer = csv.DictWriter(f_timings, fieldnames=TIMINGS_COLUMNS)
+            if write_header:
+                writer.writeheader()
+            writer.writerows(self._new)
+            self._new = []
+
+
+def lpt_order(
+    costs: Sequence[float], priorities: Optional[Sequence[int]] = None
+) -> List[int]:
+    """Ordonne des tâches de la plus longue à la plus courte.
+
+    Parameters
+    ----------
+    costs: Sequence[float]
+        Durée estimée de chaque tâche.
+    priorities: Sequence[int], optional
+        Priorité de chaque tâche (la plus petite valeur passe en premier) ;
+        les tâches sont alors ordonnées par priorité, puis par durée.
+
+    Returns
+    -------
+    order: List[int]
+        Indices des tâches, par priorité puis durée décroissante (ordre
+        d'origine conservé à égalité).
+    """
+    if priorities is None:
+        return sorted(range(len(costs)), key=lambda i: -costs[i])
+    return sorted(range(len(costs)), key=lambda i: (priorities[i], -costs[i]))
+
+
+def estimate_makespan(costs: Sequence[float], nb_workers: int) -> float:
+    """Estime la durée totale d'un lot de tâches, dans l'ordre de soumission.
+
+    Chaque tâche est prise par le premier worker libre, comme dans un pool.
+
+    Parameters
+    ----------
+    costs: Sequence[float]
+        Durée estimée de chaque tâche, dans l'ordre de soumission.
+    nb_workers: int
+        Nombre de workers du pool.
+
+    Returns
+    -------
+    makespan: float
+        Durée totale estimée, en secondes.
+    """
+    ends = [0.0] * max(nb_workers, 1)
+    for cost in costs:
+        heapq.heappush(ends, heapq.heappop(ends) + cost)
+    return max(ends)
+
+
+def format_duration(seconds: float) -> str:
+    """Formate une durée en heures, minutes et secondes.
+
+    Parameters
+    ----------
+    seconds: float
+        Durée, en secondes.
+
+    Returns
+    -------
+    duration: str
+        Durée au format "HhMMmSSs".
+    """
+    minutes, secs = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02}m{secs:02}s"
+
+
+def log_estimate(costs: Dict[str, float], nb_workers: int) -> float:
+    """Écrit la durée estimée d'un lot, ordonné du plus long au plus court.
+
+    Parameters
+    ----------
+    costs: Dict[str, float]
+        Durée estimée de l'OCR de chaque document, dans l'ordre de
+        soumission.
+    nb_workers: int
+        Nombre de documents OCRisés simultanément.
+
+    Returns
+    -------
+    makespan: float
+        Durée totale estimée, en secondes.
+    """
+    makespan = estimate_makespan(list(costs.values()), nb_workers)
+    msg = (
+        f"OCR de {len(costs)} documents, durée estimée {format_duration(makespan)}"
+        + f" ({format_duration(sum(costs.values()))} cumulés, {nb_workers} en parallèle)"
+    )
+    if costs:
+        pdf_max = max(costs, key=costs.get)
+        msg += f" ; plus long: {pdf_max} ({format_duration(costs[pdf_max])})"
+    logging.info(msg)
+    print(msg)
+    return makespan
@@ -0,0 +1,185 @@
+"""Dimensionnement du pool de workers d'OCR.
+
+Plusieurs documents sont OCRisés en même temps, chacun par un appel à
+ocrmypdf qui peut lui-même traiter plusieurs pages en parallèle ("--jobs").
+Le nombre total de processus tesseract simultanés (documents × jobs) est
+borné par le nombre de coeurs disponibles et par la mémoire disponible.
+
+À nombre de processus égal, on privilégie le parallélisme entre documents:
+chaque appel à ocrmypdf comporte des étapes séquentielles (analyse du PDF,
+conversion PDF/A avec ghostscript) pendant lesquelles ses jobs sont inactifs.
+
+Le meilleur réglage dépend de la machine (ex: la sursouscription ralentit
+l'OCR sous WSL): s'il existe, le profil de la machine produit par
+`calibrate_ocr` remplace ce dimensionnement a priori.
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+import socket
+from typing import Optional, Sequence, Tuple
+
+from src.utils.file_utils import CACHE_DIR
+
+# mémoire utilisée par un processus tesseract sur une page A4 à 300 dpi (estimation prudente)
+MEM_PER_OCR_JOB = 512 * 1024 * 1024
+
+
+def get_nb_cores() -> int:
+    """Renvoie le nombre de coeurs utilisables par le processus courant.
+
+    Returns
+    -------
+    nb_cores: int
+        Nombre de coeurs (affinité CPU si elle est disponible).
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def get_available_memory() -> Optional[int]:
+    """Renvoie la mémoire disponible, en octets.
+
+    Returns
+    -------
+    mem_available: int, optional
+        Mémoire disponible ("MemAvailable" de /proc/meminfo), None si elle
+        ne peut être déterminée (hors Linux).
+    """
+    try:
+        with open("/proc/meminfo") as f_mem:
+            for line in f_mem:
+                if line.startswith("MemAvailable:"):
+                    # valeur en kiB
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def get_nb_ocr_slots(
+    nb_cores: Optional[int] = None,
+    mem_available: Optional[int] = None,
+) -> int:
+    """Renvoie le nombre de processus tesseract pouvant tourner simultanément.
+
+    Parameters
+    ----------
+    nb_cores: int, optional
+        Nombre de coeurs ; par défaut, ceux du processus courant.
+    mem_available: int, optional
+        Mémoire disponible en octets ; par défaut, celle du système.
+
+    Returns
+    -------
+    nb_slots: int
+        Nombre de processus tesseract simultanés (au moins 1).
+    """
+    if nb_cores is None:
+        nb_cores = get_nb_cores()
+    if mem_available is None:
+        mem_available = get_available_memory()
+    nb_slots = nb_cores
+    if mem_available is not None:
+        nb_slots = min(nb_slots, mem_available // MEM_PER_OCR_JOB)
+    return max(nb_slots, 1)
+
+
+def plan_ocr_pool(
+    nb_pages_docs: Sequence[int],
+    nb_cores: Optional[int] = None,
+    mem_available: Optional[int] = None,
+) -> Tuple[int, int]:
+    """Détermine le nombre de documents traités en parallèle et le nombre de jobs par document.
+
+    Parameters
+    ----------
+    nb_pages_docs: Sequence[int]
+        Nombre de pages à OCRiser de chaque document.
+    nb_cores: int, optional
+        Nombre de coeurs ; par défaut, ceux du processus courant.
+    mem_available: int, optional
+        Mémoire disponible en octets ; par défaut, celle du système.
+
+    Returns
+    -------
+    nb_workers: int
+        Nombre de documents OCRisés simultanément.
+    jobs_per_doc: int
+        Valeur de l'option "--jobs" d'ocrmypdf pour chaque document.
+    """
+    if nb_cores is None:
+        nb_cores = get_nb_cores()
+    if mem_available is None:
+        mem_available = get_available_memory()
+    nb_slots = get_nb_ocr_slots(nb_cores, mem_available)
+    nb_docs = len(nb_pages_docs)
+    if nb_docs == 0:
+        return 1, nb_slots
+    # un document par slot tant qu'il y a assez de documents ;
+    # les slots restants sont répartis en jobs, sans dépasser le nombre
+    # (médian) de pages à OCRiser par document
+    nb_pages_med = sorted(nb_pages_docs)[nb_docs // 2]
+    jobs_per_doc = max(1, min(nb_slots // nb_docs, nb_pages_med))
+    nb_workers = max(1, min(nb_docs, nb_slots // jobs_per_doc))
+    logging.info(
+        f"Pool d'OCR: {nb_workers} documents x {jobs_per_doc} jobs"
+        + f" ({nb_cores} coeurs, mémoire disponible: {mem_available} octets)"
+    )
+    return nb_workers, jobs_per_doc
+
+
+def get_profile_path(hostname: Optional[str] = None) -> Path:
+    """Renvoie le chemin du profil d'OCR d'une machine.
+
+    Parameters
+    ----------
+    hostname: str, optional
+        Nom de la machine ; par défaut, la machine courante.
+
+    Returns
+    -------
+    fp_profile: Path
+        Fichier JSON du profil, dans le dossier des caches persistants.
+    """
+    if hostname is None:
+        hostname = socket.gethostname()
+    return CACHE_DIR / f"ocr-profile_{hostname}.json"
+
+
+def load_ocr_profile(fp_profile: Optional[Path] = None) -> Optional[dict]:
+    """Charge le profil d'OCR de la machine, s'il existe.
+
+    Parameters
+    ----------
+    fp_profile: Path, optional
+        Fichier JSON du profil ; par défaut, celui de la machine courante.
+
+    Returns
+    -------
+    profile: dict, optional
+        Réglage retenu par la calibration: "workers" (documents
+        simultanés), "jobs" (option "--jobs" d'ocrmypdf) et "omp_threads"
+        ("OMP_THREAD_LIMIT") ; None si le profil n'existe pas ou a été
+        produit sur une machine avec un autre nombre de coeurs.
+    """
+    if fp_profile is None:
+        fp_profile = get_profile_path()
+    if not fp_profile.is_file():
+        return None
+    with open(fp_profile) as f_profile:
+        profile = json.load(f_profile)
+    if profile.get("nb_cores") != get_nb_cores():
+        logging.warning(
+            f"Profil d'OCR ignoré, calibré pour {profile.get('nb_cores')} coeurs"
+            + f" au lieu de {get_nb_cores()}: {fp_profile}"
+        )
+        return None
+    logging.info(
+        f"Profil d'OCR {fp_profile}: {profile['workers']} documents x"
+        + f" {profile['jobs']} jobs x {profile['omp_threads']} threads"
+    )
+    return profile
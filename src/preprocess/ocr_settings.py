@@ -0,0 +1,123 @@
+"""Réglages nommés de l'OCR: "fast", "balanced", "best".
+
+Un réglage peut être choisi pour tout un lot, ou selon le logiciel qui a
+produit le PDF (champs "creatortool" et "producer" de l'index, voir
+`select_ocr_settings`) ; `bench_ocr_settings` mesure, pour chaque réglage,
+le débit et la part des champs correctement extraits.
+
+Le mode adaptatif d'`extract_text_ocr` OCRise d'abord tous les documents
+avec des réglages rapides ("fast"), puis ne repasse avec des réglages de
+qualité ("best") que sur les pages dont le texte est illisible, ou sur les
+documents dont les champs clés n'ont pas été trouvés.
+
+Chaque réglage est un dictionnaire:
+* "dpi": résolution de rastérisation des pages (moteur "tesseract"
+seulement: ocrmypdf OCRise les images à leur résolution native) ;
+* "tessdata_dir": dossier des modèles de tesseract (ex: modèles "fast" de
+<https://github.com/tesseract-ocr/tessdata_fast>), None pour les modèles
+installés par défaut ;
+* "oem": moteur de tesseract ("--oem", 1: LSTM seul) ;
+* "psm": segmentation des pages ("--psm", 1: automatique avec détection de
+l'orientation, 3: automatique) ;
+* "deskew", "clean": redressement et nettoyage des pages par ocrmypdf
+("--deskew", "--clean", ce dernier nécessite unpaper) ;
+* "optimize": niveau d'optimisation du PDF/A produit par ocrmypdf
+("--optimize").
+"""
+
+import os
+import re
+from typing import Optional
+
+# dossier des modèles "fast" de tesseract, s'ils sont installés
+TESSDATA_FAST_DIR = os.environ.get("TESSDATA_FAST_PREFIX")
+
+OCR_SETTINGS = {
+    # rapide (première passe du mode adaptatif)
+    "fast": {
+        "dpi": 150,
+        "tessdata_dir": TESSDATA_FAST_DIR,
+        "oem": 1,
+        "psm": 3,
+        "deskew": False,
+        "clean": False,
+        "optimize": 0,
+    },
+    # intermédiaire: modèles par défaut, pages redressées
+    "balanced": {
+        "dpi": 200,
+        "tessdata_dir": None,
+        "oem": 1,
+        "psm": 3,
+        "deskew": True,
+        "clean": False,
+        "optimize": 0,
+    },
+    # qualité maximale (seconde passe du mode adaptatif, sur les pages en échec)
+    "best": {
+        "dpi": 300,
+        "tessdata_dir": None,
+        "oem": 1,
+        "psm": 1,
+        "deskew": True,
+        "clean": True,
+        "optimize": 1,
+    },
+}
+
+# réglages selon le logiciel ayant produit le PDF: (champ de l'index,
+# expression régulière, réglage) ; la première règle qui s'applique l'emporte
+OCR_SETTINGS_BY_PRODUCER = [
+    # numérisations de piètre qualité (voir `process_metadata.guess_badocr`)
+    ("creatortool", r"^\s*Image Capture Plus\s*$", "best"),
+    ("producer", r"^\s*Adobe PSL", "best"),
+    ("creatortool", r"^\s*Canon\s*$", "balanced"),
+]
+P_OCR_SETTINGS_BY_PRODUCER = [
+    (field, re.compile(regex), settings)
+    for field, regex, settings in OCR_SETTINGS_BY_PRODUCER
+]
+
+
+def get_settings_key(ocr_pass: str) -> str:
+    """Renvoie la clé d'un réglage d'OCR, pour le cache des pages OCRisées.
+
+    Parameters
+    ----------
+    ocr_pass: str
+        Nom du réglage, clé de `OCR_SETTINGS`.
+
+    Returns
+    -------
+    settings_key: str
+        Valeurs du réglage, concaténées.
+    """
+    settings = OCR_SETTINGS[ocr_pass]
+    return "|" + ",".join(f"{k}={v}" for k, v in sorted(settings.items()))
+
+
+def select_ocr_settings(
+    creatortool: Optional[str], producer: Optional[str], default: Optional[str]
+) -> Optional[str]:
+    """Choisit le réglage d'OCR d'un document selon le logiciel producteur.
+
+    Parameters
+    ----------
+    creatortool: str, optional
+        Champ "creatortool" des métadonnées du PDF.
+    producer: str, optional
+        Champ "producer" des métadonnées du PDF.
+    default: str, optional
+        Réglage à utiliser si aucune règle ne s'applique.
+
+    Returns
+    -------
+    ocr_pass: str, optional
+        Nom du réglage, clé de `OCR_SETTINGS`.
+    """
+    fields = {"creatortool": creatortool, "producer": producer}
+    for field, p_value, settings in P_OCR_SETTINGS_BY_PRODUCER:
+        value = fields[field]
+        if isinstance(value, str) and p_value.search(value):
+            return settings
+    return default
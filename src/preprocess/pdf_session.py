@@ -0,0 +1,236 @@
+"""Document PDF ouvert une seule fois et partagé entre les traitements.
+
+Un même fichier était ouvert et analysé successivement par pikepdf
+(métadonnées), pdftotext (texte natif) et PyPDF2 (signature électronique).
+`PdfSession` ouvre le fichier une seule fois, le projette en mémoire (mmap)
+et fournit à la demande (évaluation paresseuse) le hachage, les
+métadonnées, le nombre de pages, le texte natif par page et la date de
+signature électronique, à partir de ce même tampon.
+
+Une session est ouverte par document et par étape: l'indexation (hachage et
+métadonnées, voir `pdf_info`), la classification des pages, le cache de
+l'OCR et la détection de la signature électronique ouvrent chacun leur
+propre session. Les étapes du pipeline étant exécutées par des processus
+distincts (`process_batch.sh`), une même session n'est pas partagée d'une
+étape à l'autre.
+"""
+
+from datetime import datetime
+import hashlib
+import io
+import mmap
+from pathlib import Path
+from typing import List, Optional
+
+import pikepdf
+
+
+class _MmapReader(io.RawIOBase):
+    """Flux en lecture seule sur un fichier projeté en mémoire.
+
+    Chaque lecteur a sa propre position, ce qui permet de passer le même
+    tampon à plusieurs bibliothèques.
+    """
+
+    def __init__(self, buf):
+        self._buf = buf
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        else:
+            self._pos = len(self._buf) + offset
+        return self._pos
+
+    def readinto(self, b) -> int:
+        data = self._buf[self._pos : self._pos + len(b)]
+        b[: len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+def transform_pdf_date(date_str: str) -> str:
+    """Convertit une date PDF ("D:YYYYmmddHHMMSS+hh'mm'") au format jj/mm/aaaa.
+
+    Parameters
+    ----------
+    date_str: str
+        Date au format PDF.
+
+    Returns
+    -------
+    date_fr: str
+        Date au format jj/mm/aaaa.
+    """
+    if date_str.startswith("D:"):
+        date_str = date_str[2:]
+    date_str = date_str.replace("'", "")
+    dt = datetime.strptime(date_str, "%Y%m%d%H%M%S%z")
+    return dt.strftime("%d/%m/%Y")
+
+
+class PdfSession:
+    """Document PDF ouvert une seule fois, analysé à la demande.
+
+    Les analyses coûteuses (pikepdf, pdftotext) ne sont faites qu'au premier
+    accès, puis conservées ; `nb_parses` compte les analyses effectivement
+    réalisées.
+
+    Exemple:
+    ```
+    with PdfSession(fp_pdf) as session:
+        meta = session.metadata()
+        pages = session.pages_text()
+    ```
+    """
+
+    def __init__(self, fp_pdf: Path):
+        """Ouvre le fichier et le projette en mémoire.
+
+        Parameters
+        ----------
+        fp_pdf: Path
+            Chemin du fichier PDF.
+        """
+        self.fp_pdf = fp_pdf
+        self._f = open(fp_pdf, "rb")
+        try:
+            self._buf = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # fichier vide: mmap impossible
+            self._buf = self._f.read()
+        self._pdf = None  # pikepdf.Pdf
+        self._pdftotext = None  # pdftotext.PDF
+        self.nb_parses = 0
+
+    def close(self):
+        """Ferme le document (les objets pikepdf obtenus deviennent invalides)."""
+        if self._pdf is not None:
+            self._pdf.close()
+            self._pdf = None
+        self._pdftotext = None
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def pdf(self) -> pikepdf.Pdf:
+        """Document analysé par pikepdf (analysé au premier accès)."""
+        if self._pdf is None:
+            self._pdf = pikepdf.open(_MmapReader(self._buf))
+            self.nb_parses += 1
+        return self._pdf
+
+    @property
+    def nb_pages(self) -> int:
+        """Nombre de pages."""
+        return len(self.pdf.pages)
+
+    def digest(self, digest: str = "blake2b", digest_size: int = 10) -> str:
+        """Calcule le hachage du fichier à partir du tampon en mémoire.
+
+        Parameters
+        ----------
+        digest: str
+            Nom de la fonction de hachage.
+        digest_size: int
+            Taille du digest (blake2b, sinon ignoré).
+
+        Returns
+        -------
+        fd_hexdigest: str
+            Hachage du fichier, identique à celui de `get_file_digest`.
+        """
+        if digest == "blake2b":
+            f_digest = hashlib.blake2b(self._buf, digest_size=digest_size)
+        else:
+            f_digest = hashlib.new(digest, self._buf)
+        return f_digest.hexdigest()
+
+    def metadata(self, verbose: bool = False) -> dict:
+        """Renvoie les métadonnées du PDF (voir `get_pdf_info_pikepdf`).
+
+        Parameters
+        ----------
+        verbose: boolean, defaults to False
+            Si True, des warnings sont émis à chaque anomalie constatée dans
+            les métadonnées du PDF.
+
+        Returns
+        -------
+        infos: dict
+            Nombre de pages et métadonnées du PDF.
+        """
+        # import local: pdf_info utilise lui-même PdfSession
+        from src.preprocess.pdf_info import get_pdf_info_pikepdf_doc
+
+        return get_pdf_info_pikepdf_doc(self.pdf, self.fp_pdf, verbose=verbose)
+
+    @property
+    def pdftotext(self):
+        """Document analysé par pdftotext (analysé au premier accès).
+
+        Lève `pdftotext.Error` si le document ne peut pas être analysé.
+        """
+        if self._pdftotext is None:
+            # import local: pdftotext (poppler) n'est requis que pour le texte natif
+            import pdftotext
+
+            self._pdftotext = pdftotext.PDF(_MmapReader(self._buf))
+            self.nb_parses += 1
+        return self._pdftotext
+
+    def pages_text(self) -> List[str]:
+        """Renvoie le texte natif de chaque page, extrait par pdftotext.
+
+        Returns
+        -------
+        pages: List[str]
+            Texte natif de chaque page (terminé par "\f").
+        """
+        return list(self.pdftotext)
+
+    def signature_date(self) -> Optional[str]:
+        """Renvoie la date de la signature électronique du PDF, le cas échéant.
+
+        Parcourt les champs de formulaire (AcroForm) à la recherche d'un
+        champ de signature ("/FT /Sig"), comme `PyPDF2.PdfReader.get_fields`.
+
+        Returns
+        -------
+        signature_date: str, optional
+            Date de la signature au format jj/mm/aaaa, None en l'absence de
+            signature ou de date.
+        """
+        acroform = self.pdf.Root.get("/AcroForm")
+        if acroform is None:
+            return None
+        stack = [(x, None) for x in reversed(list(acroform.get("/Fields", [])))]
+        while stack:
+            field, ft_parent = stack.pop()
+            # le type de champ est hérité du champ parent
+            ft = field.get("/FT", ft_parent)
+            if ft == "/Sig":
+                sig_v = field.get("/V")
+                sig_m = sig_v.get("/M") if sig_v is not None else None
+                return transform_pdf_date(str(sig_m)) if sig_m is not None else None
+            stack.extend((x, ft) for x in reversed(list(field.get("/Kids", []))))
+        return None
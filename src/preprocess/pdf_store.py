@@ -0,0 +1,93 @@
+"""Stockage des PDF indexés, adressé par contenu.
+
+Chaque PDF est stocké une seule fois, sous le nom de son hachage, dans une
+arborescence à deux niveaux (ex: `ab/cd/abcd0123....pdf`) pour limiter le
+nombre de fichiers par dossier.
+Le stockage se fait par reflink ou lien physique quand le dossier d'entrée
+et le stock sont sur le même système de fichiers, sinon par copie.
+
+Les étapes suivantes du pipeline désignent un PDF par son nom logique
+(colonne "pdf": `{hachage}-{nom du fichier d'origine}`), que `resolve()`
+permet de convertir en chemin dans le stock.
+"""
+
+from pathlib import Path
+from typing import Tuple
+
+from src.utils.file_utils import link_or_copy
+
+
+class PdfStore:
+    """Stock de PDF adressé par contenu (hachage)."""
+
+    def __init__(self, root: Path, allow_link: bool = True):
+        """Ouvre le stock.
+
+        Parameters
+        ----------
+        root: Path
+            Dossier racine du stock.
+        allow_link: bool, defaults to True
+            Si False, les fichiers sont toujours copiés (pas de reflink ni
+            de lien physique).
+        """
+        self.root = root
+        self.allow_link = allow_link
+
+    def path_for(self, f_digest: str) -> Path:
+        """Renvoie le chemin de stockage d'un contenu.
+
+        Parameters
+        ----------
+        f_digest: str
+            Hachage du fichier.
+
+        Returns
+        -------
+        fp_stored: Path
+            Chemin du fichier dans le stock.
+        """
+        return self.root / f_digest[:2] / f_digest[2:4] / f"{f_digest}.pdf"
+
+    def resolve(self, pdf: str) -> Path:
+        """Renvoie le chemin de stockage d'un PDF à partir de son nom logique.
+
+        Parameters
+        ----------
+        pdf: str
+            Nom logique du PDF (`{hachage}-{nom}`), colonne "pdf" de l'index.
+
+        Returns
+        -------
+        fp_stored: Path
+            Chemin du fichier dans le stock.
+        """
+        f_digest, sep, _ = pdf.partition("-")
+        if not sep:
+            raise ValueError(f"Nom de PDF sans hachage: {pdf}")
+        return self.path_for(f_digest)
+
+    def add(self, fp_src: Path, f_digest: str) -> Tuple[Path, str]:
+        """Ajoute un fichier au stock, s'il n'y est pas déjà.
+
+        Parameters
+        ----------
+        fp_src: Path
+            Fichier à stocker.
+        f_digest: str
+            Hachage du fichier.
+
+        Returns
+        -------
+        fp_stored: Path
+            Chemin du fichier dans le stock.
+        method: str
+            "existing" si le contenu était déjà stocké, sinon la méthode
+            utilisée: "reflink", "hardlink" ou "copy".
+        """
+        fp_stored = self.path_for(f_digest)
+        if fp_stored.is_file():
+            return fp_stored, "existing"
+        fp_stored.parent.mkdir(parents=True, exist_ok=True)
+        method = link_or_copy(fp_src, fp_stored, allow_link=self.allow_link)
+        return fp_stored, method
@@ -0,0 +1,145 @@
+"""Pré-classification des documents, pour traiter les arrêtés urgents en premier.
+
+Les arrêtés de péril grave et imminent et de mise en sécurité (procédure
+urgente) doivent être publiés au plus vite, alors que les documents sont
+reçus par lots où ils côtoient de nombreuses mainlevées.
+
+Dès l'extraction du texte natif, chaque document reçoit une priorité, à
+partir du texte de sa première page (`get_urgence`, `get_classe`) et de son
+nom de fichier. Les documents sont ensuite OCRisés (`extract_text_ocr`) et
+analysés (`parse_doc_direct`) par ordre de priorité.
+
+La pré-classification est volontairement sommaire: les PDF image n'ont pas
+de texte natif, et seul leur nom de fichier est alors utilisé. La
+classification définitive est faite à l'analyse du texte complet.
+"""
+
+import logging
+from pathlib import Path
+import re
+from typing import NamedTuple, Optional
+
+import pandas as pd
+
+from src.domain_knowledge.typologie_securite import get_classe, get_urgence
+from src.utils.txt_format import load_pages_text
+
+# priorités, de la plus haute à la plus basse
+PRIORITY_URGENT = 0  # péril grave et imminent, mise en sécurité urgente
+PRIORITY_SECURITE = 1  # autres arrêtés de mise en sécurité (dont modificatifs)
+PRIORITY_UNKNOWN = 2  # non reconnu
+PRIORITY_MAINLEVEE = 3  # mainlevées
+
+# mots-clés des noms de fichiers
+P_FN_URGENT = re.compile(
+    r"urgen|imminent|(?:^|[^a-z])(?:pgi|msu)(?:[^a-z]|$)", re.IGNORECASE
+)
+P_FN_MAINLEVEE = re.compile(
+    r"main\s*lev[ée]e|abrogation|(?:^|[^a-z])ml(?:[^a-z]|$)", re.IGNORECASE
+)
+
+
+def _get_priority_txt(txt: str) -> int:
+    """Détermine la priorité d'un document d'après un texte.
+
+    Parameters
+    ----------
+    txt: str
+        Texte de la première page, ou nom de fichier.
+
+    Returns
+    -------
+    priority: int
+        Priorité du document.
+    """
+    # les mainlevées citent généralement l'intitulé de l'arrêté levé (ex:
+    # "mainlevée de l'arrêté de péril grave et imminent"): la classe est
+    # déterminée avant l'urgence
+    classe = get_classe(txt)
+    if classe == "Arrêté de mainlevée":
+        return PRIORITY_MAINLEVEE
+    if get_urgence(txt) == "oui":
+        return PRIORITY_URGENT
+    if classe is not None:
+        return PRIORITY_SECURITE
+    return PRIORITY_UNKNOWN
+
+
+def get_priority(first_page: Optional[str], filename: str) -> int:
+    """Détermine la priorité d'un document.
+
+    Le texte de la première page prévaut ; à défaut, le nom du fichier est
+    analysé comme un texte, puis par mots-clés.
+
+    Parameters
+    ----------
+    first_page: str, optional
+        Texte natif de la première page, None si le document n'en a pas.
+    filename: str
+        Nom du fichier d'origine.
+
+    Returns
+    -------
+    priority: int
+        Priorité du document (`PRIORITY_URGENT` est la plus haute).
+    """
+    if first_page is not None and first_page.strip():
+        priority = _get_priority_txt(first_page)
+        if priority != PRIORITY_UNKNOWN:
+            return priority
+    fn_txt = re.sub(r"[_\-.]+", " ", Path(filename).stem)
+    priority = _get_priority_txt(fn_txt)
+    if priority != PRIORITY_UNKNOWN:
+        return priority
+    # mainlevées d'abord, leur nom cite souvent l'arrêté levé (ex: "mainlevee_PGI")
+    if P_FN_MAINLEVEE.search(fn_txt):
+        return PRIORITY_MAINLEVEE
+    if P_FN_URGENT.search(fn_txt):
+        return PRIORITY_URGENT
+    return PRIORITY_UNKNOWN
+
+
+def get_doc_priority(df_row: NamedTuple, fp_txt: Optional[Path]) -> int:
+    """Détermine la priorité d'un document à partir de son texte natif.
+
+    Parameters
+    ----------
+    df_row: NamedTuple
+        Métadonnées du document, dont "pdf" et "origpath".
+    fp_txt: Path, optional
+        Fichier du texte natif, None s'il n'a pas été produit.
+
+    Returns
+    -------
+    priority: int
+        Priorité du document.
+    """
+    first_page = None
+    if fp_txt is not None and fp_txt.is_file():
+        first_page = load_pages_text(fp_txt)[0]
+    filename = df_row.origpath if pd.notna(df_row.origpath) else df_row.pdf
+    priority = get_priority(first_page, Path(filename).name)
+    logging.debug(f"Priorité {priority}: {df_row.pdf}")
+    return priority
+
+
+def sort_by_priority(df: pd.DataFrame) -> pd.DataFrame:
+    """Trie des documents par priorité, en conservant l'ordre d'arrivée à
+    priorité égale.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        Métadonnées des documents, dont "priority".
+
+    Returns
+    -------
+    df_sorted: pd.DataFrame
+        Documents triés, ceux sans priorité étant traités comme
+        `PRIORITY_UNKNOWN`.
+    """
+    return df.sort_values(
+        "priority",
+        key=lambda s: s.fillna(PRIORITY_UNKNOWN),
+        kind="stable",
+    )
@@ -1,5 +1,7 @@
 """Les traitements permettent de:
 * détecter les fichiers doublons,
+* détecter les numérisations en double, par hachage perceptuel des pages
+(voir `scan_duplicates`),
 * déterminer si le PDF est du texte ou image,
 * déterminer si le PDF contient des tampons de télétransmission en haut des pages,
 * déterminer si le PDF contient une dernière page qui est l'accusé de réception de la télétransmission.
@@ -12,11 +14,14 @@ import argparse
 from datetime import datetime
 import logging
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
 import pandas as pd
 
 from src.preprocess.index_pdfs import DTYPE_META_BASE
+from src.preprocess.scan_duplicates import flag_scan_duplicates
+from src.utils.file_utils import CACHE_DIR
+from src.utils.storage import read_table, write_table
 
 # format des données en sortie
 DTYPE_META_PROC = DTYPE_META_BASE | {
@@ -30,6 +35,9 @@ DTYPE_META_PROC = DTYPE_META_BASE | {
     # type de PDF
     "guess_pdftext": "boolean",
     "guess_badocr": "boolean",
+    # numérisations en double (voir scan_duplicates)
+    "dup_scan": "boolean",
+    "dup_scan_pdf": "string",
 }
 
 
@@ -242,6 +250,50 @@ def guess_pdftext(df_meta: pd.DataFrame) -> pd.DataFrame:
     return df_mmod
 
 
+def process_files(
+    df_meta: pd.DataFrame, scandup_db: Optional[Path] = None, guess_dups: bool = True
+) -> pd.DataFrame:
+    """Enrichit les métadonnées d'un lot de fichiers PDF.
+
+    Parameters
+    ----------
+    df_meta: pd.DataFrame
+        Métadonnées des fichiers PDF, issues de l'indexation.
+    scandup_db: Path, optional
+        Base SQLite de l'index des hachages perceptuels des pages, conservée
+        entre les exécutions. Si None, les numérisations en double ne sont
+        pas recherchées.
+    guess_dups: bool, defaults to True
+        Si True, les doublons sont recherchés dans le lot (colonnes
+        "dup_allinfo", "dup_createdate" et "dup_hash", voir
+        `guess_duplicates_meta`) ; si False, ces colonnes sont vides, par
+        exemple pour mettre en cache le résultat de chaque document et
+        rechercher les doublons sur le lot complet.
+
+    Returns
+    -------
+    df_mmod: pd.DataFrame
+        Métadonnées enrichies.
+    """
+    # détecter les doublons
+    # TODO ajouter la fonction de hash en paramètre de guess_duplicates_meta() ?
+    if guess_dups:
+        df_mmod = guess_duplicates_meta(df_meta)  # fn_hash="blake2b"
+    else:
+        df_mmod = df_meta.assign(dup_allinfo=None, dup_createdate=None, dup_hash=None)
+    df_mmod = guess_tampon_transmission(df_mmod)
+    df_mmod = guess_dernpage_transmission(df_mmod)
+    df_mmod = guess_pdftext(df_mmod)
+    df_mmod = guess_badocr(df_mmod)
+    # repérer les numérisations en double de documents déjà reçus
+    if scandup_db is not None:
+        df_mmod = flag_scan_duplicates(df_mmod, scandup_db)
+    else:
+        df_mmod = df_mmod.assign(dup_scan=None, dup_scan_pdf=None)
+    df_mmod = df_mmod.astype(dtype=DTYPE_META_PROC)
+    return df_mmod
+
+
 if __name__ == "__main__":
     # log
     dir_log = Path(__file__).resolve().parents[2] / "logs"
@@ -262,6 +314,11 @@ if __name__ == "__main__":
         "out_file",
         help="Chemin vers le fichier CSV en sortie contenant les métadonnées, enrichi",
     )
+    parser.add_argument(
+        "--scandup_db",
+        default=str(CACHE_DIR / "scandup-index.sqlite"),
+        help="Base SQLite de l'index des hachages perceptuels des pages, conservée entre les exécutions ('' pour désactiver)",
+    )
     group = parser.add_mutually_exclusive_group()
     # par défaut, le fichier out_file ne doit pas exister, sinon deux options mutuellement exclusives:
     # "redo" (écrase le fichier existant) et "append" (étend le fichier existant)
@@ -279,13 +336,13 @@ if __name__ == "__main__":
 
     # entrée: CSV de métadonnées à enrichir
     in_file = Path(args.in_file).resolve()
-    if not in_file.is_file():
+    if not in_file.exists():
         raise ValueError(f"Le fichier en entrée {in_file} n'existe pas.")
 
     # sortie: CSV de métadonnées enrichi
     # on crée le dossier parent (récursivement) si besoin
     out_file = Path(args.out_file).resolve()
-    if out_file.is_file():
+    if out_file.exists():
         if not args.redo and not args.append:
             # erreur si le fichier CSV existe déjà mais ni redo, ni append
             raise ValueError(
@@ -300,23 +357,14 @@ if __name__ == "__main__":
         out_dir.mkdir(parents=True, exist_ok=True)
 
     # ouvrir le fichier d'entrée
-    df_metas = pd.read_csv(in_file, dtype=DTYPE_META_BASE)
-    # détecter les doublons
-    # TODO ajouter la fonction de hash en paramètre de guess_duplicates_meta() ?
-    df_mmod = guess_duplicates_meta(df_metas)  # fn_hash="blake2b"
-    df_mmod = guess_tampon_transmission(df_mmod)
-    df_mmod = guess_dernpage_transmission(df_mmod)
-    df_mmod = guess_pdftext(df_mmod)
-    df_mmod = guess_badocr(df_mmod)
-    # garantir le typage des (nouvelles) colonnes avant l'export
-    df_mmod = df_mmod.astype(dtype=DTYPE_META_PROC)
-
-    # sauvegarder les infos extraites dans un fichier CSV
-    if args.append and out_file.is_file():
-        # si 'append', charger le fichier existant et lui ajouter les nouvelles entrées
-        df_mmod_old = pd.read_csv(out_file, dtype=DTYPE_META_PROC)
-        df_proc = pd.concat([df_mmod_old, df_mmod])
+    df_metas = read_table(in_file, DTYPE_META_BASE)
+    # index des numérisations en double, hors de data/interim
+    if args.scandup_db:
+        scandup_db = Path(args.scandup_db).resolve()
+        scandup_db.parent.mkdir(parents=True, exist_ok=True)
     else:
-        # sinon utiliser les seules nouvelles entrées
-        df_proc = df_mmod
-    df_proc.to_csv(out_file, index=False)
+        scandup_db = None
+    df_mmod = process_files(df_metas, scandup_db=scandup_db)
+
+    # sauvegarder les infos extraites (CSV ou Parquet, selon l'extension)
+    write_table(df_mmod, out_file, DTYPE_META_PROC, append=args.append)
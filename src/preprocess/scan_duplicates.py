@@ -0,0 +1,352 @@
+"""Détection des numérisations en double, par hachage perceptuel des pages.
+
+Une nouvelle numérisation ou un ré-export du même arrêté papier produit un
+fichier dont le hachage binaire (blake2b) diffère, ce que ne détecte pas
+`process_metadata.guess_duplicates_meta`, et dont le texte natif est
+souvent absent, ce que ne détecte pas `near_duplicates`.
+
+Chaque page est rendue en vignette en niveaux de gris, puis résumée par un
+hachage perceptuel (dHash: sens du gradient horizontal sur une grille de
+`HASH_SIZE` x `HASH_SIZE` pixels). Deux pages sont identiques si la distance
+de Hamming entre leurs hachages est d'au plus `MAX_HAMMING`.
+
+Les hachages sont indexés par "multi-index hashing": chaque hachage est
+découpé en `NUM_BLOCKS` blocs, indexés séparément. Deux hachages à distance
+au plus `MAX_HAMMING` < `NUM_BLOCKS` ont au moins un bloc identique, ce qui
+permet de retrouver les pages candidates sans comparer une page à tout
+l'historique.
+L'index est stocké dans une base SQLite, conservée d'une exécution à l'autre.
+
+Des arrêtés différents produits à partir d'un même modèle ont des vignettes
+très proches: une correspondance n'est qu'un candidat, que `extract_text_ocr`
+confirme sur le texte OCRisé d'une page avant de réutiliser le texte de
+l'original (voir `confirm_same_text`).
+"""
+
+from difflib import SequenceMatcher
+import logging
+from pathlib import Path
+import re
+import sqlite3
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+from pdf2image import convert_from_path
+from PIL import Image
+
+# résolution des vignettes des pages
+THUMB_DPI = 24
+# côté de la grille du dHash: HASH_SIZE ** 2 bits
+HASH_SIZE = 16
+HASH_BITS = HASH_SIZE**2
+# nombre de blocs de l'index (blocs de HASH_BITS / NUM_BLOCKS = 16 bits)
+NUM_BLOCKS = 16
+BLOCK_BITS = HASH_BITS // NUM_BLOCKS
+# distance de Hamming maximale entre deux numérisations d'une même page
+# (doit être inférieure à NUM_BLOCKS)
+MAX_HAMMING = 15
+# écart de niveau de gris minimal pour qu'un gradient compte: dans les zones
+# blanches, le signe du gradient dépend sinon du bruit de la numérisation
+MIN_GRADIENT = 4
+# similarité minimale entre les mots d'une page et ceux de la même page de
+# l'original, pour confirmer une numérisation en double
+CONFIRM_MIN_RATIO = 0.9
+
+
+def dhash(image: Image.Image, hash_size: int = HASH_SIZE) -> int:
+    """Calcule le hachage perceptuel (dHash) d'une image.
+
+    Parameters
+    ----------
+    image: Image.Image
+        Image de la page.
+    hash_size: int, defaults to HASH_SIZE
+        Côté de la grille: le hachage compte `hash_size ** 2` bits.
+
+    Returns
+    -------
+    page_hash: int
+        Hachage de l'image.
+    """
+    pixels = np.asarray(
+        image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS),
+        dtype=np.int16,
+    )
+    bits = (pixels[:, 1:] - pixels[:, :-1] > MIN_GRADIENT).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def get_page_hashes(fp_pdf: Path) -> List[int]:
+    """Calcule le hachage perceptuel de chaque page d'un PDF.
+
+    Parameters
+    ----------
+    fp_pdf: Path
+        Chemin du fichier PDF.
+
+    Returns
+    -------
+    page_hashes: List[int]
+        Hachage de chaque page, dans l'ordre des pages.
+    """
+    thumbs = convert_from_path(fp_pdf, dpi=THUMB_DPI, grayscale=True)
+    return [dhash(thumb) for thumb in thumbs]
+
+
+def _blocks(page_hash: int) -> List[int]:
+    """Découpe un hachage en blocs, pour l'index.
+
+    Parameters
+    ----------
+    page_hash: int
+        Hachage d'une page.
+
+    Returns
+    -------
+    blocks: List[int]
+        Valeur de chaque bloc.
+    """
+    mask = (1 << BLOCK_BITS) - 1
+    return [(page_hash >> (i * BLOCK_BITS)) & mask for i in range(NUM_BLOCKS)]
+
+
+def hamming(hash_a: int, hash_b: int) -> int:
+    """Calcule la distance de Hamming entre deux hachages.
+
+    Parameters
+    ----------
+    hash_a: int
+        Premier hachage.
+    hash_b: int
+        Second hachage.
+
+    Returns
+    -------
+    dist: int
+        Nombre de bits différents.
+    """
+    return bin(hash_a ^ hash_b).count("1")
+
+
+def confirm_same_text(
+    page_txt: str, page_txt_orig: str, min_ratio: float = CONFIRM_MIN_RATIO
+) -> bool:
+    """Confirme, sur leur texte OCRisé, que deux pages sont la même page.
+
+    Les nombres (dates, numéros d'arrêté, de parcelle...) distinguent deux
+    arrêtés d'un même modèle: ils doivent être identiques, dans le même
+    ordre. Le reste du texte peut différer légèrement, d'une numérisation à
+    l'autre, par les erreurs d'OCR.
+
+    Parameters
+    ----------
+    page_txt: str
+        Texte OCRisé de la page.
+    page_txt_orig: str
+        Texte OCRisé de la même page de l'original.
+    min_ratio: float, defaults to CONFIRM_MIN_RATIO
+        Similarité minimale entre les suites de mots des deux pages.
+
+    Returns
+    -------
+    confirmed: bool
+        True si les deux pages ont les mêmes nombres et des mots similaires ;
+        False sinon, ou si l'une des pages est vide.
+    """
+    words = page_txt.split()
+    words_orig = page_txt_orig.split()
+    if not words or not words_orig:
+        return False
+    if re.findall(r"\d+", page_txt) != re.findall(r"\d+", page_txt_orig):
+        return False
+    ratio = SequenceMatcher(None, words, words_orig, autojunk=False).ratio()
+    return ratio >= min_ratio
+
+
+class ScanDupIndex:
+    """Index multi-blocs des hachages perceptuels des pages, stocké dans SQLite."""
+
+    def __init__(self, fp_db: Path):
+        """Ouvre (et crée si besoin) l'index.
+
+        Parameters
+        ----------
+        fp_db: Path
+            Fichier de la base SQLite.
+        """
+        self.fp_db = fp_db
+        self.conn = sqlite3.connect(fp_db)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS scandup_page"
+            + " (pdf TEXT, page INTEGER, nb_pages INTEGER, hash BLOB,"
+            + " PRIMARY KEY (pdf, page))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS scandup_block"
+            + " (block INTEGER, value INTEGER, pdf TEXT)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_scandup_block ON scandup_block (block, value)"
+        )
+        self.conn.commit()
+
+    def close(self):
+        """Ferme la connexion à la base."""
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _doc_hashes(self, pdf: str) -> List[int]:
+        """Renvoie les hachages des pages d'un document indexé.
+
+        Parameters
+        ----------
+        pdf: str
+            Nom du document.
+
+        Returns
+        -------
+        page_hashes: List[int]
+            Hachage de chaque page, dans l'ordre des pages.
+        """
+        return [
+            int.from_bytes(blob, "big")
+            for (blob,) in self.conn.execute(
+                "SELECT hash FROM scandup_page WHERE pdf = ? ORDER BY page", (pdf,)
+            )
+        ]
+
+    def query(self, pdf: str, page_hashes: List[int]) -> Optional[str]:
+        """Cherche un document indexé dont toutes les pages sont identiques.
+
+        Les candidats sont les documents de même nombre de pages dont la
+        première page partage un bloc avec la première page du document ;
+        toutes leurs pages sont ensuite comparées, dans l'ordre.
+
+        Parameters
+        ----------
+        pdf: str
+            Nom du document, exclu des résultats.
+        page_hashes: List[int]
+            Hachage de chaque page du document.
+
+        Returns
+        -------
+        pdf_orig: str, optional
+            Nom du document indexé le plus proche (plus petite distance
+            maximale entre pages), None si aucun ne correspond.
+        """
+        candidates = set()
+        for block, value in enumerate(_blocks(page_hashes[0])):
+            candidates.update(
+                x
+                for (x,) in self.conn.execute(
+                    "SELECT b.pdf FROM scandup_block b"
+                    + " JOIN scandup_page p ON p.pdf = b.pdf AND p.page = 1"
+                    + " WHERE b.block = ? AND b.value = ? AND p.nb_pages = ?",
+                    (block, value, len(page_hashes)),
+                )
+            )
+        candidates.discard(pdf)
+        best = None
+        for cand in sorted(candidates):
+            dist = max(
+                hamming(x, y) for x, y in zip(page_hashes, self._doc_hashes(cand))
+            )
+            if dist <= MAX_HAMMING and (best is None or dist < best[1]):
+                best = (cand, dist)
+        return best[0] if best is not None else None
+
+    def add(self, pdf: str, page_hashes: List[int]):
+        """Ajoute un document à l'index, s'il n'y est pas déjà.
+
+        Seule la première page est indexée par blocs: c'est par elle que
+        les candidats sont recherchés.
+
+        Parameters
+        ----------
+        pdf: str
+            Nom du document.
+        page_hashes: List[int]
+            Hachage de chaque page du document.
+        """
+        with self.conn:
+            cur = self.conn.executemany(
+                "INSERT OR IGNORE INTO scandup_page (pdf, page, nb_pages, hash)"
+                + " VALUES (?, ?, ?, ?)",
+                [
+                    (pdf, i, len(page_hashes), x.to_bytes(HASH_BITS // 8, "big"))
+                    for i, x in enumerate(page_hashes, start=1)
+                ],
+            )
+            if cur.rowcount:
+                self.conn.executemany(
+                    "INSERT INTO scandup_block (block, value, pdf) VALUES (?, ?, ?)",
+                    [
+                        (block, value, pdf)
+                        for block, value in enumerate(_blocks(page_hashes[0]))
+                    ],
+                )
+
+
+def flag_scan_duplicates(df_meta: pd.DataFrame, fp_db: Path) -> pd.DataFrame:
+    """Repère les numérisations en double de documents déjà indexés.
+
+    Les documents sont traités dans l'ordre du DataFrame: un document est
+    comparé aux documents des exécutions précédentes et à ceux qui le
+    précèdent dans le lot.
+    Seuls les documents qui ne sont pas des doublons sont ajoutés à l'index,
+    qui ne contient donc que des "originaux". Les PDF texte ("guess_pdftext")
+    ne sont pas OCRisés et ne sont donc pas examinés.
+
+    Parameters
+    ----------
+    df_meta: pd.DataFrame
+        Métadonnées des documents.
+    fp_db: Path
+        Base SQLite de l'index des hachages perceptuels.
+
+    Returns
+    -------
+    df_mmod: pd.DataFrame
+        Métadonnées enrichies des colonnes "dup_scan" (numérisation en double
+        d'un document déjà indexé) et "dup_scan_pdf" (document original,
+        dont le texte OCRisé sera réutilisé par `extract_text_ocr`, après
+        confirmation sur le texte d'une page) ;
+        <NA> pour les documents non examinés.
+    """
+    dup_scan = []
+    dup_scan_pdf = []
+    with ScanDupIndex(fp_db) as index:
+        for df_row in df_meta.itertuples():
+            if pd.notna(df_row.guess_pdftext) and df_row.guess_pdftext:
+                dup_scan.append(None)
+                dup_scan_pdf.append(None)
+                continue
+            try:
+                page_hashes = get_page_hashes(Path(df_row.fullpath))
+            except Exception as e:
+                logging.warning(f"Vignettes impossibles à produire: {df_row.pdf}: {e}")
+                page_hashes = []
+            if not page_hashes:
+                dup_scan.append(None)
+                dup_scan_pdf.append(None)
+                continue
+            pdf_orig = index.query(df_row.pdf, page_hashes)
+            if pdf_orig is None:
+                index.add(df_row.pdf, page_hashes)
+                dup_scan.append(False)
+                dup_scan_pdf.append(None)
+            else:
+                logging.warning(f"Numérisation en double de {pdf_orig}: {df_row.pdf}")
+                dup_scan.append(True)
+                dup_scan_pdf.append(pdf_orig)
+    nb_dups = sum(x is True for x in dup_scan)
+    logging.info(f"Numérisations en double: {nb_dups} / {len(df_meta)}")
+    df_mmod = df_meta.assign(dup_scan=dup_scan, dup_scan_pdf=dup_scan_pdf)
+    return df_mmod
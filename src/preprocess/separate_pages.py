@@ -9,6 +9,7 @@ from pathlib import Path
 import pandas as pd
 
 from src.preprocess.determine_pdf_type import DTYPE_META_NTXT_PDFTYPE
+from src.utils.storage import read_table, write_table
 from src.utils.txt_format import load_pages_text
 
 # champs des documents copiés pour les pages: métadonnées du fichier PDF et du TXT
@@ -126,13 +127,13 @@ if __name__ == "__main__":
 
     # entrée: CSV de pages de texte
     in_file = Path(args.in_file).resolve()
-    if not in_file.is_file():
+    if not in_file.exists():
         raise ValueError(f"Le fichier en entrée {in_file} n'existe pas.")
 
     # sortie: CSV de pages de texte annotées
     # on crée le dossier parent (récursivement) si besoin
     out_file = Path(args.out_file).resolve()
-    if out_file.is_file():
+    if out_file.exists():
         if not args.redo and not args.append:
             # erreur si le fichier CSV existe déjà mais ni redo, ni append
             raise ValueError(
@@ -148,15 +149,8 @@ if __name__ == "__main__":
 
     # ouvrir le fichier d'entrée
     logging.info(f"Ouverture du fichier CSV {in_file}")
-    df_meta = pd.read_csv(in_file, dtype=DTYPE_META_NTXT_PDFTYPE)
+    df_meta = read_table(in_file, DTYPE_META_NTXT_PDFTYPE)
     # traiter les documents (découpés en pages de texte)
     df_txts = create_pages_dataframe(df_meta)
-    # sauvegarder les infos extraites dans un fichier CSV
-    if args.append and out_file.is_file():
-        # si 'append', charger le fichier existant et lui ajouter les nouvelles entrées
-        df_txts_old = pd.read_csv(out_file, dtype=DTYPE_NTXT_PAGES)
-        df_proc = pd.concat([df_txts_old, df_txts])
-    else:
-        # sinon utiliser les seules nouvelles entrées
-        df_proc = df_txts
-    df_proc.to_csv(out_file, index=False)
+    # sauvegarder les infos extraites (CSV ou Parquet, selon l'extension)
+    write_table(df_txts, out_file, DTYPE_NTXT_PAGES, append=args.append)
@@ -0,0 +1,581 @@
+"""Ingestion continue: surveille le dossier d'entrée et traite les nouveaux PDF
+par micro-lots.
+
+Remplace, pour un démon lancé une fois pour toutes, l'exécution périodique de
+`scripts/process.sh` qui reparcourt tout le dossier d'entrée à chaque fois.
+
+Les nouveaux fichiers sont repérés avec inotify si le module optionnel
+`inotify_simple` est installé, sinon par scrutation périodique (qui ne
+reliste que les dossiers modifiés). NB: sous WSL, inotify ne voit pas les
+fichiers écrits côté Windows dans /mnt/c: utiliser alors `--poll`.
+
+Un fichier n'est pris en compte que lorsque sa taille et sa date de
+modification n'ont pas changé depuis `settle_s` secondes (fichier en cours
+de copie). Les fichiers prêts sont indexés par micro-lots avec
+`index_folder`, puis les étapes suivantes sont lancées sur le lot par
+`scripts/process_batch.sh`.
+"""
+
+import argparse
+from datetime import datetime
+import logging
+import os
+from pathlib import Path
+import signal
+import subprocess
+import time
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import inotify_simple
+except ImportError:
+    # dépendance optionnelle: repli sur la scrutation périodique
+    inotify_simple = None
+
+from src.preprocess.deferred_queue import requeue_deferred
+from src.preprocess.index_pdfs import (
+    DIR_PDF_STORE,
+    FP_FIRST_SEEN_DB,
+    FP_INDEX_DB,
+    index_folder,
+)
+from src.utils.file_utils import CACHE_DIR
+
+# racine du dépôt (les scripts shell utilisent des chemins relatifs)
+ROOT_DIR = Path(__file__).resolve().parents[2]
+
+# délai (s) sans modification avant qu'un fichier soit considéré complet
+SETTLE_S = 10.0
+# délai (s) entre deux scrutations (ou attente maximale d'un événement inotify)
+POLL_S = 5.0
+# délai maximal (s) d'attente d'un micro-lot incomplet, et taille maximale d'un lot
+BATCH_WAIT_S = 60.0
+BATCH_MAX = 50
+
+
+def _is_pdf(name: str) -> bool:
+    """Indique si un nom de fichier est celui d'un PDF (hors fichiers cachés)."""
+    return name.lower().endswith(".pdf") and not name.startswith((".", "~$"))
+
+
+def _list_pdfs(in_dir: Path, recursive: bool = True) -> List[Path]:
+    """Liste les PDF d'un dossier (parcours complet).
+
+    Parameters
+    ----------
+    in_dir: Path
+        Dossier à parcourir.
+    recursive: bool, defaults to True
+        Si True, parcourt aussi les sous-dossiers.
+
+    Returns
+    -------
+    fps: List[Path]
+        Fichiers PDF.
+    """
+    fps = []
+    for dirpath, dirnames, filenames in os.walk(in_dir):
+        fps.extend(Path(dirpath) / x for x in filenames if _is_pdf(x))
+        if not recursive:
+            break
+    return fps
+
+
+class PollingScanner:
+    """Repère les PDF ajoutés par scrutation périodique du dossier d'entrée.
+
+    Seuls les dossiers dont la date de modification a changé (ajout,
+    suppression ou renommage d'une entrée) sont relistés ; les autres sont
+    seulement consultés (stat) pour descendre dans leurs sous-dossiers.
+    """
+
+    def __init__(self, in_dir: Path, recursive: bool = True):
+        self.in_dir = in_dir
+        self.recursive = recursive
+        # pour chaque dossier: date de modification et sous-dossiers lors du dernier listage
+        self.dirs: Dict[Path, Tuple[int, List[Path]]] = {}
+
+    def scan(self, timeout: float) -> List[Path]:
+        """Attend `timeout` secondes puis renvoie les PDF des dossiers modifiés.
+
+        Le premier appel renvoie tous les PDF du dossier d'entrée.
+
+        Parameters
+        ----------
+        timeout: float
+            Délai d'attente avant la scrutation.
+
+        Returns
+        -------
+        fps: List[Path]
+            PDF présents dans les dossiers modifiés depuis la dernière scrutation.
+        """
+        if self.dirs:
+            time.sleep(timeout)
+        fps = []
+        seen = set()
+        stack = [self.in_dir]
+        while stack:
+            d = stack.pop()
+            try:
+                mtime = d.stat().st_mtime_ns
+            except OSError:
+                continue
+            seen.add(d)
+            cached = self.dirs.get(d)
+            if cached is not None and cached[0] == mtime:
+                subdirs = cached[1]
+            else:
+                subdirs = []
+                try:
+                    with os.scandir(d) as it:
+                        for entry in it:
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(Path(entry.path))
+                            elif _is_pdf(entry.name):
+                                fps.append(Path(entry.path))
+                except OSError:
+                    continue
+                self.dirs[d] = (mtime, subdirs)
+            if self.recursive:
+                stack.extend(subdirs)
+        # oublier les dossiers disparus
+        for d in set(self.dirs) - seen:
+            del self.dirs[d]
+        return fps
+
+
+class InotifyScanner:
+    """Repère les PDF ajoutés grâce aux événements inotify (Linux)."""
+
+    def __init__(self, in_dir: Path, recursive: bool = True):
+        self.in_dir = in_dir
+        self.recursive = recursive
+        self.inotify = inotify_simple.INotify()
+        flags = inotify_simple.flags
+        self.mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+        self.wd2dir: Dict[int, Path] = {}
+        self.initial = True
+        self._watch(in_dir)
+
+    def _watch(self, d: Path):
+        """Surveille un dossier et, si récursif, ses sous-dossiers."""
+        try:
+            self.wd2dir[self.inotify.add_watch(d, self.mask)] = d
+        except OSError as e:
+            logging.warning(f"Impossible de surveiller {d}: {e}")
+            return
+        if self.recursive:
+            for x in d.iterdir():
+                if x.is_dir() and not x.is_symlink():
+                    self._watch(x)
+
+    def scan(self, timeout: float) -> List[Path]:
+        """Attend au plus `timeout` secondes et renvoie les PDF signalés.
+
+        Le premier appel renvoie tous les PDF du dossier d'entrée.
+
+        Parameters
+        ----------
+        timeout: float
+            Délai maximal d'attente d'un événement.
+
+        Returns
+        -------
+        fps: List[Path]
+            PDF créés, écrits ou déplacés dans le dossier d'entrée.
+        """
+        if self.initial:
+            self.initial = False
+            return _list_pdfs(self.in_dir, recursive=self.recursive)
+        fps = []
+        flags = inotify_simple.flags
+        for event in self.inotify.read(timeout=int(timeout * 1000)):
+            d = self.wd2dir.get(event.wd)
+            if d is None or not event.name:
+                continue
+            fp = d / event.name
+            if event.mask & flags.ISDIR:
+                if self.recursive and event.mask & (flags.CREATE | flags.MOVED_TO):
+                    # nouveau sous-dossier: le surveiller, et prendre les PDF
+                    # qu'il contenait déjà (ex: dossier déplacé)
+                    self._watch(fp)
+                    fps.extend(_list_pdfs(fp))
+            elif _is_pdf(event.name):
+                fps.append(fp)
+        return fps
+
+
+class PendingFiles:
+    """Fichiers repérés, en attente de stabilisation (anti-rebond)."""
+
+    def __init__(self, settle_s: float = SETTLE_S):
+        self.settle_s = settle_s
+        # fichier => (taille, date de modification), instant depuis lequel elles sont stables
+        self.pending: Dict[Path, Tuple[Optional[Tuple[int, int]], float]] = {}
+        # fichiers déjà ingérés, avec leur (taille, date de modification)
+        self.done: Dict[Path, Tuple[int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def add(self, fp: Path, now: float):
+        """Signale un fichier nouveau ou modifié.
+
+        Parameters
+        ----------
+        fp: Path
+            Fichier.
+        now: float
+            Instant courant (time.monotonic()).
+        """
+        if fp not in self.pending:
+            self.pending[fp] = (None, now)
+
+    def pop_ready(self, now: float) -> List[Tuple[Path, Tuple[int, int]]]:
+        """Renvoie (et retire) les fichiers stables depuis `settle_s` secondes.
+
+        Parameters
+        ----------
+        now: float
+            Instant courant (time.monotonic()).
+
+        Returns
+        -------
+        ready: List[Tuple[Path, Tuple[int, int]]]
+            Fichiers prêts, avec leur (taille, date de modification).
+        """
+        ready = []
+        for fp, (key, since) in list(self.pending.items()):
+            try:
+                st = fp.stat()
+            except OSError:
+                # fichier supprimé ou renommé entre-temps
+                del self.pending[fp]
+                continue
+            cur = (st.st_size, st.st_mtime_ns)
+            if cur != key:
+                # fichier nouveau ou encore en cours d'écriture
+                self.pending[fp] = (cur, now)
+            elif self.done.get(fp) == cur:
+                # déjà ingéré, inchangé
+                del self.pending[fp]
+            elif now - since >= self.settle_s and st.st_size > 0:
+                ready.append((fp, cur))
+                del self.pending[fp]
+        return ready
+
+    def mark_done(self, batch: List[Tuple[Path, Tuple[int, int]]]):
+        """Enregistre les fichiers d'un lot comme ingérés.
+
+        Parameters
+        ----------
+        batch: List[Tuple[Path, Tuple[int, int]]]
+            Fichiers du lot, avec leur (taille, date de modification).
+        """
+        self.done.update(batch)
+
+
+def process_batch(
+    fps: List[Path],
+    in_dir: Path,
+    data_int: Path,
+    dir_out: Path,
+    jobs: int = 1,
+    digest_cache: Optional[Path] = None,
+    batch_cmd: Optional[Path] = None,
+    pdf_store_dir: Path = DIR_PDF_STORE,
+    index_db: Path = FP_INDEX_DB,
+    first_seen_db: Optional[Path] = FP_FIRST_SEEN_DB,
+) -> Optional[str]:
+    """Indexe un micro-lot de PDF puis lance les étapes suivantes.
+
+    Parameters
+    ----------
+    fps: List[Path]
+        Fichiers PDF du lot.
+    in_dir: Path
+        Dossier d'entrée surveillé.
+    data_int: Path
+        Dossier des fichiers intermédiaires (index des nouveaux PDF du lot).
+    dir_out: Path
+        Dossier de sortie des étapes suivantes.
+    jobs: int, defaults to 1
+        Nombre de workers pour l'indexation.
+    digest_cache: Path, optional
+        Cache des hachages des fichiers d'entrée.
+    batch_cmd: Path, optional
+        Script des étapes suivantes, appelé avec l'identifiant du lot et
+        `dir_out`, et `data_int` dans la variable d'environnement DATA_INT ;
+        si None, seule l'indexation est faite.
+    pdf_store_dir: Path, defaults to DIR_PDF_STORE
+        Dossier du stock de travail des PDF.
+    index_db: Path, defaults to FP_INDEX_DB
+        Base SQLite d'index général des PDF.
+    first_seen_db: Path, optional
+        Base SQLite des dates de première réception des PDF.
+
+    Returns
+    -------
+    run: str, optional
+        Identifiant du lot, ou None si aucun nouveau PDF n'a été indexé.
+    """
+    run = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    new_csv = data_int / f"pdf-index_new_{run}.csv"
+    index_folder(
+        in_dir,
+        pdf_store_dir,
+        index_db,
+        new_csv,
+        jobs=jobs,
+        digest_cache=digest_cache,
+        pdfs_in=fps,
+        first_seen_db=first_seen_db,
+    )
+    # ajouter au lot les documents reportés par le lot précédent
+    requeue_deferred(new_csv)
+    if not new_csv.is_file():
+        logging.info(f"Lot {run}: aucun nouveau PDF parmi {len(fps)} fichier(s)")
+        return None
+    if batch_cmd is not None:
+        t0 = time.perf_counter()
+        proc = subprocess.run(
+            [str(batch_cmd), run, str(dir_out)],
+            cwd=ROOT_DIR,
+            env=os.environ | {"DATA_INT": str(data_int)},
+        )
+        logging.info(
+            f"Lot {run}: {batch_cmd.name} terminé (code {proc.returncode})"
+            + f" en {time.perf_counter() - t0:.1f} s"
+        )
+    print(f"Lot {run}: {len(fps)} fichier(s) traité(s)")
+    return run
+
+
+def watch(
+    in_dir: Path,
+    data_int: Path,
+    dir_out: Path,
+    recursive: bool = True,
+    poll: bool = False,
+    settle_s: float = SETTLE_S,
+    poll_s: float = POLL_S,
+    batch_wait_s: float = BATCH_WAIT_S,
+    batch_max: int = BATCH_MAX,
+    jobs: int = 1,
+    digest_cache: Optional[Path] = None,
+    batch_cmd: Optional[Path] = None,
+    once: bool = False,
+    pdf_store_dir: Path = DIR_PDF_STORE,
+    index_db: Path = FP_INDEX_DB,
+    first_seen_db: Optional[Path] = FP_FIRST_SEEN_DB,
+):
+    """Surveille un dossier et traite les nouveaux PDF par micro-lots.
+
+    Un lot est lancé dès qu'il atteint `batch_max` fichiers, ou lorsque son
+    plus ancien fichier attend depuis `batch_wait_s` secondes.
+
+    Parameters
+    ----------
+    in_dir: Path
+        Dossier d'entrée à surveiller.
+    data_int: Path
+        Dossier des fichiers intermédiaires.
+    dir_out: Path
+        Dossier de sortie.
+    recursive: bool, defaults to True
+        Si True, surveille aussi les sous-dossiers.
+    poll: bool, defaults to False
+        Si True, utilise la scrutation périodique même si inotify est disponible.
+    settle_s: float
+        Délai sans modification avant qu'un fichier soit considéré complet.
+    poll_s: float
+        Délai entre deux scrutations.
+    batch_wait_s: float
+        Délai maximal d'attente d'un micro-lot incomplet.
+    batch_max: int
+        Taille maximale d'un micro-lot.
+    jobs: int, defaults to 1
+        Nombre de workers pour l'indexation.
+    digest_cache: Path, optional
+        Cache des hachages des fichiers d'entrée.
+    batch_cmd: Path, optional
+        Script des étapes suivantes (voir `process_batch`).
+    once: bool, defaults to False
+        Si True, traite les fichiers présents puis s'arrête (pas de surveillance).
+    pdf_store_dir: Path, defaults to DIR_PDF_STORE
+        Dossier du stock de travail des PDF.
+    index_db: Path, defaults to FP_INDEX_DB
+        Base SQLite d'index général des PDF.
+    first_seen_db: Path, optional
+        Base SQLite des dates de première réception des PDF.
+    """
+    if poll or inotify_simple is None:
+        scanner = PollingScanner(in_dir, recursive=recursive)
+        logging.info(f"Surveillance de {in_dir} par scrutation toutes les {poll_s} s")
+    else:
+        scanner = InotifyScanner(in_dir, recursive=recursive)
+        logging.info(f"Surveillance de {in_dir} par inotify")
+    pending = PendingFiles(settle_s=settle_s)
+    queue = []  # fichiers prêts, en attente de traitement
+    queue_since = None
+    while True:
+        fps = scanner.scan(0 if once else poll_s)
+        now = time.monotonic()
+        for fp in fps:
+            pending.add(fp, now)
+        ready = pending.pop_ready(now)
+        if ready and not queue:
+            queue_since = now
+        queue.extend(ready)
+        if queue and (
+            once or len(queue) >= batch_max or now - queue_since >= batch_wait_s
+        ):
+            batch, queue = queue[:batch_max], queue[batch_max:]
+            queue_since = now if queue else None
+            process_batch(
+                [fp for fp, _ in batch],
+                in_dir,
+                data_int,
+                dir_out,
+                jobs=jobs,
+                digest_cache=digest_cache,
+                batch_cmd=batch_cmd,
+                pdf_store_dir=pdf_store_dir,
+                index_db=index_db,
+                first_seen_db=first_seen_db,
+            )
+            # même en cas d'échec, ne pas retraiter en boucle un fichier inchangé
+            pending.mark_done(batch)
+        if once and not queue:
+            if not pending:
+                break
+            # attendre la stabilisation des fichiers repérés
+            time.sleep(min(settle_s, poll_s))
+
+
+def _sigterm_handler(signum, frame):
+    """Convertit SIGTERM en KeyboardInterrupt, pour un arrêt propre."""
+    raise KeyboardInterrupt
+
+
+if __name__ == "__main__":
+    # log
+    dir_log = ROOT_DIR / "logs"
+    if not dir_log.is_dir():
+        dir_log.mkdir(parents=True, exist_ok=True)
+    logging.basicConfig(
+        filename=f"{dir_log}/watch_folder_{datetime.now().isoformat()}.log",
+        encoding="utf-8",
+        level=logging.INFO,
+    )
+    logging.captureWarnings(True)
+
+    # arguments de la commande exécutable
+    parser = argparse.ArgumentParser()
+    parser.add_argument("in_dir", help="Dossier contenant les PDFs à surveiller")
+    parser.add_argument(
+        "--data_int",
+        default=str(ROOT_DIR / "data" / "interim"),
+        help="Dossier des fichiers intermédiaires (index des nouveaux PDFs de chaque lot)",
+    )
+    parser.add_argument(
+        "--index_dir",
+        default=str(CACHE_DIR),
+        help="Dossier du stock de travail (pdf-index/) et de l'index général (pdf-index.sqlite) des PDFs, conservés d'une exécution à l'autre",
+    )
+    parser.add_argument(
+        "--out_dir",
+        default=str(ROOT_DIR / "data" / "processed"),
+        help="Dossier de sortie des étapes de traitement des lots",
+    )
+    parser.add_argument(
+        "--batch_cmd",
+        default=str(ROOT_DIR / "scripts" / "process_batch.sh"),
+        help="Script de traitement d'un lot ('' pour seulement indexer)",
+    )
+    parser.add_argument(
+        "--nonrecursive",
+        action="store_true",
+        help="Ne surveille pas les sous-dossiers de in_dir",
+    )
+    parser.add_argument(
+        "--poll",
+        action="store_true",
+        help="Scrutation périodique au lieu d'inotify (ex: dossier Windows vu depuis WSL)",
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=SETTLE_S,
+        help="Délai (s) sans modification avant de prendre en compte un fichier",
+    )
+    parser.add_argument(
+        "--poll_interval",
+        type=float,
+        default=POLL_S,
+        help="Délai (s) entre deux scrutations",
+    )
+    parser.add_argument(
+        "--batch_wait",
+        type=float,
+        default=BATCH_WAIT_S,
+        help="Délai (s) maximal d'attente d'un micro-lot incomplet",
+    )
+    parser.add_argument(
+        "--batch_max", type=int, default=BATCH_MAX, help="Taille maximale d'un lot"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Nombre de workers pour l'indexation (0: nombre de coeurs)",
+    )
+    parser.add_argument(
+        "--digest_cache",
+        default=str(CACHE_DIR / "digest-cache.csv"),
+        help="Fichier CSV du cache des hachages des PDFs d'entrée ('' pour désactiver le cache)",
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="Traite les fichiers présents puis s'arrête",
+    )
+    args = parser.parse_args()
+
+    # entrée: dossier à surveiller
+    in_dir = Path(args.in_dir).resolve()
+    if not in_dir.is_dir():
+        raise ValueError(f"Le dossier à surveiller n'existe pas: {in_dir}")
+    # dossiers de travail et de sortie
+    data_int = Path(args.data_int).resolve()
+    data_int.mkdir(parents=True, exist_ok=True)
+    index_dir = Path(args.index_dir).resolve()
+    (index_dir / DIR_PDF_STORE.name).mkdir(parents=True, exist_ok=True)
+    out_dir = Path(args.out_dir).resolve()
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    signal.signal(signal.SIGTERM, _sigterm_handler)
+    try:
+        watch(
+            in_dir,
+            data_int,
+            out_dir,
+            recursive=not args.nonrecursive,
+            poll=args.poll,
+            settle_s=args.settle,
+            poll_s=args.poll_interval,
+            batch_wait_s=args.batch_wait,
+            batch_max=args.batch_max,
+            jobs=args.jobs if args.jobs > 0 else os.cpu_count(),
+            digest_cache=(
+                Path(args.digest_cache).resolve() if args.digest_cache else None
+            ),
+            batch_cmd=Path(args.batch_cmd).resolve() if args.batch_cmd else None,
+            once=args.once,
+            pdf_store_dir=index_dir / DIR_PDF_STORE.name,
+            index_db=index_dir / FP_INDEX_DB.name,
+            first_seen_db=index_dir / FP_FIRST_SEEN_DB.name,
+        )
+    except KeyboardInterrupt:
+        logging.info("Arrêt de la surveillance")
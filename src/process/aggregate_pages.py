@@ -12,7 +12,7 @@ import time  # WIP
 
 import pandas as pd
 
-from parse_native_pages import (
+from src.process.parse_native_pages import (
     DTYPE_META_NTXT_FILT,
     DTYPE_META_NTXT_PROC,
 )
@@ -10,10 +10,10 @@ import argparse
 from datetime import datetime
 import logging
 from pathlib import Path
-import PyPDF2
 
 import pandas as pd
 
+from src.preprocess.pdf_session import PdfSession
 from src.process.aggregate_pages import DTYPE_META_NTXT_DOC
 from src.domain_knowledge.adresse import (
     create_adresse_normalisee,
@@ -63,16 +63,6 @@ DTYPE_DATA = {
 }
 
 
-def transform_pdf_date(date_str):
-    """Transform PDF date string to a standard date format."""
-    if date_str.startswith("D:"):
-        date_str = date_str[2:]
-    date_str = date_str.replace("'", "")
-    dt_format = "%Y%m%d%H%M%S%z"
-    dt = datetime.strptime(date_str, dt_format)
-    return dt.strftime("%d/%m/%Y")
-
-
 def detect_digital_signature(file_path):
     """Detect if the PDF has a digital signature and return the result.
 
@@ -86,17 +76,9 @@ def detect_digital_signature(file_path):
     signature_date: str
         Date of the digital signature if it exists, None otherwise.
     """
-    reader = PyPDF2.PdfReader(file_path)
-    fields = reader.get_fields()
-    if not fields:
-        return None
-
-    for field_name, field_value in fields.items():
-        if field_value.get("/FT") == "/Sig":
-            date = field_value.get("/V", {}).get("/M", None)
-            formatted_date = transform_pdf_date(date) if date else None
-            return formatted_date
-    return None
+    # pikepdf via PdfSession, plutôt qu'une analyse supplémentaire par PyPDF2
+    with PdfSession(Path(file_path)) as session:
+        return session.signature_date()
 
 
 # TODO déplacer dans arrete ? ou ailleurs ?
@@ -6,7 +6,7 @@ import argparse
 from datetime import datetime
 import logging
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Iterator, Optional, Tuple
 
 import pandas as pd  # tableau récapitulatif des extractions
 
@@ -55,6 +55,7 @@ from src.preprocess.data_sources import EXCLUDE_FIXME_FILES, EXCLUDE_FILES
 from src.preprocess.separate_pages import load_pages_text
 from src.preprocess.filter_docs import DTYPE_META_NTXT_FILT, DTYPE_NTXT_PAGES_FILT
 from src.quality.validate_parses import examine_doc_content  # WIP
+from src.utils.storage import read_table
 from src.utils.text_utils import P_STRIP, P_LINE, normalize_string
 
 
@@ -747,26 +748,35 @@ def parse_page_content(
 EXCLUDE_SET = set(EXCLUDE_FIXME_FILES)
 
 
-def parse_arrete_pages(fn_pdf: str, pages: list[str]) -> list:
-    """Analyse les pages de texte d'un arrêté.
+def iter_arrete_pages(
+    fn_pdf: str, pages: Iterable[Optional[str]]
+) -> Iterator[Tuple[Optional[dict], str]]:
+    """Analyse les pages de texte d'un arrêté, une par une.
+
+    Les pages sont consommées au fur et à mesure de l'analyse: l'appelant
+    peut interrompre l'analyse, par exemple dès que l'état "apres_signature"
+    est atteint, sans que les pages suivantes soient produites (OCR
+    progressive).
 
     Parameters
     ----------
     fn_pdf: str
         Nom du fichier PDF.
-    pages: list[str]
-        Liste de pages de texte à analyser.
-
-    Returns
-    -------
-    doc_content: list[dict]
-        Contenu du document, par page découpée en zones de texte.
+    pages: Iterable[Optional[str]]
+        Pages de texte à analyser (None ou NA pour une page sans texte).
+
+    Yields
+    ------
+    page_content: dict, optional
+        Contenu de la page, découpé en zones de texte ; None si la page
+        est ignorée.
+    cur_state: str
+        État de l'analyse après la page: "avant_vucons", "avant_articles",
+        "avant_signature" ou "apres_signature".
     """
-    doc_content = []  # valeur de retour
-
     # FIXME on ne traite pas une poignée de documents qui posent différents problèmes
     if fn_pdf in EXCLUDE_SET:
-        return doc_content
+        return
     # end FIXME
 
     # métadonnées du document
@@ -789,7 +799,7 @@ def parse_arrete_pages(fn_pdf: str, pages: list[str]) -> list:
                 "body": None,  # texte (sans le texte du template)
                 "content": None,  # empans de contenu (paragraphes et données): vide
             }
-            doc_content.append(page_content)
+            yield page_content, cur_state
             continue
 
         # NEW normalisation du texte
@@ -809,7 +819,7 @@ def parse_arrete_pages(fn_pdf: str, pages: list[str]) -> list:
                 "body": pg_txt_body,  # texte (sans le texte du template)
                 "content": pg_content,  # empans de contenu (paragraphes et données): vide
             }
-            doc_content.append(page_content)
+            yield page_content, cur_state
             continue
         elif P_BORDEREAU.search(pg_txt_body):
             # * page de bordereau de formalités (Aix-en-Provence)
@@ -819,7 +829,7 @@ def parse_arrete_pages(fn_pdf: str, pages: list[str]) -> list:
                 "body": pg_txt_body,  # texte (sans le texte du template)
                 "content": pg_content,  # empans de contenu (paragraphes et données): vide
             }
-            doc_content.append(page_content)
+            yield page_content, cur_state
             continue
 
         # TODO pages d'annexe
@@ -853,6 +863,7 @@ def parse_arrete_pages(fn_pdf: str, pages: list[str]) -> list:
                 logging.warning(
                     f"{fn_pdf}: page {i}: ni 'vu' ni 'considérant' donc page ignorée"
                 )
+                yield None, cur_state
                 continue
             main_beg = pream_end
         else:
@@ -967,7 +978,6 @@ def parse_arrete_pages(fn_pdf: str, pages: list[str]) -> list:
             "body": pg_txt_body,  # texte (sans le texte du template)
             "content": pg_content,  # empans de contenu (paragraphes et données)
         }
-        doc_content.append(page_content)
         if False:  # DEBUG
             print("<<<<<<<<<<<<<<<<")
             print(pg_content)  # DEBUG
@@ -976,8 +986,37 @@ def parse_arrete_pages(fn_pdf: str, pages: list[str]) -> list:
             print("~~~~~~~~~~~~~~~~")
             print(pg_txt_body[main_beg:main_end])  # DEBUG
             print("================")
-        # TODO arrêter le traitement à la fin du postambule et tronquer le texte / le PDF si possible? (utile pour l'OCR)
+        # l'appelant peut arrêter le traitement à la fin du postambule (OCR progressive)
+        yield page_content, cur_state
+
+
+def parse_arrete_pages(fn_pdf: str, pages: list[str]) -> list:
+    """Analyse les pages de texte d'un arrêté.
+
+    Parameters
+    ----------
+    fn_pdf: str
+        Nom du fichier PDF.
+    pages: list[str]
+        Liste de pages de texte à analyser.
+
+    Returns
+    -------
+    doc_content: list[dict]
+        Contenu du document, par page découpée en zones de texte.
+    """
+    doc_content = []  # valeur de retour
+
+    # FIXME on ne traite pas une poignée de documents qui posent différents problèmes
+    if fn_pdf in EXCLUDE_SET:
+        return doc_content
+    # end FIXME
 
+    doc_content = [
+        page_content
+        for page_content, _ in iter_arrete_pages(fn_pdf, pages)
+        if page_content is not None
+    ]
     # vérifier que le résultat est bien formé
     examine_doc_content(fn_pdf, doc_content)
     #
@@ -1325,7 +1364,8 @@ if __name__ == "__main__":
     df_meta = pd.read_csv(in_file_meta, dtype=DTYPE_META_NTXT_FILT)
     # ouvrir le fichier d'entrée
     logging.info(f"Ouverture du fichier CSV de pages de texte {in_file_pages}")
-    df_txts = pd.read_csv(in_file_pages, dtype=DTYPE_NTXT_PAGES_FILT)
+    # texte des pages: chaînes au format Arrow, plus compactes en mémoire
+    df_txts = read_table(in_file_pages, DTYPE_NTXT_PAGES_FILT, arrow_strings=True)
     # traiter les documents (découpés en pages de texte)
     df_tmod = process_files(df_meta, df_txts)
 
@@ -9,12 +9,11 @@ import itertools
 import logging
 from pathlib import Path
 import shutil
-from typing import Dict, List
+from typing import Dict, List, NamedTuple, Optional
 from src.utils.text_utils import create_file_name_url
 
 
 import pandas as pd
-import numpy as np
 
 from src.domain_knowledge.actes import P_ACCUSE
 from src.domain_knowledge.adresse import (
@@ -52,6 +51,7 @@ from src.preprocess.data_sources import (
     EXCLUDE_HORS_AMP,
 )
 from src.preprocess.extract_text_ocr import DTYPE_META_NTXT_OCR
+from src.preprocess.priority import sort_by_priority
 from src.process.export_data import (
     DTYPE_ADRESSE,
     DTYPE_ARRETE,
@@ -60,7 +60,11 @@ from src.process.export_data import (
 )
 from src.process.extract_data import determine_commune, detect_digital_signature
 from src.process.parse_doc import parse_arrete_pages
+from src.process.publish_latency import record_publish_latency
 from src.quality.validate_parses import generate_html_report
+from src.utils.artifact_cache import ArtifactCache, get_input_digest
+from src.utils.file_utils import CACHE_DIR, link_or_copy
+from src.utils.storage import read_table
 from src.utils.str_date import process_date_brute
 from src.utils.text_utils import normalize_string, remove_accents
 from src.utils.txt_format import load_pages_text
@@ -283,7 +287,9 @@ def extract_adresses_commune(
     return adresses_enr
 
 
-def parse_arrete(fp_pdf_in: Path, fp_txt_in: Path) -> dict:
+def parse_arrete(
+    fp_pdf_in: Path, fp_txt_in: Path, fn_pdf: Optional[str] = None
+) -> dict:
     """Analyse un arrêté et extrait les données qu'il contient.
 
     L'arrêté est découpé en paragraphes puis les données sont
@@ -295,13 +301,17 @@ def parse_arrete(fp_pdf_in: Path, fp_txt_in: Path) -> dict:
         Fichier PDF source (temporairement?)
     fp_txt_in : Path
         Fichier texte à analyser.
+    fn_pdf : str, optional
+        Nom logique du PDF (colonne "pdf" de l'index) ; par défaut, le nom
+        du fichier `fp_pdf_in`.
 
     Returns
     -------
     doc_data : dict
         Données extraites du document.
     """
-    fn_pdf = fp_pdf_in.name
+    if fn_pdf is None:
+        fn_pdf = fp_pdf_in.name
     fn_pdf_out = create_file_name_url(fn_pdf)
 
     pages = load_pages_text(fp_txt_in)
@@ -611,186 +621,245 @@ def parse_arrete(fp_pdf_in: Path, fp_txt_in: Path) -> dict:
     return doc_data
 
 
-def process_files(
-    df_in: pd.DataFrame,
-    out_dir: Path,
-    date_exec: date,
-) -> Dict[str, Path]:
-    """Analyse le texte des fichiers PDF extrait dans des fichiers TXT.
+class PaquetWriter:
+    """Écriture des 4 fichiers paquet_*.csv d'une exécution, document par document.
 
-    Parameters
-    ----------
-    df_in: pd.DataFrame
-        Fichier meta_$RUN_otxt.csv contenant les métadonnées enrichies et
-        les fichiers PDF et TXT (natif ou OCR) à traiter.
-    out_dir : Path
-        Dossier de sortie
-    date_exec : date
-        Date d'exécution du script, utilisée pour (a) le nom des copies de fichiers CSV
-        incluant la date de traitement, (b) l'identifiant unique des arrêtés dans les 4
-        tables, (c) le champ 'datemaj' initialement rempli avec la date d'exécution.
-
-    Returns
-    -------
-    out_files : Dict[str, Path]
-        Fichiers CSV produits, contenant les données extraites.
-        Dictionnaire indexé par les clés {"adresse", "arrete", "notifie", "parcelle"}.
+    Les lignes de chaque document sont ajoutées aux fichiers CSV datés (dans
+    csv_historique/) dès son analyse, puis son fichier PDF est placé dans le
+    dossier de sa commune, sauf si le placement est reporté à la fin. Les
+    copies sous les noms de base (paquet_*.csv) sont faites à la fin
+    (`finalize`).
     """
-    # - les fichiers CSV datés sont stockés dans un sous-dossier "csv_historique"
-    out_dir_csv = out_dir / "csv_historique"
-    logging.info(
-        f"Sous-dossier de sortie: {out_dir_csv} {'existe déjà' if out_dir_csv.is_dir() else 'va être créé'}."
-    )
-    out_dir_csv.mkdir(parents=True, exist_ok=True)
-    # - les fichiers PDF à reclasser sont stockés dans un sous-dossier (temporaire) "pdf_a_reclasser"
-    out_dir_pdf_areclass = out_dir / "pdf_analyses/pdf_a_reclasser"
-    logging.info(
-        f"Sous-dossier de sortie: {out_dir_pdf_areclass} {'existe déjà' if out_dir_pdf_areclass.is_dir() else 'va être créé'}."
-    )
-    out_dir_pdf_areclass.mkdir(parents=True, exist_ok=True)
-    # - les fichiers TXT extraits nativement ou par OCR dans un sous-dossier "txt"
-    out_dir_txt = out_dir / "txt"
-    logging.info(
-        f"Sous-dossier de sortie: {out_dir_txt} {'existe déjà' if out_dir_txt.is_dir() else 'va être créé'}."
-    )
-    out_dir_txt.mkdir(parents=True, exist_ok=True)
 
-    # 0. charger la liste des PDF déjà traités, définis comme les PDF déjà
-    # présents dans un des fichiers "paquet_arrete_*.csv"
-    fps_paquet_arrete = sorted(
-        out_dir_csv.glob(
-            f"paquet_arrete_[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]_[0-9][0-9].csv"
+    def __init__(
+        self,
+        out_dir: Path,
+        date_exec: date,
+        latency_csv: Optional[Path] = None,
+        artifact_cache: Optional[ArtifactCache] = None,
+        place_on_finalize: bool = False,
+    ):
+        """Prépare les dossiers et les noms des fichiers de sortie.
+
+        Parameters
+        ----------
+        out_dir : Path
+            Dossier de sortie
+        date_exec : date
+            Date d'exécution du script, utilisée pour (a) le nom des copies de fichiers CSV
+            incluant la date de traitement, (b) l'identifiant unique des arrêtés dans les 4
+            tables, (c) le champ 'datemaj' initialement rempli avec la date d'exécution.
+        latency_csv : Path, optional
+            Fichier CSV des délais de publication (de l'indexation à l'écriture des
+            fichiers CSV), complété à chaque exécution ; si None, les délais ne sont
+            pas enregistrés.
+        artifact_cache : ArtifactCache, optional
+            Cache des sorties des étapes: l'analyse d'un document n'est refaite
+            que si son texte, ses métadonnées ou le code de l'analyse ont changé.
+        place_on_finalize : bool, defaults to False
+            Si True, les fichiers PDF sont placés par `finalize`, une fois
+            tous les documents analysés (exécution par lot: un échec sur un
+            document n'entraîne le déplacement d'aucun fichier) ; sinon,
+            chaque fichier est placé dès l'écriture de ses lignes.
+        """
+        self.out_dir = out_dir
+        self.latency_csv = latency_csv
+        self.artifact_cache = artifact_cache
+        self.place_on_finalize = place_on_finalize
+        # fichiers PDF à placer par `finalize`: (métadonnées, lignes paquet_arrete)
+        self.pdfs_to_place = []
+        # - les fichiers CSV datés sont stockés dans un sous-dossier "csv_historique"
+        out_dir_csv = out_dir / "csv_historique"
+        logging.info(
+            f"Sous-dossier de sortie: {out_dir_csv} {'existe déjà' if out_dir_csv.is_dir() else 'va être créé'}."
         )
-    )
-    pdfs_old = []
-    for fp_paquet_arrete in fps_paquet_arrete:
-        df_arr_old = pd.read_csv(fp_paquet_arrete, dtype=DTYPE_ARRETE, sep=";")
-        pdfs_old.extend(df_arr_old["pdf"])
-    pdfs_old = set(pdfs_old)
-
-    # 1. déterminer le nom des fichiers de sortie
-    # les noms des fichiers de sortie incluent:
-    # - la date de traitement (ex: "2023-05-30")
-    date_proc_dash = date_exec.strftime("%Y-%m-%d")
-    # - le numéro d'exécution ce jour (ex: "02"), calculé en recensant les
-    # éventuels fichiers existants
-    out_prevruns = sorted(
-        itertools.chain.from_iterable(
-            out_dir_csv.glob(f"paquet_{x}_{date_proc_dash}_[0-9][0-9].csv")
-            for x in OUT_BASENAMES
+        out_dir_csv.mkdir(parents=True, exist_ok=True)
+        # - les fichiers PDF à reclasser sont stockés dans un sous-dossier (temporaire) "pdf_a_reclasser"
+        self.out_dir_pdf_areclass = out_dir / "pdf_analyses/pdf_a_reclasser"
+        logging.info(
+            f"Sous-dossier de sortie: {self.out_dir_pdf_areclass} {'existe déjà' if self.out_dir_pdf_areclass.is_dir() else 'va être créé'}."
         )
-    )
-    #    - numéro d'exécution du script ce jour
-    i_run = 0  # init
-    for fp_prevrun in out_prevruns:
-        # le numéro se trouve à la fin du stem, après le dernier séparateur "_"
-        fp_out_idx = int(fp_prevrun.stem.split("_")[-1])
-        i_run = max(i_run, fp_out_idx)
-    i_run += 1  # on prend le numéro d'exécution suivant
-    # résultat: fichiers générés par cette exécution
-    out_files = {
-        x: out_dir_csv / f"paquet_{x}_{date_proc_dash}_{i_run:>02}.csv"
-        for x in OUT_BASENAMES
-    }
-
-    # 2. déterminer le premier identifiant unique (idu) des prochaines entrées:
-    # il suit le dernier idu généré par les exécutions précédentes le même jour
-    i_idu = 0  # init
-    for fp_prevrun in out_prevruns:
-        # ouvrir le fichier, lire les idus, prendre le dernier, extraire l'index
-        s_idus = pd.read_csv(
-            fp_prevrun, usecols=["idu"], dtype={"idu": "string"}, sep=";"
-        )["idu"]
-        max_idx = s_idus.str.rsplit("-", n=1, expand=True)[1].astype("int32").max()
-        i_idu = max(i_idu, max_idx)
-    i_idu += 1  # on prend le numéro d'arrêté suivant
-
-    # 3. filtrer les arrêtés
-    # - filtrer les documents hors périmètre thématique ou géographique ?
-    # TODO vérifier si ok sans liste d'exclusion ici ; sinon corriger avant déploiement?
-    # df_in["pdf"].str.split("-", 1)[0] not in set(EXCLUDE_FILES + EXCLUDE_FIXME_FILES)  # + EXCLUDE_HORS_AMP)
-    #
-    # - filtrer les fichiers déjà traités: ne garder que les PDF qui ne
-    # sont pas déjà présents dans un "paquet_arrete_*.csv"
-    pdfs_in_old = set(df_in["pdf"].tolist()).intersection(pdfs_old)
-
-    # vérifier que le fichier PDF existe bien dans les dossiers destination,
-    # pdf_a_reclasser ou un dossier de commune,
-    # sinon il faut le traiter comme s'il était complètement nouveau
-    already_proc = []
-    # sous-dossiers par code commune (INSEE), sur 5 chiffres
-    out_dir_analyses = out_dir / "pdf_analyses"
-    out_dir_pdf_communes = [
-        d for d in out_dir_analyses.glob("[0-9][0-9][0-9][0-9][0-9]") if d.is_dir()
-    ]
-
-    for fn in pdfs_in_old:
-        fn_url = create_file_name_url(fn)
-        areclass = sorted(out_dir_pdf_areclass.rglob(fn_url))
-        bienclas = []
-        for directory in out_dir_pdf_communes:
-            bienclas += sorted(directory.rglob(fn_url))
+        self.out_dir_pdf_areclass.mkdir(parents=True, exist_ok=True)
+        # - les fichiers TXT extraits nativement ou par OCR dans un sous-dossier "txt"
+        self.out_dir_txt = out_dir / "txt"
+        logging.info(
+            f"Sous-dossier de sortie: {self.out_dir_txt} {'existe déjà' if self.out_dir_txt.is_dir() else 'va être créé'}."
+        )
+        self.out_dir_txt.mkdir(parents=True, exist_ok=True)
 
-        if areclass or bienclas:
-            logging.warning(
-                f"Fichier à ignorer car déjà traité: {areclass[0] if areclass else bienclas[0]}"
+        # 0. charger la liste des PDF déjà traités, définis comme les PDF déjà
+        # présents dans un des fichiers "paquet_arrete_*.csv"
+        fps_paquet_arrete = sorted(
+            out_dir_csv.glob(
+                f"paquet_arrete_[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]_[0-9][0-9].csv"
             )
-            print(
-                f"\n/!\\ Fichier à ignorer car déjà traité: {areclass[0] if areclass else bienclas[0]}"
+        )
+        pdfs_old = []
+        for fp_paquet_arrete in fps_paquet_arrete:
+            df_arr_old = pd.read_csv(fp_paquet_arrete, dtype=DTYPE_ARRETE, sep=";")
+            pdfs_old.extend(df_arr_old["pdf"])
+        self.pdfs_old = set(pdfs_old)
+
+        # 1. déterminer le nom des fichiers de sortie
+        # les noms des fichiers de sortie incluent:
+        # - la date de traitement (ex: "2023-05-30")
+        date_proc_dash = date_exec.strftime("%Y-%m-%d")
+        # - le numéro d'exécution ce jour (ex: "02"), calculé en recensant les
+        # éventuels fichiers existants
+        out_prevruns = sorted(
+            itertools.chain.from_iterable(
+                out_dir_csv.glob(f"paquet_{x}_{date_proc_dash}_[0-9][0-9].csv")
+                for x in OUT_BASENAMES
             )
-            already_proc.append(fn)
-    already_proc = set(already_proc)
-    #
-    s_dups = df_in["pdf"].isin(already_proc)
-    if any(s_dups):
-        logging.info(
-            f"{s_dups.sum()} fichiers seront déplacés dans 'doublons/'"
-            + " et ne seront pas retraités, car ils sont déjà présents"
-            + " dans un fichier 'paquet_arrete_*.csv' de 'csv_historique/'"
-            + " et dans un dossier de commune"
-            + " ou 'pdf_a_reclasser' ."
         )
-        # déplacer les fichiers déjà traités dans doublons/
-        # (plus prudent que de les supprimer d'emblée)
-        out_dups = out_dir_analyses / "doublons"
-        out_dups.mkdir(exist_ok=True)
-        #
-        df_dups = df_in[s_dups]
-        for df_row in df_dups.itertuples():
-            fp = Path(df_row.fullpath)
-            fp_dst = out_dups / fp.name
-            shutil.move(fp, fp_dst)
-            # si le move a réussi, on peut supprimer le fichier dans le dossier d'entrée
-            if fp_dst.is_file():
-                fp_orig = Path(df_row.origpath)
-                fp_orig.unlink()
-
-    #
-    df_in = df_in[~s_dups]
-    # si après filtrage, df_in est vide, aucun fichier CSV ne sera produit
-    # et on peut sortir immédiatement
-    if df_in.empty:
-        return {}
-
-    # 4 tables de sortie
-    rows_adresse = []
-    rows_arrete = []
-    rows_notifie = []
-    rows_parcelle = []
-
-    # date de traitement, en 2 formats
-    date_proc = date_exec.strftime("%Y%m%d")  # pour "idu" (id uniques des arrêtés)
-    datemaj = date_exec.strftime("%d/%m/%Y")  # pour "datemaj" des 4 tables
+        #    - numéro d'exécution du script ce jour
+        i_run = 0  # init
+        for fp_prevrun in out_prevruns:
+            # le numéro se trouve à la fin du stem, après le dernier séparateur "_"
+            fp_out_idx = int(fp_prevrun.stem.split("_")[-1])
+            i_run = max(i_run, fp_out_idx)
+        i_run += 1  # on prend le numéro d'exécution suivant
+        # résultat: fichiers générés par cette exécution
+        self.out_files = {
+            x: out_dir_csv / f"paquet_{x}_{date_proc_dash}_{i_run:>02}.csv"
+            for x in OUT_BASENAMES
+        }
 
-    # identifiant des entrées dans les fichiers de sortie: <type arrêté>-<date du traitement>-<index>
-    # itérer sur les fichiers PDF et TXT
-    for i, df_row in enumerate(df_in.itertuples(), start=i_idu):
+        # 2. déterminer le premier identifiant unique (idu) des prochaines entrées:
+        # il suit le dernier idu généré par les exécutions précédentes le même jour
+        i_idu = 0  # init
+        for fp_prevrun in out_prevruns:
+            # ouvrir le fichier, lire les idus, prendre le dernier, extraire l'index
+            s_idus = pd.read_csv(
+                fp_prevrun, usecols=["idu"], dtype={"idu": "string"}, sep=";"
+            )["idu"]
+            max_idx = s_idus.str.rsplit("-", n=1, expand=True)[1].astype("int32").max()
+            i_idu = max(i_idu, max_idx)
+        self.i_idu = i_idu + 1  # on prend le numéro d'arrêté suivant
+
+        # date de traitement, en 2 formats
+        self.date_proc = date_exec.strftime("%Y%m%d")  # pour "idu" (id uniques des arrêtés)
+        self.datemaj = date_exec.strftime("%d/%m/%Y")  # pour "datemaj" des 4 tables
+        # documents exportés, pour le délai de publication
+        self.docs_published = []
+
+    def exclude_duplicates(self, df_in: pd.DataFrame) -> pd.DataFrame:
+        """Écarte les documents déjà traités et les quasi-doublons.
+
+        Leurs fichiers sont placés dans le dossier doublons/.
+
+        Parameters
+        ----------
+        df_in: pd.DataFrame
+            Documents à analyser.
+
+        Returns
+        -------
+        df_in: pd.DataFrame
+            Documents à analyser, sans les doublons.
+        """
+        # 3. filtrer les arrêtés
+        # - filtrer les documents hors périmètre thématique ou géographique ?
+        # TODO vérifier si ok sans liste d'exclusion ici ; sinon corriger avant déploiement?
+        # df_in["pdf"].str.split("-", 1)[0] not in set(EXCLUDE_FILES + EXCLUDE_FIXME_FILES)  # + EXCLUDE_HORS_AMP)
+        #
+        # - filtrer les fichiers déjà traités: ne garder que les PDF qui ne
+        # sont pas déjà présents dans un "paquet_arrete_*.csv"
+        pdfs_in_old = set(df_in["pdf"].tolist()).intersection(self.pdfs_old)
+
+        # vérifier que le fichier PDF existe bien dans les dossiers destination,
+        # pdf_a_reclasser ou un dossier de commune,
+        # sinon il faut le traiter comme s'il était complètement nouveau
+        already_proc = []
+        # sous-dossiers par code commune (INSEE), sur 5 chiffres
+        out_dir_analyses = self.out_dir / "pdf_analyses"
+        out_dir_pdf_communes = [
+            d for d in out_dir_analyses.glob("[0-9][0-9][0-9][0-9][0-9]") if d.is_dir()
+        ]
+
+        for fn in pdfs_in_old:
+            fn_url = create_file_name_url(fn)
+            areclass = sorted(self.out_dir_pdf_areclass.rglob(fn_url))
+            bienclas = []
+            for directory in out_dir_pdf_communes:
+                bienclas += sorted(directory.rglob(fn_url))
+
+            if areclass or bienclas:
+                logging.warning(
+                    f"Fichier à ignorer car déjà traité: {areclass[0] if areclass else bienclas[0]}"
+                )
+                print(
+                    f"\n/!\\ Fichier à ignorer car déjà traité: {areclass[0] if areclass else bienclas[0]}"
+                )
+                already_proc.append(fn)
+        already_proc = set(already_proc)
+        #
+        s_dups = df_in["pdf"].isin(already_proc)
+        if any(s_dups):
+            logging.info(
+                f"{s_dups.sum()} fichiers seront déplacés dans 'doublons/'"
+                + " et ne seront pas retraités, car ils sont déjà présents"
+                + " dans un fichier 'paquet_arrete_*.csv' de 'csv_historique/'"
+                + " et dans un dossier de commune"
+                + " ou 'pdf_a_reclasser' ."
+            )
+        # - filtrer les quasi-doublons de documents déjà reçus (même texte natif,
+        # mais nom ou contenu binaire différent), repérés par extract_native_text
+        s_neardups = df_in["dup_neartext"].fillna(False).astype(bool) & ~s_dups
+        if any(s_neardups):
+            logging.info(
+                f"{s_neardups.sum()} fichiers seront déplacés dans 'doublons/'"
+                + " et ne seront pas traités, car ce sont des quasi-doublons"
+                + " de documents déjà reçus: "
+                + ", ".join(
+                    f"{x.pdf} ~ {x.dup_neartext_pdf}"
+                    for x in df_in[s_neardups].itertuples()
+                )
+            )
+        s_dups = s_dups | s_neardups
+        if any(s_dups):
+            # placer les fichiers déjà traités et les quasi-doublons dans doublons/
+            # (plus prudent que de les supprimer d'emblée) ;
+            # le fichier est lié ou copié depuis le stock de travail, qui est
+            # adressé par contenu et peut être partagé par plusieurs entrées
+            out_dups = out_dir_analyses / "doublons"
+            out_dups.mkdir(exist_ok=True)
+            #
+            df_dups = df_in[s_dups]
+            for df_row in df_dups.itertuples():
+                fp = Path(df_row.fullpath)
+                fp_dst = out_dups / df_row.pdf
+                link_or_copy(fp, fp_dst)
+                # si le placement a réussi, on peut supprimer le fichier dans le dossier d'entrée
+                if fp_dst.is_file():
+                    fp_orig = Path(df_row.origpath)
+                    fp_orig.unlink()
+
+        return df_in[~s_dups]
+
+    def add_doc(self, df_row: NamedTuple, doc_data: Optional[dict] = None) -> str:
+        """Analyse un document, écrit ses lignes et place son fichier PDF.
+
+        Parameters
+        ----------
+        df_row: NamedTuple
+            Métadonnées du document, dont les fichiers PDF et TXT (natif ou
+            OCR).
+        doc_data: dict, optional
+            Données extraites du document, si l'analyse a déjà été faite
+            (ex: par un autre processus, voir `src.work_queue`).
+
+        Returns
+        -------
+        idu: str
+            Identifiant unique du document dans les fichiers paquet_*.csv.
+        """
         # fichier PDF
         fp_pdf = Path(df_row.fullpath)
-        if not fp_pdf.is_file():
-            raise ValueError(f"{fp_pdf}: fichier PDF introuvable ({fp_txt})")
         # fichier TXT (OCR sinon natif)
         fp_txt = Path(df_row.fullpath_txt)
+        if not fp_pdf.is_file():
+            raise ValueError(f"{fp_pdf}: fichier PDF introuvable ({fp_txt})")
         if not fp_txt.is_file():
             raise ValueError(f"{fp_pdf}: fichier TXT introuvable ({fp_txt})")
 
@@ -801,50 +870,97 @@ def process_files(
         # TODO détecter le ou les éventuels fichiers déjà produits ce jour, écarter les doublons (blake2b?)
         # et initialiser le compteur à la prochaine valeur
         # format: {type d'arrêté}-{date}-{id relatif, sur 4 chiffres}
-        idu = f"{type_arr}-{date_proc}-{i:04}"
+        idu = f"{type_arr}-{self.date_proc}-{self.i_idu:04}"
+        self.i_idu += 1
         # analyser le texte
-        doc_data = parse_arrete(fp_pdf, fp_txt)
+        if doc_data is None:
+            doc_data = self._parse(df_row, fp_pdf, fp_txt)
+
+        # ajouter les entrées du document aux 4 fichiers CSV
+        # (colonnes dans l'ordre des schémas, identique pour tous les documents)
+        for key, rows, dtype in [
+            ("adresse", doc_data["adresses"], DTYPE_ADRESSE),
+            ("arrete", doc_data["arretes"], DTYPE_ARRETE),
+            ("notifie", doc_data["notifies"], DTYPE_NOTIFIE),
+            ("parcelle", doc_data["parcelles"], DTYPE_PARCELLE),
+        ]:
+            out_file = self.out_files[key]
+            df = pd.DataFrame.from_records(
+                [({"idu": idu} | x | {"datemaj": self.datemaj}) for x in rows],
+                columns=list(dtype),
+            ).astype(dtype=dtype)
+            df.to_csv(
+                out_file,
+                mode="a",
+                header=not out_file.is_file(),
+                index=False,
+                sep=";",
+            )
+            if key == "arrete":
+                df_arr = df
+
+        # placer le fichier PDF traité, après l'écriture de ses lignes
+        # pour éviter de déplacer le fichier si les CSV ne sont finalement pas
+        # produits ; par lot, après l'écriture des lignes de tous les documents
+        # (eg. en cas d'échec sur un autre document)
+        if self.place_on_finalize:
+            self.pdfs_to_place.append((df_row, df_arr))
+        else:
+            for df_row_arr in df_arr.itertuples():
+                self._place_pdf(df_row, df_row_arr)
 
-        # ajouter des entrées dans les 4 tables
-        rows_adresse.extend(
-            ({"idu": idu} | x | {"datemaj": datemaj}) for x in doc_data["adresses"]
-        )
-        rows_arrete.extend(
-            ({"idu": idu} | x | {"datemaj": datemaj}) for x in doc_data["arretes"]
-        )
-        rows_notifie.extend(
-            ({"idu": idu} | x | {"datemaj": datemaj}) for x in doc_data["notifies"]
-        )
-        rows_parcelle.extend(
-            ({"idu": idu} | x | {"datemaj": datemaj}) for x in doc_data["parcelles"]
+        arrete = doc_data["arretes"][0] if doc_data["arretes"] else {}
+        self.docs_published.append(
+            {
+                "pdf": df_row.pdf,
+                "idu": idu,
+                "priority": df_row.priority,
+                "classe": arrete.get("classe"),
+                "urgence": arrete.get("urgence"),
+                "ingested_at": df_row.ingested_at,
+            }
         )
-
-    # créer les 4 DataFrames et les exporter en CSV
-    for key, rows, dtype in [
-        ("adresse", rows_adresse, DTYPE_ADRESSE),
-        ("arrete", rows_arrete, DTYPE_ARRETE),
-        ("notifie", rows_notifie, DTYPE_NOTIFIE),
-        ("parcelle", rows_parcelle, DTYPE_PARCELLE),
-    ]:
-        out_file = out_files[key]
-        df = pd.DataFrame.from_records(rows)
-
-        for dtype_key, _ in dtype.items():
-            if dtype_key not in df.columns:
-                df[dtype_key] = np.nan
-
-        df = df.astype(dtype=dtype)
-        df.to_csv(out_file, index=False, sep=";")
-
-    # déplacer les fichiers PDF traités ;
-    # le code est redondant avec celui utilisé pour remplir le champ d'URL
-    # mais on fait les déplacements de fichiers après l'écriture du dataframe
-    # pour éviter de déplacer le fichier si les CSV ne sont finalement pas
-    # produits (eg. à cause d'un échec sur un autre document)
-    df_arr = pd.read_csv(out_files["arrete"], dtype=DTYPE_ARRETE, sep=";")
-    for df_row in df_arr.itertuples():
-        # nom du PDF (incluant hash)
-        fn = df_row.pdf
+        return idu
+
+    def _parse(self, df_row: NamedTuple, fp_pdf: Path, fp_txt: Path) -> dict:
+        """Analyse un document, ou relit son analyse dans le cache.
+
+        Parameters
+        ----------
+        df_row: NamedTuple
+            Métadonnées du document.
+        fp_pdf: Path
+            Fichier PDF.
+        fp_txt: Path
+            Fichier texte à analyser.
+
+        Returns
+        -------
+        doc_data: dict
+            Données extraites du document.
+        """
+        if self.artifact_cache is None:
+            return parse_arrete(fp_pdf, fp_txt, fn_pdf=df_row.pdf)
+        row = df_row._asdict()
+        row.pop("Index", None)
+        key = self.artifact_cache.get_key("parse", get_input_digest(row))
+        doc_data = self.artifact_cache.get(key, "parse")
+        if doc_data is None:
+            doc_data = parse_arrete(fp_pdf, fp_txt, fn_pdf=df_row.pdf)
+            self.artifact_cache.put(key, "parse", doc_data)
+        return doc_data
+
+    def _place_pdf(self, df_row_in: NamedTuple, df_row: NamedTuple):
+        """Place le fichier PDF d'un document dans le dossier de sa commune.
+
+        Parameters
+        ----------
+        df_row_in: NamedTuple
+            Métadonnées du document.
+        df_row: NamedTuple
+            Ligne du document dans le fichier paquet_arrete.
+        """
+        # le code est redondant avec celui utilisé pour remplir le champ d'URL
         # déterminer le dossier destination
         if pd.notna(df_row.codeinsee):
             commune = df_row.codeinsee
@@ -856,50 +972,176 @@ def process_files(
                 year = df_row.date.rsplit("/", 1)[1]
 
                 if commune != "13055":
-                    dest_dir = out_dir / "pdf_analyses" / commune / year
+                    dest_dir = self.out_dir / "pdf_analyses" / commune / year
                 else:
                     # cas particulier de marseille 13055 => besoin de reclasser manuellement même si on a l'année
-                    dest_dir = out_dir / "pdf_analyses/pdf_a_reclasser/13055" / year
+                    dest_dir = self.out_dir / "pdf_analyses/pdf_a_reclasser/13055" / year
             else:
-                dest_dir = out_dir / "pdf_analyses/pdf_a_reclasser" / commune
+                dest_dir = self.out_dir / "pdf_analyses/pdf_a_reclasser" / commune
         else:
-            dest_dir = out_dir / "pdf_analyses/pdf_a_reclasser"
+            dest_dir = self.out_dir / "pdf_analyses/pdf_a_reclasser"
         # créer le dossier destination si besoin
         dest_dir.mkdir(parents=True, exist_ok=True)
-        # retrouver l'entrée correspondance dans df_in, pour avoir le
-        # chemin complet de sa copie (à déplacer) et du fichier original
-        # (à supprimer)
-        # .head(1) car normalement il y a *exactement une* entrée correspondante
-        # et .itertuples() pour avoir facilement un namedtuple
-        for df_row_in in df_in.loc[df_in["pdf"] == fn].head(1).itertuples():
-            # chemin du fichier traité (copié depuis dir_in vers le dossier de travail)
-            fp = Path(df_row_in.fullpath)
-            # chemin du fichier d'origine (pour suppression après move)
-            fp_orig = Path(df_row_in.origpath)
-            # chemin destination du fichier traité
-            print(fp.name)
-            fp_dst = dest_dir / create_file_name_url(fp.name)
-            print(fp_dst)
-            print()
-
-            shutil.move(fp, fp_dst)
-            # si le move a réussi, on peut supprimer le fichier dans le dossier d'entrée
-            if fp_dst.is_file():
-                fp_orig.unlink()
-            # chemin du fichier TXT (OCR sinon natif)
-            fp_txt = Path(df_row_in.fullpath_txt)
-            shutil.copy2(fp_txt, out_dir_txt / fp_txt.name)
-
-    # faire une copie des 4 fichiers générés avec les noms de base (écraser chaque fichier
-    # pré-existant ayant le nom de base)
-    for fp_out in out_files.values():
-        # retirer la date et le numéro d'exécution pour retrouver le nom de base
-        fp_copy = (
-            out_dir / fp_out.with_stem(f"{fp_out.stem.rsplit('_', maxsplit=2)[0]}").name
-        )
-        shutil.copy2(fp_out, fp_copy)
+        # chemin du fichier traité (stocké depuis dir_in dans le stock de travail)
+        fp = Path(df_row_in.fullpath)
+        # chemin du fichier d'origine (pour suppression après placement)
+        fp_orig = Path(df_row_in.origpath)
+        # chemin destination du fichier traité
+        print(df_row_in.pdf)
+        fp_dst = dest_dir / create_file_name_url(df_row_in.pdf)
+        print(fp_dst)
+        print()
+
+        # lien ou copie plutôt que déplacement: le stock de travail est
+        # adressé par contenu et peut être partagé par plusieurs entrées
+        link_or_copy(fp, fp_dst)
+        # si le placement a réussi, on peut supprimer le fichier dans le dossier d'entrée
+        if fp_dst.is_file():
+            fp_orig.unlink()
+        # chemin du fichier TXT (OCR sinon natif)
+        fp_txt = Path(df_row_in.fullpath_txt)
+        shutil.copy2(fp_txt, self.out_dir_txt / fp_txt.name)
+
+    def finalize(self) -> Dict[str, Path]:
+        """Copie les fichiers CSV sous leurs noms de base, place les fichiers PDF
+        restant à placer et enregistre les délais de publication.
+
+        Returns
+        -------
+        out_files : Dict[str, Path]
+            Fichiers CSV produits, vide si aucun document n'a été analysé.
+        """
+        if not self.docs_published:
+            return {}
+        # faire une copie des 4 fichiers générés avec les noms de base (écraser chaque fichier
+        # pré-existant ayant le nom de base)
+        for fp_out in self.out_files.values():
+            # retirer la date et le numéro d'exécution pour retrouver le nom de base
+            fp_copy = (
+                self.out_dir
+                / fp_out.with_stem(f"{fp_out.stem.rsplit('_', maxsplit=2)[0]}").name
+            )
+            shutil.copy2(fp_out, fp_copy)
+
+        # placer les fichiers PDF, une fois tous les fichiers CSV produits
+        for df_row, df_arr in self.pdfs_to_place:
+            for df_row_arr in df_arr.itertuples():
+                self._place_pdf(df_row, df_row_arr)
+        self.pdfs_to_place = []
+
+        # délai de publication de chaque document
+        if self.latency_csv is not None:
+            record_publish_latency(self.docs_published, datetime.now(), self.latency_csv)
+
+        return self.out_files
+
+
+def process_files(
+    df_in: pd.DataFrame,
+    out_dir: Path,
+    date_exec: date,
+    latency_csv: Optional[Path] = None,
+    artifact_cache: Optional[ArtifactCache] = None,
+) -> Dict[str, Path]:
+    """Analyse le texte des fichiers PDF extrait dans des fichiers TXT.
+
+    Les documents sont analysés par ordre de priorité (voir
+    `src.preprocess.priority`), les arrêtés urgents en premier.
+
+    Parameters
+    ----------
+    df_in: pd.DataFrame
+        Fichier meta_$RUN_otxt.csv contenant les métadonnées enrichies et
+        les fichiers PDF et TXT (natif ou OCR) à traiter.
+    out_dir : Path
+        Dossier de sortie
+    date_exec : date
+        Date d'exécution du script, utilisée pour (a) le nom des copies de fichiers CSV
+        incluant la date de traitement, (b) l'identifiant unique des arrêtés dans les 4
+        tables, (c) le champ 'datemaj' initialement rempli avec la date d'exécution.
+    latency_csv : Path, optional
+        Fichier CSV des délais de publication (de l'indexation à l'écriture des
+        fichiers CSV), complété à chaque exécution ; si None, les délais ne sont
+        pas enregistrés.
+    artifact_cache : ArtifactCache, optional
+        Cache des sorties des étapes, pour ne pas refaire l'analyse des documents
+        inchangés.
 
-    return out_files
+    Returns
+    -------
+    out_files : Dict[str, Path]
+        Fichiers CSV produits, contenant les données extraites.
+        Dictionnaire indexé par les clés {"adresse", "arrete", "notifie", "parcelle"}.
+    """
+    # fichiers PDF placés une fois tous les documents analysés
+    writer = PaquetWriter(
+        out_dir,
+        date_exec,
+        latency_csv=latency_csv,
+        artifact_cache=artifact_cache,
+        place_on_finalize=True,
+    )
+    df_in = writer.exclude_duplicates(df_in)
+    # si après filtrage, df_in est vide, aucun fichier CSV ne sera produit
+    # et on peut sortir immédiatement
+    if df_in.empty:
+        return {}
+    # analyser les documents urgents en premier
+    df_in = sort_by_priority(df_in)
+    # itérer sur les fichiers PDF et TXT
+    for df_row in df_in.itertuples():
+        writer.add_doc(df_row)
+    return writer.finalize()
+
+
+def export_report(out_files: Dict[str, Path], out_dir: Path) -> Path:
+    """Finalise les fichiers CSV produits et génère le rapport d'erreurs.
+
+    Parameters
+    ----------
+    out_files : Dict[str, Path]
+        Fichiers CSV produits par `process_files`.
+    out_dir : Path
+        Dossier de sortie
+
+    Returns
+    -------
+    fp_rapport : Path
+        Rapport d'erreurs (HTML).
+    """
+    # update arrete pdf column with create_name to match the url
+    df_arrete = pd.read_csv(out_files["arrete"], dtype=DTYPE_ARRETE, sep=";")
+    df_arrete["pdf"] = df_arrete["pdf"].apply(lambda x: create_file_name_url(x))
+    df_arrete.to_csv(out_files["arrete"], index=False, sep=";")
+    df_arrete.to_csv(out_dir / "paquet_arrete.csv", index=False, sep=";")
+
+    # générer le rapport d'erreurs
+    run = out_files["adresse"].stem.split("_", 2)[2]
+    dfs = {
+        x: pd.read_csv(out_files[x], dtype=x_dtype, sep=";")
+        for (x, x_dtype) in (
+            ("adresse", DTYPE_ADRESSE),
+            ("arrete", DTYPE_ARRETE),
+            ("notifie", DTYPE_NOTIFIE),
+            ("parcelle", DTYPE_PARCELLE),
+        )
+    }
+    html_report = generate_html_report(
+        run,
+        dfs["adresse"],
+        dfs["arrete"],
+        dfs["notifie"],
+        dfs["parcelle"],
+    )
+    out_dir_rapport = out_dir / "rapport_erreurs"
+    logging.info(
+        f"Sous-dossier de sortie: {out_dir_rapport} {'existe déjà' if out_dir_rapport.is_dir() else 'va être créé'}."
+    )
+    out_dir_rapport.mkdir(parents=True, exist_ok=True)
+    fp_rapport = out_dir_rapport / f"rapport_{run}.html"
+    with open(fp_rapport, mode="w") as f_rapport:
+        f_rapport.write(html_report)
+    return fp_rapport
 
 
 if __name__ == "__main__":
@@ -933,13 +1175,18 @@ if __name__ == "__main__":
         + " Les fichiers PDF traités sont rangés dans des dossiers par code commune puis année (ex: 13201/2023/),"
         + " et en l'absence de code commune ou d'année dans le dossier temporaire pdf_a_reclasser/ .)",
     )
+    parser.add_argument(
+        "--latency_csv",
+        default=str(CACHE_DIR / "publish-latency.csv"),
+        help="Fichier CSV des délais de publication (de l'indexation à l'écriture des fichiers paquet_*.csv), complété à chaque exécution ('' pour désactiver)",
+    )
     args = parser.parse_args()
 
     # entrée: fichiers PDF et TXT
     meta_run_otxt = Path(args.meta_run_otxt).resolve()
-    if not meta_run_otxt.is_file():
+    if not meta_run_otxt.exists():
         raise ValueError(f"Impossible de trouver le fichier {meta_run_otxt}")
-    df_in = pd.read_csv(meta_run_otxt, dtype=DTYPE_META_NTXT_OCR)
+    df_in = read_table(meta_run_otxt, DTYPE_META_NTXT_OCR)
 
     # sortie: fichiers CSV générés
     # créer le dossier destination, récursivement, si besoin
@@ -953,37 +1200,9 @@ if __name__ == "__main__":
         df_in,
         out_dir,
         date_exec=date_exec,
+        latency_csv=Path(args.latency_csv).resolve() if args.latency_csv else None,
     )
 
-    # update arrete pdf column with create_name to match the url
-    df_arrete = pd.read_csv(out_files["arrete"], dtype=DTYPE_ARRETE, sep=";")
-    df_arrete["pdf"] = df_arrete["pdf"].apply(lambda x: create_file_name_url(x))
-    df_arrete.to_csv(out_files["arrete"], index=False, sep=";")
-    df_arrete.to_csv(out_dir / "paquet_arrete.csv", index=False, sep=";")
-
-    # générer le rapport d'erreurs
-    run = out_files["adresse"].stem.split("_", 2)[2]
-    dfs = {
-        x: pd.read_csv(out_files[x], dtype=x_dtype, sep=";")
-        for (x, x_dtype) in (
-            ("adresse", DTYPE_ADRESSE),
-            ("arrete", DTYPE_ARRETE),
-            ("notifie", DTYPE_NOTIFIE),
-            ("parcelle", DTYPE_PARCELLE),
-        )
-    }
-    html_report = generate_html_report(
-        run,
-        dfs["adresse"],
-        dfs["arrete"],
-        dfs["notifie"],
-        dfs["parcelle"],
-    )
-    out_dir_rapport = out_dir / "rapport_erreurs"
-    logging.info(
-        f"Sous-dossier de sortie: {out_dir_rapport} {'existe déjà' if out_dir_rapport.is_dir() else 'va être créé'}."
-    )
-    out_dir_rapport.mkdir(parents=True, exist_ok=True)
-    fp_rapport = out_dir_rapport / f"rapport_{run}.html"
-    with open(fp_rapport, mode="w") as f_rapport:
-        f_rapport.write(html_report)
+    # noms des PDF dans les URL, rapport d'erreurs
+    if out_files:
+        export_report(out_files, out_dir)
@@ -55,6 +55,7 @@ from src.domain_knowledge.typologie_securite import (
 
 # type des colonnes des fichiers CSV en entrée
 from src.preprocess.filter_docs import DTYPE_META_NTXT_FILT, DTYPE_NTXT_PAGES_FILT
+from src.utils.storage import read_table
 
 
 # dtypes des champs extraits
@@ -328,7 +329,8 @@ if __name__ == "__main__":
     df_meta = pd.read_csv(in_file_meta, dtype=DTYPE_META_NTXT_FILT)
     # ouvrir le fichier d'entrée
     logging.info(f"Ouverture du fichier CSV de pages de texte {in_file_pages}")
-    df_txts = pd.read_csv(in_file_pages, dtype=DTYPE_NTXT_PAGES_FILT)
+    # texte des pages: chaînes au format Arrow, plus compactes en mémoire
+    df_txts = read_table(in_file_pages, DTYPE_NTXT_PAGES_FILT, arrow_strings=True)
     # traiter les documents (découpés en pages de texte)
     df_tmod = process_files(df_meta, df_txts)
 
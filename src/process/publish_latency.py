@@ -0,0 +1,77 @@
+"""Délai de publication des arrêtés, de leur réception à leur export.
+
+Pour chaque document exporté dans les fichiers paquet_*.csv, le délai
+entre sa première réception ("ingested_at", voir `index_pdfs`) et l'écriture des
+fichiers CSV est ajouté à un fichier CSV conservé dans `CACHE_DIR`, avec la
+priorité issue de la pré-classification (voir `src.preprocess.priority`) et
+la classification définitive.
+Ce fichier permet de suivre le délai de publication des arrêtés urgents.
+"""
+
+from datetime import datetime
+import logging
+from pathlib import Path
+from typing import Dict, List
+
+import pandas as pd
+
+from src.preprocess.priority import PRIORITY_URGENT
+
+# colonnes du fichier des délais de publication
+DTYPE_LATENCY = {
+    "pdf": "string",
+    "idu": "string",
+    "priority": "Int64",  # priorité de traitement (pré-classification)
+    "classe": "string",  # classification définitive
+    "urgence": "string",  # procédure d'urgence (classification définitive)
+    "ingested_at": "string",
+    "published_at": "string",
+    "latency_s": "Float64",  # délai de publication, en secondes
+}
+
+
+def record_publish_latency(
+    docs: List[Dict], published_at: datetime, fp_csv: Path
+) -> pd.DataFrame:
+    """Enregistre le délai de publication des documents exportés.
+
+    Le résumé (médiane et maximum, pour les urgents et pour les autres) est
+    écrit dans le log et sur la sortie standard (résumé dans batch-logs).
+
+    Parameters
+    ----------
+    docs: List[Dict]
+        Documents exportés: "pdf", "idu", "priority", "classe", "urgence",
+        "ingested_at".
+    published_at: datetime
+        Date et heure de l'écriture des fichiers paquet_*.csv.
+    fp_csv: Path
+        Fichier CSV des délais de publication, complété à chaque exécution.
+
+    Returns
+    -------
+    df_latency: pd.DataFrame
+        Délai de publication des documents exportés.
+    """
+    df_latency = pd.DataFrame(docs, columns=list(DTYPE_LATENCY)).astype(DTYPE_LATENCY)
+    df_latency["published_at"] = published_at.isoformat(timespec="seconds")
+    ingested_at = pd.to_datetime(df_latency["ingested_at"], errors="coerce")
+    df_latency["latency_s"] = (
+        (published_at - ingested_at).dt.total_seconds().round(0).astype("Float64")
+    )
+    fp_csv.parent.mkdir(parents=True, exist_ok=True)
+    df_latency.to_csv(fp_csv, mode="a", header=not fp_csv.is_file(), index=False)
+    # résumé
+    s_urgent = df_latency["priority"] == PRIORITY_URGENT
+    for label, s_docs in (("urgents", s_urgent), ("autres", ~s_urgent)):
+        latencies = df_latency.loc[s_docs.fillna(False), "latency_s"].dropna()
+        if latencies.empty:
+            continue
+        msg = (
+            f"Délai de publication ({label}, {len(latencies)} documents):"
+            + f" médiane {latencies.median() / 60:.1f} min,"
+            + f" max {latencies.max() / 60:.1f} min"
+        )
+        logging.info(msg)
+        print(msg)
+    return df_latency
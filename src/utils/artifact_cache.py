@@ -0,0 +1,514 @@
+"""Cache persistant des sorties des étapes, document par document.
+
+Le dossier data/interim est effacé à chaque exécution du pipeline: sans
+cache, la ré-exécution d'un lot refait toutes les étapes pour tous les
+documents, même si seul le code d'une étape a changé (ex: une expression
+régulière de `src.domain_knowledge`, utilisée par l'analyse du texte).
+
+La sortie d'une étape pour un document (sa ligne de métadonnées, et le
+contenu des fichiers texte qu'elle référence) est stockée sous une clé qui
+combine:
+* l'entrée de l'étape pour ce document: sa ligne de métadonnées, dont le
+hachage du fichier PDF ("blake2b"), et le contenu du fichier texte
+qu'elle référence ("fullpath_txt") ;
+* la version du code de l'étape: hachage des fichiers source de ses modules
+(`STAGE_MODULES`) et des modules du dépôt qu'ils importent, et des fichiers
+de données lus par ces modules (`MODULE_DATA_FILES`) ;
+* ses réglages (dossiers de sortie, moteur d'OCR...).
+Une étape dont la clé n'a pas changé n'est pas ré-exécutée: sa sortie est
+relue dans le cache, et les fichiers texte absents de data/interim sont
+réécrits. Une étape ré-exécutée dont la sortie est identique ne provoque pas
+la ré-exécution des étapes suivantes.
+
+Le cache est stocké dans une base SQLite, de taille bornée: les sorties
+utilisées le moins récemment sont évincées (LRU).
+"""
+
+from collections import Counter
+import ast
+import functools
+import hashlib
+import json
+import logging
+from pathlib import Path
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+import zlib
+
+import pandas as pd
+
+# racine du dépôt, pour retrouver les fichiers source des étapes
+ROOT_DIR = Path(__file__).resolve().parents[2]
+# taille maximale du cache par défaut (sorties compressées), en octets
+ARTIFACT_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# après éviction, le cache est ramené à cette fraction de sa taille maximale
+_EVICT_TO = 0.9
+# modules d'entrée de chaque étape: la version du code de l'étape porte sur
+# ces modules et sur tous les modules du dépôt qu'ils importent, directement
+# ou non (voir `get_src_closure`)
+STAGE_MODULES = {
+    "process_metadata": ("src.preprocess.process_metadata",),
+    "extract_native_text": ("src.preprocess.extract_native_text",),
+    "determine_pdf_type": ("src.preprocess.determine_pdf_type",),
+    "filter_docs": (
+        "src.preprocess.separate_pages",
+        "src.preprocess.filter_docs",
+    ),
+    "convert_native_pdf_to_pdfa": ("src.preprocess.convert_native_pdf_to_pdfa",),
+    "extract_text_ocr": ("src.preprocess.extract_text_ocr",),
+    "parse": ("src.process.parse_doc_direct",),
+}
+# paquet racine des modules du dépôt
+SRC_PACKAGE = "src"
+# fichiers de données (relatifs à la racine du dépôt) lus par des modules du
+# dépôt: la version du code d'une étape porte aussi sur ceux des modules
+# qu'elle importe (voir `src.domain_knowledge.codes_geo`: FP_INSEE,
+# FP_CPOSTAL)
+MODULE_DATA_FILES = {
+    "src.domain_knowledge.codes_geo": (
+        "data/external/codes_insee_amp.csv",
+        "data/external/codeinsee_codepostal.csv",
+    ),
+}
+# colonnes dont la valeur change à chaque indexation, sans effet sur la
+# sortie des étapes: exclues de la clé et reprises de l'entrée
+VOLATILE_COLS = ("ingested_at",)
+# colonnes désignant un fichier texte produit par une étape: son contenu
+# fait partie de la clé des étapes suivantes et de la sortie stockée
+TEXT_FILE_COLS = ("fullpath_txt",)
+
+
+def _module_file(module: str) -> Optional[Path]:
+    """Renvoie le fichier source d'un module du dépôt.
+
+    Parameters
+    ----------
+    module: str
+        Nom du module ou du paquet (ex: "src.preprocess.filter_docs").
+
+    Returns
+    -------
+    fp_src: Path, optional
+        Fichier source du module, ou "__init__.py" du paquet ; None si le
+        nom ne désigne pas un module (ex: fonction importée d'un module).
+    """
+    fp_mod = ROOT_DIR.joinpath(*module.split("."))
+    if (fp_mod / "__init__.py").is_file():
+        return fp_mod / "__init__.py"
+    if fp_mod.with_suffix(".py").is_file():
+        return fp_mod.with_suffix(".py")
+    return None
+
+
+def get_src_closure(modules: Iterable[str]) -> List[Path]:
+    """Liste les fichiers source des modules du dépôt importés par des modules.
+
+    Les instructions d'import de chaque module sont lues dans son code source
+    (sans l'importer), y compris les imports placés dans des fonctions ; les
+    paquets parents de chaque module, exécutés à l'import, sont inclus.
+
+    Parameters
+    ----------
+    modules: Iterable[str]
+        Modules d'entrée.
+
+    Returns
+    -------
+    fps_src: List[Path]
+        Fichiers source des modules d'entrée et des modules du dépôt qu'ils
+        importent, directement ou non, triés.
+    """
+    todo = list(modules)
+    seen = {}
+    while todo:
+        module = todo.pop()
+        if module in seen:
+            continue
+        seen[module] = fp_src = _module_file(module)
+        if fp_src is None:
+            continue
+        parts = module.split(".")
+        todo.extend(".".join(parts[:i]) for i in range(1, len(parts)))
+        for node in ast.walk(ast.parse(fp_src.read_bytes())):
+            if isinstance(node, ast.Import):
+                names = [x.name for x in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                # "from paquet import nom": le nom peut être un sous-module
+                names = [node.module] + [f"{node.module}.{x.name}" for x in node.names]
+            else:
+                continue
+            todo.extend(
+                x for x in names if x.split(".")[0] == SRC_PACKAGE and x not in seen
+            )
+    return sorted(x for x in seen.values() if x is not None)
+
+
+@functools.lru_cache(maxsize=None)
+def get_code_version(stage: str) -> str:
+    """Calcule la version du code d'une étape.
+
+    Parameters
+    ----------
+    stage: str
+        Nom de l'étape, dans `STAGE_MODULES`.
+
+    Returns
+    -------
+    code_version: str
+        Hachage des fichiers source des modules de l'étape et des modules du
+        dépôt qu'ils importent, et des fichiers de données lus par ces
+        modules.
+    """
+    fps_src = get_src_closure(STAGE_MODULES[stage])
+    fps_data = sorted(
+        ROOT_DIR / fp_data
+        for module, fps_mod_data in MODULE_DATA_FILES.items()
+        if _module_file(module) in fps_src
+        for fp_data in fps_mod_data
+    )
+    f_digest = hashlib.blake2b(digest_size=16)
+    for fp in [*fps_src, *fps_data]:
+        f_digest.update(str(fp.relative_to(ROOT_DIR)).encode())
+        # fichier de données absent: son absence fait partie de la version
+        f_digest.update(fp.read_bytes() if fp.is_file() else b"")
+    return f_digest.hexdigest()
+
+
+def get_input_digest(row: Dict, text_cols: Iterable[str] = TEXT_FILE_COLS) -> str:
+    """Calcule l'empreinte de l'entrée d'une étape pour un document.
+
+    Parameters
+    ----------
+    row: Dict
+        Ligne de métadonnées du document.
+    text_cols: Iterable[str], defaults to TEXT_FILE_COLS
+        Colonnes désignant un fichier texte dont le contenu est pris en
+        compte.
+
+    Returns
+    -------
+    input_digest: str
+        Empreinte de la ligne, hors colonnes volatiles, et du contenu des
+        fichiers texte.
+    """
+    f_digest = hashlib.blake2b(digest_size=16)
+    row_key = {k: v for k, v in row.items() if k not in VOLATILE_COLS}
+    f_digest.update(json.dumps(row_key, sort_keys=True, default=str).encode())
+    for col in text_cols:
+        fp_txt = row.get(col)
+        if isinstance(fp_txt, str) and Path(fp_txt).is_file():
+            f_digest.update(Path(fp_txt).read_bytes())
+    return f_digest.hexdigest()
+
+
+def _row_to_dict(df: pd.DataFrame, i: int) -> Dict:
+    """Convertit une ligne d'un DataFrame en dictionnaire sérialisable en JSON.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        DataFrame.
+    i: int
+        Position de la ligne.
+
+    Returns
+    -------
+    row: Dict
+        Valeurs de la ligne, les valeurs manquantes étant None.
+    """
+    return json.loads(df.iloc[[i]].to_json(orient="records"))[0]
+
+
+class ArtifactCache:
+    """Cache des sorties des étapes, stocké dans SQLite.
+
+    Utilisable depuis plusieurs threads.
+    """
+
+    def __init__(self, fp_db: Path, max_bytes: int = ARTIFACT_CACHE_MAX_BYTES):
+        """Ouvre (et crée si besoin) le cache.
+
+        Parameters
+        ----------
+        fp_db: Path
+            Fichier de la base SQLite.
+        max_bytes: int, defaults to ARTIFACT_CACHE_MAX_BYTES
+            Taille maximale des sorties stockées (compressées), en octets.
+        """
+        self.fp_db = fp_db
+        self.max_bytes = max_bytes
+        # sorties trouvées et recalculées, par étape
+        self.hits = Counter()
+        self.misses = Counter()
+        self.nb_evicted = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(fp_db, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS artifact"
+            + " (key TEXT PRIMARY KEY, stage TEXT, data BLOB, nb_bytes INTEGER,"
+            + " last_used REAL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_artifact_last_used ON artifact (last_used)"
+        )
+        self.conn.commit()
+        (total,) = self.conn.execute(
+            "SELECT COALESCE(SUM(nb_bytes), 0) FROM artifact"
+        ).fetchone()
+        self._total_bytes = total
+
+    def close(self):
+        """Ferme la connexion à la base."""
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get_key(
+        self, stage: str, input_digest: str, params: Optional[Dict] = None
+    ) -> str:
+        """Calcule la clé de la sortie d'une étape pour un document.
+
+        Parameters
+        ----------
+        stage: str
+            Nom de l'étape, dans `STAGE_MODULES`.
+        input_digest: str
+            Empreinte de l'entrée de l'étape (voir `get_input_digest`).
+        params: Dict, optional
+            Réglages de l'étape.
+
+        Returns
+        -------
+        key: str
+            Clé de la sortie.
+        """
+        f_digest = hashlib.blake2b(digest_size=16)
+        f_digest.update(f"{stage}|{get_code_version(stage)}|{input_digest}|".encode())
+        f_digest.update(json.dumps(params or {}, sort_keys=True, default=str).encode())
+        return f_digest.hexdigest()
+
+    def get(self, key: str, stage: str) -> Optional[Dict]:
+        """Renvoie une sortie en cache, sinon None.
+
+        Parameters
+        ----------
+        key: str
+            Clé de la sortie.
+        stage: str
+            Nom de l'étape, pour les statistiques.
+
+        Returns
+        -------
+        artifact: Dict, optional
+            Sortie de l'étape, None si elle est absente du cache.
+        """
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT data FROM artifact WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses[stage] += 1
+                return None
+            self.hits[stage] += 1
+            with self.conn:
+                self.conn.execute(
+                    "UPDATE artifact SET last_used = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+        return pickle.loads(zlib.decompress(row[0]))
+
+    def unhit(self, stage: str):
+        """Compte comme recalculée une sortie trouvée mais inutilisable.
+
+        Parameters
+        ----------
+        stage: str
+            Nom de l'étape.
+        """
+        with self._lock:
+            self.hits[stage] -= 1
+            self.misses[stage] += 1
+
+    def put(self, key: str, stage: str, artifact: Dict):
+        """Ajoute une sortie au cache, puis évince si besoin.
+
+        Parameters
+        ----------
+        key: str
+            Clé de la sortie.
+        stage: str
+            Nom de l'étape.
+        artifact: Dict
+            Sortie de l'étape, sérialisable avec pickle.
+        """
+        data = zlib.compress(pickle.dumps(artifact))
+        nb_bytes = len(data)
+        with self._lock:
+            with self.conn:
+                row = self.conn.execute(
+                    "SELECT nb_bytes FROM artifact WHERE key = ?", (key,)
+                ).fetchone()
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO artifact"
+                    + " (key, stage, data, nb_bytes, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (key, stage, data, nb_bytes, time.time()),
+                )
+            self._total_bytes += nb_bytes - (row[0] if row is not None else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Évince les sorties utilisées le moins récemment (verrou déjà acquis)."""
+        target = self.max_bytes * _EVICT_TO
+        evicted = []
+        for key, nb_bytes in self.conn.execute(
+            "SELECT key, nb_bytes FROM artifact ORDER BY last_used"
+        ):
+            if self._total_bytes <= target:
+                break
+            evicted.append((key,))
+            self._total_bytes -= nb_bytes
+        with self.conn:
+            self.conn.executemany("DELETE FROM artifact WHERE key = ?", evicted)
+        self.nb_evicted += len(evicted)
+        logging.info(f"Cache des étapes: {len(evicted)} sorties évincées")
+
+    def log_stats(self):
+        """Écrit le nombre de sorties trouvées et recalculées de chaque étape.
+
+        Aussi sur la sortie standard, pour le résumé dans batch-logs.
+        """
+        lines = [f"{'cache des étapes':<28} {'trouvés':>8} {'recalculés':>11}"]
+        for stage in STAGE_MODULES:
+            if self.hits[stage] or self.misses[stage]:
+                lines.append(
+                    f"{stage:<28} {self.hits[stage]:>8} {self.misses[stage]:>11}"
+                )
+        lines.append(
+            f"Cache des étapes: {self.nb_evicted} sorties évincées,"
+            + f" {self._total_bytes / 1e6:.1f} Mo / {self.max_bytes / 1e6:.1f} Mo"
+        )
+        for line in lines:
+            logging.info(line)
+            print(line)
+
+
+def _restore_row(artifact: Dict) -> bool:
+    """Réécrit les fichiers texte d'une sortie en cache, s'ils sont absents.
+
+    Parameters
+    ----------
+    artifact: Dict
+        Sortie de l'étape: ligne de métadonnées ("row"), contenu des fichiers
+        texte ("files") et fichiers qui doivent exister ("required").
+
+    Returns
+    -------
+    restored: bool
+        False si un fichier requis est absent (ex: PDF/A conservé lors d'une
+        exécution précédente, puis effacé).
+    """
+    for fp in artifact["required"]:
+        if not Path(fp).is_file():
+            return False
+    for fp, content in artifact["files"].items():
+        fp = Path(fp)
+        if not fp.is_file():
+            fp.parent.mkdir(parents=True, exist_ok=True)
+            fp.write_text(content)
+    return True
+
+
+def run_cached(
+    cache: Optional[ArtifactCache],
+    stage: str,
+    func: Callable[[pd.DataFrame], pd.DataFrame],
+    df_in: pd.DataFrame,
+    dtype: Dict[str, str],
+    params: Optional[Dict] = None,
+    required_cols: Iterable[str] = (),
+) -> pd.DataFrame:
+    """Exécute une étape sur les seuls documents dont la sortie n'est pas en
+    cache.
+
+    Les documents absents de la sortie de l'étape (ex: reportés au prochain
+    lot) ne sont pas mis en cache.
+
+    Parameters
+    ----------
+    cache: ArtifactCache, optional
+        Cache des sorties ; si None, l'étape est exécutée sur tous les
+        documents.
+    stage: str
+        Nom de l'étape, dans `STAGE_MODULES`.
+    func: Callable[[pd.DataFrame], pd.DataFrame]
+        Traitement des documents: une ligne par document en sortie,
+        identifiée par la colonne "pdf".
+    df_in: pd.DataFrame
+        Documents en entrée.
+    dtype: Dict[str, str]
+        Types des colonnes de la sortie.
+    params: Dict, optional
+        Réglages de l'étape, intégrés à la clé.
+    required_cols: Iterable[str], defaults to ()
+        Colonnes de la sortie désignant un fichier qui doit exister pour
+        réutiliser la sortie en cache (ex: "fullpath_pdfa").
+
+    Returns
+    -------
+    df_out: pd.DataFrame
+        Sortie de l'étape, dans l'ordre des documents en entrée.
+    """
+    if cache is None:
+        return func(df_in)
+    keys = {}
+    rows_hit = {}
+    for i in range(len(df_in)):
+        row_in = _row_to_dict(df_in, i)
+        key = cache.get_key(stage, get_input_digest(row_in), params)
+        keys[row_in["pdf"]] = key
+        artifact = cache.get(key, stage)
+        if artifact is None:
+            continue
+        if not _restore_row(artifact):
+            cache.unhit(stage)
+            continue
+        # valeurs propres à cette indexation
+        rows_hit[row_in["pdf"]] = artifact["row"] | {
+            k: row_in[k] for k in VOLATILE_COLS if k in row_in
+        }
+    s_miss = ~df_in["pdf"].isin(rows_hit)
+    if s_miss.any():
+        df_miss = func(df_in[s_miss])
+        for i in range(len(df_miss)):
+            row_out = _row_to_dict(df_miss, i)
+            files = {}
+            for col in TEXT_FILE_COLS:
+                fp_txt = row_out.get(col)
+                if isinstance(fp_txt, str) and Path(fp_txt).is_file():
+                    files[fp_txt] = Path(fp_txt).read_text()
+            required = [row_out[x] for x in required_cols if row_out.get(x)]
+            cache.put(
+                keys[row_out["pdf"]],
+                stage,
+                {"row": row_out, "files": files, "required": required},
+            )
+    else:
+        df_miss = pd.DataFrame(columns=list(dtype)).astype(dtype)
+    if not rows_hit:
+        return df_miss
+    df_hit = pd.DataFrame.from_records(list(rows_hit.values()))
+    # colonnes de la sortie, puis colonnes hors schéma (ex: "blake2b")
+    df_hit = df_hit.reindex(columns=list(dict.fromkeys([*dtype, *df_hit.columns])))
+    df_hit = df_hit.astype(dtype)
+    df_out = pd.concat([df_hit, df_miss], ignore_index=True)
+    # ordre des documents en entrée
+    order = {pdf: i for i, pdf in enumerate(df_in["pdf"])}
+    return df_out.sort_values("pdf", key=lambda s: s.map(order)).reset_index(drop=True)
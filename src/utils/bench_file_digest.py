@@ -0,0 +1,105 @@
+"""Mesure le débit du hachage des PDF d'entrée, avec et sans cache.
+
+Trois mesures sont faites sur le même dossier:
+* "legacy": lecture par blocs de 8 Kio, sans cache (ancien comportement) ;
+* "cold": hachage optimisé, cache de hachages vide ;
+* "warm": cache de hachages rempli par la mesure précédente, aucun fichier
+modifié.
+
+NB: le cache de pages du système d'exploitation n'est pas vidé entre les
+mesures, "cold" désigne l'état du cache de hachages.
+"""
+
+import argparse
+import hashlib
+from pathlib import Path
+import tempfile
+import time
+from typing import List
+
+from src.preprocess.index_pdfs import PAT_PDF
+from src.utils.file_utils import DigestCache, get_file_digest, get_stat_key
+
+
+def _hash_files(fps: List[Path], cache: DigestCache):
+    """Hache une liste de fichiers, en utilisant un cache.
+
+    Parameters
+    ----------
+    fps: List[Path]
+        Fichiers à hacher.
+    cache: DigestCache
+        Cache de hachages.
+    """
+    for fp in fps:
+        stat_key = get_stat_key(fp)
+        if cache.get(stat_key) is None:
+            cache.put(stat_key, get_file_digest(fp))
+
+
+def _legacy_digest(fp: Path) -> str:
+    """Hachage par blocs de 8 Kio, comme avant l'introduction du cache.
+
+    Parameters
+    ----------
+    fp: Path
+        Fichier à hacher.
+
+    Returns
+    -------
+    fd_hexdigest: str
+        Hachage du fichier.
+    """
+    with open(fp, mode="rb") as f:
+        f_digest = hashlib.blake2b(digest_size=10)
+        while chunk := f.read(8192):
+            f_digest.update(chunk)
+    return f_digest.hexdigest()
+
+
+def bench_digest(in_dir: Path) -> dict:
+    """Mesure le débit du hachage sur un dossier de PDF.
+
+    Parameters
+    ----------
+    in_dir: Path
+        Dossier contenant des PDF (parcouru récursivement).
+
+    Returns
+    -------
+    results: dict
+        Débit en Mo/s pour chaque mesure ("legacy", "cold", "warm").
+    """
+    fps = sorted(in_dir.rglob(PAT_PDF))
+    nb_mb = sum(x.stat().st_size for x in fps) / 1e6
+    print(f"{len(fps)} fichiers, {nb_mb:.1f} Mo")
+    results = {}
+    # ancien comportement
+    t0 = time.perf_counter()
+    for fp in fps:
+        _legacy_digest(fp)
+    results["legacy"] = nb_mb / (time.perf_counter() - t0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fp_cache = Path(tmp_dir) / "digest-cache.csv"
+        # cache vide
+        t0 = time.perf_counter()
+        cache = DigestCache(fp_cache)
+        _hash_files(fps, cache)
+        cache.save()
+        results["cold"] = nb_mb / (time.perf_counter() - t0)
+        # cache rempli
+        t0 = time.perf_counter()
+        cache = DigestCache(fp_cache)
+        _hash_files(fps, cache)
+        cache.save()
+        results["warm"] = nb_mb / (time.perf_counter() - t0)
+    for key, mb_s in results.items():
+        print(f"{key}: {mb_s:.1f} Mo/s")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("in_dir", help="Dossier contenant les PDFs à hacher")
+    args = parser.parse_args()
+    bench_digest(Path(args.in_dir).resolve())
@@ -0,0 +1,185 @@
+"""Compare le stockage des fichiers intermédiaires en CSV et en Parquet.
+
+Pour chaque fichier CSV intermédiaire d'un lot (produit par
+`scripts/process_batch.sh`), le même contenu est écrit et relu dans les deux
+formats, avec les types des colonnes de l'étape:
+* "write": écriture du fichier ;
+* "read": lecture, avec les types des colonnes ;
+* "append": ajout du même contenu au fichier existant (en CSV: relecture et
+réécriture complètes ; en Parquet: nouveau fragment) ;
+* "size": taille sur disque, avant ajout ;
+* "memory": mémoire occupée par le contenu relu.
+Chaque format est aussi mesuré avec les chaînes de caractères chargées au
+format Arrow ("csv+arrow", "parquet+arrow", voir `storage.arrow_dtypes`),
+comme pour les fichiers de pages ; avec pandas >= 3, dont le type "string"
+est déjà au format Arrow si pyarrow est installé, les deux variantes sont
+identiques.
+
+Exemple:
+python src/utils/bench_storage.py data/interim/meta_2023-06-17T06:00:00_*.csv data/interim/pages_2023-06-17T06:00:00_*.csv
+"""
+
+import argparse
+from pathlib import Path
+import tempfile
+import time
+from typing import Dict, List
+
+from src.preprocess.convert_native_pdf_to_pdfa import DTYPE_META_NTXT_PDFA
+from src.preprocess.determine_pdf_type import DTYPE_META_NTXT_PDFTYPE
+from src.preprocess.extract_native_text import DTYPE_META_NTXT
+from src.preprocess.extract_text_ocr import DTYPE_META_NTXT_OCR
+from src.preprocess.filter_docs import DTYPE_META_NTXT_FILT, DTYPE_NTXT_PAGES_FILT
+from src.preprocess.process_metadata import DTYPE_META_PROC
+from src.preprocess.separate_pages import DTYPE_NTXT_PAGES
+from src.utils.storage import list_parts, read_table, write_table
+
+# types des fichiers intermédiaires de métadonnées, d'après la fin de leur nom
+DTYPES_META = {
+    "_proc": DTYPE_META_PROC,
+    "_ntxt": DTYPE_META_NTXT,
+    "_ntxt_pdftype": DTYPE_META_NTXT_PDFTYPE,
+    "_ntxt_filt": DTYPE_META_NTXT_FILT,
+    "_ntxt_pdfa": DTYPE_META_NTXT_PDFA,
+    "_otxt": DTYPE_META_NTXT_OCR,
+}
+
+
+def guess_dtype(fp: Path) -> Dict[str, str]:
+    """Détermine les types des colonnes d'un fichier intermédiaire.
+
+    Parameters
+    ----------
+    fp: Path
+        Fichier intermédiaire, nommé comme dans `scripts/process_batch.sh`
+        (ex: "meta_{RUN}_ntxt_pdftype.csv", "pages_{RUN}_ntxt.csv").
+
+    Returns
+    -------
+    dtype: Dict[str, str]
+        Types des colonnes.
+    """
+    if fp.stem.startswith("pages_"):
+        return DTYPE_NTXT_PAGES_FILT if fp.stem.endswith("_filt") else DTYPE_NTXT_PAGES
+    # suffixe le plus long d'abord ("_ntxt_filt" avant "_ntxt")
+    for suffix in sorted(DTYPES_META, key=len, reverse=True):
+        if fp.stem.endswith(suffix):
+            return DTYPES_META[suffix]
+    raise ValueError(f"Fichier intermédiaire non reconnu: {fp}")
+
+
+def _size(fp: Path) -> int:
+    """Taille d'un fichier CSV ou Parquet (somme des fragments), en octets.
+
+    Parameters
+    ----------
+    fp: Path
+        Fichier.
+
+    Returns
+    -------
+    size: int
+        Taille, en octets.
+    """
+    if fp.is_dir():
+        return sum(x.stat().st_size for x in list_parts(fp))
+    return fp.stat().st_size
+
+
+def bench_table(fp_csv: Path, repeat: int = 3) -> Dict[str, Dict[str, float]]:
+    """Mesure l'écriture, la lecture et l'ajout d'un fichier intermédiaire.
+
+    Parameters
+    ----------
+    fp_csv: Path
+        Fichier CSV intermédiaire.
+    repeat: int, defaults to 3
+        Nombre de répétitions ; la meilleure durée est retenue.
+
+    Returns
+    -------
+    results: Dict[str, Dict[str, float]]
+        Pour chaque format ("csv", "parquet", "csv+arrow", "parquet+arrow"):
+        durées ("write", "read", "append", en secondes), taille sur disque
+        ("size") et en mémoire ("memory", en octets).
+    """
+    dtype = guess_dtype(fp_csv)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for arrow_strings in (False, True):
+            df = read_table(fp_csv, dtype, arrow_strings=arrow_strings)
+            for fmt in ("csv", "parquet"):
+                fp = Path(tmp_dir) / f"{fp_csv.stem}.{fmt}"
+                res = {
+                    "write": float("inf"),
+                    "read": float("inf"),
+                    "append": float("inf"),
+                }
+                for _ in range(repeat):
+                    t0 = time.perf_counter()
+                    write_table(df, fp, dtype)
+                    res["write"] = min(res["write"], time.perf_counter() - t0)
+                    t0 = time.perf_counter()
+                    df_read = read_table(fp, dtype, arrow_strings=arrow_strings)
+                    res["read"] = min(res["read"], time.perf_counter() - t0)
+                    res["size"] = _size(fp)
+                    res["memory"] = df_read.memory_usage(deep=True).sum()
+                    t0 = time.perf_counter()
+                    write_table(df, fp, dtype, append=True)
+                    res["append"] = min(res["append"], time.perf_counter() - t0)
+                results[f"{fmt}+arrow" if arrow_strings else fmt] = res
+    return results
+
+
+def bench_storage(fps_csv: List[Path], repeat: int = 3):
+    """Compare CSV et Parquet sur des fichiers intermédiaires, et écrit les
+    résultats sur la sortie standard.
+
+    Parameters
+    ----------
+    fps_csv: List[Path]
+        Fichiers CSV intermédiaires.
+    repeat: int, defaults to 3
+        Nombre de répétitions de chaque mesure.
+    """
+    print(
+        f"{'fichier':<40} {'format':<14} {'lignes':>7} {'écriture':>9}"
+        + f" {'lecture':>9} {'ajout':>9} {'taille':>10} {'mémoire':>10}"
+    )
+    totals = {}
+    for fp_csv in fps_csv:
+        nb_rows = len(read_table(fp_csv, guess_dtype(fp_csv)))
+        for fmt, res in bench_table(fp_csv, repeat=repeat).items():
+            print(
+                f"{fp_csv.name[:40]:<40} {fmt:<14} {nb_rows:>7}"
+                + f" {res['write']:>8.3f}s {res['read']:>8.3f}s"
+                + f" {res['append']:>8.3f}s {res['size'] / 1e6:>8.2f}Mo"
+                + f" {res['memory'] / 1e6:>8.2f}Mo"
+            )
+            tot = totals.setdefault(fmt, dict.fromkeys(res, 0.0))
+            for k, v in res.items():
+                tot[k] += v
+    for fmt, tot in totals.items():
+        print(
+            f"{'total':<40} {fmt:<14} {'':>7}"
+            + f" {tot['write']:>8.3f}s {tot['read']:>8.3f}s"
+            + f" {tot['append']:>8.3f}s {tot['size'] / 1e6:>8.2f}Mo"
+            + f" {tot['memory'] / 1e6:>8.2f}Mo"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "in_files",
+        nargs="+",
+        help="Fichiers CSV intermédiaires d'un lot (meta_*.csv, pages_*.csv)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Nombre de répétitions de chaque mesure (la meilleure est retenue)",
+    )
+    args = parser.parse_args()
+    bench_storage([Path(x).resolve() for x in args.in_files], repeat=args.repeat)
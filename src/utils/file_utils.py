@@ -1,43 +1,273 @@
 """"""
 
+import csv
 import hashlib
+import logging
+import os
 from pathlib import Path
+import shutil
+import threading
+from typing import Dict, Optional, Tuple
+
+# dossier des caches persistants, hors de data/interim qui est effacé à chaque exécution
+CACHE_DIR = Path(__file__).resolve().parents[2] / "data" / "cache"
+
+# taille du tampon de lecture pour le hachage (1 Mio, au lieu de 8 Kio précédemment)
+DIGEST_BUF_SIZE = 1024 * 1024
+
+
+def _new_digest(digest: str = "blake2b", digest_size: int = 10):
+    """Crée un objet de hachage.
+
+    Parameters
+    ----------
+    digest : str
+        Nom de la fonction de hachage à utiliser.
+    digest_size : int
+        Taille du digest (blake2b, sinon ignoré).
+
+    Returns
+    -------
+    f_digest : hashlib._Hash
+        Objet de hachage.
+    """
+    if digest == "blake2b":
+        # constructeur direct privilégié car plus rapide (doc module hashlib)
+        # et digest_size configurable pour les algos blake2
+        return hashlib.blake2b(digest_size=digest_size)
+    return hashlib.new(digest)
 
 
 def get_file_digest(
-    fp_pdf: Path, digest: str = "blake2b", digest_size: int = 10
+    fp_pdf: Path,
+    digest: str = "blake2b",
+    digest_size: int = 10,
+    buf_size: int = DIGEST_BUF_SIZE,
 ) -> str:
     """Extraire le hachage d'un fichier avec la fonction `digest`.
 
-    Fonctionne pour Python >= 3.8, mais le code pourra être simplifié
-    pour Python >= 3.11 quand ce sera la version minimale requise par
-    les principaux projets.
+    Utilise `hashlib.file_digest` pour Python >= 3.11, sinon une lecture par
+    blocs de `buf_size` octets dans un tampon réutilisé.
 
     Parameters
     ----------
     fp_pdf : Path
         Chemin du fichier PDF à traiter.
     digest : str
-        Nom de la fonction de hachage à utiliser, "sha1" par défaut.
+        Nom de la fonction de hachage à utiliser, "blake2b" par défaut.
     digest_size : int
         Taille du digest (blake2b, sinon ignoré).
+    buf_size : int
+        Taille du tampon de lecture (Python < 3.11).
 
     Returns
     -------
     fd_hexdigest : str
         Hachage du fichier.
     """
-    with open(fp_pdf, mode="rb") as f:
-        # python >= 3.8
-        if digest == "blake2b":
-            # constructeur direct privilégié car plus rapide (doc module hashlib)
-            # et digest_size configurable pour les algos blake2
-            f_digest = hashlib.blake2b(digest_size=digest_size)
+    with open(fp_pdf, mode="rb", buffering=0) as f:
+        if hasattr(hashlib, "file_digest"):
+            # python >= 3.11
+            f_digest = hashlib.file_digest(
+                f, lambda: _new_digest(digest=digest, digest_size=digest_size)
+            )
         else:
-            f_digest = hashlib.new(digest)
-        while chunk := f.read(8192):
-            f_digest.update(chunk)
-        # alternative en 1 ligne (remplace les 3 lignes précédentes) pour python >= 3.11:
-        # f_digest = hashlib.file_digest(f, digest)
+            # python >= 3.8
+            f_digest = _new_digest(digest=digest, digest_size=digest_size)
+            buf = bytearray(buf_size)
+            view = memoryview(buf)
+            while size := f.readinto(buf):
+                f_digest.update(view[:size])
     fd_hexdigest = f_digest.hexdigest()
     return fd_hexdigest
+
+
+def get_stat_key(fp: Path) -> Tuple[str, int, int, int]:
+    """Renvoie la clé d'un fichier pour le cache de hachages.
+
+    Parameters
+    ----------
+    fp : Path
+        Chemin du fichier.
+
+    Returns
+    -------
+    stat_key : Tuple[str, int, int, int]
+        Chemin absolu, taille, date de modification (ns) et inode du fichier.
+    """
+    st = fp.stat()
+    return (str(fp.resolve()), st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+class DigestCache:
+    """Cache persistant des hachages de fichiers.
+
+    Un hachage est réutilisé tant que le fichier a le même chemin, la même
+    taille, la même date de modification (ns) et le même inode, sinon le
+    fichier doit être haché à nouveau.
+
+    Le cache est stocké dans un fichier CSV, chargé en entier à l'ouverture
+    et réécrit (atomiquement) par `save()`.
+    """
+
+    COLUMNS = ["path", "size", "mtime_ns", "inode", "digest_fn", "digest"]
+
+    def __init__(self, fp_cache: Path, digest: str = "blake2b"):
+        """Ouvre le cache.
+
+        Parameters
+        ----------
+        fp_cache : Path
+            Fichier CSV du cache ; il est créé s'il n'existe pas.
+        digest : str
+            Nom de la fonction de hachage ; les entrées calculées avec une
+            autre fonction sont ignorées (mais conservées).
+        """
+        self.fp_cache = fp_cache
+        self.digest = digest
+        self.entries: Dict[Tuple[str, str], Tuple[int, int, int, str]] = {}
+        self.nb_hits = 0
+        self.nb_misses = 0
+        if fp_cache.is_file():
+            with open(fp_cache, newline="") as f:
+                for row in csv.DictReader(f):
+                    self.entries[(row["path"], row["digest_fn"])] = (
+                        int(row["size"]),
+                        int(row["mtime_ns"]),
+                        int(row["inode"]),
+                        row["digest"],
+                    )
+            logging.info(f"Cache de hachages chargé: {len(self.entries)} entrées")
+
+    def get(self, stat_key: Tuple[str, int, int, int]) -> Optional[str]:
+        """Renvoie le hachage en cache pour un fichier inchangé, sinon None.
+
+        Parameters
+        ----------
+        stat_key : Tuple[str, int, int, int]
+            Clé du fichier, renvoyée par `get_stat_key`.
+
+        Returns
+        -------
+        fd_hexdigest : str, optional
+            Hachage du fichier, ou None si le fichier est absent du cache
+            ou a changé.
+        """
+        path, size, mtime_ns, inode = stat_key
+        entry = self.entries.get((path, self.digest))
+        if entry is not None and entry[:3] == (size, mtime_ns, inode):
+            self.nb_hits += 1
+            return entry[3]
+        self.nb_misses += 1
+        return None
+
+    def put(self, stat_key: Tuple[str, int, int, int], fd_hexdigest: str):
+        """Ajoute ou met à jour le hachage d'un fichier.
+
+        Parameters
+        ----------
+        stat_key : Tuple[str, int, int, int]
+            Clé du fichier, renvoyée par `get_stat_key`.
+        fd_hexdigest : str
+            Hachage du fichier.
+        """
+        path, size, mtime_ns, inode = stat_key
+        self.entries[(path, self.digest)] = (size, mtime_ns, inode, fd_hexdigest)
+
+    def save(self):
+        """Écrit le cache sur disque.
+
+        Le fichier est écrit sous un nom temporaire puis renommé, pour ne
+        jamais laisser un cache tronqué en cas d'interruption.
+        """
+        self.fp_cache.parent.mkdir(parents=True, exist_ok=True)
+        fp_tmp = self.fp_cache.with_name(self.fp_cache.name + ".tmp")
+        with open(fp_tmp, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(self.COLUMNS)
+            for (path, digest_fn), (size, mtime_ns, inode, fd_hex) in sorted(
+                self.entries.items()
+            ):
+                writer.writerow([path, size, mtime_ns, inode, digest_fn, fd_hex])
+        os.replace(fp_tmp, self.fp_cache)
+        logging.info(
+            f"Cache de hachages: {self.nb_hits} fichiers inchangés, {self.nb_misses} hachés"
+        )
+
+
+# ioctl Linux de clonage de fichier (reflink, copie sur écriture: btrfs, xfs...)
+FICLONE = 0x40049409
+
+
+def _reflink(fp_src: Path, fp_dst: Path):
+    """Clone un fichier par reflink (Linux uniquement).
+
+    Les blocs de données sont partagés jusqu'à la première modification de
+    l'un des fichiers (copie sur écriture).
+
+    Parameters
+    ----------
+    fp_src : Path
+        Fichier source.
+    fp_dst : Path
+        Fichier destination, qui ne doit pas exister.
+    """
+    import fcntl  # absent sous Windows
+
+    with open(fp_src, "rb") as f_src, open(fp_dst, "xb") as f_dst:
+        try:
+            fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+        except OSError:
+            f_dst.close()
+            fp_dst.unlink()
+            raise
+
+
+def link_or_copy(fp_src: Path, fp_dst: Path, allow_link: bool = True) -> str:
+    """Place un fichier à un nouvel emplacement sans le dupliquer si possible.
+
+    Essaie successivement un reflink (copie sur écriture), un lien physique
+    (même système de fichiers), puis une copie complète.
+    Le fichier destination est d'abord écrit sous un nom temporaire puis
+    renommé, pour ne jamais laisser de fichier partiel.
+
+    Un lien physique partage l'inode du fichier source: le fichier
+    destination ne doit donc jamais être modifié en place.
+
+    Parameters
+    ----------
+    fp_src : Path
+        Fichier source.
+    fp_dst : Path
+        Fichier destination ; écrasé s'il existe.
+    allow_link : bool
+        Si False, seule la copie complète est utilisée.
+
+    Returns
+    -------
+    method : str
+        Méthode utilisée: "reflink", "hardlink" ou "copy".
+    """
+    fp_tmp = fp_dst.with_name(
+        f".{fp_dst.name}.{os.getpid()}-{threading.get_ident()}.tmp"
+    )
+    fp_tmp.unlink(missing_ok=True)
+    method = "copy"
+    if allow_link:
+        try:
+            _reflink(fp_src, fp_tmp)
+            method = "reflink"
+        except (ImportError, OSError):
+            try:
+                os.link(fp_src, fp_tmp)
+                method = "hardlink"
+            except OSError:
+                pass
+    try:
+        if method == "copy":
+            shutil.copy2(fp_src, fp_tmp)
+        os.replace(fp_tmp, fp_dst)
+    except BaseException:
+        fp_tmp.unlink(missing_ok=True)
+        raise
+    return method
@@ -0,0 +1,234 @@
+"""Budget d'une exécution: durée maximale et ressources partagées.
+
+Le serveur est partagé avec d'autres traitements planifiés: une exécution
+doit se terminer dans sa fenêtre, et ne pas occuper plus d'une part de la
+mémoire et des processeurs.
+
+Avant de commencer un document, chaque étape (extraction du texte natif,
+OCR) demande l'accord du budget (`RunBudget.acquire`):
+* si le document ne peut pas être terminé avant l'échéance, il est reporté ;
+* si la mémoire résidente de l'exécution (processus courant et processus
+lancés: ocrmypdf, tesseract...) ou la charge des processeurs dépasse sa
+limite, le document attend que des ressources se libèrent, puis est reporté
+si l'attente se prolonge.
+
+Les documents reportés sont inscrits dans la file des documents reportés
+(voir `src.preprocess.deferred_queue`), traitée au début du lot suivant.
+"""
+
+from collections import Counter
+from datetime import datetime
+import logging
+import os
+from pathlib import Path
+import time
+from typing import Iterable, Optional
+
+# intervalle entre deux vérifications des ressources, en secondes
+GOVERNOR_POLL_S = 5.0
+# attente maximale de ressources libres avant de reporter un document
+GOVERNOR_MAX_WAIT_S = 600.0
+
+# motifs de report
+REASON_DEADLINE = "delai"
+REASON_MEMORY = "memoire"
+REASON_CPU = "cpu"
+
+
+def get_process_tree_rss(pid: int, include_self: bool = True) -> int:
+    """Calcule la mémoire résidente d'un processus et de ses descendants.
+
+    Parameters
+    ----------
+    pid: int
+        Identifiant du processus racine.
+    include_self: bool, defaults to True
+        Si False, seuls les descendants sont comptés.
+
+    Returns
+    -------
+    rss: int
+        Somme des mémoires résidentes, en octets (0 si /proc n'est pas
+        disponible).
+    """
+    # arbre des processus, d'après /proc/<pid>/stat
+    children = {}
+    for fp_stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            stat = fp_stat.read_text()
+        except OSError:
+            continue
+        # le nom de la commande, entre parenthèses, peut contenir des espaces
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(fp_stat.parent.name))
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    rss = 0
+    todo = list(children.get(pid, []))
+    if include_self:
+        todo.append(pid)
+    while todo:
+        proc = todo.pop()
+        if proc != pid:
+            todo.extend(children.get(proc, []))
+        try:
+            rss += int(Path(f"/proc/{proc}/statm").read_text().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            continue
+    return rss
+
+
+def get_cpu_load() -> Optional[float]:
+    """Renvoie la charge des processeurs de la machine.
+
+    Returns
+    -------
+    cpu_load: float, optional
+        Charge moyenne sur une minute, rapportée au nombre de processeurs
+        (1.0: tous les processeurs occupés) ; None si elle n'est pas
+        disponible.
+    """
+    if not hasattr(os, "getloadavg"):
+        return None
+    return os.getloadavg()[0] / (os.cpu_count() or 1)
+
+
+def parse_deadline(deadline: Optional[str]) -> Optional[datetime]:
+    """Lit l'échéance d'une exécution.
+
+    Parameters
+    ----------
+    deadline: str, optional
+        Échéance au format ISO 8601 (ex: "2023-06-17T06:00:00"), ou vide.
+
+    Returns
+    -------
+    deadline: datetime, optional
+        Échéance, None si elle n'est pas fournie.
+    """
+    return datetime.fromisoformat(deadline) if deadline else None
+
+
+class RunBudget:
+    """Budget d'une exécution, partagé par les workers d'une étape."""
+
+    def __init__(
+        self,
+        deadline: Optional[datetime] = None,
+        max_rss: Optional[int] = None,
+        cpu_share: Optional[float] = None,
+        max_wait_s: float = GOVERNOR_MAX_WAIT_S,
+    ):
+        """Initialise le budget.
+
+        Parameters
+        ----------
+        deadline: datetime, optional
+            Échéance de l'exécution (heure locale) ; None pour aucune.
+        max_rss: int, optional
+            Mémoire résidente maximale de l'exécution, en octets.
+        cpu_share: float, optional
+            Charge maximale des processeurs de la machine (entre 0 et 1) au-delà
+            de laquelle aucun document n'est commencé.
+        max_wait_s: float, defaults to GOVERNOR_MAX_WAIT_S
+            Attente maximale de ressources libres, en secondes.
+        """
+        self.deadline = deadline
+        self.max_rss = max_rss
+        self.cpu_share = cpu_share
+        self.max_wait_s = max_wait_s
+
+    @property
+    def is_limited(self) -> bool:
+        """True si le budget comporte au moins une limite."""
+        return (
+            self.deadline is not None
+            or self.max_rss is not None
+            or self.cpu_share is not None
+        )
+
+    def remaining_s(self) -> Optional[float]:
+        """Renvoie le temps restant avant l'échéance.
+
+        Returns
+        -------
+        remaining_s: float, optional
+            Temps restant, en secondes (négatif si l'échéance est passée),
+            None s'il n'y a pas d'échéance.
+        """
+        if self.deadline is None:
+            return None
+        return (self.deadline - datetime.now()).total_seconds()
+
+    def _busy(self) -> Optional[str]:
+        """Vérifie la mémoire et la charge des processeurs.
+
+        Returns
+        -------
+        reason: str, optional
+            Ressource saturée, None si les deux sont sous leur limite.
+        """
+        if (
+            self.max_rss is not None
+            and get_process_tree_rss(os.getpid()) > self.max_rss
+        ):
+            return REASON_MEMORY
+        if self.cpu_share is not None:
+            cpu_load = get_cpu_load()
+            if cpu_load is not None and cpu_load > self.cpu_share:
+                return REASON_CPU
+        return None
+
+    def acquire(self, cost_s: float = 0.0) -> Optional[str]:
+        """Demande l'accord du budget pour commencer un document.
+
+        Attend, si besoin, que la mémoire et les processeurs se libèrent.
+
+        Parameters
+        ----------
+        cost_s: float, defaults to 0.0
+            Durée estimée du traitement du document, en secondes.
+
+        Returns
+        -------
+        reason: str, optional
+            Motif du report du document (`REASON_DEADLINE`, `REASON_MEMORY`
+            ou `REASON_CPU`), None si le document peut être commencé.
+        """
+        t_wait = time.monotonic()
+        while True:
+            remaining_s = self.remaining_s()
+            if remaining_s is not None and remaining_s < cost_s:
+                reason = REASON_DEADLINE
+                break
+            reason = self._busy()
+            if reason is None:
+                return None
+            if time.monotonic() - t_wait >= self.max_wait_s:
+                break
+            time.sleep(GOVERNOR_POLL_S)
+        return reason
+
+
+def log_deferred(step: str, reasons: Iterable[str]):
+    """Écrit le nombre de documents reportés par une étape, par motif.
+
+    Aussi sur la sortie standard, pour le résumé dans batch-logs.
+
+    Parameters
+    ----------
+    step: str
+        Nom de l'étape, pour les messages.
+    reasons: Iterable[str]
+        Motif du report de chaque document.
+    """
+    counts = Counter(reasons)
+    nb_deferred = sum(counts.values())
+    if not nb_deferred:
+        return
+    msg = (
+        f"{step}: {nb_deferred} document(s) reporté(s) au prochain lot ("
+        + ", ".join(f"{k}: {v}" for k, v in sorted(counts.items()))
+        + ")"
+    )
+    logging.warning(msg)
+    print(msg)
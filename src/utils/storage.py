@@ -0,0 +1,182 @@
+"""Stockage des fichiers intermédiaires entre les étapes: CSV ou Parquet.
+
+Le format est déterminé par l'extension du fichier: ".csv" ou ".parquet".
+
+En CSV, chaque lecture ré-analyse le texte avec les types des colonnes
+(`DTYPE_META_*`), et l'ajout (`--append`) relit puis réécrit tout le
+fichier.
+
+En Parquet (dépendance optionnelle: pyarrow), les types des colonnes
+(booléens, entiers "Int64", chaînes) sont conservés dans le fichier. Un
+fichier Parquet est un dossier de fragments ("part-00000.parquet", ...):
+l'ajout écrit un nouveau fragment, sans relire ni réécrire les précédents.
+"""
+
+from pathlib import Path
+import shutil
+from typing import Dict, List
+
+import pandas as pd
+
+try:
+    # optionnel: fichiers intermédiaires en Parquet
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# extensions des formats de stockage
+SUFFIX_CSV = ".csv"
+SUFFIX_PARQUET = ".parquet"
+# formats disponibles, pour les options des scripts
+TABLE_FORMATS = ("csv", "parquet")
+# chaînes de caractères stockées en mémoire au format Arrow
+DTYPE_STRING_ARROW = "string[pyarrow]"
+
+
+def is_parquet(fp: Path) -> bool:
+    """Détermine si un fichier intermédiaire est au format Parquet.
+
+    Parameters
+    ----------
+    fp: Path
+        Chemin du fichier.
+
+    Returns
+    -------
+    is_parquet: bool
+        True si l'extension est ".parquet".
+    """
+    return fp.suffix == SUFFIX_PARQUET
+
+
+def arrow_dtypes(dtype: Dict[str, str]) -> Dict[str, str]:
+    """Remplace les chaînes de caractères par des chaînes au format Arrow.
+
+    Les colonnes de texte long (ex: "pagetxt") occupent alors moins de
+    mémoire et sont écrites en Parquet sans conversion.
+
+    Parameters
+    ----------
+    dtype: Dict[str, str]
+        Types des colonnes.
+
+    Returns
+    -------
+    dtype_arrow: Dict[str, str]
+        Types des colonnes, "string" étant remplacé par
+        `DTYPE_STRING_ARROW` si pyarrow est installé.
+    """
+    if pyarrow is None:
+        return dtype
+    return {k: (DTYPE_STRING_ARROW if v == "string" else v) for k, v in dtype.items()}
+
+
+def _check_parquet(fp: Path):
+    """Vérifie que le format Parquet est disponible.
+
+    Parameters
+    ----------
+    fp: Path
+        Fichier Parquet à lire ou écrire.
+    """
+    if pyarrow is None:
+        raise ValueError(
+            f"Impossible de lire ou écrire {fp}: le format Parquet nécessite pyarrow."
+        )
+
+
+def list_parts(fp: Path) -> List[Path]:
+    """Liste les fragments d'un fichier Parquet.
+
+    Parameters
+    ----------
+    fp: Path
+        Fichier Parquet: dossier de fragments, ou fichier unique.
+
+    Returns
+    -------
+    fps_part: List[Path]
+        Fragments, dans l'ordre d'écriture.
+    """
+    if fp.is_dir():
+        return sorted(fp.glob(f"part-*{SUFFIX_PARQUET}"))
+    if fp.is_file():
+        return [fp]
+    return []
+
+
+def read_table(
+    fp: Path, dtype: Dict[str, str], arrow_strings: bool = False
+) -> pd.DataFrame:
+    """Lit un fichier intermédiaire, CSV ou Parquet.
+
+    Parameters
+    ----------
+    fp: Path
+        Fichier à lire.
+    dtype: Dict[str, str]
+        Types des colonnes (ex: `DTYPE_META_NTXT`).
+    arrow_strings: bool, defaults to False
+        Si True, les chaînes de caractères sont chargées au format Arrow.
+
+    Returns
+    -------
+    df: pd.DataFrame
+        Contenu du fichier.
+    """
+    if arrow_strings:
+        dtype = arrow_dtypes(dtype)
+    if not is_parquet(fp):
+        return pd.read_csv(fp, dtype=dtype)
+    _check_parquet(fp)
+    fps_part = list_parts(fp)
+    if not fps_part:
+        raise ValueError(f"Aucun fragment Parquet dans {fp}")
+    df = pd.concat([pd.read_parquet(x) for x in fps_part], ignore_index=True)
+    # les types sont conservés dans le fichier, sauf pour les colonnes
+    # entièrement vides de certains fragments
+    return df.astype({k: v for k, v in dtype.items() if k in df.columns})
+
+
+def write_table(
+    df: pd.DataFrame, fp: Path, dtype: Dict[str, str], append: bool = False
+):
+    """Écrit un fichier intermédiaire, CSV ou Parquet.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        Contenu à écrire.
+    fp: Path
+        Fichier à écrire.
+    dtype: Dict[str, str]
+        Types des colonnes, pour relire le fichier CSV existant (ajout).
+    append: bool, defaults to False
+        Si True, ajoute le contenu au fichier existant ; sinon le fichier est
+        écrasé.
+    """
+    if not is_parquet(fp):
+        if append and fp.is_file():
+            # charger le fichier existant et lui ajouter les nouvelles entrées
+            df_old = pd.read_csv(fp, dtype=dtype)
+            df = pd.concat([df_old, df])
+        df.to_csv(fp, index=False)
+        return
+    _check_parquet(fp)
+    fps_part = list_parts(fp)
+    if not append and fp.exists():
+        # écraser le fichier existant
+        if fp.is_dir():
+            shutil.rmtree(fp)
+        else:
+            fp.unlink()
+        fps_part = []
+    elif fp.is_file():
+        # fichier unique, écrit par un autre outil: il devient le premier fragment
+        fp_tmp = fp.with_name(fp.name + ".tmp")
+        fp.rename(fp_tmp)
+        fp.mkdir()
+        fps_part = [fp_tmp.rename(fp / f"part-00000{SUFFIX_PARQUET}")]
+    fp.mkdir(parents=True, exist_ok=True)
+    fp_part = fp / f"part-{len(fps_part):05d}{SUFFIX_PARQUET}"
+    df.to_parquet(fp_part, index=False)
@@ -0,0 +1,452 @@
+"""File de tâches partagée entre plusieurs machines, stockée dans SQLite.
+
+Chaque tâche porte sur un document et une étape (ex: OCR, analyse du
+texte). Un worker prend une tâche en bail (`lease`) pour une durée limitée,
+qu'il prolonge régulièrement (`heartbeat`) tant que le traitement dure. Si
+le worker s'arrête brutalement (plantage, machine ou conteneur arrêté), le
+bail expire et la tâche est remise dans la file, jusqu'à `MAX_ATTEMPTS`
+tentatives ; au-delà, ou après autant d'échecs du traitement, la tâche est
+marquée en échec.
+
+La base SQLite peut être placée sur un volume partagé (NFS, SMB...) et
+utilisée par des processus de plusieurs machines: les transactions
+d'écriture prennent un verrou exclusif sur le fichier (journal "DELETE",
+le mode WAL ne fonctionnant pas sur un système de fichiers réseau). Le
+volume doit donc gérer les verrous de fichiers POSIX.
+
+Les entrées et les résultats des tâches sont stockés en JSON: relire des
+objets pickle depuis un volume partagé permettrait à quiconque peut y
+écrire d'exécuter du code sur les machines des workers.
+"""
+
+import json
+import logging
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# statut des tâches
+TASK_PENDING = "pending"
+TASK_LEASED = "leased"
+TASK_DONE = "done"
+TASK_FAILED = "failed"
+# durée d'un bail, en secondes, prolongée par les battements de coeur
+LEASE_S = 300.0
+# nombre maximal de tentatives d'une tâche
+MAX_ATTEMPTS = 3
+# attente maximale d'un verrou sur la base, en secondes
+_LOCK_TIMEOUT_S = 120.0
+
+
+class Task:
+    """Tâche prise en bail par un worker."""
+
+    def __init__(
+        self, task_id: int, run: str, stage: str, pdf: str, payload: Any, attempts: int
+    ):
+        """Initialise la tâche.
+
+        Parameters
+        ----------
+        task_id: int
+            Identifiant de la tâche dans la file.
+        run: str
+            Identifiant du lot.
+        stage: str
+            Étape à exécuter.
+        pdf: str
+            Document traité.
+        payload: Any
+            Entrée de l'étape (ex: DataFrame d'une ligne).
+        attempts: int
+            Numéro de la tentative en cours (à partir de 1).
+        """
+        self.task_id = task_id
+        self.run = run
+        self.stage = stage
+        self.pdf = pdf
+        self.payload = payload
+        self.attempts = attempts
+
+
+class TaskQueue:
+    """File de tâches stockée dans SQLite.
+
+    Utilisable depuis plusieurs threads et plusieurs processus.
+    """
+
+    def __init__(self, fp_db: Path, max_attempts: int = MAX_ATTEMPTS):
+        """Ouvre (et crée si besoin) la file.
+
+        Parameters
+        ----------
+        fp_db: Path
+            Fichier de la base SQLite, sur un volume partagé par les workers.
+        max_attempts: int, defaults to MAX_ATTEMPTS
+            Nombre maximal de tentatives d'une tâche.
+        """
+        self.fp_db = fp_db
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # transactions explicites (BEGIN IMMEDIATE) pour le verrou entre processus
+        self.conn = sqlite3.connect(
+            fp_db,
+            timeout=_LOCK_TIMEOUT_S,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        with self._transaction():
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS task"
+                + " (task_id INTEGER PRIMARY KEY AUTOINCREMENT, run TEXT, stage TEXT,"
+                + " pdf TEXT, priority INTEGER, payload BLOB, status TEXT,"
+                + " worker TEXT, lease_until REAL, attempts INTEGER DEFAULT 0,"
+                + " result BLOB, error TEXT, updated_at REAL,"
+                + " UNIQUE (run, stage, pdf))"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_task_status"
+                + " ON task (status, priority, task_id)"
+            )
+
+    def close(self):
+        """Ferme la connexion à la base."""
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _transaction(self):
+        """Transaction d'écriture, avec verrou exclusif sur la base.
+
+        Returns
+        -------
+        transaction: _Transaction
+            Gestionnaire de contexte: validation en sortie normale,
+            annulation en cas d'exception.
+        """
+        return _Transaction(self.conn, self._lock)
+
+    def submit(
+        self, run: str, stage: str, pdf: str, payload: Any, priority: int
+    ) -> bool:
+        """Ajoute une tâche à la file.
+
+        Une tâche déjà soumise pour le même lot, la même étape et le même
+        document n'est pas ajoutée de nouveau (reprise du coordinateur).
+
+        Parameters
+        ----------
+        run: str
+            Identifiant du lot.
+        stage: str
+            Étape à exécuter.
+        pdf: str
+            Document à traiter.
+        payload: Any
+            Entrée de l'étape, sérialisable en JSON.
+        priority: int
+            Priorité du document (les plus petites valeurs d'abord).
+
+        Returns
+        -------
+        added: bool
+            True si la tâche a été ajoutée.
+        """
+        with self._transaction():
+            cur = self.conn.execute(
+                "INSERT OR IGNORE INTO task"
+                + " (run, stage, pdf, priority, payload, status, updated_at)"
+                + " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    run,
+                    stage,
+                    pdf,
+                    priority,
+                    json.dumps(payload),
+                    TASK_PENDING,
+                    time.time(),
+                ),
+            )
+        return cur.rowcount == 1
+
+    def lease(
+        self, worker: str, stages: Iterable[str], lease_s: float = LEASE_S
+    ) -> Optional[Task]:
+        """Prend en bail la prochaine tâche, par priorité puis ordre d'arrivée.
+
+        Les baux expirés (worker arrêté) sont d'abord remis dans la file.
+
+        Parameters
+        ----------
+        worker: str
+            Identifiant du worker.
+        stages: Iterable[str]
+            Étapes que le worker sait exécuter.
+        lease_s: float, defaults to LEASE_S
+            Durée du bail, en secondes.
+
+        Returns
+        -------
+        task: Task, optional
+            Tâche prise en bail, None si aucune tâche n'est en attente.
+        """
+        stages = list(stages)
+        now = time.time()
+        with self._transaction():
+            self._requeue_expired(now)
+            row = self.conn.execute(
+                "SELECT task_id, run, stage, pdf, payload, attempts FROM task"
+                + f" WHERE status = ? AND stage IN ({', '.join('?' * len(stages))})"
+                + " ORDER BY priority, task_id LIMIT 1",
+                (TASK_PENDING, *stages),
+            ).fetchone()
+            if row is None:
+                return None
+            task_id, run, stage, pdf, payload, attempts = row
+            self.conn.execute(
+                "UPDATE task SET status = ?, worker = ?, lease_until = ?,"
+                + " attempts = ?, updated_at = ? WHERE task_id = ?",
+                (TASK_LEASED, worker, now + lease_s, attempts + 1, now, task_id),
+            )
+        return Task(task_id, run, stage, pdf, json.loads(payload), attempts + 1)
+
+    def _requeue_expired(self, now: float):
+        """Remet dans la file les tâches dont le bail a expiré (transaction
+        déjà ouverte).
+
+        Parameters
+        ----------
+        now: float
+            Date courante (time.time()).
+        """
+        expired = self.conn.execute(
+            "SELECT task_id, pdf, stage, worker, attempts FROM task"
+            + " WHERE status = ? AND lease_until < ?",
+            (TASK_LEASED, now),
+        ).fetchall()
+        for task_id, pdf, stage, worker, attempts in expired:
+            status = TASK_PENDING if attempts < self.max_attempts else TASK_FAILED
+            logging.warning(
+                f"File de tâches: bail expiré pour {stage} {pdf} ({worker},"
+                + f" tentative {attempts}/{self.max_attempts}): {status}"
+            )
+            self.conn.execute(
+                "UPDATE task SET status = ?, worker = NULL, lease_until = NULL,"
+                + " error = ?, updated_at = ? WHERE task_id = ?",
+                (status, f"bail expiré ({worker})", now, task_id),
+            )
+
+    def heartbeat(self, task: Task, worker: str, lease_s: float = LEASE_S) -> bool:
+        """Prolonge le bail d'une tâche.
+
+        Parameters
+        ----------
+        task: Task
+            Tâche en cours.
+        worker: str
+            Identifiant du worker.
+        lease_s: float, defaults to LEASE_S
+            Nouvelle durée du bail, à partir de maintenant, en secondes.
+
+        Returns
+        -------
+        kept: bool
+            False si le bail a été perdu (expiré puis repris par un autre
+            worker).
+        """
+        now = time.time()
+        with self._transaction():
+            cur = self.conn.execute(
+                "UPDATE task SET lease_until = ?, updated_at = ?"
+                + " WHERE task_id = ? AND status = ? AND worker = ?",
+                (now + lease_s, now, task.task_id, TASK_LEASED, worker),
+            )
+            return cur.rowcount == 1
+
+    def complete(self, task: Task, worker: str, result: Any) -> bool:
+        """Enregistre le résultat d'une tâche.
+
+        Parameters
+        ----------
+        task: Task
+            Tâche terminée.
+        worker: str
+            Identifiant du worker.
+        result: Any
+            Résultat, sérialisable en JSON.
+
+        Returns
+        -------
+        recorded: bool
+            False si le bail a été perdu: le résultat est ignoré, la tâche
+            étant reprise par un autre worker.
+        """
+        with self._transaction():
+            cur = self.conn.execute(
+                "UPDATE task SET status = ?, result = ?, lease_until = NULL,"
+                + " error = NULL, updated_at = ?"
+                + " WHERE task_id = ? AND status = ? AND worker = ?",
+                (
+                    TASK_DONE,
+                    json.dumps(result),
+                    time.time(),
+                    task.task_id,
+                    TASK_LEASED,
+                    worker,
+                ),
+            )
+            if cur.rowcount != 1:
+                logging.warning(
+                    f"File de tâches: bail perdu pour {task.stage} {task.pdf}"
+                    + f" ({worker}), résultat ignoré"
+                )
+                return False
+        return True
+
+    def fail(self, task: Task, worker: str, error: str):
+        """Signale l'échec d'une tâche, remise dans la file s'il reste des
+        tentatives.
+
+        Parameters
+        ----------
+        task: Task
+            Tâche en échec.
+        worker: str
+            Identifiant du worker.
+        error: str
+            Description de l'erreur.
+        """
+        status = TASK_PENDING if task.attempts < self.max_attempts else TASK_FAILED
+        with self._transaction():
+            self.conn.execute(
+                "UPDATE task SET status = ?, worker = NULL, lease_until = NULL,"
+                + " error = ?, updated_at = ?"
+                + " WHERE task_id = ? AND status = ? AND worker = ?",
+                (status, error, time.time(), task.task_id, TASK_LEASED, worker),
+            )
+
+    def counts(self, run: str) -> Dict[Tuple[str, str], int]:
+        """Compte les tâches d'un lot, par étape et par statut.
+
+        Parameters
+        ----------
+        run: str
+            Identifiant du lot.
+
+        Returns
+        -------
+        counts: Dict[Tuple[str, str], int]
+            Nombre de tâches par (étape, statut).
+        """
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT stage, status, COUNT(*) FROM task WHERE run = ?"
+                + " GROUP BY stage, status",
+                (run,),
+            ).fetchall()
+        return {(stage, status): nb for stage, status, nb in rows}
+
+    def is_finished(self, run: str, stage: str) -> bool:
+        """Détermine si toutes les tâches d'une étape d'un lot sont terminées
+        ou en échec.
+
+        Parameters
+        ----------
+        run: str
+            Identifiant du lot.
+        stage: str
+            Étape.
+
+        Returns
+        -------
+        finished: bool
+            True si aucune tâche n'est en attente ou en cours.
+        """
+        with self._lock:
+            (nb_open,) = self.conn.execute(
+                "SELECT COUNT(*) FROM task WHERE run = ? AND stage = ?"
+                + " AND status IN (?, ?)",
+                (run, stage, TASK_PENDING, TASK_LEASED),
+            ).fetchone()
+        return nb_open == 0
+
+    def results(self, run: str, stage: str) -> Dict[str, Any]:
+        """Renvoie les résultats des tâches terminées d'une étape.
+
+        Parameters
+        ----------
+        run: str
+            Identifiant du lot.
+        stage: str
+            Étape.
+
+        Returns
+        -------
+        results: Dict[str, Any]
+            Résultat de chaque document.
+        """
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT pdf, result FROM task WHERE run = ? AND stage = ? AND status = ?",
+                (run, stage, TASK_DONE),
+            ).fetchall()
+        return {pdf: json.loads(result) for pdf, result in rows}
+
+    def failures(self, run: str) -> List[Tuple[str, str, str]]:
+        """Liste les tâches en échec d'un lot.
+
+        Parameters
+        ----------
+        run: str
+            Identifiant du lot.
+
+        Returns
+        -------
+        failures: List[Tuple[str, str, str]]
+            (étape, document, erreur) de chaque tâche en échec.
+        """
+        with self._lock:
+            return self.conn.execute(
+                "SELECT stage, pdf, error FROM task WHERE run = ? AND status = ?",
+                (run, TASK_FAILED),
+            ).fetchall()
+
+
+class _Transaction:
+    """Transaction d'écriture SQLite, avec verrou exclusif sur la base."""
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.Lock):
+        """Prépare la transaction.
+
+        Parameters
+        ----------
+        conn: sqlite3.Connection
+            Connexion, en mode autocommit (isolation_level=None).
+        lock: threading.Lock
+            Verrou de la connexion, entre threads du même processus.
+        """
+        self.conn = conn
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            # verrou d'écriture sur le fichier dès le début de la transaction
+            self.conn.execute("BEGIN IMMEDIATE")
+        except Exception:
+            self.lock.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        try:
+            self.conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        finally:
+            self.lock.release()
@@ -1,7 +1,7 @@
 """"""
 
 from pathlib import Path
-from typing import List
+from typing import Iterable, List
 
 
 def load_pages_text(fp_txt: Path, page_break: str = "\f") -> List[str]:
@@ -25,3 +25,50 @@ def load_pages_text(fp_txt: Path, page_break: str = "\f") -> List[str]:
     with open(fp_txt) as f_txt:
         doc_txt = f_txt.read().split(page_break)
     return doc_txt
+
+
+def format_page_list(pages: Iterable[int]) -> str:
+    """Formate une liste de numéros de pages, en regroupant les plages.
+
+    Le format est celui de l'option "--pages" d'ocrmypdf, ex: "1,3,5-7".
+
+    Parameters
+    ----------
+    pages: Iterable[int]
+        Numéros de pages (la première page est numérotée 1).
+
+    Returns
+    -------
+    page_list: str
+        Liste de pages, chaîne vide si aucune page.
+    """
+    ranges = []
+    for page in sorted(set(pages)):
+        if ranges and page == ranges[-1][1] + 1:
+            ranges[-1][1] = page
+        else:
+            ranges.append([page, page])
+    return ",".join(f"{beg}" if beg == end else f"{beg}-{end}" for beg, end in ranges)
+
+
+def parse_page_list(page_list: str) -> List[int]:
+    """Lit une liste de numéros de pages produite par `format_page_list`.
+
+    Parameters
+    ----------
+    page_list: str
+        Liste de pages, ex: "1,3,5-7".
+
+    Returns
+    -------
+    pages: List[int]
+        Numéros de pages, dans l'ordre croissant.
+    """
+    pages = set()
+    for item in page_list.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        beg, _, end = item.partition("-")
+        pages.update(range(int(beg), int(end or beg) + 1))
+    return sorted(pages)
@@ -0,0 +1,679 @@
+"""Exécution d'un lot par plusieurs machines, avec une file de tâches partagée.
+
+Pour les gros lots (ex: les imports d'arrêtés anciens de `RAW_BATCHES`,
+"mrs-2011-2018" ou "2018-2021-VdM"), l'OCR et l'analyse du texte sont
+répartis entre des workers, sur plusieurs machines ou dans plusieurs
+conteneurs, qui prennent les documents un par un dans une file de tâches
+(voir `src.utils.task_queue`):
+* le coordinateur exécute les étapes 2 à 7 (voir `src.pipeline`), soumet une
+tâche d'OCR par document, puis, une fois l'OCR terminé, une tâche
+d'analyse par document (hors doublons) ; il fusionne enfin les résultats
+dans les fichiers paquet_*.csv, avec les mêmes schémas et identifiants
+(idu) qu'une exécution sur une seule machine ;
+* chaque worker prend en bail la tâche la plus prioritaire (arrêtés urgents
+d'abord), prolonge son bail tant qu'il la traite, puis enregistre son
+résultat dans la file ; la tâche d'un worker arrêté brutalement est reprise
+par un autre worker à l'expiration du bail.
+
+La file (base SQLite), le stock des PDF indexés (`data/cache/pdf-index`) et
+le dossier des fichiers intermédiaires (`--data_int`: textes extraits, PDF/A)
+doivent être sur un volume partagé, monté au même chemin sur toutes les
+machines.
+
+Le coordinateur peut aussi exécuter des workers dans son propre processus
+(`--local_workers`). Une tâche soumise de nouveau pour le même lot n'est pas
+dupliquée: un coordinateur relancé reprend les tâches déjà terminées. Les
+documents dont l'OCR ou l'analyse a échoué sont reportés au prochain lot (voir
+`src.preprocess.deferred_queue`).
+
+Exemples:
+python -m src.work_queue coordinate mrs-2011-2018 data/processed/ --queue /mnt/partage/work-queue.sqlite --data_int /mnt/partage/interim
+python -m src.work_queue work --queue /mnt/partage/work-queue.sqlite --data_int /mnt/partage/interim
+"""
+
+import argparse
+from datetime import datetime
+import json
+import logging
+import os
+from pathlib import Path
+import socket
+import threading
+import time
+import traceback
+from typing import Any, Dict, Mapping, Optional
+
+import pandas as pd
+
+from src.pipeline import (
+    DATA_INT,
+    DATA_PRO,
+    FP_ARTIFACT_CACHE,
+    ROOT_DIR,
+    PipelineRunner,
+    cached_stage,
+    prepare_batch,
+)
+from src.preprocess import extract_text_ocr
+from src.preprocess.convert_native_pdf_to_pdfa import DTYPE_META_NTXT_PDFA
+from src.preprocess.deferred_queue import FP_DEFERRED, DeferredQueue
+from src.preprocess.extract_text_ocr import DTYPE_META_NTXT_OCR
+from src.preprocess.extract_text_ocr_ocrmypdf import OCR_ENGINE_KEY
+from src.preprocess.index_pdfs import DTYPE_META_BASE
+from src.preprocess.ocr_cache import OcrPageCache
+from src.preprocess.ocr_cost import OcrCostModel
+from src.preprocess.ocr_pool import get_profile_path, load_ocr_profile
+from src.preprocess.priority import PRIORITY_UNKNOWN, sort_by_priority
+from src.process import parse_doc_direct
+from src.utils.artifact_cache import ARTIFACT_CACHE_MAX_BYTES, ArtifactCache
+from src.utils.file_utils import CACHE_DIR
+from src.utils.run_budget import RunBudget, parse_deadline
+from src.utils.task_queue import (
+    LEASE_S,
+    TASK_DONE,
+    TASK_FAILED,
+    Task,
+    TaskQueue,
+)
+
+# étapes exécutées par les workers
+STAGE_OCR = "ocr"
+STAGE_PARSE = "parse"
+TASK_STAGES = (STAGE_OCR, STAGE_PARSE)
+# file de tâches par défaut (à placer sur un volume partagé)
+FP_WORK_QUEUE = CACHE_DIR / "work-queue.sqlite"
+# intervalle entre deux consultations de la file, en secondes
+POLL_S = 5.0
+# un worker sans tâche depuis cette durée s'arrête, en secondes (0: jamais)
+WORKER_IDLE_EXIT_S = 600.0
+
+
+def encode_doc(df_doc: pd.DataFrame) -> Dict[str, Any]:
+    """Sérialise les métadonnées d'un document pour la file de tâches (JSON).
+
+    Parameters
+    ----------
+    df_doc: pd.DataFrame
+        Métadonnées du document (DataFrame d'une ligne, ou vide).
+
+    Returns
+    -------
+    doc: Dict[str, Any]
+        Colonnes et lignes des métadonnées.
+    """
+    return json.loads(df_doc.to_json(orient="split", index=False))
+
+
+def decode_doc(doc: Dict[str, Any], dtype: Mapping[str, str]) -> pd.DataFrame:
+    """Reconstruit les métadonnées d'un document lues dans la file de tâches.
+
+    Parameters
+    ----------
+    doc: Dict[str, Any]
+        Colonnes et lignes des métadonnées (voir `encode_doc`).
+    dtype: Mapping[str, str]
+        Types des colonnes ; les colonnes absentes de `dtype` gardent le
+        type déduit par pandas.
+
+    Returns
+    -------
+    df_doc: pd.DataFrame
+        Métadonnées du document.
+    """
+    df_doc = pd.DataFrame(doc["data"], columns=doc["columns"])
+    return df_doc.astype({k: v for k, v in dtype.items() if k in df_doc.columns})
+
+
+def get_worker_id() -> str:
+    """Identifiant du worker courant.
+
+    Returns
+    -------
+    worker: str
+        Nom de la machine, processus et thread.
+    """
+    return f"{socket.gethostname()}-{os.getpid()}-{threading.current_thread().name}"
+
+
+class Heartbeat:
+    """Prolonge le bail d'une tâche tant qu'elle est traitée."""
+
+    def __init__(
+        self, task_queue: TaskQueue, task: Task, worker: str, lease_s: float = LEASE_S
+    ):
+        """Prépare les battements de coeur.
+
+        Parameters
+        ----------
+        task_queue: TaskQueue
+            File de tâches.
+        task: Task
+            Tâche en cours.
+        worker: str
+            Identifiant du worker.
+        lease_s: float, defaults to LEASE_S
+            Durée du bail, prolongé 3 fois par bail.
+        """
+        self.task_queue = task_queue
+        self.task = task
+        self.worker = worker
+        self.lease_s = lease_s
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+
+    def _beat(self):
+        """Prolonge le bail à intervalles réguliers, jusqu'à l'arrêt."""
+        while not self._stop.wait(self.lease_s / 3):
+            if not self.task_queue.heartbeat(self.task, self.worker, self.lease_s):
+                logging.warning(
+                    f"{self.worker}: bail perdu pour {self.task.stage} {self.task.pdf}"
+                )
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class QueueWorker:
+    """Worker: exécute les tâches d'OCR et d'analyse de la file."""
+
+    def __init__(
+        self,
+        task_queue: TaskQueue,
+        data_int: Path = DATA_INT,
+        worker: Optional[str] = None,
+        lease_s: float = LEASE_S,
+    ):
+        """Prépare le worker.
+
+        Parameters
+        ----------
+        task_queue: TaskQueue
+            File de tâches.
+        data_int: Path, defaults to DATA_INT
+            Dossier des fichiers intermédiaires, partagé avec le coordinateur.
+        worker: str, optional
+            Identifiant du worker ; par défaut, d'après la machine, le
+            processus et le thread.
+        lease_s: float, defaults to LEASE_S
+            Durée du bail des tâches, en secondes.
+        """
+        self.task_queue = task_queue
+        self.worker = worker if worker is not None else get_worker_id()
+        self.lease_s = lease_s
+        self.out_pdfa_ocr = data_int / "pdfa_ocr"
+        self.out_txt_ocr = data_int / "txt_ocr"
+        for out_sub in (self.out_pdfa_ocr, self.out_txt_ocr):
+            out_sub.mkdir(parents=True, exist_ok=True)
+        # caches et mesures propres à la machine
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        self.ocr_cache = OcrPageCache(
+            CACHE_DIR / "ocr-page-cache.sqlite", OCR_ENGINE_KEY
+        )
+        self.ocr_profile = load_ocr_profile(get_profile_path())
+        self.cost_model = OcrCostModel(CACHE_DIR / "ocr-timings.csv")
+        self.nb_done = 0
+        self.nb_failed = 0
+
+    def close(self):
+        """Ferme le cache de l'OCR."""
+        self.ocr_cache.close()
+
+    def run_task(self, task: Task) -> Any:
+        """Exécute une tâche.
+
+        Parameters
+        ----------
+        task: Task
+            Tâche: OCR (entrée: métadonnées du document, meta_{run}_ntxt_pdfa)
+            ou analyse (entrée: métadonnées du document, meta_{run}_otxt).
+
+        Returns
+        -------
+        result: Any
+            OCR: métadonnées du document (voir `encode_doc`) ; analyse:
+            données extraites du document.
+        """
+        if task.stage == STAGE_OCR:
+            df_doc = decode_doc(task.payload, DTYPE_META_NTXT_PDFA)
+            df_ocr = extract_text_ocr.process_files(
+                df_doc,
+                self.out_pdfa_ocr,
+                self.out_txt_ocr,
+                workers=1,
+                ocr_cache=self.ocr_cache,
+                ocr_profile=self.ocr_profile,
+                cost_model=self.cost_model,
+            )
+            return encode_doc(df_ocr)
+        if task.stage == STAGE_PARSE:
+            df_doc = decode_doc(task.payload, DTYPE_META_NTXT_OCR)
+            df_row = next(df_doc.itertuples())
+            return parse_doc_direct.parse_arrete(
+                Path(df_row.fullpath), Path(df_row.fullpath_txt), fn_pdf=df_row.pdf
+            )
+        raise ValueError(f"Étape inconnue: {task.stage}")
+
+    def work(
+        self,
+        stop: Optional[threading.Event] = None,
+        idle_exit_s: float = WORKER_IDLE_EXIT_S,
+    ):
+        """Traite les tâches de la file, jusqu'à l'arrêt.
+
+        Parameters
+        ----------
+        stop: threading.Event, optional
+            Demande d'arrêt (workers du coordinateur), vérifiée entre deux
+            tâches.
+        idle_exit_s: float, defaults to WORKER_IDLE_EXIT_S
+            Le worker s'arrête après cette durée sans tâche, en secondes
+            (0: jamais).
+        """
+        if stop is None:
+            stop = threading.Event()
+        t_idle = time.monotonic()
+        while not stop.is_set():
+            task = self.task_queue.lease(self.worker, TASK_STAGES, self.lease_s)
+            if task is None:
+                if idle_exit_s and time.monotonic() - t_idle > idle_exit_s:
+                    logging.info(f"{self.worker}: aucune tâche, arrêt")
+                    break
+                stop.wait(POLL_S)
+                continue
+            logging.info(
+                f"{self.worker}: {task.stage} {task.pdf} (tentative {task.attempts})"
+            )
+            try:
+                with Heartbeat(self.task_queue, task, self.worker, self.lease_s):
+                    result = self.run_task(task)
+            except Exception:
+                logging.exception(f"{self.worker}: échec de {task.stage} {task.pdf}")
+                self.task_queue.fail(task, self.worker, traceback.format_exc())
+                self.nb_failed += 1
+            else:
+                if self.task_queue.complete(task, self.worker, result):
+                    self.nb_done += 1
+            t_idle = time.monotonic()
+        logging.info(
+            f"{self.worker}: {self.nb_done} tâches terminées, {self.nb_failed} échecs"
+        )
+
+
+def run_tasks(
+    task_queue: TaskQueue,
+    run: str,
+    stage: str,
+    df_metas: pd.DataFrame,
+    poll_s: float = POLL_S,
+) -> Dict[str, Any]:
+    """Soumet une tâche par document et attend que toutes soient terminées.
+
+    Parameters
+    ----------
+    task_queue: TaskQueue
+        File de tâches.
+    run: str
+        Identifiant du lot.
+    stage: str
+        Étape à exécuter.
+    df_metas: pd.DataFrame
+        Documents.
+    poll_s: float, defaults to POLL_S
+        Intervalle entre deux consultations de la file, en secondes.
+
+    Returns
+    -------
+    results: Dict[str, Any]
+        Résultat de chaque document dont la tâche a réussi.
+    """
+    for i in range(len(df_metas)):
+        df_doc = df_metas.iloc[[i]]
+        priority = df_doc["priority"].iloc[0]
+        task_queue.submit(
+            run,
+            stage,
+            df_doc["pdf"].iloc[0],
+            encode_doc(df_doc),
+            int(priority) if pd.notna(priority) else PRIORITY_UNKNOWN,
+        )
+    t_log = time.monotonic()
+    while not task_queue.is_finished(run, stage):
+        time.sleep(poll_s)
+        if time.monotonic() - t_log > 60:
+            counts = task_queue.counts(run)
+            logging.info(
+                f"{stage}: "
+                + ", ".join(
+                    f"{n} {status}" for (s, status), n in counts.items() if s == stage
+                )
+            )
+            t_log = time.monotonic()
+    results = task_queue.results(run, stage)
+    return {pdf: results[pdf] for pdf in df_metas["pdf"] if pdf in results}
+
+
+def coordinate(
+    run: str,
+    dir_out: Path,
+    fp_queue: Path = FP_WORK_QUEUE,
+    data_int: Path = DATA_INT,
+    budget: Optional[RunBudget] = None,
+    fp_deferred: Path = FP_DEFERRED,
+    local_workers: int = 0,
+    lease_s: float = LEASE_S,
+    fp_artifact_cache: Optional[Path] = FP_ARTIFACT_CACHE,
+    artifact_cache_size: int = ARTIFACT_CACHE_MAX_BYTES,
+) -> Optional[Dict[str, Path]]:
+    """Traite un lot de PDF déjà indexés, en répartissant l'OCR et l'analyse
+    entre des workers.
+
+    Parameters
+    ----------
+    run: str
+        Identifiant du lot: l'index des nouveaux PDF est
+        `data_int / f"pdf-index_new_{run}.csv"`.
+    dir_out: Path
+        Dossier de sortie des fichiers paquet_*.csv et des PDF.
+    fp_queue: Path, defaults to FP_WORK_QUEUE
+        Base SQLite de la file de tâches, partagée avec les workers.
+    data_int: Path, defaults to DATA_INT
+        Dossier des fichiers intermédiaires, partagé avec les workers.
+    budget: RunBudget, optional
+        Budget de l'exécution, pour l'extraction du texte natif.
+    fp_deferred: Path, defaults to FP_DEFERRED
+        Fichier CSV de la file des documents reportés au prochain lot.
+    local_workers: int, defaults to 0
+        Nombre de workers exécutés dans le processus du coordinateur.
+    lease_s: float, defaults to LEASE_S
+        Durée du bail des tâches des workers locaux, en secondes.
+    fp_artifact_cache: Path, optional
+        Base SQLite du cache des sorties des étapes ; si None, toutes les
+        étapes sont exécutées pour tous les documents.
+    artifact_cache_size: int, defaults to ARTIFACT_CACHE_MAX_BYTES
+        Taille maximale du cache des sorties des étapes, en octets.
+
+    Returns
+    -------
+    out_files: Dict[str, Path], optional
+        Fichiers CSV produits, None si aucun document n'est arrivé à
+        l'analyse.
+    """
+    in_file = data_int / f"pdf-index_new_{run}.csv"
+    if not in_file.is_file():
+        raise ValueError(f"Le fichier en entrée {in_file} n'existe pas.")
+    for out_sub in ("txt_nat", "pdfa_nat", "pdfa_ocr", "txt_ocr"):
+        (data_int / out_sub).mkdir(parents=True, exist_ok=True)
+    dir_out.mkdir(parents=True, exist_ok=True)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    deferred_queue = DeferredQueue(fp_deferred)
+    artifact_cache = (
+        ArtifactCache(fp_artifact_cache, max_bytes=artifact_cache_size)
+        if fp_artifact_cache is not None
+        else None
+    )
+    task_queue = TaskQueue(fp_queue)
+    # workers locaux, arrêtés après la fusion des résultats
+    stop = threading.Event()
+    workers = [
+        QueueWorker(
+            task_queue, data_int, worker=f"{get_worker_id()}-{i}", lease_s=lease_s
+        )
+        for i in range(local_workers)
+    ]
+    threads = [
+        threading.Thread(target=x.work, args=(stop,), kwargs={"idle_exit_s": 0})
+        for x in workers
+    ]
+    for thread in threads:
+        thread.start()
+
+    def _defer_failed(df: pd.DataFrame, results: Dict, stage: str, step: str):
+        # documents dont la tâche a échoué: reportés au prochain lot (la tâche
+        # en échec n'est pas soumise de nouveau pour ce lot, et le document,
+        # déjà indexé, ne serait pas ré-indexé)
+        errors = {
+            pdf: error
+            for t_stage, pdf, error in task_queue.failures(run)
+            if t_stage == stage
+        }
+        df_failed = df[~df["pdf"].isin(list(results))]
+        for df_row in df_failed.itertuples():
+            error = errors.get(df_row.pdf)
+            reason = error.strip().splitlines()[-1] if error else "tâche inachevée"
+            deferred_queue.add(df_row, step, f"échec de la tâche {stage}: {reason}")
+        deferred_queue.save()
+        if not df_failed.empty:
+            print(
+                f"{stage}: {len(df_failed)} documents en échec, reportés au prochain lot"
+            )
+
+    def _ocr(df: pd.DataFrame) -> pd.DataFrame:
+        results = run_tasks(task_queue, run, STAGE_OCR, df)
+        _defer_failed(df, results, STAGE_OCR, "extract_text_ocr")
+        df_empty = pd.DataFrame(columns=list(DTYPE_META_NTXT_OCR))
+        return pd.concat(
+            [
+                df_empty.astype(DTYPE_META_NTXT_OCR),
+                *(decode_doc(x, DTYPE_META_NTXT_OCR) for x in results.values()),
+            ],
+            ignore_index=True,
+        )
+
+    def _parse(df: pd.DataFrame) -> Dict[str, Any]:
+        results = run_tasks(task_queue, run, STAGE_PARSE, df)
+        _defer_failed(df, results, STAGE_PARSE, "parse_doc_direct")
+        return results
+
+    runner = PipelineRunner(run, data_int)
+    df_metas = pd.read_csv(in_file, dtype=DTYPE_META_BASE)
+    out_files = None
+    try:
+        # 2. à 7. métadonnées, texte natif, type des PDF, filtrage, PDF/A
+        df_metas = prepare_batch(
+            runner, df_metas, data_int, budget, deferred_queue, artifact_cache
+        )
+        if df_metas is None:
+            return None
+        # 8. OCR par les workers (documents absents du cache des étapes)
+        df_metas = runner.run_stage(
+            "OCR par les workers",
+            "src.work_queue",
+            cached_stage(
+                artifact_cache,
+                "extract_text_ocr",
+                _ocr,
+                DTYPE_META_NTXT_OCR,
+                params={
+                    "engine": OCR_ENGINE_KEY,
+                    "out_dirs": [data_int / "pdfa_ocr", data_int / "txt_ocr"],
+                },
+                required_cols=("fullpath_pdfa",),
+            ),
+            df_metas,
+        )
+        if df_metas.empty:
+            logging.warning("Aucun document après l'OCR")
+            print("Arrêt: aucun document à analyser")
+            return None
+        # 9. analyse du texte par les workers, fusion dans les fichiers paquet_*.csv
+        writer = parse_doc_direct.PaquetWriter(
+            dir_out,
+            datetime.now().date(),
+            latency_csv=CACHE_DIR / "publish-latency.csv",
+            place_on_finalize=True,
+        )
+        df_metas = sort_by_priority(writer.exclude_duplicates(df_metas))
+        docs_data = runner.run_stage(
+            "analyse du texte par les workers",
+            "src.work_queue",
+            _parse,
+            df_metas,
+        )
+        for df_row in df_metas.itertuples():
+            if df_row.pdf in docs_data:
+                writer.add_doc(df_row, doc_data=docs_data[df_row.pdf])
+        out_files = writer.finalize()
+        if out_files:
+            parse_doc_direct.export_report(out_files, dir_out)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        for worker in workers:
+            worker.close()
+        runner.report()
+        report_tasks(task_queue, run)
+        task_queue.close()
+        if artifact_cache is not None:
+            artifact_cache.log_stats()
+            artifact_cache.close()
+    return out_files
+
+
+def report_tasks(task_queue: TaskQueue, run: str):
+    """Écrit le nombre de tâches terminées et en échec, et les échecs.
+
+    Aussi sur la sortie standard, pour le résumé dans batch-logs.
+
+    Parameters
+    ----------
+    task_queue: TaskQueue
+        File de tâches.
+    run: str
+        Identifiant du lot.
+    """
+    counts = task_queue.counts(run)
+    lines = [f"{'tâches':<10} {'terminées':>10} {'échecs':>7}"]
+    for stage in TASK_STAGES:
+        lines.append(
+            f"{stage:<10} {counts.get((stage, TASK_DONE), 0):>10}"
+            + f" {counts.get((stage, TASK_FAILED), 0):>7}"
+        )
+    for stage, pdf, error in task_queue.failures(run):
+        # dernière ligne de l'erreur (exception)
+        lines.append(f"Échec {stage} {pdf}: {error.strip().splitlines()[-1]}")
+    for line in lines:
+        logging.info(line)
+        print(line)
+
+
+if __name__ == "__main__":
+    # log
+    dir_log = ROOT_DIR / "logs"
+    dir_log.mkdir(exist_ok=True)
+    # NB: pas de level=logging.DEBUG, à cause de pdfminer.six (voir extract_native_text)
+    logging.basicConfig(
+        filename=f"{dir_log}/work_queue_{socket.gethostname()}_{datetime.now().isoformat()}.log",
+        encoding="utf-8",
+        level=logging.INFO,
+    )
+
+    # arguments de la commande exécutable
+    # - communs au coordinateur et aux workers
+    parser_common = argparse.ArgumentParser(add_help=False)
+    parser_common.add_argument(
+        "--queue",
+        default=str(FP_WORK_QUEUE),
+        help="Base SQLite de la file de tâches, sur un volume partagé",
+    )
+    parser_common.add_argument(
+        "--data_int",
+        default=str(DATA_INT),
+        help="Dossier des fichiers intermédiaires, sur un volume partagé (même chemin sur toutes les machines)",
+    )
+    parser_common.add_argument(
+        "--lease",
+        type=float,
+        default=LEASE_S,
+        help="Durée du bail des tâches, en secondes, prolongé tant que la tâche est traitée",
+    )
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    # - coordinateur
+    parser_coord = subparsers.add_parser(
+        "coordinate",
+        parents=[parser_common],
+        help="Traiter un lot de PDF déjà indexés, en répartissant l'OCR et l'analyse entre les workers",
+    )
+    parser_coord.add_argument(
+        "run",
+        help="Identifiant du lot, tel que l'index des nouveaux PDF est DATA_INT/pdf-index_new_RUN.csv",
+    )
+    parser_coord.add_argument(
+        "dir_out",
+        nargs="?",
+        default=str(DATA_PRO),
+        help="Dossier de sortie des fichiers paquet_*.csv et des PDF",
+    )
+    parser_coord.add_argument(
+        "--local_workers",
+        type=int,
+        default=0,
+        help="Nombre de workers exécutés dans le processus du coordinateur",
+    )
+    parser_coord.add_argument(
+        "--deadline",
+        default=os.environ.get("RUN_DEADLINE", ""),
+        help="Échéance de l'extraction du texte natif, au format ISO (ex: 2023-06-17T06:00:00): les documents restants sont alors reportés au prochain lot (par défaut: variable d'environnement RUN_DEADLINE)",
+    )
+    parser_coord.add_argument(
+        "--deferred",
+        default=str(FP_DEFERRED),
+        help="Fichier CSV de la file des documents reportés au prochain lot",
+    )
+    parser_coord.add_argument(
+        "--artifact_cache",
+        default=str(FP_ARTIFACT_CACHE),
+        help="Base SQLite du cache des sorties des étapes, conservée entre les exécutions ('' pour désactiver le cache)",
+    )
+    parser_coord.add_argument(
+        "--artifact_cache_size",
+        type=int,
+        default=ARTIFACT_CACHE_MAX_BYTES // (1024 * 1024),
+        help="Taille maximale du cache des sorties des étapes, en Mio",
+    )
+    # - worker
+    parser_work = subparsers.add_parser(
+        "work",
+        parents=[parser_common],
+        help="Exécuter les tâches d'OCR et d'analyse de la file",
+    )
+    parser_work.add_argument(
+        "--idle_exit",
+        type=float,
+        default=WORKER_IDLE_EXIT_S,
+        help="Arrêter le worker après cette durée sans tâche, en secondes (0: jamais)",
+    )
+    args = parser.parse_args()
+
+    if args.command == "coordinate":
+        budget = RunBudget(deadline=parse_deadline(args.deadline))
+        coordinate(
+            args.run,
+            Path(args.dir_out).resolve(),
+            fp_queue=Path(args.queue).resolve(),
+            data_int=Path(args.data_int).resolve(),
+            budget=budget if budget.is_limited else None,
+            fp_deferred=Path(args.deferred).resolve(),
+            local_workers=args.local_workers,
+            lease_s=args.lease,
+            fp_artifact_cache=(
+                Path(args.artifact_cache).resolve() if args.artifact_cache else None
+            ),
+            artifact_cache_size=args.artifact_cache_size * 1024 * 1024,
+        )
+    else:
+        with TaskQueue(Path(args.queue).resolve()) as task_queue:
+            worker = QueueWorker(
+                task_queue, Path(args.data_int).resolve(), lease_s=args.lease
+            )
+            try:
+                worker.work(idle_exit_s=args.idle_exit)
+            finally:
+                worker.close()